@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Check that the reference AM resource catalog (gcf.geni.am.aggregate)
+scales with the size of the request, not the number of resources.
+
+For each pool size in --sizes (20 to 100000 FakeVMs by default), fills
+--fill of the pool with allocations of --request resources to slices
+and users, then times finding, allocating and releasing --request more
+resources, looking them up by id and listing a slice's resources.
+Reports the median time of each operation per pool size, and fails if
+the median at the largest pool is more than --max-growth times that at
+the smallest.
+
+Runs offline.
+
+Run with "-h" flag to see usage and command line options.
+"""
+
+import sys
+
+# Check python version. Requires 2.6 or greater, but less than 3.
+if sys.version_info < (2, 6):
+    raise Exception('Must use python 2.6 or greater.')
+elif sys.version_info >= (3,):
+    raise Exception('Not python 3 ready')
+
+import datetime
+import json
+import logging
+import optparse
+import timeit
+
+from gcf.geni.am.aggregate import Aggregate
+from gcf.geni.am.fakevm import FakeVM
+
+SLICE_URN = 'urn:publicid:IDN+bench.example.net+slice+s%d'
+USER_URN = 'urn:publicid:IDN+bench.example.net+user+u%d'
+USERS = 10
+
+def parse_args(argv):
+    parser = optparse.OptionParser(usage="%prog [options]\n" + __doc__)
+    parser.add_option("--sizes", default="20,100,1000,10000,100000",
+                      help="Comma separated resource pool sizes [default: %default]")
+    parser.add_option("-n", "--iterations", type="int", default=200,
+                      help="Timed runs of each operation per pool size [default: %default]")
+    parser.add_option("--request", type="int", default=5,
+                      help="Resources per allocation [default: %default]")
+    parser.add_option("--fill", type="float", default=0.5,
+                      help="Fraction of the pool allocated before timing [default: %default]")
+    parser.add_option("--max-growth", type="float", default=4.0,
+                      help="Most an operation may slow down from the smallest to the largest pool (0 to not check) [default: %default]")
+    parser.add_option("--json", default=None, metavar="FILE",
+                      help="Also write the results as JSON to FILE")
+    parser.add_option("--debug", action="store_true", default=False,
+                      help="Log debug messages")
+    opts, args = parser.parse_args(argv)
+    try:
+        opts.sizes = [int(size) for size in opts.sizes.split(',')]
+    except ValueError:
+        parser.error("--sizes must be a comma separated list of numbers")
+    if opts.request < 1:
+        parser.error("--request must be at least 1")
+    if min(opts.sizes) < 3 * opts.request:
+        parser.error("Every pool size must be at least 3 times --request")
+    return opts, args
+
+class Pool(object):
+    '''An aggregate of FakeVMs, partly allocated to slices and users
+    as the reference AMs do.'''
+
+    def __init__(self, size, request, fill):
+        self.request = request
+        self.agg = Aggregate()
+        self.agg.add_resources([FakeVM(self.agg) for _ in range(size)])
+        self.slices = 0
+        # Leaving room for the allocation the operations hold,
+        # and the one they make
+        allocations = min(int(size * fill), size - 2 * request) // request
+        for _ in range(allocations):
+            self.allocate()
+
+    def allocate(self):
+        '''Allocate --request available resources to a new slice.
+        Return the slice URN, user URN and resources.'''
+        resources = self.agg.available_resources(self.request)
+        if len(resources) < self.request:
+            raise Exception("Only %d resources available" % len(resources))
+        for resource in resources:
+            resource.available = False
+        slice_urn = SLICE_URN % self.slices
+        user_urn = USER_URN % (self.slices % USERS)
+        self.slices += 1
+        self.agg.allocate(slice_urn, resources)
+        self.agg.allocate(user_urn, resources)
+        return slice_urn, user_urn, resources
+
+    def release(self, slice_urn, user_urn, resources):
+        self.agg.deallocate(slice_urn, None)
+        self.agg.deallocate(user_urn, resources)
+        for resource in resources:
+            resource.reset()
+
+def operations(pool):
+    # An allocation kept between runs, for the operations that need one
+    held = [pool.allocate()]
+
+    def find():
+        if pool.agg.available_count() < pool.request:
+            raise Exception("Pool exhausted")
+        return pool.agg.available_resources(pool.request)
+
+    def allocate_release():
+        pool.release(*pool.allocate())
+
+    def lookup():
+        for resource in held[0][2]:
+            pool.agg.get_resource(resource.id)
+
+    def catalog_slice():
+        return pool.agg.catalog(held[0][0])
+
+    def deprovision():
+        # As a FakeVM does when its sliver is deleted
+        slice_urn, user_urn, resources = held[0]
+        for resource in resources:
+            resource.deprovision()
+        pool.release(slice_urn, user_urn, resources)
+        held[0] = pool.allocate()
+
+    return [
+        ('find', 'Count and find --request available resources', find),
+        ('allocate_release', 'Allocate --request resources to a slice and user, then release them',
+         allocate_release),
+        ('lookup', 'Look up --request resources by id', lookup),
+        ('catalog_slice', 'List the resources of a slice', catalog_slice),
+        ('deprovision', 'Deprovision, release and reallocate a slice\'s resources',
+         deprovision),
+        ]
+
+def run(func, iterations):
+    '''Run func iterations times (after one untimed warm up run).
+    Return the median time in seconds.'''
+    func()
+    times = []
+    for i in range(iterations):
+        start = timeit.default_timer()
+        func()
+        times.append(timeit.default_timer() - start)
+    times.sort()
+    return times[iterations // 2]
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    opts, args = parse_args(argv)
+
+    level = logging.INFO
+    if opts.debug:
+        level = logging.DEBUG
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)-8s %(message)s')
+    logger = logging.getLogger("gcf-aggregate-benchmark")
+
+    # Operation name => [median secs per pool size]
+    medians = {}
+    names = []
+    for size in opts.sizes:
+        start = timeit.default_timer()
+        pool = Pool(size, opts.request, opts.fill)
+        logger.info("Built a pool of %d resources (%d allocated) in %.2f seconds",
+                    size, size - pool.agg.available_count(),
+                    timeit.default_timer() - start)
+        for (name, description, func) in operations(pool):
+            if name not in medians:
+                names.append(name)
+                medians[name] = []
+            medians[name].append(run(func, opts.iterations))
+
+    print "%-20s" % "median usec" + "".join(["%12d" % size for size in opts.sizes]) + "%10s" % "growth"
+    ok = True
+    results = []
+    for name in names:
+        times = medians[name]
+        growth = times[-1] / times[0] if times[0] > 0 else 0
+        print "%-20s" % name + "".join(["%12.1f" % (1e6 * t) for t in times]) + "%10.2f" % growth
+        if opts.max_growth > 0 and growth > opts.max_growth:
+            ok = False
+            logger.error("%s is %.1f times slower with %d resources than with %d",
+                         name, growth, opts.sizes[-1], opts.sizes[0])
+        results.append(dict(operation=name,
+                            median_usec=[1e6 * t for t in times],
+                            growth=growth))
+
+    if opts.json:
+        with open(opts.json, 'w') as f:
+            json.dump(dict(sizes=opts.sizes,
+                           request=opts.request,
+                           fill=opts.fill,
+                           iterations=opts.iterations,
+                           timestamp=datetime.datetime.utcnow().isoformat(),
+                           results=results), f, indent=2)
+        logger.info("Wrote results to %s", opts.json)
+    if not ok:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -47,6 +47,7 @@ import gcf.geni.am.am2
 import gcf.geni.am.am3
 from gcf.geni.config import read_config
 from gcf.geni.auth.util import getInstanceFromClassname
+from gcf.geni.auth.authorizer_pool import Authorizer_Pool
 
 
 def parse_args(argv):
@@ -136,13 +137,17 @@ def main(argv=None):
         authorizer_classname = opts.authorizer
     else:
         authorizer_classname = "gcf.geni.auth.sfa_authorizer.SFA_Authorizer"
-    authorizer = getInstanceFromClassname(authorizer_classname, 
-                                          getAbsPath(opts.rootcadir), opts, argument_guard)
-
     # Use XMLRPC authorizer if opt.remote_authorizer is set
+    # Run the authorizer in worker processes if opts.authorizer_workers is set
     if hasattr(opts, 'remote_authorizer'):
         import xmlrpclib
         authorizer = xmlrpclib.Server(opts.remote_authorizer)
+    elif int(getattr(opts, 'authorizer_workers', 0)) > 0:
+        authorizer = Authorizer_Pool(authorizer_classname,
+                                     getAbsPath(opts.rootcadir), opts, argument_guard)
+    else:
+        authorizer = getInstanceFromClassname(authorizer_classname, 
+                                              getAbsPath(opts.rootcadir), opts, argument_guard)
 
     # Instantiate resource manager from 'authorizer_resource_manager' 
     # config argument. Default = None
@@ -182,7 +187,8 @@ def main(argv=None):
                                                      ca_certs=comboCertsFile,
                                                      base_name=config['global']['base_name'],
                                                      authorizer=authorizer,
-                                                     resource_manager=resource_manager)
+                                                     resource_manager=resource_manager,
+                                                     sliver_store=getattr(opts, 'sliver_store', None))
     else:
         msg = "Unknown API version: %d. Valid choices are \"1\", \"2\", or \"3\""
         sys.exit(msg % (opts.api_version))
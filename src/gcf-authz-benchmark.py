@@ -0,0 +1,490 @@
+#!/usr/bin/env python
+
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Benchmark the aggregate authorization (quota) computations.
+
+Generates --slivers existing sliver allocations (the requested_state an
+ABAC authorizer hands its resource binders) for one user, spread over
+--slices slices of one project, with random (but repeatable) start and
+end times and NODE and MEMORY measurements. Then times computing the
+TOTAL, HOURS and MAX bindings over them, both from the list of
+allocations and from an allocation ledger (as for an allocate call by
+the GCF AM resource manager), and evaluating an ABAC quota policy with
+the resulting bindings. Reports per operation latency and throughput.
+
+The abac_authorize operations run whole authorizations (binders, policy
+and queries) for an allocate call, by one caller and by --threads
+callers at once (one of whom is blacklisted by the policy), checking
+that each caller gets its own answer.
+
+With --verify, first checks the MAX bindings against a direct
+computation of the total in every time window (slow: only the first
+--verify-slivers slivers are used).
+
+Runs offline.
+
+Run with "-h" flag to see usage and command line options.
+"""
+
+import sys
+
+# Check python version. Requires 2.6 or greater, but less than 3.
+if sys.version_info < (2, 6):
+    raise Exception('Must use python 2.6 or greater.')
+elif sys.version_info >= (3,):
+    raise Exception('Not python 3 ready')
+
+import datetime
+import json
+import logging
+import optparse
+import os
+import random
+import tempfile
+import threading
+import timeit
+
+import dateutil.parser
+
+from gcf.geni.auth import abac_authorizer
+from gcf.geni.auth import resource_binder
+from gcf.geni.auth.allocation_ledger import Allocation_Ledger, Requested_Allocation_State
+from gcf.geni.util.cert_util import create_cert
+
+AUTHORITY = 'bench.example.net'
+PROJECT = 'benchproj'
+MEASUREMENTS = ('NODE', 'MEMORY')
+
+# An ABAC policy with quotas on the resource bindings,
+# like examples/example_am_policies.json
+POLICY = {
+    "constants" : {
+        "$BLUE_AUTHS" : "['urn:publicid:IDN+%s+authority+ca']" % AUTHORITY,
+        "$RED_AUTHS" : "['urn:publicid:IDN+red.example.net+authority+ca']"
+        },
+    "conditional_assertions" : [
+        {"precondition" : "True",
+         "exclusive" : True,
+         "clauses" : [
+                {"condition" : "$SFA_AUTHORIZED",
+                 "assertion" : "AM.IS_AUTHORIZED<-$CALLER"},
+                {"condition" : "'$CALLER_AUTHORITY' in $RED_AUTHS and $AUTHORITY_NODE_TOTAL > 8",
+                 "assertion" : "AM.EXCEEDS_QUOTA<-$CALLER"},
+                {"condition" : "'$CALLER_AUTHORITY' in $BLUE_AUTHS and $AUTHORITY_MEMORY_MAX > 1000000",
+                 "assertion" : "AM.EXCEEDS_QUOTA<-$CALLER"},
+                {"condition" : "$USER_NUM_SLICES > 100",
+                 "assertion" : "AM.EXCEEDS_QUOTA<-$CALLER"},
+                {"condition" : "$SLICE_NODE_HOURS > 1000000",
+                 "assertion" : "AM.EXCEEDS_QUOTA<-$CALLER"},
+                {"condition" : "$USER_NODE_MAX > 100000",
+                 "assertion" : "AM.EXCEEDS_QUOTA<-$CALLER"},
+                {"condition" : "'urn:publicid:IDN+%s+user+blocked' == '$CALLER'" % AUTHORITY,
+                 "assertion" : "AM.IS_BLACKLISTED<-$CALLER"}
+                ]}
+        ],
+    "policies" : [],
+    "queries" : [
+        {"statement" : "AM.IS_AUTHORIZED<-$CALLER", "is_positive" : True,
+         "message" : "Authorization Failure"},
+        {"statement" : "AM.EXCEEDS_QUOTA<-$CALLER", "is_positive" : False,
+         "message" : "Quota Exceeded"},
+        {"statement" : "AM.IS_BLACKLISTED<-$CALLER", "is_positive" : False,
+         "message" : "Blacklisted"},
+        {"statement" : "AM.MAY_SHUTDOWN<-$CALLER", "is_positive" : True,
+         "message" : "Privilege Failure",
+         "condition" : "'$METHOD' in ['Shutdown_V2', 'Shutdown_V3']"}
+        ]
+    }
+
+# POLICY with the binders a whole authorization runs. $SFA_AUTHORIZED
+# stands in for the SFA binder, which needs trust roots and credentials
+AUTHORIZE_POLICY = dict(POLICY)
+AUTHORIZE_POLICY["binders"] = ["gcf.geni.auth.binders.Standard_Binder",
+                               "gcf.geni.auth.resource_binder.TOTAL_Binder",
+                               "gcf.geni.auth.resource_binder.HOURS_Binder",
+                               "gcf.geni.auth.resource_binder.MAX_Binder",
+                               "gcf.geni.auth.resource_binder.User_Slice_Binder"]
+AUTHORIZE_POLICY["constants"] = dict(POLICY["constants"])
+AUTHORIZE_POLICY["constants"]["$SFA_AUTHORIZED"] = "True"
+
+def parse_args(argv):
+    parser = optparse.OptionParser(usage="%prog [options]\n" + __doc__)
+    parser.add_option("-n", "--iterations", type="int", default=5,
+                      help="Number of times to run each operation (default %default)")
+    parser.add_option("--slivers", type="int", default=10000,
+                      help="Number of existing slivers (default %default)")
+    parser.add_option("--slices", type="int", default=20,
+                      help="Number of slices the slivers are in (default %default)")
+    parser.add_option("--days", type="int", default=30,
+                      help="Slivers start at random times over this many days (default %default)")
+    parser.add_option("--seed", type="int", default=1,
+                      help="Random seed for the sliver times (default %default)")
+    parser.add_option("--verify", action="store_true", default=False,
+                      help="Check the MAX bindings against a direct computation first")
+    parser.add_option("--verify-slivers", type="int", default=500,
+                      help="Number of slivers to use with --verify (default %default)")
+    parser.add_option("--threads", type="int", default=4,
+                      help="Concurrent callers for abac_authorize_threads (default %default)")
+    parser.add_option("-o", "--operation", action="append", default=None,
+                      help="Only run the named operation. May be repeated.")
+    parser.add_option("--list", action="store_true", default=False,
+                      help="List the operations and exit")
+    parser.add_option("--json", default=None, metavar="FILE",
+                      help="Also write the results as JSON to this file")
+    parser.add_option("--debug", action="store_true", default=False,
+                      help="Enable debug logging")
+    opts, args = parser.parse_args(argv)
+    if opts.iterations < 1:
+        parser.error("--iterations must be at least 1")
+    if opts.slivers < 1:
+        parser.error("--slivers must be at least 1")
+    if opts.slices < 1:
+        parser.error("--slices must be at least 1")
+    if opts.threads < 2:
+        parser.error("--threads must be at least 2")
+    return opts, args
+
+class Fixture(object):
+    '''The existing sliver allocations the operations work on.'''
+
+    def __init__(self, slivers, slices, days, seed, logger):
+        rand = random.Random(seed)
+        self.user_urn = 'urn:publicid:IDN+%s+user+bench' % AUTHORITY
+        self.slice_urns = ['urn:publicid:IDN+%s:%s+slice+bench%d' % (AUTHORITY, PROJECT, i)
+                           for i in range(slices)]
+        self.project_urn = resource_binder.convert_slice_urn_to_project_urn(self.slice_urns[0])
+        self.authority_urn = resource_binder.convert_user_urn_to_authority_urn(self.user_urn)
+        base = datetime.datetime(2015, 1, 1)
+        self.sliver_infos = []
+        for i in range(slivers):
+            # Start on the minute, so many slivers share start and end times
+            start = base + datetime.timedelta(minutes=rand.randrange(days * 24 * 60))
+            end = start + datetime.timedelta(minutes=rand.randrange(60, 14 * 24 * 60))
+            slice_urn = self.slice_urns[i % slices]
+            self.sliver_infos.append({
+                    'sliver_urn' : 'urn:publicid:IDN+%s+sliver+%d' % (AUTHORITY, i),
+                    'slice_urn' : slice_urn,
+                    'user_urn' : self.user_urn,
+                    'start_time' : start.isoformat(),
+                    'end_time' : end.isoformat(),
+                    'measurements' : {'NODE' : 1,
+                                      'MEMORY' : rand.choice((512, 1024, 2048, 4096))}})
+        # Parsed (start, end, measurements) for the measurement states
+        self.entries = [(dateutil.parser.parse(info['start_time']),
+                         dateutil.parser.parse(info['end_time']),
+                         info['measurements'])
+                        for info in self.sliver_infos]
+        # One more sliver, as requested by an allocate call
+        start = base + datetime.timedelta(days=days // 2)
+        self.new_slivers = [{'sliver_urn' : 'not_set_yet',
+                             'slice_urn' : self.slice_urns[0],
+                             'user_urn' : self.user_urn,
+                             'start_time' : start,
+                             'end_time' : start + datetime.timedelta(days=1),
+                             'measurements' : {'NODE' : 1, 'MEMORY' : 1024}}]
+        self.ledger = Allocation_Ledger()
+        for info in self.sliver_infos:
+            self.ledger.add_sliver(info['sliver_urn'], info['slice_urn'], info['user_urn'],
+                                   info['start_time'], info['end_time'], info['measurements'])
+        logger.info("Generated %d slivers in %d slices over %d days", slivers, slices, days)
+
+    def rule_set(self, policy=POLICY):
+        '''The given policy rules, as the ABAC authorizer loads them.'''
+        (fd, filename) = tempfile.mkstemp(suffix='.json')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(policy, f)
+            rules = abac_authorizer.ABAC_Authorizer_Rule_Set('default', None)
+            rules.parse(filename)
+            rules.compile()
+        finally:
+            os.unlink(filename)
+        return rules
+
+    def binder(self, binder_class):
+        '''A resource binder set up for a call on the first slice by the user,
+        as generate_bindings does.'''
+        binder = binder_class(None)
+        binder._slice_urn = self.slice_urns[0]
+        binder._project_urn = self.project_urn
+        binder._user_urn = self.user_urn
+        binder._authority_urn = self.authority_urn
+        return binder
+
+def direct_max(entries):
+    '''Maximum total value over every window between two start/end times, computed
+    by adding each (start, end, value) entry to each window it covers.'''
+    boundaries = sorted(set([e[0] for e in entries] + [e[1] for e in entries]))
+    max_total = 0
+    for i in range(len(boundaries) - 1):
+        total = 0
+        for (start, end, value) in entries:
+            if start < boundaries[i + 1] and end > boundaries[i]:
+                total = total + value
+        max_total = max(total, max_total)
+    return max_total
+
+def verify(fixture, count, logger):
+    '''Compare the MAX bindings for the first count slivers with direct_max.
+    Return True if they all match.'''
+    binder = fixture.binder(resource_binder.MAX_Binder)
+    states = {}
+    for info in fixture.sliver_infos[:count]:
+        binder.updateForSliverInfo(info, states)
+    bindings = binder.getBindings(states)
+    ok = True
+    for meas in MEASUREMENTS:
+        entries = [(start, end, measurements[meas])
+                   for (start, end, measurements) in fixture.entries[:count]]
+        expected = str(direct_max(entries))
+        for urn_type in ('SLICE', 'USER', 'PROJECT', 'AUTHORITY'):
+            key = "$%s_%s_MAX" % (urn_type, meas)
+            if urn_type == 'SLICE':
+                expected_here = str(direct_max([entries[i] for i in range(len(entries))
+                                                if fixture.sliver_infos[i]['slice_urn'] == fixture.slice_urns[0]]))
+            else:
+                expected_here = expected
+            if bindings.get(key) != expected_here:
+                logger.error("%s is %s, expected %s", key, bindings.get(key), expected_here)
+                ok = False
+    if ok:
+        logger.info("MAX bindings match the direct computation for %d slivers", count)
+    return ok
+
+def caller_certs(count):
+    '''PEM certificates for count callers at AUTHORITY, the first of them
+    the user POLICY blacklists.'''
+    names = ['blocked'] + ['caller%d' % i for i in range(1, count)]
+    return [create_cert('urn:publicid:IDN+%s+user+%s' % (AUTHORITY, name))[0].save_to_string()
+            for name in names]
+
+def operations(fixture, threads=4):
+    '''Return the list of (name, description, function) benchmark
+    operations on the given fixture.'''
+    f = fixture
+
+    def max_state():
+        state = resource_binder.MAX_ResourceMeasurementState('USER', 'NODE')
+        for (start, end, measurements) in f.entries:
+            state.update(start, end, measurements['NODE'], None)
+        return state.getBindings()
+
+    def binder_bindings(binder_class):
+        binder = f.binder(binder_class)
+        states = {}
+        for info in f.sliver_infos:
+            binder.updateForSliverInfo(info, states)
+        return binder.getBindings(states)
+
+    def ledger_bindings(binder_class):
+        # As generate_bindings does, for an allocate call
+        binder = f.binder(binder_class)
+        requested_state = Requested_Allocation_State(f.ledger, new_slivers=f.new_slivers)
+        states = {}
+        for urn_type, urn in (('SLICE', binder._slice_urn), ('USER', binder._user_urn),
+                              ('PROJECT', binder._project_urn),
+                              ('AUTHORITY', binder._authority_urn)):
+            for meas_type, state in requested_state.get_measurement_states(binder, urn_type, urn).items():
+                states["%s:%s" % (urn_type, meas_type)] = state
+        return binder.getBindings(states)
+
+    # Bindings for an allocate call, as the ABAC authorizer has them
+    bindings = {'$METHOD' : 'Allocate_V3',
+                '$CALLER' : f.user_urn,
+                '$CALLER_AUTHORITY' : f.authority_urn,
+                '$SLICE_URN' : f.slice_urns[0],
+                '$PROJECT_URN' : f.project_urn,
+                '$SFA_AUTHORIZED' : 'True'}
+    for binder_class in (resource_binder.TOTAL_Binder, resource_binder.HOURS_Binder,
+                         resource_binder.MAX_Binder, resource_binder.User_Slice_Binder):
+        bindings.update(ledger_bindings(binder_class))
+    rules = f.rule_set()
+    bindings.update(rules.getConstants())
+    authorizer = abac_authorizer.ABAC_Authorizer.__new__(abac_authorizer.ABAC_Authorizer)
+    authorizer._logger = logging.getLogger("gcf-authz-benchmark.abac")
+    # The authorizer logs every condition and query at INFO
+    authorizer._logger.setLevel(logging.WARNING)
+
+    def abac_policy():
+        assertions = authorizer._generate_assertions(bindings, rules)
+        assertions = assertions + rules.getCompiledPolicies()
+        return authorizer._evaluate_queries(bindings, assertions, rules)
+
+    # Whole authorizations, by one caller or many at once
+    authorizer._DEFAULT_RULES = f.rule_set(AUTHORIZE_POLICY)
+    authorizer._AUTHORITY_SPECIFIC_RULES = {}
+    authorizer._argument_guard = None
+    callers = caller_certs(threads)
+    args = {'slice_urn' : f.slice_urns[0]}
+
+    def authorize(caller):
+        requested_state = Requested_Allocation_State(f.ledger, new_slivers=f.new_slivers)
+        try:
+            authorizer.authorize('Allocate_V3', caller, [], args, {}, requested_state)
+            return None
+        except Exception, e:
+            return str(e)
+
+    # Whether the quotas pass depends on the fixture, but only the first
+    # caller is blacklisted, and each caller always gets the same answer
+    expected = {}
+    for caller in callers:
+        expected[caller] = authorize(caller)
+        blacklisted = 'Blacklisted' in (expected[caller] or '')
+        if blacklisted != (caller is callers[0]):
+            raise Exception("Authorization gave %s for caller %d" % \
+                                (expected[caller], callers.index(caller)))
+
+    def check(caller, result):
+        if result != expected[caller]:
+            raise Exception("Authorization gave %s, expected %s" % (result, expected[caller]))
+
+    def abac_authorize():
+        check(callers[1], authorize(callers[1]))
+
+    def abac_authorize_threads():
+        # Each caller authorizes a few times, all at once
+        results = {}
+        def run_caller(caller):
+            for i in range(10):
+                results.setdefault(caller, []).append(authorize(caller))
+        workers = [threading.Thread(target=run_caller, args=(caller,)) for caller in callers]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        for caller in callers:
+            for result in results[caller]:
+                check(caller, result)
+
+    def ledger_churn():
+        # Renew then delete and re-add a sliver
+        info = f.sliver_infos[0]
+        f.ledger.set_end_time(info['sliver_urn'], info['end_time'])
+        f.ledger.remove_sliver(info['sliver_urn'])
+        f.ledger.add_sliver(info['sliver_urn'], info['slice_urn'], info['user_urn'],
+                            info['start_time'], info['end_time'], info['measurements'])
+
+    return [
+        ('max_state', 'MAX of one measurement over the parsed slivers',
+         max_state),
+        ('max_binder', 'MAX bindings for all contexts and measurements',
+         lambda: binder_bindings(resource_binder.MAX_Binder)),
+        ('total_binder', 'TOTAL bindings for all contexts and measurements',
+         lambda: binder_bindings(resource_binder.TOTAL_Binder)),
+        ('hours_binder', 'HOURS bindings for all contexts and measurements',
+         lambda: binder_bindings(resource_binder.HOURS_Binder)),
+        ('ledger_max', 'MAX bindings for an allocate call, from the ledger',
+         lambda: ledger_bindings(resource_binder.MAX_Binder)),
+        ('ledger_total', 'TOTAL bindings for an allocate call, from the ledger',
+         lambda: ledger_bindings(resource_binder.TOTAL_Binder)),
+        ('ledger_hours', 'HOURS bindings for an allocate call, from the ledger',
+         lambda: ledger_bindings(resource_binder.HOURS_Binder)),
+        ('ledger_user_slice', 'User slice and project counts for an allocate call, from the ledger',
+         lambda: ledger_bindings(resource_binder.User_Slice_Binder)),
+        ('ledger_churn', 'Renew, delete and allocate one sliver in the ledger',
+         ledger_churn),
+        ('abac_policy', 'Evaluate the ABAC quota policy conditions and queries',
+         abac_policy),
+        ('abac_authorize', 'Authorize an allocate call, binders and policy',
+         abac_authorize),
+        ('abac_authorize_threads', '10 allocate call authorizations by each of --threads callers at once',
+         abac_authorize_threads),
+        ]
+
+def run(name, func, iterations):
+    '''Run func iterations times (after one untimed warm up run).
+    Return a dict of results.'''
+    func()
+    times = []
+    for i in range(iterations):
+        start = timeit.default_timer()
+        func()
+        times.append(timeit.default_timer() - start)
+    times.sort()
+    total = sum(times)
+    return dict(operation=name, iterations=iterations,
+                mean_ms=1000.0 * total / iterations,
+                median_ms=1000.0 * times[iterations // 2],
+                p95_ms=1000.0 * times[min(iterations - 1, int(iterations * 0.95))],
+                min_ms=1000.0 * times[0],
+                ops_per_sec=iterations / total if total > 0 else 0)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    opts, args = parse_args(argv)
+
+    level = logging.INFO
+    if opts.debug:
+        level = logging.DEBUG
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)-8s %(message)s')
+    logger = logging.getLogger("gcf-authz-benchmark")
+
+    fixture = Fixture(opts.slivers, opts.slices, opts.days, opts.seed, logger)
+    ops = operations(fixture, opts.threads)
+    if opts.list:
+        for (name, description, func) in ops:
+            print "%-20s %s" % (name, description)
+        return 0
+
+    if opts.operation:
+        unknown = set(opts.operation) - set([op[0] for op in ops])
+        if unknown:
+            sys.exit("Unknown operation(s): %s" % ", ".join(sorted(unknown)))
+        ops = [op for op in ops if op[0] in opts.operation]
+
+    if opts.verify and not verify(fixture, opts.verify_slivers, logger):
+        return 1
+
+    results = []
+    print "%-20s %10s %10s %10s %10s" % ("operation", "mean ms", "median ms", "p95 ms", "ops/sec")
+    for (name, description, func) in ops:
+        try:
+            result = run(name, func, opts.iterations)
+        except Exception, e:
+            logger.debug("%s failed", name, exc_info=True)
+            print "%-20s failed: %s" % (name, e)
+            results.append(dict(operation=name, error=str(e)))
+            continue
+        results.append(result)
+        print "%-20s %10.3f %10.3f %10.3f %10.1f" % \
+            (name, result['mean_ms'], result['median_ms'],
+             result['p95_ms'], result['ops_per_sec'])
+
+    if opts.json:
+        with open(opts.json, 'w') as f:
+            json.dump(dict(slivers=opts.slivers,
+                           slices=opts.slices,
+                           days=opts.days,
+                           seed=opts.seed,
+                           iterations=opts.iterations,
+                           timestamp=datetime.datetime.utcnow().isoformat(),
+                           results=results), f, indent=2)
+        logger.info("Wrote results to %s", opts.json)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,644 @@
+#!/usr/bin/env python
+
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Measure how much load a local GCF aggregate manager takes.
+
+Generates a clearinghouse, aggregate manager and --users experimenter
+certificates (with gen-certs.py) and a gcf_config in --directory (a
+temporary directory by default), then starts gcf-ch.py and, in turn
+for each of --api-versions, gcf-am.py. For each AM, --clients client
+threads each create a slice at the clearinghouse and then call the AM
+over TLS with their experimenter's certificate for --duration seconds,
+after --warmup seconds that are not counted.
+
+Each client picks its next call at random, weighted by --mix, from
+those that make sense for its slice at the AM: Allocate when it has no
+slivers, Provision when they are allocated, Status, Renew and Delete
+when it has slivers, and GetVersion and ListResources at any time.
+With AM API v2 Allocate is CreateSliver (which also provisions),
+Provision is never picked, and Status, Renew and Delete are
+SliverStatus, RenewSliver and DeleteSliver.
+
+Reports, for each AM method called, the calls per second, the median
+(p50), 99th percentile (p99) and maximum latency, and the rates of
+refusals (results with a non zero geni_code, like Too Big when the AM
+is out of resources) and errors (faults and failed connections).
+
+The reference AMs have few resources (3 FakeVMs for v2, 20 for v3),
+so Allocate is refused more often with more clients.
+
+Run with "-h" flag to see usage and command line options.
+"""
+
+import sys
+
+# Check python version. Requires 2.6 or greater, but less than 3.
+if sys.version_info < (2, 6):
+    raise Exception('Must use python 2.6 or greater.')
+elif sys.version_info >= (3,):
+    raise Exception('Not python 3 ready')
+
+import datetime
+import json
+import logging
+import optparse
+import os
+import random
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import timeit
+
+from gcf.omnilib.xmlrpc.client import make_client
+import gcf.sfa.trust.credential as cred
+
+OPERATIONS = ('GetVersion', 'ListResources', 'Allocate', 'Provision',
+              'Status', 'Renew', 'Delete')
+
+DEFAULT_MIX = "GetVersion=2,ListResources=2,Allocate=1,Provision=1,Status=2,Renew=1,Delete=1"
+
+# States of a client's slice at the AM
+EMPTY = 'empty'
+ALLOCATED = 'allocated'
+PROVISIONED = 'provisioned'
+
+# Operations that make sense in each state
+STATE_OPERATIONS = {
+    EMPTY : ('GetVersion', 'ListResources', 'Allocate'),
+    ALLOCATED : ('GetVersion', 'ListResources', 'Provision', 'Status',
+                 'Renew', 'Delete'),
+    PROVISIONED : ('GetVersion', 'ListResources', 'Status', 'Renew',
+                   'Delete'),
+    }
+
+# Operations that need a slice credential
+SLICE_OPERATIONS = ('ListResources', 'Allocate', 'Provision', 'Status',
+                    'Renew', 'Delete')
+
+# Outcomes of a call
+OK = 'ok'
+REFUSED = 'refused'
+ERROR = 'error'
+
+RSPEC_VERSION = dict(type='geni', version='3')
+
+REQUEST_RSPEC_NODE = '<node client_id="node%d" exclusive="false"/>'
+REQUEST_RSPEC = '''<?xml version="1.0" encoding="UTF-8"?>
+<rspec xmlns="http://www.geni.net/resources/rspec/3"
+       xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+       xsi:schemaLocation="http://www.geni.net/resources/rspec/3 http://www.geni.net/resources/rspec/3/request.xsd"
+       type="request">
+%s
+</rspec>
+'''
+
+CONFIG = '''[global]
+base_name=%(base_name)s
+rootcadir=%(directory)s/trusted_roots
+
+[clearinghouse]
+host=127.0.0.1
+port=%(ch_port)d
+keyfile=%(directory)s/ch-key.pem
+certfile=%(directory)s/ch-cert.pem
+user_cred_duration=86400
+slice_duration=7200
+
+[aggregate_manager]
+name=am1
+host=127.0.0.1
+port=%(am_port)d
+keyfile=%(directory)s/am-key.pem
+certfile=%(directory)s/am-cert.pem
+%(am_options)s
+
+[gcf-test]
+keyfile=%(directory)s/alice-key.pem
+certfile=%(directory)s/alice-cert.pem
+'''
+
+def parse_args(argv):
+    parser = optparse.OptionParser(usage="%prog [options]\n" + __doc__)
+    parser.add_option("--api-versions", default="2,3",
+                      help="Comma separated AM API versions to run [default: %default]")
+    parser.add_option("--clients", type="int", default=8,
+                      help="Concurrent clients [default: %default]")
+    parser.add_option("--users", type="int", default=4,
+                      help="Experimenters the clients call as [default: %default]")
+    parser.add_option("--duration", type="float", default=30,
+                      help="Seconds of calls counted per AM [default: %default]")
+    parser.add_option("--warmup", type="float", default=3,
+                      help="Seconds of calls not counted first [default: %default]")
+    parser.add_option("--mix", default=DEFAULT_MIX,
+                      help="Comma separated operation=weight [default: %default]")
+    parser.add_option("--nodes", type="int", default=1,
+                      help="Nodes per Allocate [default: %default]")
+    parser.add_option("--am-option", action="append", default=[],
+                      metavar="NAME=VALUE", dest="am_options",
+                      help="Set an aggregate_manager option in the generated gcf_config, like authorizer_workers=2 (may be repeated)")
+    parser.add_option("--directory", default=None, metavar="DIR",
+                      help="Where to put certificates, gcf_config and server logs (kept) [default: a temporary directory, removed]")
+    parser.add_option("--startup-timeout", type="float", default=30,
+                      help="Seconds to wait for a server to start [default: %default]")
+    parser.add_option("--seed", type="int", default=0,
+                      help="Random seed for the clients' choices [default: %default]")
+    parser.add_option("--json", default=None, metavar="FILE",
+                      help="Also write the results as JSON to FILE")
+    parser.add_option("--debug", action="store_true", default=False,
+                      help="Log debug messages")
+    opts, args = parser.parse_args(argv)
+    try:
+        opts.api_versions = [int(version) for version in \
+                                 opts.api_versions.split(',')]
+    except ValueError:
+        parser.error("--api-versions must be a comma separated list of numbers")
+    for version in opts.api_versions:
+        if version not in (2, 3):
+            parser.error("Unsupported AM API version %d (use 2 or 3)" % version)
+    try:
+        opts.mix = parse_mix(opts.mix)
+    except Exception, e:
+        parser.error("Bad --mix: %s" % e)
+    for option in opts.am_options:
+        if '=' not in option:
+            parser.error("--am-option must be NAME=VALUE, not %s" % option)
+    if opts.clients < 1 or opts.users < 1 or opts.nodes < 1:
+        parser.error("--clients, --users and --nodes must be at least 1")
+    return opts, args
+
+def parse_mix(mix):
+    '''Parse operation=weight,... into a dict of operation => weight.
+    Operations not named get weight 0.'''
+    weights = dict([(operation, 0.0) for operation in OPERATIONS])
+    for item in mix.split(','):
+        operation, weight = item.split('=')
+        operation = operation.strip()
+        if operation not in weights:
+            raise Exception("Unknown operation %s (use one of %s)" % \
+                                (operation, ', '.join(OPERATIONS)))
+        weights[operation] = float(weight)
+        if weights[operation] < 0:
+            raise Exception("Negative weight for %s" % operation)
+    if sum(weights.values()) <= 0:
+        raise Exception("No operation has a weight")
+    return weights
+
+def free_port():
+    '''Return a local TCP port that is not in use.'''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+def user_name(index):
+    # gen-certs.py names user files after the user, replacing 'alice'
+    if index == 0:
+        return 'alice'
+    return 'user%d' % index
+
+class Servers(object):
+    '''The generated configuration and certificates,
+    and the gcf-ch.py and gcf-am.py processes run with them.'''
+
+    def __init__(self, directory, scripts_dir, users, am_options,
+                 startup_timeout):
+        self.directory = directory
+        self.scripts_dir = scripts_dir
+        self.startup_timeout = startup_timeout
+        self.logger = logging.getLogger("gcf-load-benchmark")
+        self.ch_port = free_port()
+        self.am_port = free_port()
+        self.ch_url = 'https://127.0.0.1:%d/' % self.ch_port
+        self.am_url = 'https://127.0.0.1:%d/' % self.am_port
+        self.config = os.path.join(directory, 'gcf_config')
+        with open(self.config, 'w') as f:
+            f.write(CONFIG % dict(base_name='geni//gpo//gcf',
+                                  directory=directory,
+                                  ch_port=self.ch_port,
+                                  am_port=self.am_port,
+                                  am_options='\n'.join(am_options)))
+        self._run_script('gen-certs.py', '-d', directory)
+        for index in range(1, users):
+            self._run_script('gen-certs.py', '-d', directory, '--notAll',
+                             '--exp', '-u', user_name(index))
+        # (keyfile, certfile) per user
+        self.users = []
+        for index in range(users):
+            name = user_name(index)
+            self.users.append((os.path.join(directory, '%s-key.pem' % name),
+                               os.path.join(directory, '%s-cert.pem' % name)))
+        self.ch = None
+        self.am = None
+
+    def _script(self, script, *args):
+        return [sys.executable, os.path.join(self.scripts_dir, script),
+                '-c', self.config] + list(args)
+
+    def _run_script(self, script, *args):
+        log_path = os.path.join(self.directory, 'gen-certs.log')
+        with open(log_path, 'a') as log:
+            code = subprocess.call(self._script(script, *args),
+                                   stdout=log, stderr=subprocess.STDOUT)
+        if code != 0:
+            raise Exception("%s failed (exit code %d): see %s" % \
+                                (script, code, log_path))
+
+    def _start(self, script, log_name, url, get_version, *args):
+        log_path = os.path.join(self.directory, log_name)
+        log = open(log_path, 'w')
+        try:
+            process = subprocess.Popen(self._script(script, *args),
+                                       stdout=log, stderr=subprocess.STDOUT)
+        finally:
+            log.close()
+        keyfile, certfile = self.users[0]
+        client = make_client(url, keyfile, certfile, timeout=5)
+        deadline = time.time() + self.startup_timeout
+        while True:
+            try:
+                get_version(client)
+                break
+            except Exception, e:
+                if process.poll() is not None:
+                    raise Exception("%s exited (code %s): see %s" % \
+                                        (script, process.returncode,
+                                         log_path))
+                if time.time() > deadline:
+                    self._stop(process)
+                    raise Exception("%s did not answer within %s seconds (%s): see %s" % \
+                                        (script, self.startup_timeout, e,
+                                         log_path))
+                time.sleep(0.2)
+        self.logger.info("Started %s %s (log %s)", script, ' '.join(args),
+                         log_path)
+        return process
+
+    def start_ch(self):
+        self.ch = self._start('gcf-ch.py', 'ch.log', self.ch_url,
+                              lambda client: client.GetVersion())
+
+    def start_am(self, api_version):
+        self.am = self._start('gcf-am.py', 'am-v%d.log' % api_version,
+                              self.am_url,
+                              lambda client: client.GetVersion(dict()),
+                              '-V', str(api_version))
+
+    def stop_am(self):
+        self._stop(self.am)
+        self.am = None
+
+    def stop(self):
+        self._stop(self.am)
+        self._stop(self.ch)
+        self.am = self.ch = None
+
+    def _stop(self, process):
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        deadline = time.time() + 5
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(0.1)
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+class Client(object):
+    '''One client: a slice and a connection to the AM, calling it
+    from its own thread.'''
+
+    def __init__(self, index, servers, api_version, mix, nodes, seed):
+        self.index = index
+        self.api_version = api_version
+        self.mix = mix
+        self.nodes = nodes
+        self.random = random.Random(seed * 1000 + index)
+        self.keyfile, self.certfile = servers.users[index % len(servers.users)]
+        self.am = make_client(servers.am_url, self.keyfile, self.certfile)
+        self.ch_url = servers.ch_url
+        self.state = EMPTY
+        self.slice_urn = None
+        self.credentials = None
+        # (start time, method, seconds, outcome) of each call
+        self.calls = []
+        self.exception = None
+
+    def create_slice(self):
+        '''Create this client's slice at the clearinghouse.'''
+        ch = make_client(self.ch_url, self.keyfile, self.certfile)
+        slice_cred_string = ch.CreateSlice()
+        slice_credential = cred.Credential(string=slice_cred_string)
+        self.slice_urn = slice_credential.get_gid_object().get_urn()
+        if self.api_version > 2:
+            self.credentials = [dict(geni_type=cred.Credential.SFA_CREDENTIAL_TYPE,
+                                     geni_version="3",
+                                     geni_value=slice_cred_string)]
+        else:
+            self.credentials = [slice_cred_string]
+
+    def choose(self):
+        '''Pick the next operation, weighted by the mix, from those that
+        make sense in the current state. Return None if there are none.'''
+        operations = [operation for operation in STATE_OPERATIONS[self.state] \
+                          if self.mix[operation] > 0 and \
+                          not (operation == 'Provision' and \
+                                   self.api_version < 3)]
+        total = sum([self.mix[operation] for operation in operations])
+        if total <= 0:
+            return None
+        pick = self.random.uniform(0, total)
+        for operation in operations:
+            pick -= self.mix[operation]
+            if pick <= 0:
+                return operation
+        return operations[-1]
+
+    def call(self, operation):
+        '''Make the AM call for the given operation.
+        Return the method called and the result.'''
+        options = dict()
+        if self.api_version < 3:
+            if operation == 'GetVersion':
+                return 'GetVersion', self.am.GetVersion(options)
+            if operation == 'ListResources':
+                options.update(geni_available=True, geni_compressed=True,
+                               geni_rspec_version=RSPEC_VERSION)
+                return 'ListResources', self.am.ListResources(self.credentials,
+                                                              options)
+            if operation == 'Allocate':
+                return 'CreateSliver', \
+                    self.am.CreateSliver(self.slice_urn, self.credentials,
+                                         self.request_rspec(), [], options)
+            if operation == 'Status':
+                return 'SliverStatus', \
+                    self.am.SliverStatus(self.slice_urn, self.credentials,
+                                         options)
+            if operation == 'Renew':
+                return 'RenewSliver', \
+                    self.am.RenewSliver(self.slice_urn, self.credentials,
+                                        self.expiration(), options)
+            if operation == 'Delete':
+                return 'DeleteSliver', \
+                    self.am.DeleteSliver(self.slice_urn, self.credentials,
+                                         options)
+        else:
+            if operation == 'GetVersion':
+                return 'GetVersion', self.am.GetVersion(options)
+            if operation == 'ListResources':
+                options.update(geni_available=True, geni_compressed=True,
+                               geni_rspec_version=RSPEC_VERSION)
+                return 'ListResources', self.am.ListResources(self.credentials,
+                                                              options)
+            if operation == 'Allocate':
+                return 'Allocate', \
+                    self.am.Allocate(self.slice_urn, self.credentials,
+                                     self.request_rspec(), options)
+            if operation == 'Provision':
+                options.update(geni_rspec_version=RSPEC_VERSION)
+                return 'Provision', \
+                    self.am.Provision([self.slice_urn], self.credentials,
+                                      options)
+            if operation == 'Status':
+                return 'Status', self.am.Status([self.slice_urn],
+                                                self.credentials, options)
+            if operation == 'Renew':
+                return 'Renew', self.am.Renew([self.slice_urn],
+                                              self.credentials,
+                                              self.expiration(), options)
+            if operation == 'Delete':
+                return 'Delete', self.am.Delete([self.slice_urn],
+                                                self.credentials, options)
+        raise Exception("Unknown operation %s" % operation)
+
+    def request_rspec(self):
+        nodes = [REQUEST_RSPEC_NODE % i for i in range(self.nodes)]
+        return REQUEST_RSPEC % '\n'.join(nodes)
+
+    def expiration(self):
+        # Within the slice lifetime (slice_duration in the config)
+        expiration = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        return expiration.isoformat() + 'Z'
+
+    def next_state(self, operation):
+        '''The state of the slice after the operation succeeds.'''
+        if operation == 'Allocate':
+            if self.api_version < 3:
+                return PROVISIONED
+            return ALLOCATED
+        if operation == 'Provision':
+            return PROVISIONED
+        if operation == 'Delete':
+            return EMPTY
+        return self.state
+
+    def run(self, end):
+        '''Call the AM until the end time.'''
+        try:
+            while True:
+                operation = self.choose()
+                if operation is None:
+                    break
+                start = time.time()
+                if start >= end:
+                    break
+                method = operation
+                begin = timeit.default_timer()
+                try:
+                    method, result = self.call(operation)
+                    outcome = result_outcome(result)
+                except Exception, e:
+                    logging.getLogger("gcf-load-benchmark").debug("Client %d %s failed: %s",
+                                                                   self.index,
+                                                                   operation, e)
+                    outcome = ERROR
+                secs = timeit.default_timer() - begin
+                self.calls.append((start, method, secs, outcome))
+                if outcome == OK:
+                    self.state = self.next_state(operation)
+                elif outcome == REFUSED and operation == 'Delete':
+                    # Nothing left to delete (e.g. the slivers expired)
+                    self.state = EMPTY
+        except Exception, e:
+            self.exception = e
+
+def result_outcome(result):
+    '''Is this AM API result OK, or refused (a non zero geni_code)?'''
+    if isinstance(result, dict) and isinstance(result.get('code'), dict):
+        if result['code'].get('geni_code', 0) != 0:
+            return REFUSED
+    return OK
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+def summarize(calls, duration):
+    '''Summarize (method, seconds, outcome) calls by method,
+    and all together (as method '*'). Return a list of dicts.'''
+    by_method = {}
+    for method, secs, outcome in calls:
+        by_method.setdefault(method, []).append((secs, outcome))
+    by_method['*'] = [(secs, outcome) for method, secs, outcome in calls]
+    summary = []
+    for method in sorted(by_method):
+        method_calls = by_method[method]
+        latencies = sorted([secs for secs, outcome in method_calls])
+        count = len(method_calls)
+        refused = len([c for c in method_calls if c[1] == REFUSED])
+        errors = len([c for c in method_calls if c[1] == ERROR])
+        summary.append(dict(method=method,
+                            calls=count,
+                            calls_per_sec=count / duration,
+                            p50_msecs=1000 * percentile(latencies, 0.5),
+                            p99_msecs=1000 * percentile(latencies, 0.99),
+                            max_msecs=1000 * percentile(latencies, 1.0),
+                            refused=refused,
+                            refused_rate=float(refused) / count if count else 0.0,
+                            errors=errors,
+                            error_rate=float(errors) / count if count else 0.0))
+    return summary
+
+def run_am(servers, api_version, opts):
+    '''Start the AM, load it with the clients and stop it.
+    Return the summary of the calls.'''
+    logger = logging.getLogger("gcf-load-benchmark")
+    servers.start_am(api_version)
+    try:
+        clients = [Client(index, servers, api_version, opts.mix, opts.nodes,
+                          opts.seed) \
+                       for index in range(opts.clients)]
+        if [operation for operation in SLICE_OPERATIONS \
+                if opts.mix[operation] > 0]:
+            for client in clients:
+                try:
+                    client.create_slice()
+                except Exception, e:
+                    raise Exception("Client %d failed to create a slice at the clearinghouse: %s" % \
+                                        (client.index, e))
+        start = time.time()
+        counted = start + opts.warmup
+        end = counted + opts.duration
+        threads = [threading.Thread(target=client.run, args=(end,),
+                                    name="client-%d" % client.index) \
+                       for client in clients]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        servers.stop_am()
+    for client in clients:
+        if client.exception is not None:
+            logger.error("Client %d stopped: %s", client.index,
+                         client.exception)
+    calls = [(method, secs, outcome) for client in clients \
+                 for (call_start, method, secs, outcome) in client.calls \
+                 if call_start >= counted]
+    return summarize(calls, opts.duration)
+
+def print_summary(api_version, opts, summary):
+    print "AM API v%d: %d clients, %g seconds" % (api_version, opts.clients,
+                                                   opts.duration)
+    print "%-16s%8s%10s%10s%10s%10s%10s%10s" % ('method', 'calls', 'calls/s',
+                                                'p50 ms', 'p99 ms', 'max ms',
+                                                'refused', 'errors')
+    for row in summary:
+        print "%-16s%8d%10.1f%10.1f%10.1f%10.1f%9.1f%%%9.1f%%" % \
+            (row['method'], row['calls'], row['calls_per_sec'],
+             row['p50_msecs'], row['p99_msecs'], row['max_msecs'],
+             100 * row['refused_rate'], 100 * row['error_rate'])
+    print
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    opts, args = parse_args(argv)
+
+    level = logging.INFO
+    if opts.debug:
+        level = logging.DEBUG
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)-8s %(message)s')
+    logger = logging.getLogger("gcf-load-benchmark")
+
+    directory = opts.directory
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix='gcf-load-')
+    else:
+        directory = os.path.abspath(os.path.expanduser(directory))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+    scripts_dir = os.path.dirname(os.path.abspath(__file__))
+
+    failed = False
+    results = []
+    servers = None
+    try:
+        servers = Servers(directory, scripts_dir, opts.users,
+                          opts.am_options, opts.startup_timeout)
+        servers.start_ch()
+        for api_version in opts.api_versions:
+            summary = run_am(servers, api_version, opts)
+            print_summary(api_version, opts, summary)
+            results.append(dict(api_version=api_version, methods=summary))
+    except Exception, e:
+        logger.error("%s", e)
+        failed = True
+    finally:
+        if servers is not None:
+            servers.stop()
+
+    if opts.json:
+        with open(opts.json, 'w') as f:
+            json.dump(dict(clients=opts.clients,
+                           users=opts.users,
+                           duration=opts.duration,
+                           warmup=opts.warmup,
+                           mix=opts.mix,
+                           nodes=opts.nodes,
+                           am_options=opts.am_options,
+                           timestamp=datetime.datetime.utcnow().isoformat(),
+                           results=results), f, indent=2)
+        logger.info("Wrote results to %s", opts.json)
+
+    if opts.directory is None:
+        if failed:
+            logger.info("Kept certificates, gcf_config and logs in %s",
+                        directory)
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+    if failed:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
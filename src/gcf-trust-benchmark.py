@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Benchmark the certificate and credential (trust) stack.
+
+Generates a synthetic CA hierarchy (a root CA, --ca-depth - 1
+intermediate CAs and a slice authority) with cert_util.create_cert as
+gen-certs.py does, a slice credential, a chain of --delegations
+delegated slice credentials (as delegateSliceCred.py makes them) and
+an ABAC speaks-for credential. Then times the common trust operations
+(certificate parsing and chain verification, credential parsing,
+signing and verification, speaks-for) and reports per operation
+latency and throughput.
+
+Runs offline. Operations that need a missing backend (such as
+xmlsec1) are reported as skipped.
+
+Run with "-h" flag to see usage and command line options.
+"""
+
+import sys
+
+# Check python version. Requires 2.6 or greater, but less than 3.
+if sys.version_info < (2, 6):
+    raise Exception('Must use python 2.6 or greater.')
+elif sys.version_info >= (3,):
+    raise Exception('Not python 3 ready')
+
+import datetime
+import json
+import logging
+import optparse
+import os
+import shutil
+import tempfile
+import timeit
+
+from OpenSSL import crypto
+
+import gcf.sfa.trust.credential as cred
+from gcf.sfa.trust.abac_credential import ABACCredential, ABACElement
+from gcf.sfa.trust.credential_factory import CredentialFactory
+from gcf.sfa.trust.gid import GID
+from gcf.geni.util import cred_util
+from gcf.geni.util import speaksfor_util
+from gcf.geni.util import xmldsig_util
+from gcf.geni.util.cert_util import create_cert
+from gcf.geni.util.urn_util import URN
+
+AUTHORITY = 'bench.example.net'
+SLICE_PRIVILEGES = ('createsliver',)
+
+def parse_args(argv):
+    parser = optparse.OptionParser(usage="%prog [options]\n" + __doc__)
+    parser.add_option("-n", "--iterations", type="int", default=20,
+                      help="Number of times to run each operation (default %default)")
+    parser.add_option("--ca-depth", type="int", default=2,
+                      help="Number of CAs above the slice authority, including the root (default %default)")
+    parser.add_option("--delegations", type="int", default=1,
+                      help="Number of times the slice credential is delegated (default %default)")
+    parser.add_option("-o", "--operation", action="append", default=None,
+                      help="Only run the named operation. May be repeated.")
+    parser.add_option("--list", action="store_true", default=False,
+                      help="List the operations and exit")
+    parser.add_option("-d", "--directory", default=None,
+                      help="Directory to write the generated certificates and credentials to (default: a temporary directory, removed at the end)")
+    parser.add_option("--json", default=None, metavar="FILE",
+                      help="Also write the results as JSON to this file")
+    parser.add_option("--debug", action="store_true", default=False,
+                      help="Enable debug logging")
+    opts, args = parser.parse_args(argv)
+    if opts.iterations < 1:
+        parser.error("--iterations must be at least 1")
+    if opts.ca_depth < 1:
+        parser.error("--ca-depth must be at least 1")
+    if opts.delegations < 0:
+        parser.error("--delegations must not be negative")
+    return opts, args
+
+def make_cert(dirname, name, urn, issuer=None, ca=False):
+    '''Create a certificate (with a subject key identifier, as ABAC
+    needs) and key, signed by the given (gid, keys, certfile) issuer.
+    Save them to dirname and return (gid, keys, certfile, keyfile).'''
+    if issuer:
+        (gid, keys) = create_cert(urn, issuer[1], issuer[0], ca=ca)
+    else:
+        (gid, keys) = create_cert(urn, ca=ca)
+    gid.cert.add_extensions([crypto.X509Extension('subjectKeyIdentifier',
+                                                  False, 'hash',
+                                                  subject=gid.cert)])
+    gid.sign()
+    certfile = os.path.join(dirname, '%s-cert.pem' % name)
+    keyfile = os.path.join(dirname, '%s-key.pem' % name)
+    gid.save_to_file(certfile, save_parents=True)
+    keys.save_to_file(keyfile)
+    return (GID(filename=certfile), keys, certfile, keyfile)
+
+class Fixture(object):
+    '''The certificates and credentials the operations work on.'''
+
+    def __init__(self, dirname, ca_depth, delegations, logger):
+        self.dirname = dirname
+        rootsdir = os.path.join(dirname, 'trusted_roots')
+        os.mkdir(rootsdir)
+
+        # CA hierarchy: root, intermediates, slice authority
+        issuer = make_cert(dirname, 'ca0',
+                           URN(AUTHORITY, 'authority', 'ca0').urn_string(),
+                           ca=True)
+        self.root_file = os.path.join(rootsdir, 'ca0-cert.pem')
+        shutil.copy(issuer[2], self.root_file)
+        for i in range(1, ca_depth):
+            name = 'ca%d' % i
+            issuer = make_cert(dirname, name,
+                               URN(AUTHORITY, 'authority', name).urn_string(),
+                               issuer, ca=True)
+        self.sa = make_cert(dirname, 'sa',
+                            URN(AUTHORITY, 'authority', 'sa').urn_string(),
+                            issuer, ca=True)
+        self.users = [make_cert(dirname, 'user%d' % i,
+                                URN(AUTHORITY, 'user', 'user%d' % i).urn_string(),
+                                self.sa)
+                      for i in range(delegations + 1)]
+        self.tool = make_cert(dirname, 'tool',
+                              URN(AUTHORITY, 'user', 'tool').urn_string(),
+                              self.sa)
+        self.slice_gid = make_cert(dirname, 'slice',
+                                   URN(AUTHORITY, 'slice', 'bench').urn_string(),
+                                   self.sa)[0]
+        logger.info("Created %d level CA hierarchy and %d users in %s",
+                    ca_depth + 1, len(self.users), dirname)
+
+        self.verifier = cred_util.CredentialVerifier(rootsdir)
+        self.roots = self.verifier.get_root_certs()
+        self.issuer = cred_util.CredentialIssuer(self.sa[3], self.sa[2],
+                                                 [self.root_file])
+        self.expiration = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+
+        # Slice credential for the first user, delegated down the users
+        self.slice_cred = self.issuer.create_credential(self.users[0][0],
+                                                        self.slice_gid,
+                                                        self.expiration,
+                                                        'slice', True,
+                                                        verify=False)
+        current = self.slice_cred
+        for i in range(1, len(self.users)):
+            current = self.delegate(current, self.users[i - 1], self.users[i])
+        self.cred = current
+        self.cred_xml = current.save_to_string()
+        self.caller = self.users[-1]
+        self.caller_pem = open(self.caller[2]).read()
+        logger.info("Created slice credential delegated %d times", delegations)
+
+        self.sf_xml = self.speaks_for(self.users[0], self.tool)
+        self.sf_user_urn = self.users[0][0].get_urn()
+
+    def delegate(self, parent, owner, delegee):
+        '''Delegate the parent credential from owner to delegee,
+        as delegateSliceCred.py does.'''
+        dcred = cred.Credential(subject="%s delegated to %s" % \
+                                    (self.slice_gid.get_hrn(), delegee[0].get_hrn()))
+        dcred.set_gid_caller(delegee[0])
+        dcred.set_gid_object(parent.get_gid_object())
+        dcred.set_parent(parent)
+        dcred.set_expiration(parent.get_expiration())
+        dcred.set_privileges(parent.get_privileges())
+        dcred.get_privileges().delegate_all_privileges(True)
+        dcred.set_signer(xmldsig_util.XMLSigner(owner[3], owner[2]))
+        dcred.encode()
+        dcred.sign()
+        return cred.Credential(string=dcred.save_to_string())
+
+    def speaks_for(self, user, tool):
+        '''Return a speaks-for credential from user for tool.'''
+        sf = ABACCredential()
+        sf.set_signer(xmldsig_util.XMLSigner(user[3], user[2]))
+        user_keyid = speaksfor_util.get_cert_keyid(user[0])
+        tool_keyid = speaksfor_util.get_cert_keyid(tool[0])
+        sf.head = ABACElement(user_keyid, user[0].get_urn(),
+                              "speaks_for_%s" % user_keyid)
+        sf.tails.append(ABACElement(tool_keyid, tool[0].get_urn()))
+        sf.set_expiration(self.expiration.replace(microsecond=0))
+        sf.encode()
+        sf.sign()
+        return sf.save_to_string()
+
+def have_xmlsec1():
+    return bool(cred.Credential().xmlsec_path)
+
+def operations(fixture):
+    '''Return the list of (name, description, function, skip reason)
+    benchmark operations on the given fixture.'''
+    f = fixture
+    no_xmlsec = None
+    if not have_xmlsec1():
+        no_xmlsec = "xmlsec1 not found"
+
+    def sign_xmlsec1():
+        c = cred.Credential(subject='bench')
+        c.set_gid_caller(f.users[0][0])
+        c.set_gid_object(f.slice_gid)
+        c.set_expiration(f.expiration)
+        c.set_privileges(f.slice_cred.get_privileges())
+        c.set_issuer_keys(f.sa[3], f.sa[2])
+        c.encode()
+        c.sign()
+
+    def speaks_for(cached):
+        if not cached:
+            speaksfor_util.speaks_for_cache.clear()
+        gid = speaksfor_util.determine_speaks_for(None, [f.sf_xml], f.tool[0],
+                                                  {'geni_speaking_for' : f.sf_user_urn},
+                                                  f.roots)
+        if gid is f.tool[0]:
+            raise Exception("Speaks-for credential did not verify")
+
+    return [
+        ('gid_parse', 'Parse a user certificate and its chain',
+         lambda: GID(string=f.caller_pem), None),
+        ('verify_chain', 'Verify a user certificate chain to the trusted roots',
+         lambda: f.caller[0].verify_chain(f.roots), None),
+        ('cred_parse', 'Parse (decode) the delegated slice credential',
+         lambda: cred.Credential(string=f.cred_xml), None),
+        ('cred_sign', 'Create and sign a slice credential in process',
+         lambda: f.issuer.create_credential(f.users[0][0], f.slice_gid,
+                                            f.expiration, 'slice', True,
+                                            verify=False), None),
+        ('cred_issue', 'Create, sign and verify a slice credential in process',
+         lambda: f.issuer.create_credential(f.users[0][0], f.slice_gid,
+                                            f.expiration, 'slice', True),
+         None),
+        ('cred_sign_xmlsec1', 'Create and sign a slice credential with xmlsec1',
+         sign_xmlsec1, no_xmlsec),
+        ('xmldsig_verify', 'Verify the outer credential signature in process',
+         lambda: xmldsig_util.verify_signature(f.cred_xml, f.roots), None),
+        ('cred_verify', 'Verify the delegated slice credential (Credential.verify, xmlsec1)',
+         lambda: f.cred.verify([f.root_file]), no_xmlsec),
+        ('verify_from_strings', 'CredentialVerifier.verify_from_strings on the delegated slice credential',
+         lambda: f.verifier.verify_from_strings(f.caller_pem, [f.cred_xml],
+                                                f.slice_gid.get_urn(),
+                                                SLICE_PRIVILEGES), no_xmlsec),
+        ('abac_parse', 'Parse the ABAC speaks-for credential',
+         lambda: CredentialFactory.createCred(f.sf_xml), None),
+        ('speaks_for', 'Verify the speaks-for credential (cache cleared)',
+         lambda: speaks_for(False), None),
+        ('speaks_for_cached', 'Verify the speaks-for credential (cached)',
+         lambda: speaks_for(True), None),
+        ]
+
+def run(name, func, iterations):
+    '''Run func iterations times (after one untimed warm up run).
+    Return a dict of results.'''
+    func()
+    times = []
+    for i in range(iterations):
+        start = timeit.default_timer()
+        func()
+        times.append(timeit.default_timer() - start)
+    times.sort()
+    total = sum(times)
+    return dict(operation=name, iterations=iterations,
+                mean_ms=1000.0 * total / iterations,
+                median_ms=1000.0 * times[iterations // 2],
+                p95_ms=1000.0 * times[min(iterations - 1, int(iterations * 0.95))],
+                min_ms=1000.0 * times[0],
+                ops_per_sec=iterations / total if total > 0 else 0)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    opts, args = parse_args(argv)
+
+    level = logging.INFO
+    if opts.debug:
+        level = logging.DEBUG
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)-8s %(message)s')
+    logger = logging.getLogger("gcf-trust-benchmark")
+    if not opts.debug:
+        # The SFA trust code logs (e.g. a missing xmlsec1) on every
+        # Credential created
+        logging.getLogger("info").setLevel(logging.ERROR)
+
+    dirname = opts.directory
+    if dirname:
+        dirname = os.path.abspath(os.path.expanduser(dirname))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+    else:
+        dirname = tempfile.mkdtemp(prefix='gcf-trust-benchmark-')
+
+    try:
+        fixture = Fixture(dirname, opts.ca_depth, opts.delegations, logger)
+        ops = operations(fixture)
+        if opts.list:
+            for (name, description, func, skip) in ops:
+                print "%-20s %s" % (name, description)
+            return 0
+
+        if opts.operation:
+            unknown = set(opts.operation) - set([op[0] for op in ops])
+            if unknown:
+                sys.exit("Unknown operation(s): %s" % ", ".join(sorted(unknown)))
+            ops = [op for op in ops if op[0] in opts.operation]
+
+        results = []
+        print "%-20s %10s %10s %10s %10s" % ("operation", "mean ms", "median ms", "p95 ms", "ops/sec")
+        for (name, description, func, skip) in ops:
+            if skip:
+                print "%-20s skipped: %s" % (name, skip)
+                results.append(dict(operation=name, skipped=skip))
+                continue
+            try:
+                result = run(name, func, opts.iterations)
+            except Exception, e:
+                logger.debug("%s failed", name, exc_info=True)
+                print "%-20s failed: %s" % (name, e)
+                results.append(dict(operation=name, error=str(e)))
+                continue
+            results.append(result)
+            print "%-20s %10.3f %10.3f %10.3f %10.1f" % \
+                (name, result['mean_ms'], result['median_ms'],
+                 result['p95_ms'], result['ops_per_sec'])
+
+        if opts.json:
+            with open(opts.json, 'w') as f:
+                json.dump(dict(ca_depth=opts.ca_depth,
+                               delegations=opts.delegations,
+                               iterations=opts.iterations,
+                               timestamp=datetime.datetime.utcnow().isoformat(),
+                               results=results), f, indent=2)
+            logger.info("Wrote results to %s", opts.json)
+    finally:
+        if not opts.directory:
+            shutil.rmtree(dirname, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
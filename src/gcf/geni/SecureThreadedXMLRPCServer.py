@@ -39,6 +39,7 @@ import SocketServer
 
 from .SecureXMLRPCServer import SecureXMLRPCServer
 from .SecureXMLRPCServer import SecureXMLRPCRequestHandler
+from .util.cert_util import PeerIdentity
 
 
 class SecureThreadedXMLRPCRequestHandler(SecureXMLRPCRequestHandler):
@@ -55,6 +56,7 @@ class SecureThreadedXMLRPCRequestHandler(SecureXMLRPCRequestHandler):
         self.server.peercert = None
         self.server.der_cert = None
         self.server.pem_cert = None
+        self.server.peer_identity = None
 
         # Now save all this information in a thread specific data structure.    
         # This is so we can have multiple requests active on this server        
@@ -67,6 +69,11 @@ class SecureThreadedXMLRPCRequestHandler(SecureXMLRPCRequestHandler):
         # This last is what a GID is created from                               
         SecureThreadedXMLRPCRequestHandler.request_specific_info.pem_cert = \
             self.der_to_pem(SecureThreadedXMLRPCRequestHandler.request_specific_info.der_cert)
+        # Parsed (on first use) identity of the caller, shared by all
+        # requests on this connection (and by later connections from
+        # the same caller)
+        SecureThreadedXMLRPCRequestHandler.request_specific_info.peer_identity = \
+            PeerIdentity.for_pem(SecureThreadedXMLRPCRequestHandler.request_specific_info.pem_cert)
         SecureThreadedXMLRPCRequestHandler.request_specific_info.thread_name = \
             threading.current_thread().name
         SecureThreadedXMLRPCRequestHandler.request_specific_info.requestline = \
@@ -82,6 +89,10 @@ class SecureThreadedXMLRPCRequestHandler(SecureXMLRPCRequestHandler):
     def get_pem_cert() :
         return SecureThreadedXMLRPCRequestHandler.request_specific_info.pem_cert
 
+    @staticmethod
+    def get_peer_identity() :
+        return SecureThreadedXMLRPCRequestHandler.request_specific_info.peer_identity
+
 class SecureThreadedXMLRPCServer(SocketServer.ThreadingMixIn, SecureXMLRPCServer):
     """An extension to SecureMLRPCServer that adds multi-threading per RPC"""
 
@@ -102,3 +113,7 @@ class SecureThreadedXMLRPCServer(SocketServer.ThreadingMixIn, SecureXMLRPCServer
     def get_pem_cert(self) :
         return SecureThreadedXMLRPCRequestHandler.get_pem_cert()
 
+    # Threaded version of get_peer_identity
+    def get_peer_identity(self) :
+        return SecureThreadedXMLRPCRequestHandler.get_peer_identity()
+
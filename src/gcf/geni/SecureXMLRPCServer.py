@@ -37,6 +37,10 @@ import os
 
 from SimpleXMLRPCServer import SimpleXMLRPCServer
 from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler
+from SimpleXMLRPCServer import resolve_dotted_attribute
+
+from .util.cert_util import PeerIdentity
+from .util.call_metrics import UNKNOWN_METHOD
 
 class SecureXMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
     """A request handler that grabs the socket peer's certificate and
@@ -56,6 +60,8 @@ class SecureXMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
         self.server.der_cert = self.request.getpeercert(binary_form=True)
         # This last is what a GID is created from
         self.server.pem_cert = self.der_to_pem(self.server.der_cert)
+        # Parsed (on first use) identity of the caller
+        self.server.peer_identity = PeerIdentity.for_pem(self.server.pem_cert)
         self.requestline = "<requestline not set by XMLRPC server>"
         self.log_request()
         if self.server.logRequests:
@@ -67,6 +73,7 @@ class SecureXMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
         self.server.peercert = None
         self.server.der_cert = None
         self.server.pem_cert = None
+        self.server.peer_identity = None
         SimpleXMLRPCRequestHandler.finish(self)
         
     def der_to_pem(self, der_cert_bytes):
@@ -80,7 +87,12 @@ class SecureXMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
         
 
 class SecureXMLRPCServer(SimpleXMLRPCServer):
-    """An extension to SimpleXMLRPCServer that adds SSL support."""
+    """An extension to SimpleXMLRPCServer that adds SSL support.
+
+    Set metrics to a CallMetrics (see util/call_metrics.py) to have
+    calls counted and timed."""
+
+    metrics = None
 
     def __init__(self, addr, requestHandler=SecureXMLRPCRequestHandler,
                  logRequests=False, allow_none=False, encoding=None,
@@ -115,3 +127,51 @@ class SecureXMLRPCServer(SimpleXMLRPCServer):
     # This method for the threaded case
     def get_pem_cert(self):
         return self.pem_cert
+
+    # Return the PeerIdentity (parsed cert, URN, keyid) for the
+    # current XMLRPC client connection
+    def get_peer_identity(self):
+        return self.peer_identity
+
+    # Time the whole call, including parsing the request and
+    # serializing the response, if keeping metrics
+    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        if self.metrics is None:
+            return SimpleXMLRPCServer._marshaled_dispatch(self, data,
+                                                          dispatch_method,
+                                                          path)
+        call = self.metrics.begin_call()
+        try:
+            return SimpleXMLRPCServer._marshaled_dispatch(self, data,
+                                                          dispatch_method,
+                                                          path)
+        finally:
+            self.metrics.end_call(call)
+
+    # Is the given method name one this server dispatches to?
+    # An instance with its own _dispatch may take any name, so
+    # its methods are not known.
+    def _is_registered_method(self, method):
+        if method in self.funcs:
+            return True
+        if self.instance is None or hasattr(self.instance, '_dispatch'):
+            return False
+        try:
+            resolve_dotted_attribute(self.instance, method,
+                                     self.allow_dotted_names)
+        except AttributeError:
+            return False
+        return True
+
+    # Time the dispatched method, if keeping metrics. Calls to other
+    # than registered methods are counted together under
+    # UNKNOWN_METHOD, so a client cannot grow the metrics without bound.
+    def _dispatch(self, method, params):
+        if self.metrics is None:
+            return SimpleXMLRPCServer._dispatch(self, method, params)
+        if self._is_registered_method(method):
+            name = method
+        else:
+            name = UNKNOWN_METHOD
+        return self.metrics.dispatch(name, SimpleXMLRPCServer._dispatch,
+                                     self, method, params)
@@ -23,21 +23,83 @@
 
 from __future__ import absolute_import
 
+import collections
+
 from .resource import Resource
 
 class Aggregate(object):
+    """The resources of an aggregate, and the containers (e.g. slices and
+    users) things (resources or slivers) are allocated to.
+
+    Available resources are kept in free lists by type, resources are
+    indexed by id, and each thing allocated knows its containers, so
+    finding, allocating and deallocating k resources takes time in k,
+    not in the number of resources. Resources tell their aggregate when
+    their availability changes.
+    """
 
     def __init__(self):
         self.resources = []
+        # Resource id => resource
+        self._resources_by_id = {}
+        # Resource type => available resources of that type, by id
+        self._free = collections.OrderedDict()
+        # Container => things allocated to it (as keys, in the order
+        # they were allocated)
         self.containers = {}
+        # Thing allocated => containers it is allocated to
+        self._holders = {}
 
     def add_resources(self, resources):
         self.resources.extend(resources)
+        for r in resources:
+            self._resources_by_id[r.id] = r
+            r._aggregate = self
+            self.availability_changed(r)
+        Resource.availability_changed()
+
+    def get_resource(self, resource_id):
+        """Return the resource with the given id, or None."""
+        return self._resources_by_id.get(resource_id)
+
+    def availability_changed(self, resource):
+        """Update the free lists for a change in a resource's
+        availability."""
+        free = self._free.get(resource.type)
+        if free is None:
+            free = collections.OrderedDict()
+            self._free[resource.type] = free
+        if resource.available:
+            free[resource.id] = resource
+        else:
+            free.pop(resource.id, None)
+
+    def available_resources(self, count=None, resource_type=None):
+        """Return up to count (or all) available resources, of the given
+        type or of any type."""
+        result = []
+        if resource_type is None:
+            free_lists = self._free.values()
+        else:
+            free_lists = [self._free.get(resource_type, {})]
+        for free in free_lists:
+            for r in free.itervalues():
+                if count is not None and len(result) >= count:
+                    return result
+                result.append(r)
+        return result
+
+    def available_count(self, resource_type=None):
+        """Return the number of available resources, of the given type
+        or of any type."""
+        if resource_type is None:
+            return sum([len(free) for free in self._free.values()])
+        return len(self._free.get(resource_type, {}))
 
     def catalog(self, container=None):
         if container:
             if container in self.containers:
-                return self.containers[container]
+                return self.containers[container].keys()
             else:
                 return []
         else:
@@ -45,38 +107,53 @@ class Aggregate(object):
 
     def allocate(self, container, resources):
         if container not in self.containers:
-            self.containers[container] = []
+            self.containers[container] = collections.OrderedDict()
+        allocated = self.containers[container]
         for r in resources:
-            self.containers[container].append(r)
+            if r not in allocated:
+                allocated[r] = None
+                self._holders.setdefault(r, []).append(container)
 
     def deallocate(self, container, resources):
         if container and not self.containers.has_key(container):
             # Be flexible: if a container is specified but unknown
             # ignore the call
             return
+        touched = set()
         if container and resources:
             # deallocate the given resources from the container
+            # (ignoring any it does not hold, e.g. ones restored
+            # from a sliver store without their user's container)
             for r in resources:
-                self.containers[container].remove(r)
+                self._remove(container, r)
+            touched.add(container)
         elif container:
             # deallocate all the resources in the container
-            container_resources = list(self.containers[container])
-            for r in container_resources:
-                self.containers[container].remove(r)
+            for r in self.containers[container].keys():
+                self._remove(container, r)
+            touched.add(container)
         elif resources:
             # deallocate the resources from their container
             for r in resources:
-                for c in self.containers.values():
-                    if r in c:
-                        c.remove(r)
-        # Finally, check if container is empty. If so, delete it.
-        # Note cache the keys because we will be modifying the dict
-        # inside the loop
-        allkeys = self.containers.keys()
-        for k in allkeys:
+                for c in list(self._holders.get(r, [])):
+                    self._remove(c, r)
+                    touched.add(c)
+        # Finally, check if the containers are empty. If so, delete them.
+        for k in touched:
             if not self.containers[k]:
                 del self.containers[k]
 
+    # Remove a thing from a container, if it holds it
+    def _remove(self, container, r):
+        allocated = self.containers[container]
+        if r not in allocated:
+            return
+        del allocated[r]
+        holders = self._holders[r]
+        holders.remove(container)
+        if not holders:
+            del self._holders[r]
+
     def stop(self, container):
         # Mark the resources as 'SHUTDOWN'
         if container in self.containers:
@@ -41,6 +41,7 @@ import dateutil.parser
 import logging
 import os
 import string
+import threading
 import uuid
 import xml.dom.minidom as minidom
 import xmlrpclib
@@ -53,6 +54,7 @@ from ... import geni
 from ..util.urn_util import publicid_to_urn, URN
 from ..util.tz_util import tzd
 from ..SecureXMLRPCServer import SecureXMLRPCServer
+from ..util.call_metrics import CallMetrics
 from ..auth.base_authorizer import *
 from .am_method_context import AMMethodContext
 
@@ -85,6 +87,9 @@ class Slice(object):
         self.urn = urn
         self.expiration = expiration
         self.resources = dict()
+        # When and by whom (if known) the slice was created
+        self.start_time = datetime.datetime.utcnow()
+        self.user_urn = None
 
     def getURN(self) : return self.urn
 
@@ -131,8 +136,14 @@ class ReferenceAggregateManager(object):
         self._cred_verifier = geni.CredentialVerifier(root_cert)
         self._urn_authority = urn_authority
         self._my_urn = publicid_to_urn("%s %s %s" % (self._urn_authority, 'authority', 'am'))
+        # Advertisement RSpecs by (available only, compressed),
+        # for the availability generation they were built at
+        self._adverts = dict()
+        self._advert_generation = None
+        self._advert_lock = threading.Lock()
         self.max_lease = datetime.timedelta(days=REFAM_MAXLEASE_DAYS)
         self.logger = logging.getLogger('gcf.am2')
+        self._allocation_listeners = list()
 
     def GetVersion(self, options):
         '''Specify version information about this AM. That could
@@ -239,19 +250,16 @@ class ReferenceAggregateManager(object):
                 # return an empty rspec
                 return self._no_such_slice(slice_urn)
         else:
-            all_resources = self._agg.catalog(None)
             available = 'geni_available' in options and options['geni_available']
-            resource_xml = ""
-            for r in all_resources:
-                if available and not r.available:
-                    continue
-                resource_xml = resource_xml + self.advert_resource(r)
-            result = self.advert_header() + resource_xml + self.advert_footer()
+            result = self.advertisement(available)
         self.logger.debug("Result is now \"%s\"", result)
         # Optionally compress the result
         if 'geni_compressed' in options and options['geni_compressed']:
             try:
-                result = base64.b64encode(zlib.compress(result))
+                if 'geni_slice_urn' in options:
+                    result = base64.b64encode(zlib.compress(result))
+                else:
+                    result = self.advertisement(available, compressed=True)
             except Exception, exc:
                 import traceback
                 self.logger.error("Error compressing and encoding resource list: %s", traceback.format_exc())
@@ -318,27 +326,18 @@ class ReferenceAggregateManager(object):
         # EG if both V1 and V2 are supported, and the user gives V2 request,
         # then you must return a V2 request and not V1
 
-        allresources = self._agg.catalog()
-        allrdict = dict()
-        for r in allresources:
-            if r.available:
-                allrdict[r.id] = r
-
         # Note: This only handles unbound nodes. Any attempt by the client
         # to specify a node is ignored.
         resources = dict()
         unbound = list()
         for elem in rspec_dom.documentElement.getElementsByTagName('node'):
             unbound.append(elem)
-        for elem in unbound:
+        available = self._agg.available_resources(len(unbound))
+        if len(unbound) > len(available):
+            return self.errorResult(6, 'Too Big: insufficient resources to fulfill request')
+        for elem, r in zip(unbound, available):
             client_id = elem.getAttribute('client_id')
-            keys = allrdict.keys()
-            if keys:
-                rid = keys[0]
-                resources[client_id] = allrdict[rid]
-                del allrdict[rid]
-            else:
-                return self.errorResult(6, 'Too Big: insufficient resources to fulfill request')
+            resources[client_id] = r
 
         # determine max expiration time from credentials
         # do not create a sliver that will outlive the slice!
@@ -349,11 +348,16 @@ class ReferenceAggregateManager(object):
                 expiration = credexp
 
         newslice = Slice(slice_urn, expiration)
+        newslice.user_urn = user_urn
         self._agg.allocate(slice_urn, resources.values())
         self._agg.allocate(user_urn, resources.values())
+        now = datetime.datetime.utcnow()
         for cid, r in resources.items():
             newslice.resources[cid] = r.id
             r.status = Resource.STATUS_READY
+            self._notify_allocation_listeners('sliver_allocated', r.id,
+                                              slice_urn, user_urn, 
+                                              now, expiration)
         self._slices[slice_urn] = newslice
 
         self.logger.info("Created new slice %s" % slice_urn)
@@ -409,6 +413,9 @@ class ReferenceAggregateManager(object):
             self._agg.deallocate(user_urn, None)
             for r in resources:
                 r.status = Resource.STATUS_UNKNOWN
+            for sliver_urn in sliver.resources.values():
+                self._notify_allocation_listeners('sliver_deleted', 
+                                                  sliver_urn)
             del self._slices[slice_urn]
             self.logger.info("Sliver %r deleted" % slice_urn)
             return self.successResult(True)
@@ -464,18 +471,18 @@ class ReferenceAggregateManager(object):
             for cid, sliver_uuid in theSlice.resources.items():
                 resource = None
                 sliver_urn = None
-                for res in self._agg.resources:
-                    if res.id == sliver_uuid:
-                        self.logger.debug('Resource = %s', str(res))
-                        resources.append(res)
-                        sliver_urn = res.sliver_urn(self._urn_authority, slivername) 
-                        # Gather the status of all the resources
-                        # in the sliver. This could be actually
-                        # communicating with the resources, or simply
-                        # reporting the state of initialized, started, stopped, ...
-                        res_status.append(dict(geni_urn=sliver_urn,
-                                               geni_status=res.status,
-                                               geni_error=''))
+                res = self._agg.get_resource(sliver_uuid)
+                if res is not None:
+                    self.logger.debug('Resource = %s', str(res))
+                    resources.append(res)
+                    sliver_urn = res.sliver_urn(self._urn_authority, slivername) 
+                    # Gather the status of all the resources
+                    # in the sliver. This could be actually
+                    # communicating with the resources, or simply
+                    # reporting the state of initialized, started, stopped, ...
+                    res_status.append(dict(geni_urn=sliver_urn,
+                                           geni_status=res.status,
+                                           geni_error=''))
             self.logger.info("Calculated and returning slice %s status", slice_urn)
             result = dict(geni_urn=slice_urn,
                           geni_status=theSlice.status(resources),
@@ -537,6 +544,9 @@ class ReferenceAggregateManager(object):
                     return self.errorResult(19, "Out of range: Expiration %s is out of range (AM policy limits renewals to %s)." % (expiration_time, self.max_lease))
                     
             sliver.expiration = requested
+            for sliver_urn in sliver.resources.values():
+                self._notify_allocation_listeners('sliver_end_time_changed',
+                                                  sliver_urn, requested)
             return self.successResult(True, requested)
 
         else:
@@ -609,6 +619,37 @@ class ReferenceAggregateManager(object):
             dt = dt.replace(tzinfo=None)
         return dt
 
+    def advertisement(self, available=False, compressed=False):
+        """Return the advertisement RSpec of all resources, or of only
+        the available ones, optionally compressed and base64 encoded.
+        Each variant is built once, and rebuilt only after resource
+        availability changes (see Resource.availability_generation).
+        """
+        # Read the generation before building, so a change made while
+        # building leaves the result out of date rather than unnoticed
+        generation = Resource.availability_generation
+        key = (bool(available), bool(compressed))
+        with self._advert_lock:
+            if self._advert_generation != generation:
+                self._adverts = dict()
+                self._advert_generation = generation
+            result = self._adverts.get(key)
+        if result is not None:
+            return result
+        if compressed:
+            result = base64.b64encode(zlib.compress(self.advertisement(available)))
+        else:
+            parts = [self.advert_header()]
+            parts.extend(self.advert_resource(r)
+                         for r in self._agg.catalog(None)
+                         if r.available or not available)
+            parts.append(self.advert_footer())
+            result = ''.join(parts)
+        with self._advert_lock:
+            if self._advert_generation == generation:
+                self._adverts[key] = result
+        return result
+
     def advert_resource(self, resource):
         tmpl = '''<node component_manager_id="%s"
         component_name="%s"
@@ -666,10 +707,10 @@ class ReferenceAggregateManager(object):
         for cid, res_uuid in self._slices[slice_urn].resources.items():
             resource = None
             sliver_urn = None
-            for res in self._agg.resources:
-                if res.id == res_uuid:
-                    sliver_urn = res.sliver_urn(self._urn_authority, slivername) 
-                    resource_urn = res.urn(self._urn_authority)
+            res = self._agg.get_resource(res_uuid)
+            if res is not None:
+                sliver_urn = res.sliver_urn(self._urn_authority, slivername) 
+                resource_urn = res.urn(self._urn_authority)
             result = result + tmpl % (cid, resource_urn, self._my_urn, sliver_urn)
         return result
 
@@ -697,6 +738,24 @@ class ReferenceAggregateManager(object):
                 expires.append(self._naiveUTC(requested))
         return min(expires)
 
+    def add_allocation_listener(self, listener):
+        """Register an object to be told as sliver allocations change,
+        e.g. so a resource manager can keep a ledger of them. These
+        methods of the listener are called:
+          sliver_allocated(sliver_urn, slice_urn, user_urn, start_time, end_time)
+          sliver_end_time_changed(sliver_urn, end_time)
+          sliver_deleted(sliver_urn)
+        """
+        self._allocation_listeners.append(listener)
+
+    def _notify_allocation_listeners(self, method_name, *args):
+        for listener in self._allocation_listeners:
+            try:
+                getattr(listener, method_name)(*args)
+            except Exception:
+                self.logger.exception("Allocation listener %s failed",
+                                      method_name)
+
 
 class AggregateManager(object):
     """The public API for a GENI Aggregate Manager.  This class provides the
@@ -710,6 +769,8 @@ class AggregateManager(object):
         self.logger = logging.getLogger('gcf.am2')
         self.authorizer = authorizer
         self.resource_manager = resource_manager
+        # Counts and latencies of calls, kept by the server
+        self.metrics = CallMetrics()
 
     def _exception_result(self, exception):
         output = str(exception)
@@ -731,6 +792,22 @@ class AggregateManager(object):
             self.logger.exception("Error in GetVersion:")
             return self._exception_result(e)
 
+    def GetMetrics(self, options=dict()):
+        '''Return the number of calls, errors and calls in progress
+        of each method of this AM, with histograms of their latency:
+        overall and by phase (authorization, credential verification, 
+        delegate and XML-RPC serialization). If the metrics_format
+        option is 'text', return them in the Prometheus text format.'''
+        if options.get('metrics_format') == 'text':
+            value = self.metrics.format_text()
+        else:
+            value = self.metrics.get_metrics()
+        return dict(code=dict(geni_code=0,
+                              am_type="gcf2",
+                              am_code=0),
+                    value=value,
+                    output="")
+
     def ListResources(self, credentials, options):
         '''Return an RSpec of resources managed at this AM.
         If a geni_slice_urn
@@ -864,6 +941,7 @@ class AggregateManagerServer(object):
         aggregate_manager = AggregateManager(trust_roots_dir, delegate, 
                                              authorizer, resource_manager)
         self._server.register_instance(aggregate_manager)
+        self._server.metrics = aggregate_manager.metrics
         # Set the server on the delegate so it can access the
         # client certificate.
         delegate._server = self._server
@@ -41,6 +41,7 @@ import datetime
 import dateutil.parser
 import logging
 import os
+import threading
 import traceback
 import uuid
 import xml.dom.minidom as minidom
@@ -49,11 +50,14 @@ import zlib
 
 from .aggregate import Aggregate
 from .fakevm import FakeVM
+from .resource import Resource
+from .sliver_store import MemorySliverStore, open_sliver_store
 from ... import geni
 from ..util.tz_util import tzd
 from ..util.urn_util import publicid_to_urn
 from ..util import urn_util as urn
 from ..SecureXMLRPCServer import SecureXMLRPCServer
+from ..util.call_metrics import CallMetrics
 
 from ...sfa.trust.credential import Credential
 from ...sfa.trust.abac_credential import ABACCredential
@@ -148,19 +152,26 @@ class Sliver(object):
     at an aggregate.
     """
 
-    def __init__(self, parent_slice, resource):
-        self._id = str(uuid.uuid4())
+    def __init__(self, parent_slice, resource, sliver_urn=None):
         self._resource = resource
         self._slice = parent_slice
         self._expiration = None
         self._start_time = None
         self._end_time = None
+        # URN of the user who allocated the sliver, if known
+        self._user_urn = None
         self._allocation_state = STATE_GENI_UNALLOCATED
         self._operational_state = OPSTATE_GENI_PENDING_ALLOCATION
         self._urn = None
         global RESOURCE_NAMESPACE
         self._base = RESOURCE_NAMESPACE
-        self._setUrnFromParent(resource.urn(self._base))
+        if sliver_urn:
+            # A sliver restored from a SliverStore
+            self._id = urn.URN(urn=sliver_urn).getName()
+            self._urn = sliver_urn
+        else:
+            self._id = str(uuid.uuid4())
+            self._setUrnFromParent(resource.urn(self._base))
         self._shutdown = False
 
     def resource(self):
@@ -201,6 +212,12 @@ class Sliver(object):
     def endTime(self):
         return self._end_time
 
+    def setUserURN(self, new_user_urn):
+        self._user_urn = new_user_urn
+
+    def userURN(self):
+        return self._user_urn
+
     def _setUrnFromParent(self, parent_urn):
         authority = urn.URN(urn=parent_urn).getAuthority()
         self._urn = str(urn.URN(authority=authority,
@@ -251,26 +268,27 @@ class Slice(object):
     def __init__(self, urn):
         self.id = str(uuid.uuid4())
         self.urn = urn
-        self._slivers = list()
+        # Sliver URN => sliver, in the order they were added
+        self._slivers = collections.OrderedDict()
         self._resources = dict()
         self._shutdown = False
 
     def getURN(self): return self.urn
 
-    def add_resource(self, resource):
-        sliver = Sliver(self, resource)
-        self._slivers.append(sliver)
+    def add_resource(self, resource, sliver_urn=None):
+        sliver = Sliver(self, resource, sliver_urn)
+        self._slivers[sliver.urn()] = sliver
         return sliver
 
     def delete_sliver(self, sliver):
         sliver.delete()
-        self._slivers.remove(sliver)
+        del self._slivers[sliver.urn()]
 
     def slivers(self):
-        return self._slivers
+        return self._slivers.values()
 
     def resources(self):
-        return [sliver.resource() for sliver in self._slivers]
+        return [sliver.resource() for sliver in self._slivers.values()]
 
     def shutdown(self):
         for sliver in self.slivers():
@@ -286,20 +304,74 @@ class ReferenceAggregateManager(object):
 
     # root_cert is a single cert or dir of multiple certs
     # that are trusted to sign credentials
-    def __init__(self, root_cert, urn_authority, url):
+    # store is the SliverStore (see sliver_store.py) that keeps the
+    # slices, slivers and resources, by default in memory only
+    def __init__(self, root_cert, urn_authority, url, store=None):
         self._urn_authority = urn_authority
         self._url = url
         self._cred_verifier = geni.CredentialVerifier(root_cert)
         self._api_version = 3
         self._am_type = "gcf"
-        self._slices = dict()
         self._agg = Aggregate()
-        self._agg.add_resources([FakeVM(self._agg) for _ in range(20)])
+        if store is None:
+            store = MemorySliverStore()
+        self._store = store
+        self._store.load(self._load_resource, self._load_slice,
+                         self._load_sliver)
+        if not self._store.resources():
+            self._store.add_resources([FakeVM(self._agg) for _ in range(20)])
+        self._agg.add_resources(self._store.resources())
+        for the_slice in self._store.slices():
+            self._agg.allocate(the_slice.urn, the_slice.slivers())
         self._my_urn = publicid_to_urn("%s %s %s" % (self._urn_authority, 'authority', 'am'))
+        # Advertisement RSpecs by (available only, compressed),
+        # for the availability generation they were built at
+        self._adverts = dict()
+        self._advert_generation = None
+        self._advert_lock = threading.Lock()
         self.max_lease = datetime.timedelta(minutes=REFAM_MAXLEASE_MINUTES)
         self.max_alloc = datetime.timedelta(seconds=ALLOCATE_EXPIRATION_SECONDS)
         self.logger = logging.getLogger('gcf.am3')
         self.logger.info("Running %s AM v%d code version %s", self._am_type, self._api_version, GCF_VERSION)
+        self._allocation_listeners = list()
+
+    @property
+    def _slices(self):
+        """Slices by URN, for code that reads them directly
+        (e.g. resource managers)."""
+        return dict((the_slice.urn, the_slice)
+                    for the_slice in self._store.slices())
+
+    # Make the resources, slices and slivers loaded by the store
+
+    def _load_resource(self, record):
+        resource = FakeVM(self._agg)
+        resource.id = record['id']
+        resource.type = record['type']
+        resource.available = bool(record['available'])
+        resource.external_id = record['external_id']
+        resource.state = record['state']
+        resource.status = record['status']
+        resource.operational_state = record['operational_state']
+        return resource
+
+    def _load_slice(self, record):
+        the_slice = Slice(record['urn'])
+        the_slice.id = record['id']
+        the_slice._shutdown = bool(record['shutdown'])
+        return the_slice
+
+    def _load_sliver(self, record, the_slice, resource):
+        sliver = the_slice.add_resource(resource, record['urn'])
+        sliver.setExpiration(record['expiration'])
+        sliver.setStartTime(record['start_time'])
+        sliver.setEndTime(record['end_time'])
+        sliver.setUserURN(record['user_urn'])
+        sliver.setAllocationState(record['allocation_state'])
+        sliver.setOperationalState(record['operational_state'])
+        if record['shutdown']:
+            sliver.shutdown()
+        return sliver
 
     def GetVersion(self, options):
         '''Specify version information about this AM. That could
@@ -418,21 +490,17 @@ class ReferenceAggregateManager(object):
 #                # return an empty rspec
 #                return self._no_such_slice(slice_urn)
 #        else:
-        all_resources = self._agg.catalog(None)
         available = 'geni_available' in options and options['geni_available']
-        resource_xml = ""
-        for r in all_resources:
-            if available and not r.available:
-                continue
-            resource_xml = resource_xml + self.advert_resource(r)
-        result = self.advert_header() + resource_xml + self.advert_footer()
         # Optionally compress the result
-        if 'geni_compressed' in options and options['geni_compressed']:
+        compressed = 'geni_compressed' in options and options['geni_compressed']
+        if compressed:
             try:
-                result = base64.b64encode(zlib.compress(result))
+                result = self.advertisement(available, compressed=True)
             except Exception, exc:
                 self.logger.error("Error compressing and encoding resource list: %s", traceback.format_exc())
                 raise Exception("Server error compressing resource list", exc)
+        else:
+            result = self.advertisement(available)
         return self.successResult(result)
 
     # The list of credentials are options - some single cred
@@ -487,27 +555,27 @@ class ReferenceAggregateManager(object):
         # EG if both V1 and V2 are supported, and the user gives V2 request,
         # then you must return a V2 manifest and not V1
 
-        available = self.resources(available=True)
-
         # Note: This only handles unbound nodes. Any attempt by the client
         # to specify a node is ignored.
         unbound = list()
         for elem in rspec_dom.documentElement.getElementsByTagName('node'):
             unbound.append(elem)
-        if len(unbound) > len(available):
+        available_count = self._agg.available_count()
+        if len(unbound) > available_count:
             # There aren't enough resources
             self.logger.error('Too big: requesting %d resources but I only have %d',
-                              len(unbound), len(available))
+                              len(unbound), available_count)
             return self.errorResult(AM_API.TOO_BIG,
                                     'Too Big: insufficient resources to fulfill request')
 
+        available = self._agg.available_resources(len(unbound))
         resources = list()
-        for elem in unbound:
+        for elem, resource in zip(unbound, available):
             client_id = elem.getAttribute('client_id')
-            resource = available.pop(0)
             resource.external_id = client_id
             resource.available = False
             resources.append(resource)
+        self._store.save_resources(resources)
 
         # determine max expiration time from credentials
         # do not create a sliver that will outlive the slice!
@@ -547,8 +615,8 @@ class ReferenceAggregateManager(object):
 
         # if slice exists, check accept only if no  existing sliver overlaps
         # with requested start/end time. If slice doesn't exist, create it
-        if slice_urn in self._slices:
-            newslice = self._slices[slice_urn]
+        newslice = self._store.get_slice(slice_urn)
+        if newslice is not None:
             # Check if any current slivers overlap with requested start/end
             one_slice_overlaps = False
             for sliver in newslice.slivers():
@@ -565,15 +633,25 @@ class ReferenceAggregateManager(object):
         else:
             newslice = Slice(slice_urn)
 
+        new_slivers = list()
         for resource in resources:
             sliver = newslice.add_resource(resource)
             sliver.setExpiration(expiration)
             sliver.setStartTime(start_time)
             sliver.setEndTime(end_time)
+            sliver.setUserURN(user_urn)
             sliver.setAllocationState(STATE_GENI_ALLOCATED)
+            new_slivers.append(sliver)
         self._agg.allocate(slice_urn, newslice.slivers())
         self._agg.allocate(user_urn, newslice.slivers())
-        self._slices[slice_urn] = newslice
+        self._store.save_slice(newslice)
+        self._store.save_slivers(new_slivers)
+        for sliver in newslice.slivers():
+            if sliver.resource() in resources:
+                self._notify_allocation_listeners('sliver_allocated',
+                                                  sliver.urn(), slice_urn,
+                                                  user_urn, start_time,
+                                                  end_time)
 
         # Log the allocation
         self.logger.info("Allocated new slice %s" % slice_urn)
@@ -662,11 +740,14 @@ class ReferenceAggregateManager(object):
                                       and options['geni_end_time']))
         for sliver in slivers:
             # Extend the lease and set to PROVISIONED
-            expiration = min(sliver.getEndTime(), max_expiration)
+            expiration = min(sliver.endTime(), max_expiration)
             sliver.setEndTime(expiration)
+            self._notify_allocation_listeners('sliver_end_time_changed',
+                                              sliver.urn(), expiration)
             sliver.setExpiration(expiration)
             sliver.setAllocationState(STATE_GENI_PROVISIONED)
             sliver.setOperationalState(OPSTATE_GENI_NOT_READY)
+        self._store.save_slivers(slivers)
         result = dict(geni_rspec=self.manifest_rspec(the_slice.urn),
                       geni_slivers=[s.status() for s in slivers])
         return self.successResult(result)
@@ -704,13 +785,7 @@ class ReferenceAggregateManager(object):
 
         self._agg.deallocate(the_slice.urn, slivers)
         self._agg.deallocate(user_urn, slivers)
-        for sliver in slivers:
-            slyce = sliver.slice()
-            slyce.delete_sliver(sliver)
-            # If slice is now empty, delete it.
-            if not slyce.slivers():
-                self.logger.debug("Deleting empty slice %r", slyce.urn)
-                del self._slices[slyce.urn]
+        self.delete_slivers(slivers)
         return self.successResult([s.status() for s in slivers])
 
     def PerformOperationalAction(self, urns, credentials, action, options):
@@ -795,6 +870,7 @@ class ReferenceAggregateManager(object):
                 # This should have been caught above
                 msg = "Unsupported: action %s is not supported" % (action)
                 raise ApiErrorException(AM_API.UNSUPPORTED, msg)
+        self._store.save_slivers(slivers)
         return self.successResult([s.status(errors[s.urn()])
                                    for s in slivers])
 
@@ -974,6 +1050,9 @@ class ReferenceAggregateManager(object):
                 sliver.setExpiration(requested)
                 end_time = max(sliver.endTime(), requested)
                 sliver.setEndTime(end_time)
+                self._notify_allocation_listeners('sliver_end_time_changed',
+                                                  sliver.urn(), end_time)
+            self._store.save_slivers(slivers)
 
         geni_slivers = [s.status() for s in slivers]
         return self.successResult(geni_slivers)
@@ -1004,6 +1083,8 @@ class ReferenceAggregateManager(object):
             self.logger.error('Slice %s is already shut down.', slice_urn)
             return self.errorResult(AM_API.FORBIDDEN, "Already shut down.")
         the_slice.shutdown()
+        self._store.save_slice(the_slice)
+        self._store.save_slivers(the_slice.slivers())
         return self.successResult(True)
 
     def successResult(self, value):
@@ -1041,6 +1122,37 @@ class ReferenceAggregateManager(object):
             dt = dt.replace(tzinfo=None)
         return dt
 
+    def advertisement(self, available=False, compressed=False):
+        """Return the advertisement RSpec of all resources, or of only
+        the available ones, optionally compressed and base64 encoded.
+        Each variant is built once, and rebuilt only after resource
+        availability changes (see Resource.availability_generation).
+        """
+        # Read the generation before building, so a change made while
+        # building leaves the result out of date rather than unnoticed
+        generation = Resource.availability_generation
+        key = (bool(available), bool(compressed))
+        with self._advert_lock:
+            if self._advert_generation != generation:
+                self._adverts = dict()
+                self._advert_generation = generation
+            result = self._adverts.get(key)
+        if result is not None:
+            return result
+        if compressed:
+            result = base64.b64encode(zlib.compress(self.advertisement(available)))
+        else:
+            parts = [self.advert_header()]
+            parts.extend(self.advert_resource(r)
+                         for r in self._agg.catalog(None)
+                         if r.available or not available)
+            parts.append(self.advert_footer())
+            result = ''.join(parts)
+        with self._advert_lock:
+            if self._advert_generation == generation:
+                self._adverts[key] = result
+        return result
+
     def advert_resource(self, resource):
         tmpl = '''  <node component_manager_id="%s" 
         component_name="%s" 
@@ -1119,7 +1231,7 @@ class ReferenceAggregateManager(object):
 
     def manifest_slice(self, slice_urn):
         res = ''
-        for sliver in self._slices[slice_urn].slivers():
+        for sliver in self._store.get_slice(slice_urn).slivers():
             res = res + self.manifest_sliver(sliver)
         return res
 
@@ -1134,10 +1246,11 @@ class ReferenceAggregateManager(object):
         it is interpreted as boolean and only resources whose availability
         matches will be included in the returned list.
         """
-        result = self._agg.catalog()
-        if available is not None:
-            result = [r for r in result if r.available is available]
-        return result
+        if available is None:
+            return self._agg.catalog()
+        if available:
+            return self._agg.available_resources()
+        return [r for r in self._agg.catalog() if not r.available]
 
     def rfc3339format(self, dt):
         """Return a string representing the given datetime in rfc3339 format.
@@ -1152,24 +1265,32 @@ class ReferenceAggregateManager(object):
         should be run by a daemon, but until then, it is called at the
         beginning of all methods.
         """
-        expired = list()
         now = datetime.datetime.utcnow()
-        for slyce in self._slices.values():
-            for sliver in slyce.slivers():
-                self.logger.debug('Checking sliver %s (expiration = %r) at %r',
-                                  sliver.urn(), sliver.expiration(), now)
-                if sliver.expiration() < now:
-                    self.logger.debug('Expring sliver %s (expiration = %r) at %r',
-                                      sliver.urn(), sliver.expiration(), now)
-                    expired.append(sliver)
-        self.logger.info('Expiring %d slivers', len(expired))
+        expired = self._store.expired_slivers(now)
         for sliver in expired:
+            self.logger.debug('Expring sliver %s (expiration = %r) at %r',
+                              sliver.urn(), sliver.expiration(), now)
+        self.logger.info('Expiring %d slivers', len(expired))
+        self.delete_slivers(expired)
+
+    def delete_slivers(self, slivers):
+        """Delete the given slivers, and any slices they leave empty.
+        """
+        resources = [sliver.resource() for sliver in slivers]
+        emptied = list()
+        for sliver in slivers:
             slyce = sliver.slice()
             slyce.delete_sliver(sliver)
             # If slice is now empty, delete it.
-            if not slyce.slivers():
-                self.logger.debug("Deleting empty slice %r", slyce.urn)
-                del self._slices[slyce.urn]
+            if not slyce.slivers() and slyce not in emptied:
+                emptied.append(slyce)
+        self._store.delete_slivers(slivers)
+        self._store.save_resources(resources)
+        for sliver in slivers:
+            self._notify_allocation_listeners('sliver_deleted', sliver.urn())
+        for slyce in emptied:
+            self.logger.debug("Deleting empty slice %r", slyce.urn)
+            self._store.delete_slice(slyce)
 
     def decode_urns(self, urns):
         """Several methods need to map URNs to slivers and/or deduce
@@ -1182,22 +1303,14 @@ class ReferenceAggregateManager(object):
             myurn = urn.URN(urn=urn_str)
             urn_type = myurn.getType()
             if urn_type == 'slice':
-                if self._slices.has_key(urn_str):
-                    the_slice = self._slices[urn_str]
+                the_slice = self._store.get_slice(urn_str)
+                if the_slice is not None:
                     slivers.extend(the_slice.slivers())
                 else:
                     raise ApiErrorException(AM_API.SEARCH_FAILED,
                                             'Unknown slice "%s"' % (urn_str))
             elif urn_type == 'sliver':
-                # Gross linear search. Maybe keep a map of known sliver urns?
-                needle = None
-                for a_slice in self._slices.values():
-                    for sliver in a_slice.slivers():
-                        if sliver.urn() == urn_str:
-                            needle = sliver
-                            break
-                    if needle:
-                        break
+                needle = self._store.get_sliver(urn_str)
                 if needle:
                     slivers.append(needle)
                 else:
@@ -1244,6 +1357,24 @@ class ReferenceAggregateManager(object):
                 expires.append(self._naiveUTC(requested))
         return min(expires)
 
+    def add_allocation_listener(self, listener):
+        """Register an object to be told as sliver allocations change,
+        e.g. so a resource manager can keep a ledger of them. These
+        methods of the listener are called:
+          sliver_allocated(sliver_urn, slice_urn, user_urn, start_time, end_time)
+          sliver_end_time_changed(sliver_urn, end_time)
+          sliver_deleted(sliver_urn)
+        """
+        self._allocation_listeners.append(listener)
+
+    def _notify_allocation_listeners(self, method_name, *args):
+        for listener in self._allocation_listeners:
+            try:
+                getattr(listener, method_name)(*args)
+            except Exception:
+                self.logger.exception("Allocation listener %s failed",
+                                      method_name)
+
 
 class AggregateManager(object):
     """The public API for a GENI Aggregate Manager.  This class provides the
@@ -1257,6 +1388,8 @@ class AggregateManager(object):
         self.logger = logging.getLogger('gcf.am3')
         self.authorizer = authorizer
         self.resource_manager = resource_manager
+        # Counts and latencies of calls, kept by the server
+        self.metrics = CallMetrics()
 
     def _exception_result(self, exception):
         output = str(exception)
@@ -1287,6 +1420,22 @@ class AggregateManager(object):
             traceback.print_exc()
             return self._exception_result(e)
 
+    def GetMetrics(self, options=dict()):
+        '''Return the number of calls, errors and calls in progress
+        of each method of this AM, with histograms of their latency:
+        overall and by phase (authorization, credential verification, 
+        delegate and XML-RPC serialization). If the metrics_format
+        option is 'text', return them in the Prometheus text format.'''
+        if options.get('metrics_format') == 'text':
+            value = self.metrics.format_text()
+        else:
+            value = self.metrics.get_metrics()
+        return dict(code=dict(geni_code=0,
+                              am_type="gcf",
+                              am_code=0),
+                    value=value,
+                    output="")
+
     def ListResources(self, credentials, options):
         '''Return an RSpec of resources managed at this AM.
         If geni_available is specified in the options,
@@ -1452,7 +1601,8 @@ class AggregateManagerServer(object):
     def __init__(self, addr, keyfile=None, certfile=None,
                  trust_roots_dir=None,
                  ca_certs=None, base_name=None,
-                 authorizer=None, resource_manager=None):
+                 authorizer=None, resource_manager=None,
+                 sliver_store=None):
         # ca_certs arg here must be a file of concatenated certs
         if ca_certs is None:
             raise Exception('Missing CA Certs')
@@ -1461,14 +1611,18 @@ class AggregateManagerServer(object):
 
         # Decode the addr into a URL. Is there a pythonic way to do this?
         server_url = "https://%s:%d/" % addr
+        # sliver_store is the path of an SQLite database to keep slices
+        # and slivers in across restarts, or None to keep them in memory
         delegate = ReferenceAggregateManager(trust_roots_dir, base_name,
-                                             server_url)
+                                             server_url,
+                                             open_sliver_store(sliver_store))
         # FIXME: set logRequests=true if --debug
         self._server = SecureXMLRPCServer(addr, keyfile=keyfile,
                                           certfile=certfile, ca_certs=ca_certs)
         aggregate_manager = AggregateManager(trust_roots_dir, delegate, 
                                              authorizer, resource_manager)
         self._server.register_instance(aggregate_manager)
+        self._server.metrics = aggregate_manager.metrics
         # Set the server on the delegate so it can access the
         # client certificate.
         delegate._server = self._server
@@ -23,17 +23,33 @@
 
 from __future__ import absolute_import
 
+import logging
 import os
+import time
 import traceback
+import xmlrpclib
 
-from ...sfa.trust.gid import GID
 from ...sfa.trust.credential import Credential
 from ...sfa.trust.certificate import Certificate
 from ...sfa.trust.abac_credential import ABACCredential
 from ..util.speaksfor_util import determine_speaks_for
+from ..util.cert_util import PeerIdentity
+from ..util.call_metrics import record_phase
 from ..SecureThreadedXMLRPCServer import SecureThreadedXMLRPCRequestHandler
 
 
+# Most characters of the arguments, options or result of a call logged
+# (at DEBUG) - RSpecs can be large
+MAX_LOGGED_CHARS = 2000
+
+# Return the string form of a value, truncated for logging
+def _truncated(value):
+    text = str(value)
+    if len(text) > MAX_LOGGED_CHARS:
+        text = "%s... [%d more characters]" % \
+            (text[:MAX_LOGGED_CHARS], len(text) - MAX_LOGGED_CHARS)
+    return text
+
 # A class to support wrapping AM API calls from AggregateManager
 # to the delegate to check for authorization and perform speaks-for
 
@@ -59,18 +75,30 @@ class AMMethodContext:
         self._options = options
 #        self._caller_cert = self._aggregate_manager._delegate._server.pem_cert
         self._caller_cert = aggregate_manager._delegate._server.get_pem_cert()
-        self._caller_urn = GID(string=self._caller_cert).get_urn()
+        # Parsed caller cert, shared with the rest of this request
+        self._caller_identity = \
+            aggregate_manager._delegate._server.get_peer_identity()
+        if self._caller_identity is None or \
+                self._caller_identity.pem_cert != self._caller_cert:
+            self._caller_identity = PeerIdentity.for_pem(self._caller_cert)
+        self._caller_urn = self._caller_identity.get_urn()
         self._is_v3 = is_v3
         self._resource_bindings = resource_bindings
         self._result = None
         self._error = False
+        self._start_time = time.time()
+        self._delegate_start_time = None
 
     # This method is called prior to the 'with AMMethodContext' block
     def __enter__(self):
         try:
-            self._logger.info("AM Invocation: %s %s %s %s" % \
-                                  (self._method_name, self._caller_urn, 
-                                   self._args, self._options))
+            self._logger.info("AM Invocation: %s %s" % \
+                                  (self._method_name, self._caller_urn))
+            if self._logger.isEnabledFor(logging.DEBUG):
+                self._logger.debug("%s args %s options %s" % \
+                                       (self._method_name, 
+                                        _truncated(self._args),
+                                        _truncated(self._options)))
             credentials = self._credentials
 
 
@@ -84,7 +112,7 @@ class AMMethodContext:
 #                                      (self._args, self._options))
 
             # Change client cert if valid speaks-for invocation
-            caller_gid = GID(string=self._caller_cert)
+            caller_gid = self._caller_identity.get_gid()
             new_caller_gid = determine_speaks_for(self._logger,
                                                    credentials,
                                                    caller_gid,
@@ -97,6 +125,7 @@ class AMMethodContext:
                                   (self._caller_urn, new_caller_urn))
                 self._caller_cert = new_caller_gid.save_to_string()
                 self._caller_urn = new_caller_urn
+                self._caller_identity = PeerIdentity.for_pem(self._caller_cert)
 
             self._options['geni_true_caller_cert'] = self._caller_cert
             self._options['geni_am_urn'] = \
@@ -122,6 +151,11 @@ class AMMethodContext:
                                                              self._args, 
                                                              self._options, 
                                                              credentials)
+                    # A remote authorizer gets a plain list of allocations
+                    if isinstance(self._authorizer, xmlrpclib.ServerProxy) \
+                            and hasattr(requested_allocation_state, 'as_list'):
+                        requested_allocation_state = \
+                            requested_allocation_state.as_list()
                 self._authorizer.authorize(self._method_name, 
                                            self._caller_cert, 
                                            credentials, self._args, 
@@ -132,6 +166,9 @@ class AMMethodContext:
         except Exception, e:
             self._handleError(e)
         finally:
+            # The delegate runs in the 'with' block
+            self._delegate_start_time = time.time()
+            record_phase('auth', self._delegate_start_time - self._start_time)
             return self
 
     # Determine if this is a speaks-for invocation and if so,
@@ -151,12 +188,24 @@ class AMMethodContext:
     # type, value is the exception and traceback_object is the stack trace
     # Otherwise, these arguments are all none
     def __exit__(self, type, value, traceback_object):
+        end_time = time.time()
+        if not self._error:
+            # Authorization succeeded, so the delegate was called
+            record_phase('delegate', end_time - self._delegate_start_time)
         if type:
             self._logger.exception("Error in %s" % self._method_name)
             self._handleError(value)
 
-        self._logger.info("Result from %s: %s", self._method_name, 
-                          self._result)
+        code = None
+        if isinstance(self._result, dict) and \
+                isinstance(self._result.get('code'), dict):
+            code = self._result['code'].get('geni_code')
+        self._logger.info("Result from %s: code %s in %.3f seconds", 
+                          self._method_name, code, 
+                          end_time - self._start_time)
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("Result from %s: %s", self._method_name, 
+                               _truncated(self._result))
 
     # Return a GENI_style error return for given exception/traceback
     def _errorReturn(self, e):
@@ -25,11 +25,18 @@ from __future__ import absolute_import
 
 from ... import geni
 
+import itertools
 import uuid
 
 class Resource(object):
     """A Resource has an id, a type, and a boolean indicating availability."""
 
+    # Number of the latest change in the availability of any resource
+    # (or in the resources of an aggregate). Anything computed from
+    # resource availability is out of date once this changes.
+    availability_generation = 0
+    _availability_changes = itertools.count(1)
+
     STATUS_CONFIGURING = 'configuring'
     STATUS_READY = 'ready'
     STATUS_FAILED = 'failed'
@@ -52,6 +59,8 @@ class Resource(object):
     def __init__(self, rid, rtype):
         self.id = rid
         self.type = rtype
+        # The Aggregate this resource was added to, if any
+        self._aggregate = None
         self.available = True
         self.external_id = None
         # For V2 AMs
@@ -60,6 +69,26 @@ class Resource(object):
         self.state = Resource.STATE_GENI_UNALLOCATED
         self.operational_state = None
 
+    @property
+    def available(self):
+        return self._available
+
+    @available.setter
+    def available(self, available):
+        if available != getattr(self, '_available', None):
+            self._available = available
+            Resource.availability_changed()
+            if self._aggregate is not None:
+                self._aggregate.availability_changed(self)
+
+    @classmethod
+    def availability_changed(cls):
+        """Note a change in resource availability."""
+        # next() on a count is atomic, so concurrent changes
+        # each get a new generation
+        Resource.availability_generation = \
+            next(Resource._availability_changes)
+
     def urn(self, auth="geni//gpo//gcf"):
         publicid = 'IDN %s %s %s' % (auth, self.type, str(self.id))
         return geni.publicid_to_urn(publicid)
@@ -78,7 +107,8 @@ class Resource(object):
         return template % (self.urn(), self.type, self.id, self.available)
 
     def __eq__(self, other):
-        return self.id == other.id
+        # Aggregate containers may hold other things, e.g. slivers
+        return isinstance(other, Resource) and self.id == other.id
 
     def __neq__(self, other):
         return self.id != other.id
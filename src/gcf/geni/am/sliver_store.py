@@ -0,0 +1,375 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''
+Stores of the slices, slivers and resources of the reference AM (am3).
+
+The AM changes its Slice, Sliver and Resource objects in place and then
+saves them to its store, which indexes them so that the AM finds slices
+and slivers by URN and expired slivers without scanning every sliver.
+(The AM's Aggregate indexes resources by availability.)
+
+MemorySliverStore keeps them only in memory. SQLiteSliverStore also
+writes them through to an SQLite database, and loads them from it when
+the AM starts, so that they survive AM restarts. The database is only
+for persistence: lookups are always answered from memory.
+'''
+
+from __future__ import absolute_import
+
+import bisect
+import datetime
+import os
+import sqlite3
+import threading
+
+class SliverStore(object):
+    """Interface of a store of the slices, slivers and resources of an AM.
+    Slivers are saved after their slice, and deleted before it.
+    """
+
+    def load(self, make_resource, make_slice, make_sliver):
+        """Load stored resources, slices and slivers, if any. Objects are
+        made from dicts of their stored fields (see SQLiteSliverStore):
+        make_resource(record), make_slice(record) and
+        make_sliver(record, slice, resource).
+        """
+        raise NotImplementedError
+
+    def resources(self):
+        """Return the resources, in the order they were added."""
+        raise NotImplementedError
+
+    def add_resources(self, resources):
+        raise NotImplementedError
+
+    def save_resources(self, resources):
+        """Save resources after changing them (e.g. their availability)."""
+        raise NotImplementedError
+
+    def slices(self):
+        raise NotImplementedError
+
+    def get_slice(self, slice_urn):
+        """Return the slice with the given URN, or None."""
+        raise NotImplementedError
+
+    def save_slice(self, the_slice):
+        """Add or save a slice."""
+        raise NotImplementedError
+
+    def delete_slice(self, the_slice):
+        """Delete a slice, and any slivers of it still stored."""
+        raise NotImplementedError
+
+    def get_sliver(self, sliver_urn):
+        """Return the sliver with the given URN, or None."""
+        raise NotImplementedError
+
+    def save_slivers(self, slivers):
+        """Add or save slivers."""
+        raise NotImplementedError
+
+    def delete_slivers(self, slivers):
+        raise NotImplementedError
+
+    def expired_slivers(self, now):
+        """Return the slivers that expire before now, soonest first."""
+        raise NotImplementedError
+
+
+class MemorySliverStore(SliverStore):
+    """A store that keeps slices, slivers and resources in memory,
+    slices and slivers indexed by URN and expiration. Thread safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._resources = list()
+        # Slice URN => slice, sliver URN => sliver
+        self._slices = dict()
+        self._slivers = dict()
+        # Sorted (expiration, sliver URN), and the expiration
+        # each sliver is indexed under
+        self._expirations = list()
+        self._sliver_expirations = dict()
+
+    def load(self, make_resource, make_slice, make_sliver):
+        # Nothing stored
+        pass
+
+    def resources(self):
+        with self._lock:
+            return list(self._resources)
+
+    def add_resources(self, resources):
+        with self._lock:
+            self._resources.extend(resources)
+
+    def save_resources(self, resources):
+        # Nothing to do: they are the objects we hold
+        pass
+
+    def slices(self):
+        with self._lock:
+            return self._slices.values()
+
+    def get_slice(self, slice_urn):
+        with self._lock:
+            return self._slices.get(slice_urn)
+
+    def save_slice(self, the_slice):
+        with self._lock:
+            self._slices[the_slice.urn] = the_slice
+
+    def delete_slice(self, the_slice):
+        with self._lock:
+            self.delete_slivers(the_slice.slivers())
+            if self._slices.get(the_slice.urn) is the_slice:
+                del self._slices[the_slice.urn]
+
+    def get_sliver(self, sliver_urn):
+        with self._lock:
+            return self._slivers.get(sliver_urn)
+
+    def save_slivers(self, slivers):
+        with self._lock:
+            for sliver in slivers:
+                sliver_urn = sliver.urn()
+                self._slivers[sliver_urn] = sliver
+                self._index_expiration(sliver_urn, sliver.expiration())
+
+    def delete_slivers(self, slivers):
+        with self._lock:
+            for sliver in slivers:
+                sliver_urn = sliver.urn()
+                if self._slivers.get(sliver_urn) is sliver:
+                    del self._slivers[sliver_urn]
+                    self._index_expiration(sliver_urn, None)
+
+    def expired_slivers(self, now):
+        with self._lock:
+            # (now,) sorts before every (now, urn)
+            end = bisect.bisect_left(self._expirations, (now,))
+            return [self._slivers[sliver_urn]
+                    for (_, sliver_urn) in self._expirations[:end]]
+
+    # Index a sliver under its new expiration (None to unindex it)
+    def _index_expiration(self, sliver_urn, expiration):
+        old_expiration = self._sliver_expirations.get(sliver_urn)
+        if old_expiration == expiration:
+            return
+        if old_expiration is not None:
+            entry = (old_expiration, sliver_urn)
+            index = bisect.bisect_left(self._expirations, entry)
+            del self._expirations[index]
+            del self._sliver_expirations[sliver_urn]
+        if expiration is not None:
+            bisect.insort(self._expirations, (expiration, sliver_urn))
+            self._sliver_expirations[sliver_urn] = expiration
+
+
+class SQLiteSliverStore(MemorySliverStore):
+    """A store that keeps slices, slivers and resources in memory, as
+    MemorySliverStore does, and writes them through to an SQLite database
+    it loads them from when the AM starts. Times are stored as naive UTC.
+    """
+
+    TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+    SCHEMA = '''
+CREATE TABLE IF NOT EXISTS resources (
+  id TEXT PRIMARY KEY,
+  position INTEGER NOT NULL,
+  type TEXT,
+  available INTEGER NOT NULL,
+  external_id TEXT,
+  state TEXT,
+  status TEXT,
+  operational_state TEXT
+);
+CREATE TABLE IF NOT EXISTS slices (
+  urn TEXT PRIMARY KEY,
+  id TEXT,
+  shutdown INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS slivers (
+  urn TEXT PRIMARY KEY,
+  slice_urn TEXT NOT NULL REFERENCES slices (urn),
+  resource_id TEXT REFERENCES resources (id),
+  expiration TEXT,
+  start_time TEXT,
+  end_time TEXT,
+  user_urn TEXT,
+  allocation_state TEXT,
+  operational_state TEXT,
+  shutdown INTEGER NOT NULL
+);
+-- For deleting the slivers of a slice
+CREATE INDEX IF NOT EXISTS slivers_slice_urn ON slivers (slice_urn);
+'''
+
+    def __init__(self, path):
+        MemorySliverStore.__init__(self)
+        self._path = os.path.expanduser(path)
+        self._db = sqlite3.connect(self._path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        # A commit per AM call, without waiting on every write
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(self.SCHEMA)
+        # Databases made before slivers recorded their user
+        columns = [row['name'] for row in
+                   self._db.execute('PRAGMA table_info(slivers)')]
+        if 'user_urn' not in columns:
+            self._db.execute('ALTER TABLE slivers ADD COLUMN user_urn TEXT')
+        self._db.commit()
+
+    def load(self, make_resource, make_slice, make_sliver):
+        with self._lock:
+            resources = dict()
+            loaded = list()
+            for row in self._db.execute('SELECT * FROM resources'
+                                        ' ORDER BY position'):
+                resource = make_resource(dict(row))
+                resources[resource.id] = resource
+                loaded.append(resource)
+            MemorySliverStore.add_resources(self, loaded)
+            for row in self._db.execute('SELECT * FROM slices'
+                                        ' ORDER BY rowid'):
+                MemorySliverStore.save_slice(self, make_slice(dict(row)))
+            slivers = list()
+            for row in self._db.execute('SELECT * FROM slivers'
+                                        ' ORDER BY rowid'):
+                record = dict(row)
+                for field in ('expiration', 'start_time', 'end_time'):
+                    record[field] = self._parse_time(record[field])
+                slivers.append(make_sliver(record,
+                                           self._slices[record['slice_urn']],
+                                           resources.get(record['resource_id'])))
+            MemorySliverStore.save_slivers(self, slivers)
+
+    def add_resources(self, resources):
+        with self._lock:
+            position = len(self._resources)
+            MemorySliverStore.add_resources(self, resources)
+            self._db.executemany('INSERT INTO resources (id, position,'
+                                 ' available) VALUES (?, ?, 1)',
+                                 [(resource.id, position + index)
+                                  for index, resource in enumerate(resources)])
+            self._save_resource_rows(resources)
+            self._db.commit()
+
+    def save_resources(self, resources):
+        with self._lock:
+            MemorySliverStore.save_resources(self, resources)
+            self._save_resource_rows(resources)
+            self._db.commit()
+
+    def save_slice(self, the_slice):
+        with self._lock:
+            MemorySliverStore.save_slice(self, the_slice)
+            # Keep the row (and so the load order) of a known slice
+            self._db.execute('INSERT OR IGNORE INTO slices (urn, shutdown)'
+                             ' VALUES (?, 0)', (the_slice.urn,))
+            self._db.execute('UPDATE slices SET id = ?, shutdown = ?'
+                             ' WHERE urn = ?',
+                             (the_slice.id, int(the_slice.isShutdown()),
+                              the_slice.urn))
+            self._db.commit()
+
+    def delete_slice(self, the_slice):
+        with self._lock:
+            MemorySliverStore.delete_slice(self, the_slice)
+            self._db.execute('DELETE FROM slivers WHERE slice_urn = ?',
+                             (the_slice.urn,))
+            self._db.execute('DELETE FROM slices WHERE urn = ?',
+                             (the_slice.urn,))
+            self._db.commit()
+
+    def save_slivers(self, slivers):
+        with self._lock:
+            MemorySliverStore.save_slivers(self, slivers)
+            rows = list()
+            for sliver in slivers:
+                resource_id = None
+                if sliver.resource() is not None:
+                    resource_id = sliver.resource().id
+                rows.append((sliver.slice().urn, resource_id,
+                             self._format_time(sliver.expiration()),
+                             self._format_time(sliver.startTime()),
+                             self._format_time(sliver.endTime()),
+                             sliver.userURN(),
+                             sliver.allocationState(),
+                             sliver.operationalState(),
+                             int(sliver.isShutdown()),
+                             sliver.urn()))
+            # Keep the row (and so the load order) of a known sliver
+            self._db.executemany('INSERT OR IGNORE INTO slivers'
+                                 ' (urn, slice_urn, shutdown) VALUES (?, ?, 0)',
+                                 [(row[-1], row[0]) for row in rows])
+            self._db.executemany('UPDATE slivers SET slice_urn = ?,'
+                                 ' resource_id = ?, expiration = ?,'
+                                 ' start_time = ?, end_time = ?,'
+                                 ' user_urn = ?, allocation_state = ?,'
+                                 ' operational_state = ?, shutdown = ?'
+                                 ' WHERE urn = ?', rows)
+            self._db.commit()
+
+    def delete_slivers(self, slivers):
+        with self._lock:
+            MemorySliverStore.delete_slivers(self, slivers)
+            self._db.executemany('DELETE FROM slivers WHERE urn = ?',
+                                 [(sliver.urn(),) for sliver in slivers])
+            self._db.commit()
+
+    def _save_resource_rows(self, resources):
+        self._db.executemany('UPDATE resources SET type = ?, available = ?,'
+                             ' external_id = ?, state = ?, status = ?,'
+                             ' operational_state = ? WHERE id = ?',
+                             [(resource.type, int(bool(resource.available)),
+                               resource.external_id, resource.state,
+                               resource.status, resource.operational_state,
+                               resource.id)
+                              for resource in resources])
+
+    def _format_time(self, dt):
+        if dt is None:
+            return None
+        return dt.strftime(self.TIME_FORMAT)
+
+    def _parse_time(self, text):
+        if text is None:
+            return None
+        # Much faster than strptime, for our fixed format
+        return datetime.datetime(int(text[0:4]), int(text[5:7]),
+                                 int(text[8:10]), int(text[11:13]),
+                                 int(text[14:16]), int(text[17:19]),
+                                 int(text[20:26]))
+
+
+def open_sliver_store(path=None):
+    """Return an SQLiteSliverStore on the database at the given path,
+    or a MemorySliverStore if no path is given."""
+    if path:
+        return SQLiteSliverStore(path)
+    return MemorySliverStore()
@@ -23,15 +23,19 @@
 
 from __future__ import absolute_import
 
+import ast
 import gcf
 import json
 import logging
+import re
+import string
 from .base_authorizer import *
 from ...sfa.trust.credential_factory import CredentialFactory
 from ...sfa.trust.credential import Credential
 from ...sfa.trust.certificate import Certificate
 from ...sfa.trust.abac_credential import ABACCredential
 from ..util.speaksfor_util import get_cert_keyid
+from ..util.cert_util import PeerIdentity
 from .util import *
 
 # AM authorizer class that uses policies to generate ABAC proofs 
@@ -85,11 +89,12 @@ class ABAC_Authorizer(Base_Authorizer):
         rule_set = ABAC_Authorizer_Rule_Set(label, self._root_cert)
         for filename in filenames:
             rule_set.parse(filename)
+        rule_set.compile()
         return rule_set
 
     # Find the correct set of rules for the given caller based on authority
     def lookup_rules_for_caller(self, caller):
-        caller_urn = gid.GID(string=caller).get_urn()
+        caller_urn = PeerIdentity.for_pem(caller).get_urn()
         caller_authority = convert_user_urn_to_authority_urn(caller_urn)
         caller_authority_name = caller_authority.split('+')[1]
         rules = self._DEFAULT_RULES
@@ -111,24 +116,27 @@ class ABAC_Authorizer(Base_Authorizer):
 
         rules = self.lookup_rules_for_caller(caller)
 
-        caller_keyid = self._compute_keyid(cert_string=caller)
-        key_id_name_map = rules.getKeyIdNameMap()
-        key_id_name_map[caller_keyid] = "$CALLER"
+        # Requests are authorized concurrently, so everything about 
+        # this caller is kept in a context of its own, not in the rules
+        context = ABAC_Evaluation_Context(rules, 
+                                          self._compute_keyid(cert_string=caller))
 
-        bindings = self._generate_bindings(method, caller, creds, args, opts,
-                                           requested_allocation_state, rules)
+        bindings = context.bindings
+        self._generate_bindings(method, caller, creds, args, opts,
+                                requested_allocation_state, rules, bindings)
 
         # Add 'constants' to bindings
-        bindings = dict(bindings.items() + rules.getConstants().items())
+        bindings.update(rules.getConstants())
 
 #        self._logger.info("BINDINGS = %s" % bindings)
 
         assertions = self._generate_assertions(bindings, rules)
 
         credential_assertions = \
-            self._generate_credential_assertions(caller, creds, bindings, rules)
+            self._generate_credential_assertions(caller, creds, bindings, 
+                                                 context)
 
-        fixed_policies = rules.getPolicies()
+        fixed_policies = rules.getCompiledPolicies()
 
         assertions = \
             assertions + credential_assertions + fixed_policies
@@ -137,20 +145,19 @@ class ABAC_Authorizer(Base_Authorizer):
 
         success, msg = self._evaluate_queries(bindings, assertions, rules)
 
-        del key_id_name_map[caller_keyid]
-
         if not success:
             raise Exception(msg)
 
     # Get each binder to generate bindings
+    # Add them to the given bindings if provided (later binders win)
     def _generate_bindings(self, method, caller, creds, args, opts,
-                           requested_state, rules):
-        bindings = {}
+                           requested_state, rules, bindings=None):
+        if bindings is None: bindings = {}
         for binder in rules.getBinders():
             new_bindings = binder.generate_bindings(method, caller, creds,
                                                     args, opts,
                                                     requested_state)
-            bindings = dict(bindings.items() + new_bindings.items())
+            bindings.update(new_bindings)
         return bindings
 
     # For each conditional assertion, evaluate the condition
@@ -158,32 +165,18 @@ class ABAC_Authorizer(Base_Authorizer):
     # generate the assertion
     def _generate_assertions(self, bindings, rules):
         assertions = []
-        conditional_assertions = rules.getConditionalAssertions()
-
-        # Handle old format of policies that are list of condition/assertion
-        # rather than list of precondition/exclusive and then a list
-        # of condition/assertion clauses
-        if len(conditional_assertions) > 0 and \
-                'precondition' not in conditional_assertions[0]:
-            conditional_assertions = [{'precondition' : 'True',
-                                      'clauses' : conditional_assertions}]
-
-        for clause_set in conditional_assertions:
-            precondition = clause_set['precondition']
-            bound_precondition = self._bind_expression(precondition, bindings)
-            if self._has_unbound_variables(bound_precondition): continue
-            if not eval(bound_precondition): continue
-            exclusive = 'exclusive' in clause_set and clause_set['exclusive']
-            clauses = clause_set['clauses']
-            for ca in clauses:
-                condition = ca['condition']
-                assertion = ca['assertion']
-                bound_condition = self._bind_expression(condition, bindings)
-                if self._has_unbound_variables(bound_condition): continue
-                self._logger.info("EVAL : %s" % bound_condition)
-                if not eval(bound_condition): continue
-                bound_assertion = self._bind_expression(assertion, bindings)
-                if self._has_unbound_variables(bound_assertion): continue
+        for precondition, exclusive, clauses in \
+                rules.getCompiledConditionalAssertions():
+            bound, value = precondition.evaluate(bindings)
+            if not bound: continue
+            if not value: continue
+            for condition, assertion in clauses:
+                bound, value = condition.evaluate(bindings)
+                if not bound: continue
+                self._logger.info("EVAL : %s", condition)
+                if not value: continue
+                bound_assertion = assertion.bind(bindings)
+                if bound_assertion is None: continue
                 assertions.append(bound_assertion)
             # If this is an exclusive clause set whose precondition matched
             # Don't look at any other clause sets
@@ -192,7 +185,9 @@ class ABAC_Authorizer(Base_Authorizer):
 
     # If provided a set of ABAC assertions, import them into our set
     # of assertions
-    def _generate_credential_assertions(self, caller, creds, bindings, rules):
+    # Principals are named as in the given evaluation context
+    def _generate_credential_assertions(self, caller, creds, bindings, 
+                                        context):
         assertions = []
         abac_cred_objects = [CredentialFactory.createCred(credString=cred) \
                                  for cred in creds \
@@ -200,11 +195,11 @@ class ABAC_Authorizer(Base_Authorizer):
                                  ABACCredential.ABAC_CREDENTIAL_TYPE]
         for abac_cred in abac_cred_objects:
             head_principal = abac_cred.head.get_principal_keyid()
-            head_principal_name = rules._lookup_name_from_keyid(head_principal)
+            head_principal_name = context.lookup_name_from_keyid(head_principal)
             head_role = abac_cred.head.get_role()
             tail = abac_cred.tails[0] # Only take the first one
             tail_principal = tail.get_principal_keyid()
-            tail_principal_name = rules._lookup_name_from_keyid(tail_principal)
+            tail_principal_name = context.lookup_name_from_keyid(tail_principal)
             tail_role = tail.get_role()
             if tail_role:
                 assertion = "%s.%s<-%s.%s" % (head_principal_name, head_role, 
@@ -213,7 +208,7 @@ class ABAC_Authorizer(Base_Authorizer):
                 assertion = "%s.%s<-%s" % (head_principal_name, head_role, 
                                               tail_principal_name)
             bound_assertion = self._bind_expression(assertion, bindings)
-            assertions.append(bound_assertion)
+            assertions.append(ABAC_Statement.parse(bound_assertion))
 
         return assertions
 
@@ -223,19 +218,21 @@ class ABAC_Authorizer(Base_Authorizer):
 
         messages = []
 
+        parsed_assertions = self._parse_assertions(assertions)
+
         all_positive_proved = True
-        for q in rules.getPositiveQueries():
+        for q in rules.getCompiledPositiveQueries():
             evaluated, proven, msg = \
-                self._evaluate_query(bindings, assertions, q, rules)
+                self._evaluate_query(bindings, parsed_assertions, q)
             if not evaluated: continue
             if not proven:
                 all_positive_proved = False
                 messages.append(msg)
 
         all_negative_disproved = True
-        for q in rules.getNegativeQueries():
+        for q in rules.getCompiledNegativeQueries():
             evaluated, proven, msg = \
-                self._evaluate_query(bindings, assertions, q, rules)
+                self._evaluate_query(bindings, parsed_assertions, q)
             if not evaluated: continue
             if proven:
                 all_negative_disproved = False
@@ -244,37 +241,37 @@ class ABAC_Authorizer(Base_Authorizer):
         result = (all_positive_proved and all_negative_disproved)
         return result, ", ".join(messages)
 
-    # Evaluate a single query
+    # Evaluate a single compiled query
     # If there is a condition, it must be true to considered
     # Return evaluated, evaluation, failure_message
-    def _evaluate_query(self, bindings, assertions, query, rules):
+    def _evaluate_query(self, bindings, parsed_assertions, query):
         # If there is a condition on this query, only evaluate if 
         # condition is satisfied
-        if query in rules.getQueryConditionMap():
-            condition = rules.getQueryConditionMap()[query]
-            bound_condition = self._bind_expression(condition, bindings)
-            if self._has_unbound_variables(bound_condition):
+        condition = query['condition']
+        if condition:
+            bound, value = condition.evaluate(bindings)
+            if not bound:
+                bound_condition = \
+                    self._bind_expression(condition.getText(), bindings)
                 raise Exception("Illegal query condition: unbound variable %s"\
                                     % bound_condition)
-            if not eval(bound_condition): 
+            if not value: 
                 return False, False, ""
 
         # If no condition or condition  succeeded, evaluate bound query
-        bound_q = self._bind_expression(query, bindings)
-        if self._has_unbound_variables(bound_q): 
+        bound_q = query['statement'].bind(bindings)
+        if bound_q is None:
+            bound_q = self._bind_expression(query['statement'].getText(), 
+                                            bindings)
             raise Exception("Illegal query: unbound variable %s" % bound_q)
 
-        evaluation = self._prove_query(bound_q, assertions)
-        msg = rules.getQueryMessageMap()[query]
-        return True, evaluation, msg
+        evaluation = self._prove_parsed_query(bound_q, parsed_assertions)
+        return True, evaluation, query['message']
 
 
     # Replace bindings ($VAR) with bound value
     def _bind_expression(self, expr, bindings):
-        for binding, value in bindings.items():
-            if expr.find(binding) > -1:
-                expr = expr.replace(binding, value)
-        return expr
+        return _bind_text(expr, bindings)
 
     # Are there any unbound variables in expression?
     def _has_unbound_variables(self, expr):
@@ -285,23 +282,28 @@ class ABAC_Authorizer(Base_Authorizer):
     # We use a simple recursive chaining to see if we can find a path
     # from the query LHS to the query RHS
     def _prove_query(self, query, assertions):
+        assertions = [ABAC_Statement.parse(str(assertion)) \
+                          for assertion in assertions]
+        return self._prove_parsed_query(ABAC_Statement.parse(query),
+                                        self._parse_assertions(assertions))
 
-        query_parts = query.split('<-')
-        query_lhs = query_parts[0].strip()
-        query_rhs = query_parts[1].strip()
-
+    # Index ABAC_Statement assertions by their LHS
+    def _parse_assertions(self, assertions):
         parsed_assertions = {}
         for assertion in assertions:
-            assertion_parts = assertion.split('<-')
-            assert_lhs = assertion_parts[0].strip()
-            assert_rhs = assertion_parts[1].strip()
+            assert_lhs = assertion.lhs
             if assert_lhs not in parsed_assertions:
                 parsed_assertions[assert_lhs] = []
-            assertion_info = {'rhs' : assert_rhs, 'assertion' : assertion}
+            assertion_info = {'rhs' : assertion.rhs, 
+                              'assertion' : assertion.text}
             parsed_assertions[assert_lhs].append(assertion_info)
+        return parsed_assertions
 
+    # Prove (or fail to prove) an ABAC_Statement query 
+    # based on assertions indexed by _parse_assertions
+    def _prove_parsed_query(self, query, parsed_assertions):
         result, chain = \
-            self._prove_query_internal(query_lhs, query_rhs, parsed_assertions)
+            self._prove_query_internal(query.lhs, query.rhs, parsed_assertions)
 
         self._logger.info("QUERY (%s) : %s" % (result, query))
         if result:
@@ -340,7 +342,7 @@ class ABAC_Authorizer(Base_Authorizer):
     @staticmethod
     def _compute_keyid(cert_string=None, cert_filename=None):
         if cert_string:
-            cert_gid = gid.GID(string=cert_string)
+            return PeerIdentity.for_pem(cert_string).get_keyid()
         else:
             cert_gid = gid.GID(filename=cert_filename)
         extension_names = [ext[0] for ext in cert_gid.get_extensions()]
@@ -373,6 +375,7 @@ class ABAC_Authorizer_Rule_Set:
         self._query_message_map = {}
         self._query_condition_map = {}
         self._keyid_name_map = {}
+        self._compiled = None
 
     # Parse rule content from a file and add to existing rule content (if any)
     # That is, we may parse multiple files in sequence, thus adding to lists
@@ -380,6 +383,7 @@ class ABAC_Authorizer_Rule_Set:
     def parse(self, filename):
         data = open(filename).read()
         raw_rules = json.loads(data)
+        self._compiled = None
 
         if 'binders' in raw_rules:
             for b in raw_rules['binders']:
@@ -419,7 +423,55 @@ class ABAC_Authorizer_Rule_Set:
             for id_name, id_pem in raw_rules['identities'].items():
                 id_keyid = ABAC_Authorizer._compute_keyid(cert_filename=id_pem)
                 if id_keyid:
-                    self._keyid_name_map[id_keyid] = id_name
+                    self._keyid_name_map[id_keyid] = _intern_name(id_name)
+
+    # Compile the conditions, assertions and queries of the rules,
+    # so requests only bind and evaluate them. 
+    # Constants are substituted here.
+    def compile(self):
+        constants = self._constants
+        compiled = {}
+
+        # Handle old format of policies that are list of condition/assertion
+        # rather than list of precondition/exclusive and then a list
+        # of condition/assertion clauses
+        conditional_assertions = self._conditional_assertions
+        if len(conditional_assertions) > 0 and \
+                'precondition' not in conditional_assertions[0]:
+            conditional_assertions = [{'precondition' : 'True',
+                                      'clauses' : conditional_assertions}]
+        compiled['conditional_assertions'] = []
+        for clause_set in conditional_assertions:
+            precondition = \
+                ABAC_Compiled_Condition(clause_set['precondition'], constants)
+            exclusive = 'exclusive' in clause_set and clause_set['exclusive']
+            clauses = \
+                [(ABAC_Compiled_Condition(ca['condition'], constants),
+                  ABAC_Compiled_Statement(ca['assertion'], constants)) \
+                     for ca in clause_set['clauses']]
+            compiled['conditional_assertions'].append((precondition, 
+                                                       exclusive, clauses))
+
+        compiled['policies'] = [ABAC_Statement.parse(policy, intern=True) \
+                                    for policy in self._policies]
+
+        for queries_key, queries in (('positive_queries', 
+                                      self._positive_queries),
+                                     ('negative_queries',
+                                      self._negative_queries)):
+            compiled[queries_key] = []
+            for query in queries:
+                condition = None
+                if query in self._query_condition_map:
+                    condition = \
+                        ABAC_Compiled_Condition(self._query_condition_map[query],
+                                                constants)
+                compiled[queries_key].append(
+                    {'statement' : ABAC_Compiled_Statement(query, constants),
+                     'condition' : condition,
+                     'message' : self._query_message_map[query]})
+
+        self._compiled = compiled
 
     # Dump contents to stdout
     def dump(self):
@@ -469,3 +521,296 @@ class ABAC_Authorizer_Rule_Set:
     def getQueryMessageMap(self): return self._query_message_map
     def getQueryConditionMap(self): return self._query_condition_map
     def getKeyIdNameMap(self) : return self._keyid_name_map
+
+    # Accessors to compiled rule content
+    def _getCompiled(self):
+        compiled = self._compiled
+        if compiled is None:
+            self.compile()
+            compiled = self._compiled
+        return compiled
+    def getCompiledConditionalAssertions(self): 
+        return self._getCompiled()['conditional_assertions']
+    def getCompiledPolicies(self) : return self._getCompiled()['policies']
+    def getCompiledPositiveQueries(self) : 
+        return self._getCompiled()['positive_queries']
+    def getCompiledNegativeQueries(self) :
+        return self._getCompiled()['negative_queries']
+
+# The state of a single authorization: the bindings of the request and
+# the keyid of its caller, layered over the rule set for the caller's
+# authority. The rule set is shared by concurrent requests and is
+# only read here; the caller is named $CALLER ahead of any identity
+# of the rules with the same keyid.
+class ABAC_Evaluation_Context:
+
+    def __init__(self, rules, caller_keyid):
+        self.rules = rules
+        self.caller_keyid = caller_keyid
+        self.bindings = {}
+
+    # Find the name associated to a given keyid for this request
+    def lookup_name_from_keyid(self, keyid):
+        if keyid == self.caller_keyid:
+            return "$CALLER"
+        return self.rules._lookup_name_from_keyid(keyid)
+
+# Pattern for a variable in a policy expression or statement, e.g. $CALLER
+VARIABLE_PATTERN = re.compile(r'\$[A-Za-z0-9_]+')
+
+# Characters that may not adjoin a variable we compile to a slot,
+# since the bound text would then merge into a neighboring token
+IDENTIFIER_CHARS = string.ascii_letters + string.digits + '_$'
+
+# Characters that may not follow a variable we compile to a slot,
+# since the bound text would then parse differently than its value
+# (e.g. '3' then '.real')
+TRAILER_CHARS = '.[('
+
+# Python values of binding text, as used for variables in conditions
+_BINDING_VALUES = {}
+_MAX_BINDING_VALUES = 10000
+
+# Names that are Python literals
+_LITERAL_NAMES = ('True', 'False', 'None')
+
+# Raised when a binding has no Python literal value to use in place
+# of its text, so the expression must be evaluated from bound text
+class _NotLiteral(Exception):
+    pass
+
+# Return the Python value of binding text, e.g. '3' => 3
+# The text must be a single literal (a number, string, list, dict,
+# True, False or None): anything else, like '1,2' or '1+2', could
+# bind differently with its neighbors than the substituted text would
+def _binding_value(text):
+    try:
+        return _BINDING_VALUES[text]
+    except KeyError:
+        pass
+    # A sign could bind differently than the substituted text would
+    if not text or text[0] in '+-':
+        raise _NotLiteral()
+    try:
+        node = ast.parse(text, mode='eval').body
+        if isinstance(node, ast.Name):
+            if node.id not in _LITERAL_NAMES:
+                raise _NotLiteral()
+        elif not isinstance(node, (ast.Num, ast.Str, ast.List, ast.Dict)):
+            raise _NotLiteral()
+        value = ast.literal_eval(node)
+    except Exception:
+        raise _NotLiteral()
+    if len(_BINDING_VALUES) >= _MAX_BINDING_VALUES:
+        _BINDING_VALUES.clear()
+    _BINDING_VALUES[text] = value
+    return value
+
+# Intern a name used in ABAC statements, so comparing names is cheap
+def _intern_name(name):
+    try:
+        return intern(str(name))
+    except UnicodeError:
+        return name
+
+# Replace constants ($VAR) in a policy expression or statement with their text
+def _substitute_constants(expr, constants):
+    return VARIABLE_PATTERN.sub(lambda m: constants.get(m.group(0), 
+                                                        m.group(0)),
+                                expr)
+
+# A policy condition: a Python expression with $VARIABLES, 
+# compiled once when the rules are loaded.
+#
+# The condition has the value it would have if the text of each binding
+# were substituted into it and the result evaluated. Constants are
+# substituted when compiling. Other variables outside string literals 
+# are slots filled with the Python value of the binding text 
+# (e.g. '3' => 3) when that text is a single literal, and those
+# inside string literals are spliced in as text. Conditions that cannot be compiled this way (and bindings
+# that are not Python literals) are evaluated from the bound text.
+class ABAC_Compiled_Condition:
+
+    def __init__(self, condition, constants):
+        self._condition = _substitute_constants(str(condition), constants)
+        self._code = None
+        # Slot identifier => variable, for variables outside strings
+        self._slots = {}
+        # Slot identifier => list of text and variables, for strings
+        # containing variables
+        self._strings = {}
+        # A '$' that is not a variable: never bound
+        self._never_bound = False
+        try:
+            self._compile()
+        except Exception:
+            self._code = None
+
+    def _compile(self):
+        expr = self._condition
+        source = []
+        i = 0
+        while i < len(expr):
+            c = expr[i]
+            if c in '\'"':
+                if expr[i:i+3] in ("'''", '"""') or \
+                        (i > 0 and expr[i-1] in IDENTIFIER_CHARS):
+                    # Long or prefixed string literal
+                    return
+                end = expr.find(c, i+1)
+                if end < 0: return
+                body = expr[i+1:end]
+                if '\\' in body: return
+                if '$' in body:
+                    parts = []
+                    last = 0
+                    for match in VARIABLE_PATTERN.finditer(body):
+                        parts.append(body[last:match.start()])
+                        parts.append((match.group(0), c))
+                        last = match.end()
+                    parts.append(body[last:])
+                    if '$' in ''.join([p for p in parts 
+                                       if isinstance(p, basestring)]):
+                        self._never_bound = True
+                    slot = "_abac_s%d" % len(self._strings)
+                    self._strings[slot] = parts
+                    source.append(slot)
+                else:
+                    source.append(expr[i:end+1])
+                i = end + 1
+            elif c == '$':
+                match = VARIABLE_PATTERN.match(expr, i)
+                if not match:
+                    self._never_bound = True
+                    return
+                after = expr[match.end():match.end()+1]
+                if (i > 0 and expr[i-1] in IDENTIFIER_CHARS + '.') or \
+                        (after and after in IDENTIFIER_CHARS):
+                    return
+                # An attribute, subscript or call of the variable
+                trailer = expr[match.end():].lstrip()[:1]
+                if trailer and trailer in TRAILER_CHARS:
+                    return
+                slot = "_abac_v%d" % len(self._slots)
+                self._slots[slot] = match.group(0)
+                source.append(slot)
+                i = match.end()
+            else:
+                source.append(c)
+                i = i + 1
+        self._code = compile(''.join(source), '<policy condition>', 'eval')
+
+    # Evaluate the condition with the given bindings
+    # Return bound, value: bound is False if a variable is unbound
+    def evaluate(self, bindings):
+        if self._never_bound:
+            return False, None
+        if self._code is not None:
+            try:
+                return self._evaluate_compiled(bindings)
+            except _NotLiteral:
+                pass
+        bound_condition = _bind_text(self._condition, bindings)
+        if bound_condition.find("$") > -1:
+            return False, None
+        return True, eval(bound_condition)
+
+    def _evaluate_compiled(self, bindings):
+        values = {}
+        for slot, variable in self._slots.items():
+            text = bindings.get(variable)
+            if text is None or '$' in text:
+                return False, None
+            values[slot] = _binding_value(text)
+        for slot, parts in self._strings.items():
+            pieces = []
+            for part in parts:
+                if isinstance(part, tuple):
+                    (variable, quote) = part
+                    text = bindings.get(variable)
+                    if text is None or '$' in text:
+                        return False, None
+                    if '\\' in text or quote in text:
+                        raise _NotLiteral()
+                    part = text
+                pieces.append(part)
+            values[slot] = ''.join(pieces)
+        return True, eval(self._code, globals(), values)
+
+    # The condition text, after constants are substituted
+    def getText(self): return self._condition
+
+    def __str__(self): return self._condition
+
+# An ABAC statement (assertion or query) template "HEAD<-TAIL" 
+# with $VARIABLES, split once when the rules are loaded.
+# Binding it gives an ABAC_Statement.
+class ABAC_Compiled_Statement:
+
+    def __init__(self, statement, constants):
+        self._statement = _substitute_constants(str(statement), constants)
+        # List of (is_variable, text)
+        self._parts = []
+        last = 0
+        for match in VARIABLE_PATTERN.finditer(self._statement):
+            if match.start() > last:
+                self._parts.append((False, 
+                                    self._statement[last:match.start()]))
+            self._parts.append((True, match.group(0)))
+            last = match.end()
+        if last < len(self._statement):
+            self._parts.append((False, self._statement[last:]))
+        self._bound = None
+        if '$' not in self._statement:
+            self._bound = ABAC_Statement.parse(self._statement, intern=True)
+
+    # Return the ABAC_Statement with the given bindings, 
+    # or None if a variable is unbound
+    def bind(self, bindings):
+        if self._bound is not None:
+            return self._bound
+        pieces = []
+        for is_variable, text in self._parts:
+            if is_variable:
+                text = bindings.get(text)
+                if text is None: 
+                    return None
+            if '$' in text:
+                return None
+            pieces.append(text)
+        return ABAC_Statement.parse(''.join(pieces))
+
+    # The statement text, after constants are substituted
+    def getText(self): return self._statement
+
+    def __str__(self): return self._statement
+
+# A bound ABAC statement "HEAD<-TAIL", with its head (lhs) and tail (rhs)
+class ABAC_Statement:
+
+    def __init__(self, text, lhs, rhs):
+        self.text = text
+        self.lhs = lhs
+        self.rhs = rhs
+
+    # Parse a statement from text, interning the names in a statement
+    # that will be used often
+    @staticmethod
+    def parse(text, intern=False):
+        statement_parts = text.split('<-')
+        lhs = statement_parts[0].strip()
+        rhs = statement_parts[1].strip()
+        if intern:
+            lhs = _intern_name(lhs)
+            rhs = _intern_name(rhs)
+        return ABAC_Statement(text, lhs, rhs)
+
+    def __str__(self): return self.text
+
+    def __repr__(self): return repr(self.text)
+
+# Replace bindings ($VAR) in text with bound value
+def _bind_text(expr, bindings):
+    return VARIABLE_PATTERN.sub(lambda m: bindings.get(m.group(0), 
+                                                       m.group(0)),
+                                expr)
@@ -25,6 +25,7 @@ from __future__ import absolute_import
 
 import datetime
 import dateutil.parser
+import threading
 import types
 import xml.dom.minidom
 
@@ -32,6 +33,7 @@ from ...sfa.trust import gid
 from ...sfa.trust import credential
 from ..util.tz_util import tzd
 from .base_authorizer import AM_Methods, V2_Methods
+from .allocation_ledger import Allocation_Ledger, Requested_Allocation_State
 
 # Class to provide requested resource states
 # so that the authorizer can enforce resource quota policies
@@ -58,10 +60,16 @@ class Base_Resource_Manager:
 
 # Class for a Resource Manager for the GCF AM
 # We only compute a single metric, i.e. NODE (the number of nodes allocated)
+#
+# Current allocations are kept in an Allocation_Ledger, which the AM
+# updates as slivers are allocated, renewed, deleted and expire
+# (see add_allocation_listener in the GCF AM)
 class GCFAM_Resource_Manager(Base_Resource_Manager):
 
     def __init__(self):
         Base_Resource_Manager.__init__(self)
+        self._ledger = None
+        self._ledger_lock = threading.Lock()
 
     # Return combindation of current and requested allocations
     def get_requested_allocation_state(self, aggregate_manager, method_name,
@@ -72,29 +80,23 @@ class GCFAM_Resource_Manager(Base_Resource_Manager):
 
             creds = [credential.Credential(string=c) for c in credentials]
 
-            # Concatenate the current allocations and requested, since
+            # Add the requested allocations to the current ones, since
             # these must be distinct
-            curr_allocations = \
-                self.get_current_allocations(aggregate_manager, arguments, 
-                                             method_name, 
-                                             options, creds)
+            ledger = self.get_ledger(aggregate_manager, method_name, options)
             req_allocations = \
                 self.get_requested_allocations(aggregate_manager, arguments, 
                                                method_name,
                                                options, creds)
 
-            return curr_allocations + req_allocations
+            return Requested_Allocation_State(ledger, 
+                                              new_slivers=req_allocations)
 
         elif method_name in (AM_Methods.RENEW_SLIVER_V2, AM_Methods.RENEW_V3):
 
             amd = aggregate_manager._delegate
             creds = [credential.Credential(string=c) for c in credentials]
 
-            # Grab current allocations
-            curr_allocations = \
-                self.get_current_allocations(aggregate_manager, arguments, 
-                                             method_name, 
-                                             options, creds)
+            ledger = self.get_ledger(aggregate_manager, method_name, options)
             # get slice credential expiration time
             expiration = amd.min_expire(creds, max_duration=amd.max_lease)
             # get requested end time
@@ -105,10 +107,7 @@ class GCFAM_Resource_Manager(Base_Resource_Manager):
             if "geni_extend_alap" in options:
                 requested = min(expiration, requested)
 
-            requested = str(requested)
-
-            # go over all slivers in curr_allocations and change end time
-            # of those we're trying to change 
+            # change end time of the slivers we're trying to change 
             # (slivers of slice or specific slivers)
             if 'urns' in arguments:
                 # Handle V3 case
@@ -117,54 +116,70 @@ class GCFAM_Resource_Manager(Base_Resource_Manager):
                 # Handle V2 case
                 urns = [arguments['slice_urn']]
             the_slice, slivers = amd.decode_urns(urns)
-            sliver_urns = [the_sliver.urn() for the_sliver in slivers]
-            for sliver_info in curr_allocations:
-                if sliver_info['sliver_urn'] in sliver_urns:
-                    sliver_info['end_time'] = requested
+            new_end_times = dict([(the_sliver.urn(), requested) \
+                                      for the_sliver in slivers])
 
-            return curr_allocations
+            return Requested_Allocation_State(ledger, 
+                                              new_end_times=new_end_times)
 
         else:
             return []
 
-
-    # Get all current slivers and return them in proper format
-    def get_current_allocations(self, aggregate_manager,
-                                arguments, method_name, options, creds):
-
-        sliver_info = []
-        slices = aggregate_manager._delegate._slices
-        user_urn = gid.GID(string=options['geni_true_caller_cert']).get_urn()
-
-        for slice_urn, slice_obj in slices.items():
-            self.add_sliver_info_for_slice(slice_obj, sliver_info, 
-                                           method_name,
-                                           slice_urn, user_urn)
-
-        return sliver_info
+    # Return the ledger of current allocations at the AM.
+    # The first time, fill it with the AM's current slivers and have the AM
+    # tell us of every change from then on.
+    # An AM that cannot tell us of changes gets a new ledger every call.
+    def get_ledger(self, aggregate_manager, method_name, options):
+        amd = aggregate_manager._delegate
+        with self._ledger_lock:
+            if self._ledger is None:
+                ledger = Allocation_Ledger()
+                for slice_urn, slice_obj in amd._slices.items():
+                    self.add_sliver_info_for_slice(slice_obj, ledger,
+                                                   method_name,
+                                                   slice_urn)
+                if not hasattr(amd, 'add_allocation_listener'):
+                    return ledger
+                self._ledger = ledger
+                amd.add_allocation_listener(self)
+            return self._ledger
 
     # Add entry for each sliver of slice
     # Account for difference between GCF AM V2 and V3 representations
-    def add_sliver_info_for_slice(self, slice_obj, sliver_info, method_name,
-                                  slice_urn, user_urn):
+    # Slivers are charged to the user who allocated them. Slivers with no
+    # recorded user count only for their slice and project.
+    def add_sliver_info_for_slice(self, slice_obj, ledger, method_name,
+                                  slice_urn):
         if method_name in V2_Methods:
             for sliver_name, sliver_urn in slice_obj.resources.items():
-                entry = {'sliver_urn' : sliver_urn,
-                         'slice_urn' : slice_urn,
-                         'user_urn' : user_urn,
-                         'start_time' : str(datetime.datetime.utcnow()),
-                         'end_time' : str(slice_obj.expiration),
-                         'measurements' : {'NODE' : 1}}
-                sliver_info.append(entry)
+                ledger.add_sliver(sliver_urn, slice_urn, slice_obj.user_urn,
+                                  slice_obj.start_time,
+                                  slice_obj.expiration,
+                                  self.get_sliver_measurements(sliver_urn))
         else:
             for sliver in slice_obj.slivers():
-                entry = {'sliver_urn' : sliver.urn(),
-                         'slice_urn' : slice_urn,
-                         'user_urn' : user_urn,
-                         'start_time' : str(sliver.startTime()),
-                         'end_time' : str(sliver.endTime()),
-                         'measurements' : {'NODE' : 1}}
-                sliver_info.append(entry)
+                ledger.add_sliver(sliver.urn(), slice_urn, sliver.userURN(),
+                                  sliver.startTime(), sliver.endTime(),
+                                  self.get_sliver_measurements(sliver.urn()))
+
+    # Return the measurements of a sliver
+    def get_sliver_measurements(self, sliver_urn):
+        return {'NODE' : 1}
+
+    # Called by the AM as sliver allocations change, 
+    # to keep the ledger current
+
+    def sliver_allocated(self, sliver_urn, slice_urn, user_urn, 
+                         start_time, end_time):
+        self._ledger.add_sliver(sliver_urn, slice_urn, user_urn,
+                                start_time, end_time,
+                                self.get_sliver_measurements(sliver_urn))
+
+    def sliver_end_time_changed(self, sliver_urn, end_time):
+        self._ledger.set_end_time(sliver_urn, end_time)
+
+    def sliver_deleted(self, sliver_urn):
+        self._ledger.remove_sliver(sliver_urn)
 
 
     # Take the given rspec (if provided) and determine how
@@ -199,8 +214,8 @@ class GCFAM_Resource_Manager(Base_Resource_Manager):
                 entry = {'sliver_urn' : 'not_set_yet',
                          'slice_urn' : slice_urn,
                          'user_urn' : user_urn,
-                         'start_time' : str(start_time),
-                         'end_time' : str(end_time),
+                         'start_time' : start_time,
+                         'end_time' : end_time,
                          'measurements' : {'NODE' : 1}}
                 sliver_info.append(entry)
 
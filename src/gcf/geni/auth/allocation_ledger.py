@@ -0,0 +1,379 @@
+#---------------------------------------------------------------------- 
+# Copyright (c) 2015 Raytheon BBN Technologies
+# 
+# Permission is hereby granted, free of charge, to any person obtaining 
+# a copy of this software and/or hardware specification (the "Work") to 
+# deal in the Work without restriction, including without limitation the 
+# rights to use, copy, modify, merge, publish, distribute, sublicense, 
+# and/or sell copies of the Work, and to permit persons to whom the Work 
+# is furnished to do so, subject to the following conditions: 
+# 
+# The above copyright notice and this permission notice shall be 
+# included in all copies or substantial portions of the Work. 
+# 
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS 
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF 
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND 
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT 
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, 
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, 
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS 
+# IN THE WORK.
+#---------------------------------------------------------------------- 
+
+
+from __future__ import absolute_import
+
+import collections
+import datetime
+import hashlib
+import itertools
+import threading
+
+import dateutil.parser
+
+from .util import *
+
+# A persistent record of the slivers allocated at an AM, so that resource
+# binders need not recompute their measurements from every sliver on
+# every allocate or renew call.
+#
+# Each sliver is kept as a sliver_info dict (as handed to resource
+# binders), with native datetime start and end times:
+#   {'sliver_urn' : sliver1, 'slice_urn' : slice1, 'user_urn' : user1, 
+#    'start_time' : t0, 'end_time' : t1,
+#    'measurements' : {'M1' : 3, 'M2' : 4}}
+#
+# Slivers are indexed by the contexts resource binders compute their
+# bindings for: SLICE, USER, PROJECT and AUTHORITY. For each binder class
+# asked about a context, the ledger keeps the measurement states of that
+# context, and updates them as slivers are added, changed and removed.
+
+# Return the (urn_type, urn) contexts to which a sliver belongs
+def get_sliver_contexts(sliver_info):
+    contexts = []
+    slice_urn = sliver_info['slice_urn']
+    user_urn = sliver_info['user_urn']
+    if slice_urn:
+        contexts.append(('SLICE', slice_urn))
+        project_urn = convert_slice_urn_to_project_urn(slice_urn)
+        if project_urn:
+            contexts.append(('PROJECT', project_urn))
+    if user_urn:
+        contexts.append(('USER', user_urn))
+        contexts.append(('AUTHORITY', 
+                         convert_user_urn_to_authority_urn(user_urn)))
+    return contexts
+
+# Return the given time as a datetime, parsing it if it is a string
+def as_datetime(time_value):
+    if isinstance(time_value, datetime.datetime):
+        return time_value
+    return dateutil.parser.parse(str(time_value))
+
+class Allocation_Ledger:
+
+    # Number of recent changes remembered, to bring copies up to date
+    JOURNAL_SIZE = 10000
+
+    _ids = itertools.count(1)
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Distinguishes this ledger from others in this process
+        self._id = next(self._ids)
+        # sliver_urn => sliver_info
+        self._slivers = {}
+        # (urn_type, urn) => {'slivers' : set of sliver_urns,
+        #                     'measurements' : {meas_type : # slivers}}
+        self._contexts = {}
+        # (urn_type, urn) => {binder class : {meas_type : measurement state}}
+        self._states = {}
+        # binder class => a binder of that class, to make new states
+        self._binders = {}
+        # Count of changes to the ledger
+        self._generation = 0
+        # The most recent changes: (generation, sliver_urn, sliver_info)
+        # with sliver_info None for a removed sliver
+        self._journal = collections.deque(maxlen=self.JOURNAL_SIZE)
+
+    # Add (or replace) the allocation of a sliver
+    def add_sliver(self, sliver_urn, slice_urn, user_urn, 
+                   start_time, end_time, measurements):
+        sliver_info = {'sliver_urn' : sliver_urn,
+                       'slice_urn' : slice_urn,
+                       'user_urn' : user_urn,
+                       'start_time' : as_datetime(start_time),
+                       'end_time' : as_datetime(end_time),
+                       'measurements' : dict(measurements)}
+        with self._lock:
+            self.remove_sliver(sliver_urn)
+            self._generation += 1
+            self._journal.append((self._generation, sliver_urn, sliver_info))
+            self._slivers[sliver_urn] = sliver_info
+            for context in get_sliver_contexts(sliver_info):
+                if context not in self._contexts:
+                    self._contexts[context] = {'slivers' : set(), 
+                                               'measurements' : {}}
+                context_info = self._contexts[context]
+                context_info['slivers'].add(sliver_urn)
+                context_measurements = context_info['measurements']
+                for meas_type in measurements:
+                    context_measurements[meas_type] = \
+                        context_measurements.get(meas_type, 0) + 1
+                self._add_to_states(context, sliver_info)
+
+    # Change the end time of a sliver (e.g. on renew)
+    def set_end_time(self, sliver_urn, end_time):
+        with self._lock:
+            if sliver_urn not in self._slivers: return
+            sliver_info = self._slivers[sliver_urn]
+            self.add_sliver(sliver_urn, sliver_info['slice_urn'],
+                            sliver_info['user_urn'], 
+                            sliver_info['start_time'], end_time,
+                            sliver_info['measurements'])
+
+    # Remove the allocation of a sliver (e.g. on delete or expiration)
+    def remove_sliver(self, sliver_urn):
+        with self._lock:
+            if sliver_urn not in self._slivers: return
+            self._generation += 1
+            self._journal.append((self._generation, sliver_urn, None))
+            sliver_info = self._slivers.pop(sliver_urn)
+            for context in get_sliver_contexts(sliver_info):
+                context_info = self._contexts[context]
+                context_info['slivers'].discard(sliver_urn)
+                if not context_info['slivers']:
+                    # Forget all about contexts with no slivers
+                    del self._contexts[context]
+                    self._states.pop(context, None)
+                    continue
+                context_measurements = context_info['measurements']
+                gone = []
+                for meas_type in sliver_info['measurements']:
+                    context_measurements[meas_type] -= 1
+                    if context_measurements[meas_type] == 0:
+                        del context_measurements[meas_type]
+                        gone.append(meas_type)
+                self._remove_from_states(context, sliver_info, gone)
+
+    # Return the sliver_info of the given sliver, or None
+    def get_sliver(self, sliver_urn):
+        with self._lock:
+            return self._slivers.get(sliver_urn)
+
+    # Return the sliver_infos of all slivers
+    def get_slivers(self):
+        with self._lock:
+            return self._slivers.values()
+
+    # Return the number of slivers
+    def __len__(self):
+        return len(self._slivers)
+
+    # Return a number that changes whenever the slivers in the ledger do
+    def get_generation(self):
+        return self._generation
+
+    # Return a number that identifies this ledger in this process
+    def get_id(self):
+        return self._id
+
+    # Return what it takes to bring a copy of this ledger made at the
+    # given generation up to date: (generation, is_full, changes).
+    # Changes is a list of (sliver_urn, sliver_info), with sliver_info 
+    # None for a removed sliver. If the changes since the given
+    # generation (or None) are not remembered, is_full is True and 
+    # the changes add all the slivers to an empty ledger.
+    def get_changes(self, generation):
+        with self._lock:
+            if generation is not None and \
+                    (generation == self._generation or \
+                         (self._journal and \
+                              self._journal[0][0] <= generation + 1)):
+                changes = [(sliver_urn, sliver_info) 
+                           for (change_generation, sliver_urn, sliver_info) \
+                               in self._journal
+                           if change_generation > generation]
+                return self._generation, False, changes
+            changes = self._slivers.items()
+            return self._generation, True, changes
+
+    # Apply the changes returned by get_changes of another ledger
+    def apply_changes(self, changes):
+        with self._lock:
+            for sliver_urn, sliver_info in changes:
+                if sliver_info is None:
+                    self.remove_sliver(sliver_urn)
+                else:
+                    self.add_sliver(sliver_urn, sliver_info['slice_urn'],
+                                    sliver_info['user_urn'],
+                                    sliver_info['start_time'],
+                                    sliver_info['end_time'],
+                                    sliver_info['measurements'])
+
+    # Return the measurement states the given binder would compute
+    # for the slivers in the given context, 
+    # with the given slivers added and the given sliver end times changed.
+    # The states returned are copies the caller may change.
+    def get_measurement_states(self, binder, urn_type, urn,
+                               new_slivers=[], new_end_times={}):
+        context = (urn_type, urn)
+        with self._lock:
+            changed = []
+            for sliver_urn, end_time in new_end_times.items():
+                sliver_info = self._slivers.get(sliver_urn)
+                if sliver_info is None \
+                        or context not in get_sliver_contexts(sliver_info):
+                    continue
+                new_sliver_info = dict(sliver_info)
+                new_sliver_info['end_time'] = as_datetime(end_time)
+                changed.append((sliver_info, new_sliver_info))
+
+            states = {}
+            for meas_type, state in self._get_states(binder, context).items():
+                states[meas_type] = state.copy()
+            try:
+                for sliver_info, new_sliver_info in changed:
+                    for meas_type, value in \
+                            sliver_info['measurements'].items():
+                        states[meas_type].remove(sliver_info['start_time'],
+                                                 sliver_info['end_time'],
+                                                 value, sliver_info)
+                        states[meas_type].update(new_sliver_info['start_time'],
+                                                 new_sliver_info['end_time'],
+                                                 value, new_sliver_info)
+            except NotImplementedError:
+                # Recompute with the changed slivers
+                new_infos = dict([(info['sliver_urn'], new_info) \
+                                      for info, new_info in changed])
+                sliver_infos = \
+                    [new_infos.get(sliver_urn, self._slivers[sliver_urn]) \
+                         for sliver_urn in self._contexts[context]['slivers']]
+                states = self._compute_states(binder, context, sliver_infos)
+
+        for sliver_info in new_slivers:
+            if context not in get_sliver_contexts(sliver_info):
+                continue
+            self._update_states(binder, context, states, sliver_info)
+        return states
+
+    # Return the kept measurement states of a binder class for a context,
+    # computing them from the slivers in the context the first time
+    def _get_states(self, binder, context):
+        if context not in self._contexts:
+            return {}
+        binder_states = self._states.setdefault(context, {})
+        binder_class = binder.__class__
+        if binder_class not in binder_states:
+            self._binders[binder_class] = binder
+            sliver_infos = [self._slivers[sliver_urn] \
+                                for sliver_urn in \
+                                self._contexts[context]['slivers']]
+            binder_states[binder_class] = \
+                self._compute_states(binder, context, sliver_infos)
+        return binder_states[binder_class]
+
+    # Compute the measurement states of a binder for the given
+    # slivers in a context
+    def _compute_states(self, binder, context, sliver_infos):
+        states = {}
+        for sliver_info in sliver_infos:
+            self._update_states(binder, context, states, sliver_info)
+        return states
+
+    # Update the given measurement states of a binder for a context
+    # with a sliver
+    def _update_states(self, binder, context, states, sliver_info):
+        start_time = as_datetime(sliver_info['start_time'])
+        end_time = as_datetime(sliver_info['end_time'])
+        for meas_type, value in sliver_info['measurements'].items():
+            if meas_type not in states:
+                states[meas_type] = \
+                    binder.get_measurement_state(context[0], meas_type)
+            states[meas_type].update(start_time, end_time, 
+                                     value, sliver_info)
+
+    # Add a new sliver to the kept measurement states of a context
+    def _add_to_states(self, context, sliver_info):
+        for binder_class, states in self._states.get(context, {}).items():
+            self._update_states(self._binders[binder_class], context, 
+                                states, sliver_info)
+
+    # Remove a sliver from the kept measurement states of a context,
+    # dropping the states of measurements no sliver in the context has.
+    # States that cannot remove a sliver are recomputed when next needed.
+    def _remove_from_states(self, context, sliver_info, gone_meas_types):
+        binder_states = self._states.get(context, {})
+        for binder_class, states in binder_states.items():
+            try:
+                for meas_type, value in sliver_info['measurements'].items():
+                    states[meas_type].remove(sliver_info['start_time'],
+                                             sliver_info['end_time'],
+                                             value, sliver_info)
+            except NotImplementedError:
+                del binder_states[binder_class]
+                continue
+            for meas_type in gone_meas_types:
+                del states[meas_type]
+
+# The allocations at an AM if a request were granted: the slivers in
+# the ledger, with some end times changed (on renew), plus new slivers 
+# (on allocate). 
+#
+# Resource binders ask for their measurement states per context, 
+# rather than going through every sliver. Iterating gives the
+# sliver_infos, as for a plain list of allocations.
+class Requested_Allocation_State:
+
+    def __init__(self, ledger, new_slivers=[], new_end_times={}):
+        self._ledger = ledger
+        self._new_slivers = new_slivers
+        self._new_end_times = new_end_times
+
+    def get_measurement_states(self, binder, urn_type, urn):
+        return self._ledger.get_measurement_states(binder, urn_type, urn,
+                                                   self._new_slivers,
+                                                   self._new_end_times)
+
+    def get_ledger(self): return self._ledger
+    def get_new_slivers(self): return self._new_slivers
+    def get_new_end_times(self): return self._new_end_times
+
+    def __iter__(self):
+        for sliver_info in self._ledger.get_slivers():
+            sliver_urn = sliver_info['sliver_urn']
+            if sliver_urn in self._new_end_times:
+                sliver_info = dict(sliver_info)
+                sliver_info['end_time'] = \
+                    as_datetime(self._new_end_times[sliver_urn])
+            yield sliver_info
+        for sliver_info in self._new_slivers:
+            yield sliver_info
+
+    def __len__(self):
+        return len(self._ledger) + len(self._new_slivers)
+
+    # Return a digest that is the same for two requested states only
+    # if they have the same slivers, e.g. to cache authorization decisions
+    def fingerprint(self):
+        new_slivers = [[(key, isinstance(value, dict) and \
+                             sorted(value.items()) or value)
+                        for key, value in sorted(sliver_info.items())]
+                       for sliver_info in self._new_slivers]
+        digest = hashlib.sha1(repr((self._ledger.get_id(), 
+                                    self._ledger.get_generation(),
+                                    new_slivers,
+                                    sorted(self._new_end_times.items()))))
+        return digest.hexdigest()
+
+    # Return a list of sliver_infos with times as strings,
+    # e.g. to send to a remote authorizer
+    def as_list(self):
+        sliver_infos = []
+        for sliver_info in self:
+            sliver_info = dict(sliver_info)
+            sliver_info['start_time'] = str(sliver_info['start_time'])
+            sliver_info['end_time'] = str(sliver_info['end_time'])
+            sliver_infos.append(sliver_info)
+        return sliver_infos
@@ -0,0 +1,396 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+from __future__ import absolute_import
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import Queue
+import signal
+import threading
+import time
+
+from .allocation_ledger import Allocation_Ledger, Requested_Allocation_State
+from .base_authorizer import Base_Authorizer
+from .util import getInstanceFromClassname
+
+# An authorizer that runs another authorizer (e.g. the ABAC authorizer)
+# in a pool of worker processes, so that evaluating policies does not
+# hold the AM server's interpreter lock.
+#
+# Each worker process creates the authorizer once, loading and compiling
+# its rule sets, and then authorizes requests sent to it over a local
+# socket for as long as it runs. Requests that arrive while all workers
+# are busy queue up, and a worker that becomes free takes the waiting
+# requests as one batch.
+#
+# A worker also keeps a copy of the AM's allocation ledger, so that its
+# resource binders compute their measurements incrementally as they do 
+# in the AM. Each request carries only the ledger changes since the 
+# worker's last request.
+#
+# Worker processes are only started (forked) by the pool's constructor,
+# before the pool or the AM starts any threads: a process forked while
+# other threads run can inherit a lock one of them held. The pool also
+# starts a spare worker up front. When a worker exits, the spare takes
+# its place; once there is no spare left, a worker that exits is not
+# replaced, and when no worker is left every request is denied.
+#
+# Decisions are remembered for a short while, keyed on the caller,
+# method, slice and fingerprint of the requested allocation state (and
+# a digest of the credentials, arguments and options, which binders
+# also read), so that repeated identical requests are not sent again.
+#
+# Configured from the AM options:
+#   authorizer_workers : number of worker processes
+#   authorizer_batch_size : most requests sent to a worker at once
+#   authorizer_decision_cache_secs : how long to remember decisions
+#     (0 to not remember them)
+
+# The body of a worker process: create the authorizer, say whether
+# that worked, then authorize each batch of requests received.
+# A batch is a list of authorize argument tuples. The requested allocation
+# state is either a list of allocations or a dict of changes to the copy
+# of the AM ledger (see Authorizer_Pool._ledger_changes). The reply is a
+# list with, for each request, None if authorized or else the error message.
+# AM ends of connections the process inherited are closed, so that 
+# it sees the end of its own connection when the AM exits.
+def _serve_authorizer(connection, authorizer_classname, root_cert, opts,
+                      argument_guard, am_connections):
+    # Ctrl-C in the AM's terminal is for the AM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for am_connection in am_connections:
+        am_connection.close()
+    try:
+        authorizer = getInstanceFromClassname(authorizer_classname,
+                                              root_cert, opts,
+                                              argument_guard)
+    except Exception, e:
+        connection.send(('error', "Failed to create authorizer %s: %s" % \
+                             (authorizer_classname, e)))
+        return
+    connection.send(('ready', None))
+
+    ledger = None
+    while True:
+        try:
+            batch = connection.recv()
+        except (EOFError, IOError):
+            # The AM is done with us
+            break
+        results = []
+        for request in batch:
+            method, caller, creds, args, opts, state = request
+            if isinstance(state, dict):
+                if state['full']:
+                    ledger = Allocation_Ledger()
+                ledger.apply_changes(state['changes'])
+                state = Requested_Allocation_State(ledger, 
+                                                   state['new_slivers'],
+                                                   state['new_end_times'])
+            try:
+                authorizer.authorize(method, caller, creds, args, opts, 
+                                     state)
+                results.append(None)
+            except Exception, e:
+                results.append(str(e))
+        connection.send(results)
+
+class Authorizer_Pool(Base_Authorizer):
+
+    DEFAULT_WORKERS = 2
+    DEFAULT_BATCH_SIZE = 16
+    DEFAULT_DECISION_CACHE_SECS = 30
+
+    # Workers started with the pool to replace workers that exit
+    SPARE_WORKERS = 1
+
+    # Most decisions remembered
+    MAX_DECISIONS = 10000
+
+    def __init__(self, authorizer_classname, root_cert, opts,
+                 argument_guard=None):
+        Base_Authorizer.__init__(self, root_cert, opts)
+        self._logger = logging.getLogger('gcf.authorizer_pool')
+        self._authorizer_classname = authorizer_classname
+        self._argument_guard = argument_guard
+
+        num_workers = int(getattr(opts, 'authorizer_workers',
+                                  self.DEFAULT_WORKERS))
+        if num_workers < 1:
+            raise Exception("authorizer_workers must be at least 1")
+        self._batch_size = max(1, int(getattr(opts, 'authorizer_batch_size',
+                                              self.DEFAULT_BATCH_SIZE)))
+        self._decision_cache_secs = \
+            float(getattr(opts, 'authorizer_decision_cache_secs',
+                          self.DEFAULT_DECISION_CACHE_SECS))
+
+        # (caller, method, slice, state fingerprint, request digest) =>
+        # (expiration, error message or None)
+        self._decisions = {}
+        self._decisions_lock = threading.Lock()
+
+        # Requests waiting for a worker: dict with 'request' (the
+        # authorize arguments), 'done' (an Event) and 'result'
+        self._requests = Queue.Queue()
+
+        # For each worker, its (process, connection), or None once it
+        # exited with no spare to replace it. Spare workers'
+        # (process, connection). All guarded by _workers_lock, as is
+        # putting requests on _requests once no worker is left.
+        self._workers_lock = threading.Lock()
+        self._workers = []
+        self._spares = []
+
+        # For each worker, the (ledger id, generation) of its copy of 
+        # the AM ledger. Only the worker's dispatcher thread uses these
+        self._ledger_copies = []
+
+        # Start all the processes before any thread
+        for index in range(num_workers):
+            self._workers.append(self._start_worker("authorizer-%d" % index))
+            self._ledger_copies.append((None, None))
+        for index in range(self.SPARE_WORKERS):
+            self._spares.append(self._start_worker("authorizer-spare"))
+        for index in range(num_workers):
+            dispatcher = threading.Thread(target=self._send_batches,
+                                          args=(index,),
+                                          name="authorizer-%d" % index)
+            dispatcher.daemon = True
+            dispatcher.start()
+        self._logger.info("Started %d %s workers" % \
+                              (num_workers, authorizer_classname))
+
+    # Start a worker process and wait until its authorizer is ready
+    # Return its (process, connection)
+    # Only called by the constructor, before it starts any thread
+    def _start_worker(self, name):
+        connection, worker_connection = multiprocessing.Pipe()
+        am_connections = [connection] + \
+            [worker[1] for worker in self._workers + self._spares]
+        process = multiprocessing.Process(target=_serve_authorizer,
+                                          args=(worker_connection,
+                                                self._authorizer_classname,
+                                                self._root_cert,
+                                                self._opts,
+                                                self._argument_guard,
+                                                am_connections),
+                                          name=name)
+        # Do not hold up AM exit
+        process.daemon = True
+        process.start()
+        worker_connection.close()
+        try:
+            status, message = connection.recv()
+        except (EOFError, IOError):
+            status, message = 'error', "Authorizer worker exited"
+        if status != 'ready':
+            connection.close()
+            process.join()
+            raise Exception(message)
+        return process, connection
+
+    # Return the (process, connection) of a worker, or None if it
+    # exited and was not replaced
+    def _worker(self, index):
+        with self._workers_lock:
+            return self._workers[index]
+
+    # Replace a worker that exited with a spare, if there is one.
+    # Return whether it was replaced. When no worker is left, deny the
+    # requests still waiting.
+    def _replace_worker(self, index):
+        with self._workers_lock:
+            if self._spares:
+                self._workers[index] = self._spares.pop(0)
+                self._logger.warning("Replaced authorizer worker %d with the spare" % index)
+                return True
+            self._workers[index] = None
+            self._logger.error("Authorizer worker %d exited and there is no spare to replace it" % index)
+            if [worker for worker in self._workers if worker is not None]:
+                return False
+            self._logger.error("No authorizer workers left: denying all requests")
+            while True:
+                try:
+                    request = self._requests.get_nowait()
+                except Queue.Empty:
+                    break
+                request['result'] = "No authorizer workers left"
+                request['done'].set()
+            return False
+
+    # Send batches of waiting requests to a worker, until the AM exits
+    # or the worker exits and is not replaced
+    def _send_batches(self, index):
+        while self._worker(index) is not None:
+            batch = [self._requests.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._requests.get_nowait())
+                except Queue.Empty:
+                    break
+            try:
+                results = self._authorize_batch(index,
+                                                [request['request'] \
+                                                     for request in batch])
+            except Exception, e:
+                self._logger.exception("Authorizer worker %d failed" % index)
+                results = ["Authorizer failed: %s" % e] * len(batch)
+            for request, result in zip(batch, results):
+                request['result'] = result
+                request['done'].set()
+
+    # Have a worker authorize a batch of requests, having it replaced
+    # by the spare (and trying once more) if it has exited
+    def _authorize_batch(self, index, batch):
+        for attempt in range(2):
+            worker = self._worker(index)
+            if worker is None:
+                break
+            process, connection = worker
+            message = []
+            for method, caller, creds, args, opts, state in batch:
+                if isinstance(state, Requested_Allocation_State):
+                    state = self._ledger_changes(index, state)
+                message.append((method, caller, creds, args, opts, state))
+            try:
+                connection.send(message)
+                return connection.recv()
+            except (EOFError, IOError):
+                connection.close()
+                self._ledger_copies[index] = (None, None)
+                process.join(1)
+                self._logger.warning("Authorizer worker %d exited (code %s)" % \
+                                         (index, process.exitcode))
+                if not self._replace_worker(index):
+                    break
+        raise Exception("Authorizer worker %d exited" % index)
+
+    # Return the requested state to send a worker: the changes
+    # to bring its copy of the ledger up to date (or to make a new copy),
+    # and the new slivers and end times requested
+    def _ledger_changes(self, index, requested_state):
+        ledger = requested_state.get_ledger()
+        copy_id, copy_generation = self._ledger_copies[index]
+        if copy_id != ledger.get_id():
+            copy_generation = None
+        generation, full, changes = ledger.get_changes(copy_generation)
+        self._ledger_copies[index] = (ledger.get_id(), generation)
+        return {'full' : full, 'changes' : changes,
+                'new_slivers' : requested_state.get_new_slivers(),
+                'new_end_times' : requested_state.get_new_end_times()}
+
+    # Try to authorize the call in a worker process.
+    # Success is silent.
+    # Failure raise an exception with the worker authorizer's message
+    def authorize(self, method, caller, creds, args, opts,
+                  requested_allocation_state):
+        state_fingerprint = self._state_fingerprint(requested_allocation_state)
+        key = self._decision_key(method, caller, creds, args, opts,
+                                 state_fingerprint)
+        found, error = self._lookup_decision(key)
+        if found:
+            self._logger.debug("Using remembered decision for %s" % method)
+        else:
+            state = requested_allocation_state
+            if not isinstance(state, Requested_Allocation_State):
+                state = list(state)
+            request = {'request' : (method, caller, creds, args, opts, state),
+                       'done' : threading.Event(),
+                       'result' : None}
+            with self._workers_lock:
+                if not [worker for worker in self._workers \
+                            if worker is not None]:
+                    raise Exception("No authorizer workers left")
+                self._requests.put(request)
+            request['done'].wait()
+            error = request['result']
+            # Unless the allocations changed since we computed the key
+            if key is not None and state_fingerprint == \
+                    self._state_fingerprint(requested_allocation_state):
+                self._save_decision(key, error)
+        if error is not None:
+            raise Exception(error)
+
+    # Check the arguments and options with the argument guard (if any)
+    def validate_arguments(self, method_name, arguments, options):
+        if self._argument_guard:
+            return self._argument_guard.validate_arguments(method_name,
+                                                           arguments, options)
+        return arguments, options
+
+    # Return a digest of the given requested allocation state
+    def _state_fingerprint(self, requested_allocation_state):
+        if hasattr(requested_allocation_state, 'fingerprint'):
+            return requested_allocation_state.fingerprint()
+        try:
+            return hashlib.sha1(json.dumps(requested_allocation_state,
+                                           sort_keys=True,
+                                           default=str)).hexdigest()
+        except Exception:
+            return None
+
+    # Return the key for remembering the decision on a request,
+    # or None if it should not be remembered
+    def _decision_key(self, method, caller, creds, args, opts,
+                      state_fingerprint):
+        if self._decision_cache_secs <= 0 or state_fingerprint is None:
+            return None
+        try:
+            request_digest = hashlib.sha1(json.dumps([creds, args, opts],
+                                                     sort_keys=True,
+                                                     default=str))
+        except Exception:
+            # Not something we can digest
+            return None
+        return (hashlib.sha1(caller).hexdigest(), method,
+                args.get('slice_urn'), state_fingerprint,
+                request_digest.hexdigest())
+
+    # Return (True, error) for a remembered decision, else (False, None)
+    def _lookup_decision(self, key):
+        if key is None:
+            return False, None
+        with self._decisions_lock:
+            decision = self._decisions.get(key)
+            if decision is None:
+                return False, None
+            expiration, error = decision
+            if expiration < time.time():
+                del self._decisions[key]
+                return False, None
+            return True, error
+
+    def _save_decision(self, key, error):
+        now = time.time()
+        with self._decisions_lock:
+            if len(self._decisions) >= self.MAX_DECISIONS:
+                for old_key, (expiration, old_error) in \
+                        self._decisions.items():
+                    if expiration < now:
+                        del self._decisions[old_key]
+                if len(self._decisions) >= self.MAX_DECISIONS:
+                    self._decisions.clear()
+            self._decisions[key] = (now + self._decision_cache_secs, error)
@@ -29,6 +29,7 @@ import SocketServer
 import SimpleXMLRPCServer
 
 from util import getInstanceFromClassname
+from gcf.geni.auth.authorizer_pool import Authorizer_Pool
 
 class AsyncXMLRPCServer(SocketServer.ThreadingMixIn,
                         SimpleXMLRPCServer.SimpleXMLRPCServer):
@@ -48,6 +49,14 @@ def parse_args(argv):
     parser.add_option("--argument_guard",
                       help="class name for argument guard",
                       default=None)
+    parser.add_option("--authorizer_workers", type="int", default=0,
+                      help="run the authorizer in this many worker processes")
+    parser.add_option("--authorizer_batch_size", type="int",
+                      default=Authorizer_Pool.DEFAULT_BATCH_SIZE,
+                      help="with workers, most requests sent to a worker at once")
+    parser.add_option("--authorizer_decision_cache_secs", type="float",
+                      default=Authorizer_Pool.DEFAULT_DECISION_CACHE_SECS,
+                      help="with workers, seconds to remember decisions")
 
     opts = parser.parse_args()[0]
     if not opts.port and \
@@ -68,9 +77,13 @@ def main():
     if opts.argument_guard:
         argument_guard = getInstanceFromClassname(opts.argument_guard)
 
-    authorizer = getInstanceFromClassname(opts.authorizer, 
-                                          opts.trusted_roots, opts, 
-                                          argument_guard)
+    if opts.authorizer_workers > 0:
+        authorizer = Authorizer_Pool(opts.authorizer, opts.trusted_roots, 
+                                     opts, argument_guard)
+    else:
+        authorizer = getInstanceFromClassname(opts.authorizer, 
+                                              opts.trusted_roots, opts, 
+                                              argument_guard)
 
 #    authorizer._DEFAULT_RULES.dump()
 #    for rules in authorizer._AUTHORITY_SPECIFIC_RULES.values():
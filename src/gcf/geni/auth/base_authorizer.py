@@ -25,9 +25,9 @@
 from __future__ import absolute_import
 
 try:
-    from ...sfa.trust import gid
+    from ..util.cert_util import PeerIdentity
 except:
-    from gcf.sfa.trust import gid
+    from gcf.geni.util.cert_util import PeerIdentity
 
 # Name of all AM Methods
 class AM_Methods:
@@ -83,7 +83,7 @@ class Base_Authorizer(object):
     def authorize(self, method, caller, creds, args, opts,
                   requested_allocation_state):
         if self._logger:
-            caller_urn = gid.GID(string=caller).get_urn()
+            caller_urn = PeerIdentity.for_pem(caller).get_urn()
             template = "Authorizing %s %s #Creds = %s Args = %s Opts =%s"
             self._logger.info(template % \
                                   (method, caller_urn, len(creds), \
@@ -31,7 +31,7 @@ from __future__ import absolute_import
 import time
 import xml.dom.minidom
 
-from ...sfa.trust import gid
+from ..util.cert_util import PeerIdentity
 from ..util.cred_util import CredentialVerifier
 from .sfa_authorizer import SFA_Authorizer
 from .base_authorizer import AM_Methods
@@ -63,7 +63,7 @@ class Standard_Binder(Base_Binder):
 
         bindings['$METHOD'] = method
 
-        caller_urn = gid.GID(string=caller).get_urn()
+        caller_urn = PeerIdentity.for_pem(caller).get_urn()
         bindings['$CALLER'] = caller_urn
 
         if 'slice_urn' in args:
@@ -23,11 +23,12 @@
 
 from __future__ import absolute_import
 
+import copy
+
 from .util import *
 from .binders import Base_Binder
-from ...sfa.trust import gid
-
-import dateutil.parser
+from .allocation_ledger import as_datetime, Requested_Allocation_State
+from ..util.cert_util import PeerIdentity
 
 # A class to compute resource bindings from a set of 
 # sliver entries. We take only those slivers that match the 
@@ -57,8 +58,14 @@ class Resource_Binder(Base_Binder):
     # Aggregation (SUM, MAX, etc.) we're applying to measurements
     def generate_bindings(self, method, caller, creds, args, opts,
                           requested_state = []):
+        # Binders are shared by concurrent requests: set the call
+        # context on a copy for this request, never on the shared binder
+        context = copy.copy(self)
+        return context._generate_bindings(caller, args, requested_state)
+
+    def _generate_bindings(self, caller, args, requested_state):
         measurement_states = {}
-        self._user_urn = gid.GID(string=caller).get_urn()
+        self._user_urn = PeerIdentity.for_pem(caller).get_urn()
         self._authority_urn = \
             convert_user_urn_to_authority_urn(self._user_urn)
 
@@ -67,6 +74,21 @@ class Resource_Binder(Base_Binder):
             self._project_urn = \
                 convert_slice_urn_to_project_urn(self._slice_urn)
 
+        if isinstance(requested_state, Requested_Allocation_State):
+            # Start from the measurement states the allocation ledger
+            # keeps for each context, rather than going through every sliver
+            for urn_type, urn in (('SLICE', self._slice_urn),
+                                  ('USER', self._user_urn),
+                                  ('PROJECT', self._project_urn),
+                                  ('AUTHORITY', self._authority_urn)):
+                if urn is None: continue
+                states = requested_state.get_measurement_states(self, 
+                                                                urn_type, urn)
+                for meas_type, state in states.items():
+                    key = "%s:%s" % (urn_type, meas_type)
+                    measurement_states[key] = state
+            return self.getBindings(measurement_states)
+
         for sliver_info in requested_state:
             self.updateForSliverInfo(sliver_info, measurement_states)
 
@@ -79,8 +101,8 @@ class Resource_Binder(Base_Binder):
         user_urn = sliver_info['user_urn']
         project_urn = None
         authority_urn = None
-        start_time = dateutil.parser.parse(sliver_info['start_time'])
-        end_time = dateutil.parser.parse(sliver_info['end_time'])
+        start_time = as_datetime(sliver_info['start_time'])
+        end_time = as_datetime(sliver_info['end_time'])
         measurements = sliver_info['measurements']
 
         if slice_urn:
@@ -145,7 +167,7 @@ class Resource_Binder(Base_Binder):
         bindings = {}
         for meas_state in measurement_states.values():
             meas_state_bindings = meas_state.getBindings()
-            bindings = dict(bindings.items() + meas_state_bindings.items())
+            bindings.update(meas_state_bindings)
         return bindings
 
 # Resource_Binder subclass to compute total allocation measurements
@@ -199,6 +221,17 @@ class Base_ResourceMeasurementState:
     def update(self, start_time, end_time, value, sliver_info):
         pass
 
+    # Override this method to undo an update, so an Allocation_Ledger
+    # can keep the state current as slivers change
+    # rather than recompute it
+    def remove(self, start_time, end_time, value, sliver_info):
+        raise NotImplementedError
+
+    # Return a copy of this state that can be updated separately
+    # Override this if the state holds mutable containers
+    def copy(self):
+        return copy.copy(self)
+
 # ResourceMeasurementState sub-Class to compute the 
 # total of allocation measurement values
 class TOTAL_ResourceMeasurementState(Base_ResourceMeasurementState):
@@ -209,6 +242,9 @@ class TOTAL_ResourceMeasurementState(Base_ResourceMeasurementState):
     def update(self, start_time, end_time, value, sliver_info):
         self._meas_total = self._meas_total + value
 
+    def remove(self, start_time, end_time, value, sliver_info):
+        self._meas_total = self._meas_total - value
+
     def getBindings(self):
         total_key = "$%s_%s_%s" % (self._urn_type, self._meas_type, 'TOTAL')
         return {total_key : str(self._meas_total) }
@@ -225,6 +261,11 @@ class HOURS_ResourceMeasurementState(Base_ResourceMeasurementState):
         num_hours = (dt.days*24) + (dt.seconds/3600.0)
         self._meas_hours = self._meas_hours + (value * num_hours)
 
+    def remove(self, start_time, end_time, value, sliver_info):
+        dt = (end_time - start_time)
+        num_hours = (dt.days*24) + (dt.seconds/3600.0)
+        self._meas_hours = self._meas_hours - (value * num_hours)
+
     def getBindings(self):
         hours_key = "$%s_%s_%s" % (self._urn_type, self._meas_type, 'HOURS')
         return {hours_key : str(self._meas_hours) }
@@ -234,49 +275,45 @@ class HOURS_ResourceMeasurementState(Base_ResourceMeasurementState):
 class MAX_ResourceMeasurementState(Base_ResourceMeasurementState):
     def __init__(self, urn_type, meas_type):
         Base_ResourceMeasurementState.__init__(self, urn_type, meas_type)
-        # Maintain list of times
-        self._times = set()
-
-        # Maintain list of [value, start, end] tuples
-        self._entries = []
+        # Maintain net change in total at each start/end time
+        self._deltas = {}
 
     def update(self, start_time, end_time, value, sliver_info):
-        # Register times
-        self._times.add(start_time)
-        self._times.add(end_time)
-
-        # Registry entry for later 'MAX' calculation
-        self._entries.append((start_time, end_time, value))
-
+        # Note: we treat start_time as first included time
+        # end_times as NON-included time
+        # So an entry that ends before it starts never counts
+        if end_time <= start_time: return
+
+        # Register value added at start and removed at end
+        # for later 'MAX' calculation
+        self._deltas[start_time] = self._deltas.get(start_time, 0) + value
+        self._deltas[end_time] = self._deltas.get(end_time, 0) - value
+
+    def remove(self, start_time, end_time, value, sliver_info):
+        if end_time <= start_time: return
+        for tm, delta in ((start_time, -value), (end_time, value)):
+            new_delta = self._deltas.get(tm, 0) + delta
+            if new_delta == 0:
+                del self._deltas[tm]
+            else:
+                self._deltas[tm] = new_delta
+
+    def copy(self):
+        state = copy.copy(self)
+        state._deltas = dict(self._deltas)
+        return state
 
     def getBindings(self):
 
-        # Get a sorted list of all the start/end times
-        time_boundaries = [tm for tm in self._times]
-        time_boundaries.sort()
-
-        # Collect totals for each window [i:i+1] in bin [i]
-        totals = [0 for i in range(len(time_boundaries)-1)]
-
-        # For each entry, add the value to the right bins if
-        # entry overlaps the time window of that bin
-        # In so doing, compute max_total
-        #
-        # Note: we treat start_time as first included time
-        # end_times as NON-included time
+        # Sweep the start/end times in order: the running total
+        # after applying all changes at a time is the total
+        # from that time up to the next time, so max_total is
+        # the largest running total
         max_total = 0
-        for entry in self._entries:
-            entry_start = entry[0]
-            entry_end = entry[1]
-            value = entry[2]
-            for i in range(len(totals)):
-                boundary_start = time_boundaries[i]
-                boundary_end = time_boundaries[i+1]
-                no_overlap =  entry_start >= boundary_end or \
-                    entry_end <= boundary_start;
-                if not no_overlap:
-                    totals[i] = totals[i] + value
-                    max_total = max(totals[i], max_total)
+        total = 0
+        for tm in sorted(self._deltas):
+            total = total + self._deltas[tm]
+            max_total = max(total, max_total)
 
         max_key = "$%s_%s_%s" % (self._urn_type, self._meas_type, 'MAX')
         return {max_key : str(max_total) }
@@ -287,16 +324,33 @@ class User_Slice_ResourceMeasurementState(Base_ResourceMeasurementState):
     def __init__(self, urn_type, meas_type):
         Base_ResourceMeasurementState.__init__(self, urn_type, meas_type)
         self._active = urn_type == "USER" # Ignore all but user info
-        self._slices = set()
-        self._projects = set()
+        # Number of updates for each slice and project
+        self._slices = {}
+        self._projects = {}
 
     def update(self, start_time, end_time, value, sliver_info):
         if self._active:
             slice_urn = sliver_info['slice_urn']
-            self._slices.add(slice_urn)
+            self._slices[slice_urn] = self._slices.get(slice_urn, 0) + 1
             project_urn = convert_slice_urn_to_project_urn(slice_urn)
-            self._projects.add(project_urn)
+            self._projects[project_urn] = \
+                self._projects.get(project_urn, 0) + 1
 
+    def remove(self, start_time, end_time, value, sliver_info):
+        if self._active:
+            slice_urn = sliver_info['slice_urn']
+            project_urn = convert_slice_urn_to_project_urn(slice_urn)
+            for urn, counts in ((slice_urn, self._slices),
+                                (project_urn, self._projects)):
+                counts[urn] = counts[urn] - 1
+                if counts[urn] == 0:
+                    del counts[urn]
+
+    def copy(self):
+        state = copy.copy(self)
+        state._slices = dict(self._slices)
+        state._projects = dict(self._projects)
+        return state
 
     def getBindings(self):
         if self._active:
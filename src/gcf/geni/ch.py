@@ -118,6 +118,7 @@ class Clearinghouse(object):
         self.logger = cred_util.logging.getLogger('gcf-ch')
         self.slices = {}
         self.aggs = []
+        self.cred_issuer = None
 
     def load_aggregates(self):
         """Loads aggregates from the clearinghouse section of the config file.
@@ -192,7 +193,7 @@ class Clearinghouse(object):
         if os.path.isfile(os.path.expanduser(ca_certs)):
             self.ca_cert_fnames = [os.path.expanduser(ca_certs)]
         elif os.path.isdir(os.path.expanduser(ca_certs)):
-            self.ca_cert_fnames = [os.path.join(os.path.expanduser(ca_certs), name) for name in os.listdir(os.path.expanduser(ca_certs)) if name != cred_util.CredentialVerifier.CATEDCERTSFNAME]
+            self.ca_cert_fnames = cred_util.TrustRootsIndex.for_dir(ca_certs).get_root_cert_files()
 
         # Create the xmlrpc server, load the rootkeys and do the ssl thing.
         self._server = self._make_server(addr, keyfile, certfile,
@@ -434,7 +435,7 @@ class Clearinghouse(object):
         self.logger.info("Called CreateUserCredential for GID %s" % user_gid.get_hrn())
         expiration = datetime.datetime.utcnow() + datetime.timedelta(seconds=USER_CRED_LIFE)
         try:
-            ucred = cred_util.create_credential(user_gid, user_gid, expiration, 'user', self.keyfile, self.certfile, self.trusted_root_files)
+            ucred = self.get_cred_issuer().create_credential(user_gid, user_gid, expiration, 'user')
         except Exception, exc:
             self.logger.error("Failed to create user credential for %s: %s", user_gid.get_hrn(), traceback.format_exc())
             raise Exception("Failed to create user credential for %s" % user_gid.get_hrn(), exc)
@@ -444,5 +445,12 @@ class Clearinghouse(object):
         '''Create a Slice credential object for this user_gid (object) on given slice gid (object)'''
         # FIXME: Validate the user_gid and slice_gid
         # are my user and slice
-        return cred_util.create_credential(user_gid, slice_gid, expiration, 'slice', self.keyfile, self.certfile, self.trusted_root_files, delegatable)
+        return self.get_cred_issuer().create_credential(user_gid, slice_gid, expiration, 'slice', delegatable)
+
+    def get_cred_issuer(self):
+        '''Return the CredentialIssuer for this CH, loading the CH key
+        and cert on first use.'''
+        if self.cred_issuer is None:
+            self.cred_issuer = cred_util.CredentialIssuer(self.keyfile, self.certfile, self.trusted_root_files)
+        return self.cred_issuer
 
@@ -455,7 +455,7 @@ class PGClearinghouse(Clearinghouse):
         if os.path.isfile(os.path.expanduser(ca_certs)):
             self.ca_cert_fnames = [os.path.expanduser(ca_certs)]
         elif os.path.isdir(os.path.expanduser(ca_certs)):
-            self.ca_cert_fnames = [os.path.join(os.path.expanduser(ca_certs), name) for name in os.listdir(os.path.expanduser(ca_certs)) if name != cred_util.CredentialVerifier.CATEDCERTSFNAME]
+            self.ca_cert_fnames = cred_util.TrustRootsIndex.for_dir(ca_certs).get_root_cert_files()
 
         self.trusted_roots = []
         for fname in self.ca_cert_fnames:
@@ -0,0 +1,244 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''
+Per method call counts and latencies of an XML-RPC server.
+
+The server times each call as a whole, the dispatch to the method, and
+the rest (parsing the request and serializing the response). Code run
+by a call charges time to other phases of it, like authorization or
+credential verification, with record_phase or the timed_phase decorator.
+That time goes to the call running on the current thread, if any.
+'''
+
+from __future__ import absolute_import
+
+import bisect
+import threading
+import time
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Phase of a call spent outside the dispatched method
+SERIALIZATION_PHASE = 'serialization'
+
+# Name used for calls whose method could not be determined,
+# or is not one the server has
+UNKNOWN_METHOD = '<unknown>'
+
+# The call being handled by this thread
+_current = threading.local()
+
+class Histogram(object):
+    '''Counts of observed latencies by bucket, with their sum and maximum.
+    Not thread safe: CallMetrics serializes updates.'''
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        # One more bucket for latencies above the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, secs):
+        self.counts[bisect.bisect_left(self.bounds, secs)] += 1
+        self.count += 1
+        self.sum += secs
+        if secs > self.max:
+            self.max = secs
+
+    def as_dict(self):
+        '''The histogram as a dict of XML-RPC types. Buckets are cumulative
+        counts, one for each bound and a last one for all observations.'''
+        cumulative = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return dict(count=self.count, sum_secs=self.sum, max_secs=self.max,
+                    buckets=cumulative)
+
+class _Call(object):
+    '''A call being handled: its method (once known), and time by phase.'''
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.method = None
+        self.start = time.time()
+        self.dispatch_secs = 0.0
+        self.error = False
+        # Phase name => seconds
+        self.phases = {}
+
+class CallMetrics(object):
+    '''Counts, in progress calls and latency histograms by method and phase.
+
+    Thread safe.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.time()
+        # Method => dict with 'calls', 'errors', 'in_flight' counts
+        # and 'latency' (phase name => Histogram, 'total' for whole calls)
+        self._methods = {}
+
+    def _method_metrics(self, method):
+        metrics = self._methods.get(method)
+        if metrics is None:
+            metrics = dict(calls=0, errors=0, in_flight=0, latency={})
+            self._methods[method] = metrics
+        return metrics
+
+    def begin_call(self):
+        '''Start timing a call on this thread. Returns the call,
+        to pass to end_call.'''
+        call = _Call(self)
+        _current.call = call
+        return call
+
+    def end_call(self, call):
+        '''Finish timing the given call, and record it.'''
+        total = time.time() - call.start
+        _current.call = None
+        method = call.method or UNKNOWN_METHOD
+        with self._lock:
+            metrics = self._method_metrics(method)
+            metrics['calls'] += 1
+            if call.error:
+                metrics['errors'] += 1
+            latency = metrics['latency']
+            phases = dict(call.phases)
+            phases['total'] = total
+            phases[SERIALIZATION_PHASE] = max(0.0, total - call.dispatch_secs)
+            for phase, secs in phases.items():
+                if phase not in latency:
+                    latency[phase] = Histogram()
+                latency[phase].observe(secs)
+
+    def dispatch(self, method, func, *args):
+        '''Call func(*args) as the given method of the current call,
+        timing it and counting it as in progress. An exception
+        or a result with a non zero geni_code is an error.
+        Metrics are kept for each method name, so callers should
+        pass UNKNOWN_METHOD rather than an unrecognized name.'''
+        call = getattr(_current, 'call', None)
+        if call is None:
+            call = _Call(self)
+        call.method = method
+        with self._lock:
+            self._method_metrics(method)['in_flight'] += 1
+        start = time.time()
+        try:
+            result = func(*args)
+            call.error = _is_error_result(result)
+            return result
+        except:
+            call.error = True
+            raise
+        finally:
+            call.dispatch_secs = time.time() - start
+            with self._lock:
+                self._method_metrics(method)['in_flight'] -= 1
+
+    def get_metrics(self):
+        '''Return the metrics as a dict of XML-RPC types: uptime_secs,
+        latency_buckets (bucket upper bounds) and methods, for each
+        method its calls, errors, in_flight and latency histograms
+        (see Histogram.as_dict) by phase, 'total' for the whole call.'''
+        with self._lock:
+            methods = {}
+            for method, metrics in self._methods.items():
+                latency = dict([(phase, histogram.as_dict()) \
+                                    for (phase, histogram) in \
+                                    metrics['latency'].items()])
+                methods[method] = dict(calls=metrics['calls'],
+                                       errors=metrics['errors'],
+                                       in_flight=metrics['in_flight'],
+                                       latency=latency)
+        return dict(uptime_secs=time.time() - self._start,
+                    latency_buckets=list(LATENCY_BUCKETS),
+                    methods=methods)
+
+    def format_text(self):
+        '''Return the metrics in the Prometheus text exposition format.'''
+        metrics = self.get_metrics()
+        lines = []
+        lines.append('# TYPE gcf_uptime_seconds gauge')
+        lines.append('gcf_uptime_seconds %f' % metrics['uptime_secs'])
+        for (name, key, kind) in (('gcf_calls_total', 'calls', 'counter'),
+                                  ('gcf_errors_total', 'errors', 'counter'),
+                                  ('gcf_calls_in_flight', 'in_flight',
+                                   'gauge')):
+            lines.append('# TYPE %s %s' % (name, kind))
+            for method in sorted(metrics['methods']):
+                lines.append('%s{method="%s"} %d' % \
+                                 (name, method,
+                                  metrics['methods'][method][key]))
+        lines.append('# TYPE gcf_latency_seconds histogram')
+        bounds = [str(bound) for bound in metrics['latency_buckets']] + \
+            ['+Inf']
+        for method in sorted(metrics['methods']):
+            latency = metrics['methods'][method]['latency']
+            for phase in sorted(latency):
+                histogram = latency[phase]
+                labels = 'method="%s",phase="%s"' % (method, phase)
+                for bound, count in zip(bounds, histogram['buckets']):
+                    lines.append('gcf_latency_seconds_bucket{%s,le="%s"} %d' % \
+                                     (labels, bound, count))
+                lines.append('gcf_latency_seconds_sum{%s} %f' % \
+                                 (labels, histogram['sum_secs']))
+                lines.append('gcf_latency_seconds_count{%s} %d' % \
+                                 (labels, histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+def _is_error_result(result):
+    '''Is this an AM API style result with a non zero geni_code?'''
+    if not isinstance(result, dict):
+        return False
+    code = result.get('code')
+    if isinstance(code, dict):
+        return code.get('geni_code', 0) != 0
+    return False
+
+def record_phase(phase, secs):
+    '''Charge secs to the given phase of the call running on this thread.'''
+    call = getattr(_current, 'call', None)
+    if call is not None:
+        call.phases[phase] = call.phases.get(phase, 0.0) + secs
+
+def timed_phase(phase):
+    '''Decorator charging the time in the decorated function to the
+    given phase of the call running on this thread.'''
+    def decorator(func):
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_phase(phase, time.time() - start)
+        timed.__name__ = func.__name__
+        timed.__doc__ = func.__doc__
+        return timed
+    return decorator
@@ -26,9 +26,11 @@ Certificate (GID in SFA terms) creation and verification utilities.
 
 from __future__ import absolute_import
 
+import threading
 import uuid
 
 from .urn_util import URN
+from .speaksfor_util import get_cert_fingerprint, get_cert_keyid
 from ...sfa.trust.gid import GID
 from ...sfa.trust.certificate import Keypair
 
@@ -111,3 +113,73 @@ def create_cert(urn, issuer_key=None, issuer_cert=None, ca=False,
     newgid.encode()
     newgid.sign()
     return newgid, keys
+
+class PeerIdentity(object):
+    '''The identity of a caller (SSL peer or speaks-for user) given by
+    its PEM certificate. The GID, URN, key id and fingerprint are
+    computed on first use and then remembered, so that the layers
+    handling a request (speaks-for, credential verification,
+    authorization) do not each re-parse the certificate.
+
+    Use for_pem to get the (shared) identity for a certificate, so
+    that requests on a persistent connection, and repeat callers,
+    reuse it.'''
+
+    # Maximum number of identities remembered by for_pem
+    CACHE_SIZE = 1000
+
+    _identities = {}
+    _identities_lock = threading.Lock()
+
+    def __init__(self, pem_cert):
+        self.pem_cert = pem_cert
+        self._lock = threading.Lock()
+        self._gid = None
+        self._urn = None
+        self._keyid = None
+        self._have_keyid = False
+
+    @classmethod
+    def for_pem(cls, pem_cert):
+        '''Return the PeerIdentity for the given PEM certificate string,
+        or None if there is none.'''
+        if not pem_cert:
+            return None
+        identity = cls._identities.get(pem_cert)
+        if identity is None:
+            identity = cls(pem_cert)
+            with cls._identities_lock:
+                if len(cls._identities) >= cls.CACHE_SIZE:
+                    cls._identities.clear()
+                identity = cls._identities.setdefault(pem_cert, identity)
+        return identity
+
+    def get_gid(self):
+        '''Return the GID (with any parents) of this identity.
+        Callers must not modify it.'''
+        if self._gid is None:
+            with self._lock:
+                if self._gid is None:
+                    self._gid = GID(string=self.pem_cert)
+        return self._gid
+
+    def get_urn(self):
+        if self._urn is None:
+            self._urn = self.get_gid().get_urn()
+        return self._urn
+
+    def get_fingerprint(self):
+        '''Return the SHA1 fingerprint of the certificate.'''
+        return get_cert_fingerprint(self.get_gid())
+
+    def get_keyid(self):
+        '''Return the subject key identifier of the certificate
+        (as for ABAC), or None if it has none.'''
+        if not self._have_keyid:
+            cert = self.get_gid().cert
+            names = [cert.get_extension(i).get_short_name() \
+                         for i in range(cert.get_extension_count())]
+            if 'subjectKeyIdentifier' in names:
+                self._keyid = get_cert_keyid(self.get_gid())
+            self._have_keyid = True
+        return self._keyid
@@ -28,10 +28,16 @@ from __future__ import absolute_import
 
 import os
 import logging
+import hashlib
+import json
+import re
+import stat
+import threading
 import xmlrpclib
 import sys
 import datetime
 import dateutil
+import multiprocessing
 
 from ...sfa.trust import credential as cred
 from ...sfa.trust import gid
@@ -41,7 +47,14 @@ from ...sfa.trust.credential_factory import CredentialFactory
 from ...sfa.trust.abac_credential import ABACCredential
 from ...sfa.trust.certificate import Certificate
 
+from OpenSSL import crypto
+
 from .speaksfor_util import determine_speaks_for
+from .call_metrics import timed_phase
+from . import xmldsig_util
+from . import cert_util
+
+PEM_CERT_RE = re.compile('-----BEGIN CERTIFICATE-----.*?-----END CERTIFICATE-----', re.DOTALL)
 
 def naiveUTC(dt):
     """Converts dt to a naive datetime in UTC.
@@ -56,40 +69,237 @@ def naiveUTC(dt):
         dt = dt.replace(tzinfo=None)
     return dt
 
+class TrustRootsIndex(object):
+    """Index of a directory of trusted root certificate files.
+
+    A manifest records for each file its size, mtime, SHA1 hash, and
+    for each certificate in it the subject and notAfter. The manifest is
+    kept under MANIFESTDIR, not in the trusted roots directory, where
+    other tools would try to load it as a certificate. A scan only
+    reads and parses files that are new or changed since the manifest
+    was written. Files with no
+    parsable certificates, or whose (first) certificate has expired,
+    are left out. The same scan produces the list of root cert files,
+    the parsed root Certificates, and the concatenated bundle file
+    for the Python SSL library (rewritten only when it would change).
+
+    Use for_dir to share one index per directory within a process."""
+
+    CATEDCERTSFNAME = 'CATedCACerts.pem'
+    MANIFESTDIR = '~/.gcf/trust-roots'
+    MANIFEST_VERSION = 1
+
+    _indexes = dict()
+    _indexes_lock = threading.Lock()
+
+    @classmethod
+    def for_dir(cls, dirname):
+        '''Return the (rescanned) shared index of the given directory.'''
+        dirname = os.path.abspath(os.path.expanduser(dirname))
+        with cls._indexes_lock:
+            index = cls._indexes.get(dirname)
+            if index is None:
+                index = cls(dirname)
+                cls._indexes[dirname] = index
+        index.scan()
+        return index
+
+    def __init__(self, dirname):
+        self.logger = logging.getLogger('cred-verifier')
+        self.dirname = os.path.abspath(os.path.expanduser(dirname))
+        self.bundle_file = os.path.join(self.dirname, self.CATEDCERTSFNAME)
+        # One manifest per trusted roots directory, named by its path
+        self.manifest_file = os.path.join(os.path.expanduser(self.MANIFESTDIR),
+                                          '%s.manifest' % hashlib.sha1(self.dirname).hexdigest())
+        self._lock = threading.RLock()
+        # filename -> manifest entry
+        self._entries = self._read_manifest()
+        # filename -> (sha1, Certificate)
+        self._certs = dict()
+        self._root_files = []
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_file) as f:
+                manifest = json.load(f)
+            if manifest.get('version') == self.MANIFEST_VERSION:
+                return manifest.get('files', dict())
+        except IOError:
+            pass
+        except Exception, e:
+            self.logger.debug("Ignoring unreadable trust roots manifest %s: %s", self.manifest_file, e)
+        return dict()
+
+    def _write(self, path, contents):
+        # Write to a temp file and rename, so readers never see a partial file
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(contents)
+        os.rename(tmp, path)
+
+    def _parse_entry(self, contents, st):
+        '''Return a manifest entry for a file with the given contents and stat.'''
+        entry = dict(size=st.st_size, mtime=st.st_mtime,
+                     sha1=hashlib.sha1(contents).hexdigest(), certs=[], error=None)
+        for pem in PEM_CERT_RE.findall(contents):
+            try:
+                x509 = crypto.load_certificate(crypto.FILETYPE_PEM, pem)
+            except Exception, e:
+                entry['error'] = "Unparsable certificate: %s" % e
+                break
+            subject = '/'.join(['%s=%s' % c for c in x509.get_subject().get_components()])
+            entry['certs'].append(dict(subject=subject,
+                                       notAfter=x509.get_notAfter()))
+        if not entry['certs'] and entry['error'] is None:
+            entry['error'] = "No PEM certificate found"
+        return entry
+
+    def _trusted_files(self, entries, now, log=False):
+        '''Return the sorted names of the valid, unexpired files among the given entries.'''
+        trusted = []
+        for filename in sorted(entries.keys()):
+            entry = entries[filename]
+            if entry['error']:
+                continue
+            # notAfter is ASN.1 GeneralizedTime, YYYYMMDDhhmmssZ, so compares as a string
+            if entry['certs'][0]['notAfter'] < now:
+                if log:
+                    self.logger.warn("Skipping expired trusted cert file %s (expired %s)", filename, entry['certs'][0]['notAfter'])
+                continue
+            trusted.append(filename)
+        return trusted
+
+    def scan(self):
+        '''Bring the index up to date with the directory contents.
+        Return True if the set of trusted root files changed.'''
+        with self._lock:
+            now = datetime.datetime.utcnow().strftime('%Y%m%d%H%M%SZ')
+            previous = self._trusted_files(self._entries, now)
+            entries = dict()
+            manifest_changed = False
+            for filename in sorted(os.listdir(self.dirname)):
+                if filename == self.CATEDCERTSFNAME or filename.endswith('.tmp'):
+                    continue
+                filepath = os.path.join(self.dirname, filename)
+                try:
+                    st = os.stat(filepath)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    self.logger.debug('Skipping non file %s', filepath)
+                    continue
+                entry = self._entries.get(filename)
+                if entry is None or entry['size'] != st.st_size or entry['mtime'] != st.st_mtime:
+                    with open(filepath) as f:
+                        contents = f.read()
+                    new_entry = self._parse_entry(contents, st)
+                    if entry is None or entry['sha1'] != new_entry['sha1']:
+                        if new_entry['error']:
+                            self.logger.warn("Skipping trusted cert file %s: %s", filename, new_entry['error'])
+                        else:
+                            self.logger.info("Adding trusted cert file %s", filename)
+                    entry = new_entry
+                    manifest_changed = True
+                entries[filename] = entry
+            if set(entries.keys()) != set(self._entries.keys()):
+                manifest_changed = True
+            self._entries = entries
+
+            root_files = self._trusted_files(entries, now, log=True)
+            roots_changed = root_files != previous
+            self._root_files = [os.path.join(self.dirname, root_file) for root_file in root_files]
+            # Forget parsed certs of files no longer trusted
+            for filename in self._certs.keys():
+                if filename not in root_files:
+                    del self._certs[filename]
+
+            if manifest_changed or roots_changed or not os.path.exists(self.bundle_file):
+                self._write_bundle()
+                try:
+                    manifest_dir = os.path.dirname(self.manifest_file)
+                    if not os.path.isdir(manifest_dir):
+                        os.makedirs(manifest_dir)
+                    self._write(self.manifest_file,
+                                json.dumps(dict(version=self.MANIFEST_VERSION, files=entries),
+                                           indent=1, sort_keys=True))
+                except (IOError, OSError), e:
+                    self.logger.debug("Could not write trust roots manifest %s: %s", self.manifest_file, e)
+            return roots_changed
+
+    def _write_bundle(self):
+        contents = []
+        for filepath in self._root_files:
+            with open(filepath) as f:
+                data = f.read()
+            if data and not data.endswith('\n'):
+                data += '\n'
+            contents.append(data)
+        self._write(self.bundle_file, ''.join(contents))
+        self.logger.info('Combined dir of %d trusted certs %s into file %s for Python SSL support', len(self._root_files), self.dirname, self.bundle_file)
+
+    def get_root_cert_files(self):
+        '''Return the full paths of the trusted (valid, unexpired) root cert files.'''
+        return list(self._root_files)
+
+    def get_bundle_file(self):
+        '''Return the path of the concatenated trusted roots file.'''
+        return self.bundle_file
+
+    def get_root_certs(self):
+        '''Return Certificate objects for the trusted root cert files,
+        parsing only those not already parsed.'''
+        with self._lock:
+            certs = []
+            for filepath in self._root_files:
+                filename = os.path.basename(filepath)
+                sha1 = self._entries[filename]['sha1']
+                cached = self._certs.get(filename)
+                if cached is None or cached[0] != sha1:
+                    cached = (sha1, Certificate(filename=filepath))
+                    self._certs[filename] = cached
+                certs.append(cached[1])
+            return certs
+
 class CredentialVerifier(object):
     """Utilities to verify signed credentials from a given set of 
     root certificates. Will compare target and source URNs, and privileges.
     See verify and verify_from_strings methods in particular."""
 
-    CATEDCERTSFNAME = 'CATedCACerts.pem'
+    CATEDCERTSFNAME = TrustRootsIndex.CATEDCERTSFNAME
 
     # root_cert_fileordir is a trusted root cert file or directory of
     # trusted roots for verifying credentials
     def __init__(self, root_cert_fileordir):
         self.logger = logging.getLogger('cred-verifier')
+        self.trust_index = None
         if root_cert_fileordir is None:
             raise Exception("Missing Root certs argument")
         elif os.path.isdir(root_cert_fileordir):
-            files = os.listdir(root_cert_fileordir)
-            self.root_cert_files = []
-            for file in files:
-                # FIXME: exclude files that aren't cert files?
-                if file == CredentialVerifier.CATEDCERTSFNAME:
-                    continue
-                self.root_cert_files.append(os.path.expanduser(os.path.join(root_cert_fileordir, file)))
+            self.trust_index = TrustRootsIndex.for_dir(root_cert_fileordir)
+            self.root_cert_files = self.trust_index.get_root_cert_files()
             self.logger.info('Will accept credentials signed by any of %d root certs found in %s: %r' % (len(self.root_cert_files), root_cert_fileordir, self.root_cert_files))
         elif os.path.isfile(root_cert_fileordir):
             self.logger.info('Will accept credentials signed by the single root cert %s' % root_cert_fileordir)
             self.root_cert_files = [root_cert_fileordir]
         else:
             raise Exception("Couldn't find Root certs in %s" % root_cert_fileordir)
+        self._root_certs = None
 
+    def get_root_certs(self):
+        '''Return the trusted root Certificate objects, parsed once.'''
+        if self.trust_index:
+            return self.trust_index.get_root_certs()
+        if self._root_certs is None:
+            self._root_certs = [Certificate(filename=root_cert_file) \
+                                    for root_cert_file in self.root_cert_files]
+        return self._root_certs
 
     @classmethod
     def getCAsFileFromDir(cls, caCerts):
         '''Take a directory of CA certificates and concatenate them into a single
         file suitable for use by the Python SSL library to validate client 
-        credentials. Existing file is replaced.'''
+        credentials. Existing file is replaced if the trusted certs changed.
+        Expired and unparsable certificate files are left out.'''
         if caCerts is None:
             raise Exception ('Missing caCerts argument')
         if os.path.isfile(os.path.expanduser(caCerts)):
@@ -97,41 +307,12 @@ class CredentialVerifier(object):
         if not os.path.isdir(os.path.expanduser(caCerts)):
             raise Exception ('caCerts arg Not a file or a dir: %s' % caCerts)
 
-        logger = logging.getLogger('cred-verifier')
-
-        # Now we have a dir of caCerts files
-        # For each file in the dir (isfile), concatenate them into a new file
-        comboFullPath = os.path.join(caCerts, CredentialVerifier.CATEDCERTSFNAME)
-
-        caFiles = os.listdir(caCerts)
-        #logger.debug('Got %d potential caCert files in the dir', len(caFiles))
-
-        outfile = open(comboFullPath, "w")
-        okFileCount = 0
-        for filename in caFiles:
-            filepath = os.path.join(caCerts, filename)
-            # Confirm it's a CA file?
-            #        if not file.endswith('.pem'):
-            #            continue
-            if not os.path.isfile(os.path.expanduser(filepath)):
-                logger.debug('Skipping non file %s', filepath)
-                continue
-            if filename == CredentialVerifier.CATEDCERTSFNAME:
-                # logger.debug('Skipping previous cated certs file')
-                continue
-            okFileCount += 1
-            logger.info("Adding trusted cert file %s", filename)
-            certfile = open(filepath)
-            for line in certfile:
-                outfile.write(line)
-            certfile.close()
-        outfile.close()
-        if okFileCount == 0:
+        index = TrustRootsIndex.for_dir(caCerts)
+        if len(index.get_root_cert_files()) == 0:
             sys.exit('Found NO trusted certs in %s!' %  caCerts)
-        else:
-            logger.info('Combined dir of %d trusted certs %s into file %s for Python SSL support', okFileCount, caCerts, comboFullPath)
-        return comboFullPath
+        return index.get_bundle_file()
 
+    @timed_phase('credential_verify')
     def verify_from_strings(self, gid_string, cred_strings, target_urn,
                             privileges, options=None):
 
@@ -146,11 +327,11 @@ class CredentialVerifier(object):
                 self.logger.warn("Skipping unparsable credential. Error: %s. Credential begins: %s...", e, cred_string[:60])
             return credO
 
-        root_certs = \
-            [Certificate(filename=root_cert_file) \
-                 for root_cert_file in self.root_cert_files]
+        root_certs = self.get_root_certs()
 
-        caller_gid = gid.GID(string=gid_string)
+        # Reuses the GID parsed for this caller by earlier requests
+        # or by other layers of this request
+        caller_gid = cert_util.PeerIdentity.for_pem(gid_string).get_gid()
 
         # Potentially, change gid_string to be the cert of the actual user 
         # if this is a 'speaks-for' invocation
@@ -253,47 +434,47 @@ class CredentialVerifier(object):
             else:
                 # EG a slice_urn was supplied but no credentials
                 failure = "No credentials found"
-        for cred in credentials:
-            if cred is None:
+        for credential in credentials:
+            if credential is None:
                 failure = "Credential was unparseable"
                 continue
 
-            if cred.get_cred_type() == cred.SFA_CREDENTIAL_TYPE:
-                cS = cred.get_gid_caller().get_urn()
-            elif cred.get_cred_type() == ABACCredential.ABAC_CREDENTIAL_TYPE:
-                cS = cred.get_summary_tostring()
+            if credential.get_cred_type() == credential.SFA_CREDENTIAL_TYPE:
+                cS = credential.get_gid_caller().get_urn()
+            elif credential.get_cred_type() == ABACCredential.ABAC_CREDENTIAL_TYPE:
+                cS = credential.get_summary_tostring()
             else:
-                cS = "Unknown credential type %s" % cred.get_cred_type()
+                cS = "Unknown credential type %s" % credential.get_cred_type()
 
             if tried_creds != "":
                 tried_creds = "%s, %s" % (tried_creds, cS)
             else:
                 tried_creds = cS
 
-            if cred.get_cred_type() != cred.SFA_CREDENTIAL_TYPE:
+            if credential.get_cred_type() != credential.SFA_CREDENTIAL_TYPE:
                 failure = "Not an SFA credential: " + cS
                 continue
 
-            if not self.verify_source(gid, cred):
-                failure = "Cred %s fails: Credential doesn't grant rights to you (%s), but to %s (over object %s)" % (cred.get_gid_caller().get_urn(), gid.get_urn(), cred.get_gid_caller().get_urn(), cred.get_gid_object().get_urn())
+            if not self.verify_source(gid, credential):
+                failure = "Cred %s fails: Credential doesn't grant rights to you (%s), but to %s (over object %s)" % (credential.get_gid_caller().get_urn(), gid.get_urn(), credential.get_gid_caller().get_urn(), credential.get_gid_object().get_urn())
                 continue
-            if not self.verify_target(target_urn, cred):
-                failure = "Cred granting rights to %s on %s fails: It grants permissions over a different target, not %s (URNs dont match)" % (cred.get_gid_caller().get_urn(), cred.get_gid_object().get_urn(), target_urn)
+            if not self.verify_target(target_urn, credential):
+                failure = "Cred granting rights to %s on %s fails: It grants permissions over a different target, not %s (URNs dont match)" % (credential.get_gid_caller().get_urn(), credential.get_gid_object().get_urn(), target_urn)
                 continue
-            if not self.verify_privileges(privileges, cred):
-                failure = "Cred for %s over %s doesn't provide sufficient privileges" % (cred.get_gid_caller().get_urn(), cred.get_gid_object().get_urn())
+            if not self.verify_privileges(privileges, credential):
+                failure = "Cred for %s over %s doesn't provide sufficient privileges" % (credential.get_gid_caller().get_urn(), credential.get_gid_object().get_urn())
                 continue
 
             try:
-                if not cred.verify(self.root_cert_files):
-                    failure = "Couldn't validate credential for caller %s with target %s with any of %d known root certs" % (cred.get_gid_caller().get_urn(), cred.get_gid_object().get_urn(), len(self.root_cert_files))
+                if not credential.verify(self.root_cert_files):
+                    failure = "Couldn't validate credential for caller %s with target %s with any of %d known root certs" % (credential.get_gid_caller().get_urn(), credential.get_gid_object().get_urn(), len(self.root_cert_files))
                     continue
             except Exception, exc:
-                failure = "Couldn't validate credential for caller %s with target %s with any of %d known root certs: %s: %s" % (cred.get_gid_caller().get_urn(), cred.get_gid_object().get_urn(), len(self.root_cert_files), exc.__class__.__name__, exc)
+                failure = "Couldn't validate credential for caller %s with target %s with any of %d known root certs: %s: %s" % (credential.get_gid_caller().get_urn(), credential.get_gid_object().get_urn(), len(self.root_cert_files), exc.__class__.__name__, exc)
                 self.logger.info(failure)
                 continue
             # If got here it verified
-            result.append(cred)
+            result.append(credential)
 
         if result and result != list():
             # At least one credential verified ok and was added to the list
@@ -311,78 +492,166 @@ class CredentialVerifier(object):
 #            raise xmlrpclib.Fault(fault_code, fault_string)
             raise Exception(fault_string)
 
+class CredentialIssuer(object):
+    """Issue credentials signed by a single issuer key and certificate,
+    loaded once and reused for every credential.
+
+    Credentials are signed, and checked against the trusted roots,
+    in process (see xmldsig_util) rather than by calling out to xmlsec1
+    for each one. Use create_credentials to
+    issue many credentials in one call, optionally spread over a pool
+    of worker processes."""
+
+    def __init__(self, issuer_keyfile, issuer_certfile, trusted_roots):
+        if trusted_roots is None:
+            raise ValueError("Missing list of trusted roots")
+        if not os.path.isfile(issuer_keyfile):
+            raise ValueError("Cant read issuer key file %s" % issuer_keyfile)
+        if not os.path.isfile(issuer_certfile):
+            raise ValueError("Cant read issuer cert file %s" % issuer_certfile)
+        self.logger = logging.getLogger('cred-issuer')
+        self.issuer_keyfile = issuer_keyfile
+        self.issuer_certfile = issuer_certfile
+        self.trusted_roots = trusted_roots
+        self.signer = xmldsig_util.XMLSigner(issuer_keyfile, issuer_certfile)
+        self.issuer_gid = self.signer.get_gid()
+        # Loaded once, as Credential.verify loads them for each credential
+        self.trusted_root_gids = []
+        for root in trusted_roots:
+            try:
+                self.trusted_root_gids.append(gid.GID(filename=root))
+            except Exception, exc:
+                self.logger.error("Failed to load trusted cert from %s: %r", root, exc)
+
+    def create_credential(self, caller_gid, object_gid, expiration, typename, delegatable=False, verify=True):
+        '''Create and Return a Credential object issued by this issuer for the given caller
+        and object GID objects, given expiration, and given type.
+        Privileges are determined by type per sfa/trust/rights.py
+        Privileges are delegatable if requested.
+        If verify, confirm the new credential verifies against the trusted roots.'''
+        # FIXME: Validate args: my gids, type of cred one I can issue
+        if caller_gid is None:
+            raise ValueError("Missing Caller GID")
+        if object_gid is None:
+            raise ValueError("Missing Object GID")
+        if expiration is None:
+            raise ValueError("Missing expiration")
+        naive_expiration = naiveUTC(expiration)
+        duration = naive_expiration - datetime.datetime.utcnow()
+        life_secs = duration.seconds + duration.days * 24 * 3600
+        if life_secs < 1:
+            raise ValueError("Credential expiration is in the past")
+
+        if typename is None or typename.strip() == '':
+            raise ValueError("Missing credential type")
+        typename = typename.strip().lower()
+        if typename not in ("user", "sa", "ma", "authority", "slice", "component"):
+            raise ValueError("Unknown credential type %s" % typename)
+
+        issuer_gid = self.issuer_gid
+        if not (object_gid.get_urn() == issuer_gid.get_urn() or 
+            (issuer_gid.get_type().find('authority') == 0 and
+             hrn_authfor_hrn(issuer_gid.get_hrn(), object_gid.get_hrn()))):
+            raise ValueError("Issuer not authorized to issue credential: Issuer=%s  Target=%s" % (issuer_gid.get_urn(), object_gid.get_urn()))
+
+        ucred = cred.Credential()
+        # FIXME: Validate the caller_gid and object_gid
+        # are my user and slice
+        # Do get_issuer and compare to the issuer cert?
+        # Or do gid.is_signed_by_cert(issuer_certfile)?
+        ucred.set_gid_caller(caller_gid)
+        ucred.set_gid_object(object_gid)
+        ucred.set_expiration(expiration)
+        # Use sfa/trust/rights.py to figure out what privileges
+        # the credential should have.
+        # user means refresh, resolve, info
+        # per the privilege_table that lets users do
+        # remove, update, resolve, list, getcredential,
+        # listslices, listnodes, getpolicy
+        # Note that it does not allow manipulating slivers
+
+        # And every right is delegatable if any are delegatable (default False)
+        privileges = rights.determine_rights(typename, None)
+        privileges.delegate_all_privileges(delegatable)
+        ucred.set_privileges(privileges)
+        ucred.encode()
+        ucred.set_signer(self.signer)
+        ucred.sign()
+
+        if verify:
+            try:
+                self.verify_issued(ucred)
+            except Exception, exc:
+                raise Exception("Create Credential failed to verify new credential from trusted roots: %s" % exc)
+
+        return ucred
+
+    def verify_issued(self, ucred):
+        '''Check a credential this issuer just created against the
+        trusted roots, as Credential.verify does, but in process:
+        the caller and object certificates and the signer must chain to
+        the trusted roots, the signature must be by this issuer and
+        verify, and the issuer must have authority over the object.
+        Raises an exception if the credential does not verify.'''
+        ucred.get_gid_object().verify_chain(self.trusted_root_gids)
+        ucred.get_gid_caller().verify_chain(self.trusted_root_gids)
+        xmldsig_util.verify_signature(ucred.save_to_string(),
+                                      self.trusted_root_gids,
+                                      signer_gid=self.issuer_gid)
+        ucred.verify_issuer(self.trusted_root_gids)
+
+    def create_credentials(self, requests, processes=None, verify=True):
+        '''Issue a batch of credentials, returning a list of Credential
+        objects in the same order as the requests.
+        Each request is a tuple of arguments to create_credential:
+        (caller_gid, object_gid, expiration, typename[, delegatable]).
+        If processes is more than 1, sign in a pool of that many
+        worker processes, each loading the issuer key and cert once.
+        Raises an exception if any credential cannot be created.'''
+        if not processes or processes < 2 or len(requests) < 2:
+            return [self.create_credential(*request, verify=verify) \
+                        for request in requests]
+
+        # GID objects do not pickle, so send the workers strings
+        args = []
+        for request in requests:
+            request = list(request)
+            request[0] = request[0].save_to_string(save_parents=True)
+            request[1] = request[1].save_to_string(save_parents=True)
+            args.append(tuple(request) + (verify,))
+        pool = multiprocessing.Pool(processes, _init_issuer_worker,
+                                    (self.issuer_keyfile, self.issuer_certfile,
+                                     self.trusted_roots))
+        try:
+            cred_strings = pool.map(_issue_credential_worker, args)
+        finally:
+            pool.close()
+            pool.join()
+        self.logger.debug("Issued %d credentials using %d processes", len(cred_strings), processes)
+        return [cred.Credential(string=cred_string) for cred_string in cred_strings]
+
+# The CredentialIssuer of a create_credentials worker process
+_worker_issuer = None
+
+def _init_issuer_worker(issuer_keyfile, issuer_certfile, trusted_roots):
+    global _worker_issuer
+    _worker_issuer = CredentialIssuer(issuer_keyfile, issuer_certfile, trusted_roots)
+
+def _issue_credential_worker(args):
+    caller_gid_string, object_gid_string = args[:2]
+    rest = list(args[2:-1])
+    verify = args[-1]
+    ucred = _worker_issuer.create_credential(gid.GID(string=caller_gid_string),
+                                             gid.GID(string=object_gid_string),
+                                             *rest, verify=verify)
+    return ucred.save_to_string()
+
 def create_credential(caller_gid, object_gid, expiration, typename, issuer_keyfile, issuer_certfile, trusted_roots, delegatable=False):
     '''Create and Return a Credential object issued by given key/cert for the given caller
     and object GID objects, given life in seconds, and given type.
     Privileges are determined by type per sfa/trust/rights.py
-    Privileges are delegatable if requested.'''
-    # FIXME: Validate args: my gids, >0 life,
-    # type of cred one I can issue
-    # and readable key and cert files
-    if caller_gid is None:
-        raise ValueError("Missing Caller GID")
-    if object_gid is None:
-        raise ValueError("Missing Object GID")
-    if expiration is None:
-        raise ValueError("Missing expiration")
-    naive_expiration = naiveUTC(expiration)
-    duration = naive_expiration - datetime.datetime.utcnow()
-    life_secs = duration.seconds + duration.days * 24 * 3600
-    if life_secs < 1:
-        raise ValueError("Credential expiration is in the past")
-    if trusted_roots is None:
-        raise ValueError("Missing list of trusted roots")
-
-    if typename is None or typename.strip() == '':
-        raise ValueError("Missing credential type")
-    typename = typename.strip().lower()
-    if typename not in ("user", "sa", "ma", "authority", "slice", "component"):
-        raise ValueError("Unknown credential type %s" % typename)
-
-    if not os.path.isfile(issuer_keyfile):
-        raise ValueError("Cant read issuer key file %s" % issuer_keyfile)
-
-    if not os.path.isfile(issuer_certfile):
-        raise ValueError("Cant read issuer cert file %s" % issuer_certfile)
-
-    issuer_gid = gid.GID(filename=issuer_certfile)
-    
-    if not (object_gid.get_urn() == issuer_gid.get_urn() or 
-        (issuer_gid.get_type().find('authority') == 0 and
-         hrn_authfor_hrn(issuer_gid.get_hrn(), object_gid.get_hrn()))):
-        raise ValueError("Issuer not authorized to issue credential: Issuer=%s  Target=%s" % (issuer_gid.get_urn(), object_gid.get_urn()))
-    
-
-
-    ucred = cred.Credential()
-    # FIXME: Validate the caller_gid and object_gid
-    # are my user and slice
-    # Do get_issuer and compare to the issuer cert?
-    # Or do gid.is_signed_by_cert(issuer_certfile)?
-    ucred.set_gid_caller(caller_gid)
-    ucred.set_gid_object(object_gid)
-    ucred.set_expiration(expiration)
-    # Use sfa/trust/rights.py to figure out what privileges
-    # the credential should have.
-    # user means refresh, resolve, info
-    # per the privilege_table that lets users do
-    # remove, update, resolve, list, getcredential,
-    # listslices, listnodes, getpolicy
-    # Note that it does not allow manipulating slivers
-
-    # And every right is delegatable if any are delegatable (default False)
-    privileges = rights.determine_rights(typename, None)
-    privileges.delegate_all_privileges(delegatable)
-    ucred.set_privileges(privileges)
-    ucred.encode()
-    ucred.set_issuer_keys(issuer_keyfile, issuer_certfile)
-    ucred.sign()
-    
-    try:
-        ucred.verify(trusted_roots)
-    except Exception, exc:
-        raise Exception("Create Credential failed to verify new credential from trusted roots: %s" % exc)
-
-    return ucred
-
-
+    Privileges are delegatable if requested.
+    To issue many credentials from the same issuer, create a
+    CredentialIssuer once and use that instead.'''
+    issuer = CredentialIssuer(issuer_keyfile, issuer_certfile, trusted_roots)
+    return issuer.create_credential(caller_gid, object_gid, expiration, typename, delegatable)
@@ -30,7 +30,8 @@ import os
 import subprocess
 import sys
 import tempfile
-from xml.dom.minidom import *
+import threading
+from hashlib import sha1
 from StringIO import StringIO
 
 try:
@@ -39,12 +40,14 @@ try:
     from ...sfa.trust.credential import Credential, signature_template, HAVELXML
     from ...sfa.trust.credential_factory import CredentialFactory
     from ...sfa.trust.gid import GID
+    from .xmldsig_util import verify_signature, XMLSignatureError
 except:
     from gcf.sfa.trust.abac_credential import ABACCredential, ABACElement
     from gcf.sfa.trust.certificate import Certificate
     from gcf.sfa.trust.credential import Credential, signature_template, HAVELXML
     from gcf.sfa.trust.credential_factory import CredentialFactory
     from gcf.sfa.trust.gid import GID
+    from gcf.geni.util.xmldsig_util import verify_signature, XMLSignatureError
 
 # Routine to validate that a speaks-for credential 
 # says what it claims to say:
@@ -52,9 +55,12 @@ except:
 # ABAC statement:
 # S.speaks_for(S)<-T Or "S says that T speaks for S"
 
-# Requires that openssl be installed and in the path
+# Credential signatures are verified in process (see xmldsig_util)
 # create_speaks_for requires that xmlsec1 be on the path
 
+# Maximum number of entries in the key id and speaks-for caches
+CACHE_SIZE = 1000
+
 # Simple XML helper functions
 
 # Find the text associated with first child text node
@@ -91,19 +97,101 @@ def run_subprocess(cmd, stdout, stderr):
     except Exception as e:
         raise Exception("Failed call to subprocess '%s': %s" % (" ".join(cmd), e))
 
+def get_cert_fingerprint(cert):
+    """Return the SHA1 fingerprint of the given Certificate (or GID),
+    computing it only once per object."""
+    fingerprint = getattr(cert, '_sha1_fingerprint', None)
+    if fingerprint is None:
+        fingerprint = cert.cert.digest('sha1')
+        cert._sha1_fingerprint = fingerprint
+    return fingerprint
+
+# Certificate fingerprint -> subject key identifier
+_keyid_cache = {}
+
 def get_cert_keyid(gid):
     """Extract the subject key identifier from the given certificate.
     Return they key id as lowercase string with no colon separators
     between pairs. The key id as shown in the text output of a
     certificate are in uppercase with colon separators.
 
+    Key ids are remembered by certificate fingerprint, so a
+    certificate seen before is not re-read.
     """
-    raw_key_id = gid.get_extension('subjectKeyIdentifier')
-    # Raw has colons separating pairs, and all characters are upper case.
-    # Remove the colons and convert to lower case.
-    keyid = raw_key_id.replace(':', '').lower()
+    fingerprint = get_cert_fingerprint(gid)
+    keyid = _keyid_cache.get(fingerprint)
+    if keyid is None:
+        raw_key_id = gid.get_extension('subjectKeyIdentifier')
+        # Raw has colons separating pairs, and all characters are upper case.
+        # Remove the colons and convert to lower case.
+        keyid = raw_key_id.replace(':', '').lower()
+        if len(_keyid_cache) >= CACHE_SIZE:
+            _keyid_cache.clear()
+        _keyid_cache[fingerprint] = keyid
     return keyid
 
+def _cert_expiration(cert):
+    """Return the expiration (naive UTC datetime) of the given certificate."""
+    return datetime.datetime.strptime(cert.cert.get_notAfter(), '%Y%m%d%H%M%SZ')
+
+class SpeaksForCache(object):
+    """Remember successful speaks-for verifications, so that a tool
+    presenting the same speaks-for credential on every call does not
+    have the credential parsed and its signature and certificate
+    chains verified each time.
+
+    Entries are keyed by the digest of the credential XML, the
+    fingerprint of the tool certificate, the speaking-for URN,
+    the trusted roots and the schema. An entry is used only until the
+    earliest of the credential, user certificate and tool certificate
+    expirations.
+    Failed verifications are not remembered."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self._size = size
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def make_key(self, cred_xml, tool_gid, speaking_for_urn, \
+                     trusted_roots, schema=None):
+        roots = None
+        if trusted_roots is not None:
+            roots = tuple(sorted([get_cert_fingerprint(root) for root in trusted_roots]))
+        return (sha1(cred_xml).hexdigest(), get_cert_fingerprint(tool_gid),
+                speaking_for_urn, roots, schema)
+
+    def lookup(self, key):
+        """Return the user GID for the given key, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        valid_until, user_gid = entry
+        if valid_until < datetime.datetime.utcnow():
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        return user_gid
+
+    def store(self, key, cred, tool_gid, user_gid):
+        valid_until = min(_cert_expiration(user_gid), _cert_expiration(tool_gid))
+        if cred.expiration:
+            valid_until = min(valid_until, cred.expiration.replace(tzinfo=None))
+        with self._lock:
+            if len(self._entries) >= self._size:
+                now = datetime.datetime.utcnow()
+                for k, (until, _) in self._entries.items():
+                    if until < now:
+                        del self._entries[k]
+                if len(self._entries) >= self._size:
+                    self._entries.clear()
+            self._entries[key] = (valid_until, user_gid)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+speaks_for_cache = SpeaksForCache()
+
 # Pull the cert out of a list of certs in a PEM formatted cert string
 def grab_toplevel_cert(cert):
     start_label = '-----BEGIN CERTIFICATE-----'
@@ -126,7 +214,7 @@ def grab_toplevel_cert(cert):
 #      is not expired 
 #      is an ABAC credential
 #      was signed by the user associated with the speaking_for_urn
-#      is verified by xmlsec1
+#      has a valid signature
 #      asserts U.speaks_for(U)<-T ("user says that T may speak for user")
 #      If schema provided, validate against schema
 #      is trusted by given set of trusted roots (both user cert and tool cert)
@@ -167,29 +255,15 @@ def verify_speaks_for(cred, tool_gid, speaking_for_urn, \
     principal_keyid = head.get_principal_keyid()
     role = head.get_role()
 
-    # Credential must pass xmlsec1 verify
-    cred_file = write_to_tempfile(cred.save_to_string())
-    cert_args = []
-    if trusted_roots:
-        for x in trusted_roots:
-            cert_args += ['--trusted-pem', x.filename]
-    # FIXME: Why do we not need to specify the --node-id option as credential.py does?
-    xmlsec1_args = [cred.xmlsec_path, '--verify'] + cert_args + [ cred_file]
-    output = run_subprocess(xmlsec1_args, stdout=None, stderr=subprocess.PIPE)
-    os.unlink(cred_file)
-    if output != 0:
-        # FIXME
-        # xmlsec errors have a msg= which is the interesting bit.
-        # But does this go to stderr or stdout? Do we have it here?
-        mstart = verified.find("msg=")
-        msg = ""
-        if mstart > -1 and len(verified) > 4:
-            mstart = mstart + 4
-            mend = verified.find('\\', mstart)
-            msg = verified[mstart:mend]
-        if msg == "":
-            msg = output
-        return False, None, "ABAC credential failed to xmlsec1 verify: %s" % msg
+    # Credential signature must verify, as with xmlsec1 --verify
+    # --trusted-pem, and be the signature of the user certificate we trust
+    try:
+        verify_signature(cred.save_to_string(), trusted_roots or None,
+                         signer_gid=user_gid)
+    except XMLSignatureError, e:
+        return False, None, "ABAC credential failed to verify: %s" % e
+    except Exception, e:
+        return False, None, "ABAC credential failed to verify: %s: %s" % (e.__class__.__name__, e)
 
     # Must say U.speaks_for(U)<-T
     if user_keyid != principal_keyid or \
@@ -238,6 +312,7 @@ def verify_speaks_for(cred, tool_gid, speaking_for_urn, \
 # trusted_roots is a list of Certificate objects from the system
 #   trusted_root directory
 # Optionally, provide an XML schema against which to validate the credential
+# Successful verifications are remembered in speaks_for_cache
 def determine_speaks_for(logger, credentials, caller_gid, options, \
                              trusted_roots, schema=None):
     if options and 'geni_speaking_for' in options:
@@ -256,6 +331,17 @@ def determine_speaks_for(logger, credentials, caller_gid, options, \
                 if CredentialFactory.getType(cred) != ABACCredential.ABAC_CREDENTIAL_TYPE: continue
                 cred_value = cred
 
+            if isinstance(cred_value, Credential):
+                cred_xml = cred_value.save_to_string()
+            else:
+                cred_xml = cred_value
+            cache_key = speaks_for_cache.make_key(cred_xml, caller_gid,
+                                                  speaking_for_urn,
+                                                  trusted_roots, schema)
+            user_gid = speaks_for_cache.lookup(cache_key)
+            if user_gid is not None:
+                return user_gid # speaks-for, verified before
+
             # If the cred_value is xml, create the object
             if not isinstance(cred_value, ABACCredential):
                 cred = CredentialFactory.createCred(cred_value)
@@ -271,6 +357,7 @@ def determine_speaks_for(logger, credentials, caller_gid, options, \
                                       trusted_roots, schema, logger)
 
             if is_valid_speaks_for:
+                speaks_for_cache.store(cache_key, cred, caller_gid, user_gid)
                 return user_gid # speaks-for
             else:
                 if logger:
@@ -0,0 +1,459 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''
+In-process XML digital signature support for GENI credentials.
+
+Credentials are signed with enveloped XML signatures (see the
+signature_template in sfa/trust/credential.py), traditionally by
+writing the credential and the signer key and certificates to temp
+files and calling out to the xmlsec1 binary. The XMLSigner here
+produces the same signature from within Python, with the signer key
+and certificate chain loaded once. verify_signature similarly checks
+a signature in process, as xmlsec1 --verify does.
+
+Canonicalization is Canonical XML 1.0 (inclusive, without comments)
+as implemented by libxml2 and so xmlsec1, over a minidom document.
+'''
+
+from __future__ import absolute_import
+
+import base64
+import hashlib
+from xml.dom import Node
+from xml.dom.minidom import parseString
+
+from OpenSSL import crypto
+
+from ...sfa.trust.certificate import Keypair
+from ...sfa.trust.gid import GID
+
+DSIG_NS = 'http://www.w3.org/2000/09/xmldsig#'
+XML_NS = 'http://www.w3.org/XML/1998/namespace'
+XMLNS_NS = 'http://www.w3.org/2000/xmlns/'
+
+C14N = 'http://www.w3.org/TR/2001/REC-xml-c14n-20010315'
+ENVELOPED_SIGNATURE = 'http://www.w3.org/2000/09/xmldsig#enveloped-signature'
+
+DIGEST_METHODS = {
+    'http://www.w3.org/2000/09/xmldsig#sha1' : hashlib.sha1,
+    'http://www.w3.org/2001/04/xmlenc#sha256' : hashlib.sha256,
+    }
+
+# Signature method URI -> OpenSSL digest name
+SIGNATURE_METHODS = {
+    'http://www.w3.org/2000/09/xmldsig#rsa-sha1' : 'sha1',
+    'http://www.w3.org/2001/04/xmldsig-more#rsa-sha256' : 'sha256',
+    }
+
+class XMLSignatureError(Exception):
+    '''Raised when a signature cannot be created or processed.'''
+    pass
+
+# Canonical XML 1.0
+
+def _escape_text(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('\r', '&#xD;')
+
+def _escape_attr(value):
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('\t', '&#x9;').replace('\n', '&#xA;').replace('\r', '&#xD;')
+
+def _namespaces_in_scope(element):
+    '''Return dict of prefix (None for the default) -> URI of the
+    namespace declarations in scope at the given element.'''
+    chain = []
+    node = element
+    while node is not None and node.nodeType == Node.ELEMENT_NODE:
+        chain.append(node)
+        node = node.parentNode
+    namespaces = {}
+    for node in reversed(chain):
+        _add_declarations(node, namespaces)
+    return namespaces
+
+def _add_declarations(element, namespaces):
+    for i in range(element.attributes.length):
+        attr = element.attributes.item(i)
+        # minidom gives None for the value of an xmlns="" undeclaration
+        if attr.name == 'xmlns':
+            namespaces[None] = attr.value or ''
+        elif attr.name.startswith('xmlns:'):
+            namespaces[attr.name[6:]] = attr.value or ''
+
+def _inherited_xml_attributes(element):
+    '''Return the nearest xml:* attributes of the ancestors of the given
+    element that it does not itself have, as (name, value) pairs.'''
+    found = {}
+    node = element.parentNode
+    while node is not None and node.nodeType == Node.ELEMENT_NODE:
+        for i in range(node.attributes.length):
+            attr = node.attributes.item(i)
+            if attr.name.startswith('xml:') and attr.name not in found \
+                    and not element.hasAttribute(attr.name):
+                found[attr.name] = attr.value
+        node = node.parentNode
+    return found.items()
+
+def _c14n_element(element, rendered, namespaces, out, exclude, apex):
+    namespaces = dict(namespaces)
+    _add_declarations(element, namespaces)
+
+    # Namespace declarations not already rendered by an output ancestor
+    ns_out = []
+    for prefix, uri in namespaces.items():
+        if prefix is None and uri == '':
+            # xmlns="" only to undo a rendered default namespace
+            if rendered.get(None, '') != '':
+                ns_out.append(('', ' xmlns=""'))
+        elif rendered.get(prefix) != uri:
+            if prefix is None:
+                ns_out.append(('', ' xmlns="%s"' % _escape_attr(uri)))
+            else:
+                ns_out.append((prefix, ' xmlns:%s="%s"' % (prefix, _escape_attr(uri))))
+    ns_out.sort()
+
+    attrs = []
+    for i in range(element.attributes.length):
+        attr = element.attributes.item(i)
+        if attr.name == 'xmlns' or attr.name.startswith('xmlns:'):
+            continue
+        if attr.name.startswith('xml:'):
+            uri = XML_NS
+        else:
+            uri = attr.namespaceURI or ''
+        attrs.append(((uri, attr.localName or attr.name), attr.name, attr.value))
+    if apex:
+        for name, value in _inherited_xml_attributes(element):
+            attrs.append(((XML_NS, name[4:]), name, value))
+    attrs.sort()
+
+    out.append('<' + element.tagName)
+    out.extend([decl for (_, decl) in ns_out])
+    out.extend([' %s="%s"' % (name, _escape_attr(value)) for (_, name, value) in attrs])
+    out.append('>')
+    for child in element.childNodes:
+        if child.nodeType == Node.ELEMENT_NODE:
+            if child is exclude:
+                continue
+            _c14n_element(child, namespaces, namespaces, out, exclude, False)
+        elif child.nodeType in (Node.TEXT_NODE, Node.CDATA_SECTION_NODE):
+            out.append(_escape_text(child.data))
+        elif child.nodeType == Node.PROCESSING_INSTRUCTION_NODE:
+            if child.data:
+                out.append('<?%s %s?>' % (child.target, child.data))
+            else:
+                out.append('<?%s?>' % child.target)
+    out.append('</%s>' % element.tagName)
+
+def canonicalize(element, exclude=None):
+    '''Return the Canonical XML 1.0 (without comments) form of the
+    subtree rooted at the given minidom element, as UTF-8.
+    If exclude is given, that descendant element is left out
+    (the enveloped signature transform).'''
+    out = []
+    parent = element.parentNode
+    inherited = {}
+    if parent is not None and parent.nodeType == Node.ELEMENT_NODE:
+        inherited = _namespaces_in_scope(parent)
+    try:
+        _c14n_element(element, {}, inherited, out, exclude, True)
+    except Exception, e:
+        raise XMLSignatureError("Cannot canonicalize element %s: %s" % (element.tagName, e))
+    return u''.join(out).encode('utf-8')
+
+# Signatures
+
+def _child(element, localname):
+    for child in element.childNodes:
+        if child.nodeType == Node.ELEMENT_NODE and child.localName == localname:
+            return child
+    return None
+
+def _children(element, localname):
+    return [child for child in element.childNodes \
+                if child.nodeType == Node.ELEMENT_NODE and child.localName == localname]
+
+def _text(element):
+    if element is None:
+        return ''
+    return ''.join([c.data for c in element.childNodes \
+                        if c.nodeType in (Node.TEXT_NODE, Node.CDATA_SECTION_NODE)])
+
+def _set_text(doc, element, text):
+    for child in list(element.childNodes):
+        element.removeChild(child)
+    element.appendChild(doc.createTextNode(text))
+
+def find_by_id(doc, refid):
+    '''Find the element with the given xml:id, as xmlsec1 does.'''
+    found = [e for e in doc.getElementsByTagName('*') if e.getAttribute('xml:id') == refid]
+    if len(found) != 1:
+        raise XMLSignatureError("Expected 1 element with xml:id '%s', found %d" % (refid, len(found)))
+    return found[0]
+
+def b64encode_lines(data):
+    '''Base64 encode data the way xmlsec1 writes it into a signature:
+    64 character lines, starting and ending on a new line.'''
+    encoded = base64.b64encode(data)
+    lines = [encoded[i:i+64] for i in range(0, len(encoded), 64)]
+    return '\n' + '\n'.join(lines) + '\n'
+
+def b64decode_text(text):
+    return base64.b64decode(''.join(text.split()))
+
+def reference_digest(doc, signature, reference):
+    '''Compute the digest of the data referenced by the given
+    Reference element of the given Signature element.'''
+    uri = reference.getAttribute('URI')
+    if not uri.startswith('#'):
+        raise XMLSignatureError("Unsupported Reference URI '%s'" % uri)
+    target = find_by_id(doc, uri[1:])
+
+    exclude = None
+    transforms = _child(reference, 'Transforms')
+    if transforms is not None:
+        for transform in _children(transforms, 'Transform'):
+            algorithm = transform.getAttribute('Algorithm')
+            if algorithm == ENVELOPED_SIGNATURE:
+                exclude = signature
+            elif algorithm != C14N:
+                raise XMLSignatureError("Unsupported transform %s" % algorithm)
+
+    digest_method = _child(reference, 'DigestMethod')
+    if digest_method is None or digest_method.getAttribute('Algorithm') not in DIGEST_METHODS:
+        raise XMLSignatureError("Unsupported or missing DigestMethod in Reference %s" % uri)
+    digester = DIGEST_METHODS[digest_method.getAttribute('Algorithm')]
+    return digester(canonicalize(target, exclude)).digest()
+
+def signed_info_data(signature):
+    '''Return the canonical SignedInfo of the given Signature element
+    and the OpenSSL name of the digest it is signed with.'''
+    signed_info = _child(signature, 'SignedInfo')
+    if signed_info is None:
+        raise XMLSignatureError("Signature has no SignedInfo")
+    c14n = _child(signed_info, 'CanonicalizationMethod')
+    method = _child(signed_info, 'SignatureMethod')
+    if c14n is None or c14n.getAttribute('Algorithm') != C14N:
+        raise XMLSignatureError("Unsupported or missing CanonicalizationMethod")
+    if method is None or method.getAttribute('Algorithm') not in SIGNATURE_METHODS:
+        raise XMLSignatureError("Unsupported or missing SignatureMethod")
+    return canonicalize(signed_info), SIGNATURE_METHODS[method.getAttribute('Algorithm')]
+
+def _x509_name(name):
+    '''Format an X509 name as RFC 2253 (most specific component first).'''
+    parts = []
+    for key, value in reversed(name.get_components()):
+        for c in '\\,+"<>;':
+            value = value.replace(c, '\\' + c)
+        parts.append('%s=%s' % (key, value))
+    return ','.join(parts)
+
+def _mpint_to_bytes(mpint):
+    '''Convert an M2Crypto MPINT (4 byte length, then big endian
+    value) to the big endian value with no leading zeros.'''
+    return mpint[4:].lstrip('\x00')
+
+class XMLSigner(object):
+    '''Sign XML documents with enveloped signatures using a private key
+    and certificate (chain) loaded once.
+
+    sign_xml fills in a Signature template already in the document
+    (DigestValue, SignatureValue and KeyInfo) as
+    xmlsec1 --sign --node-id <id> --privkey-pem key,cert1,cert2... does.'''
+
+    def __init__(self, keyfile, certfile):
+        keypair = Keypair(filename=keyfile)
+        self.pkey = keypair.get_openssl_pkey()
+        self.gid = GID(filename=certfile)
+        self.certs = []
+        chain = self.gid
+        while chain:
+            self.certs.append(chain.cert)
+            chain = chain.get_parent()
+
+        # KeyInfo contents are the same for every signature
+        self.cert_values = [b64encode_lines(crypto.dump_certificate(crypto.FILETYPE_ASN1, c)) \
+                                for c in self.certs]
+        (exponent, modulus) = keypair.get_m2_pkey().get_rsa().pub()
+        self.modulus = b64encode_lines(_mpint_to_bytes(modulus))
+        self.exponent = base64.b64encode(_mpint_to_bytes(exponent))
+
+    def get_gid(self):
+        '''Return the GID (with any parents) of the signer.'''
+        return self.gid
+
+    def _add(self, doc, parent, name, text=None):
+        element = doc.createElementNS(DSIG_NS, name)
+        if text is not None:
+            element.appendChild(doc.createTextNode(text))
+        parent.appendChild(element)
+        parent.appendChild(doc.createTextNode('\n'))
+        return element
+
+    def _fill_key_info(self, doc, signature):
+        key_info = _child(signature, 'KeyInfo')
+        if key_info is None:
+            return
+        x509_data = _child(key_info, 'X509Data')
+        if x509_data is not None:
+            # As xmlsec1 does, write the kinds of X509 nodes present in
+            # the template for each certificate in the chain
+            kinds = set([c.localName for c in x509_data.childNodes if c.nodeType == Node.ELEMENT_NODE])
+            _set_text(doc, x509_data, '\n')
+            for (cert, value) in zip(self.certs, self.cert_values):
+                if not kinds or 'X509Certificate' in kinds:
+                    self._add(doc, x509_data, 'X509Certificate', value)
+                if 'X509SubjectName' in kinds:
+                    self._add(doc, x509_data, 'X509SubjectName', _x509_name(cert.get_subject()))
+                if 'X509IssuerSerial' in kinds:
+                    issuer_serial = self._add(doc, x509_data, 'X509IssuerSerial', '\n')
+                    self._add(doc, issuer_serial, 'X509IssuerName', _x509_name(cert.get_issuer()))
+                    self._add(doc, issuer_serial, 'X509SerialNumber', str(cert.get_serial_number()))
+        key_value = _child(key_info, 'KeyValue')
+        if key_value is not None:
+            _set_text(doc, key_value, '\n')
+            rsa = self._add(doc, key_value, 'RSAKeyValue', '\n')
+            self._add(doc, rsa, 'Modulus', self.modulus)
+            self._add(doc, rsa, 'Exponent', self.exponent)
+
+    def sign_xml(self, xml, node_id):
+        '''Sign the given XML document string, filling in the Signature
+        template with the given xml:id. Return the signed document.'''
+        doc = parseString(xml)
+        signature = find_by_id(doc, node_id)
+        if signature.localName != 'Signature' or signature.namespaceURI != DSIG_NS:
+            raise XMLSignatureError("Element %s is not a Signature but %s" % (node_id, signature.tagName))
+        signed_info = _child(signature, 'SignedInfo')
+        if signed_info is None:
+            raise XMLSignatureError("Signature %s has no SignedInfo" % node_id)
+        for reference in _children(signed_info, 'Reference'):
+            digest_value = _child(reference, 'DigestValue')
+            if digest_value is None:
+                raise XMLSignatureError("Signature %s Reference has no DigestValue" % node_id)
+            _set_text(doc, digest_value, base64.b64encode(reference_digest(doc, signature, reference)))
+
+        self._fill_key_info(doc, signature)
+
+        data, digest = signed_info_data(signature)
+        signature_value = _child(signature, 'SignatureValue')
+        if signature_value is None:
+            raise XMLSignatureError("Signature %s has no SignatureValue" % node_id)
+        _set_text(doc, signature_value, b64encode_lines(crypto.sign(self.pkey, data, digest)))
+        return doc.toxml('utf-8')
+
+def _signature_refid(signature):
+    '''The xml:id of the credential a Signature element is for,
+    worked out as Signature.decode (sfa/trust/credential.py) does.'''
+    refid = signature.getAttribute('xml:id').strip().strip('Sig_')
+    if not refid:
+        references = signature.getElementsByTagNameNS(DSIG_NS, 'Reference')
+        if len(references) > 0:
+            refid = references[0].getAttribute('xml:id').strip().strip('Sig_')
+            if not refid:
+                refid = references[0].getAttribute('URI').strip().strip('#')
+    return refid
+
+def credential_signature(doc):
+    '''Return the Signature element of a credential document that
+    Credential.decode takes the signer from, and the credential element
+    it must sign (None if the document is not a signed-credential).
+    For a signed-credential that is the last Signature in its
+    <signatures> for the xml:id of its (first) credential.'''
+    signed_creds = doc.getElementsByTagName('signed-credential')
+    if len(signed_creds) > 0:
+        creds = signed_creds[0].getElementsByTagName('credential')
+        signatures = signed_creds[0].getElementsByTagName('signatures')
+        if len(creds) == 0 or len(signatures) == 0:
+            raise XMLSignatureError("No credential or signatures found")
+        credential = creds[0]
+        found = None
+        for signature in signatures[0].getElementsByTagNameNS(DSIG_NS, 'Signature'):
+            if _signature_refid(signature) == credential.getAttribute('xml:id'):
+                found = signature
+        if found is None:
+            raise XMLSignatureError("No Signature found for credential %s" % credential.getAttribute('xml:id'))
+        return found, credential
+    found = doc.getElementsByTagNameNS(DSIG_NS, 'Signature')
+    if len(found) == 0:
+        raise XMLSignatureError("No Signature found")
+    return found[0], None
+
+def verify_signature(xml, trusted_certs=None, signer_gid=None):
+    '''Verify the signature of the given credential XML document string,
+    as xmlsec1 --verify does: the referenced data must match its digest,
+    and the SignatureValue must verify with the key of the first
+    certificate in the KeyInfo. The signature checked is the one
+    Credential.decode reads the signer from, and it must sign the
+    credential element that decode reads. If trusted_certs (a list of
+    Certificate objects) is given, the signer certificate (chain) must
+    also verify against them. If signer_gid is given, the signer
+    certificate must be that certificate.
+    Return the GID (with any parents) of the signer.
+    Raise XMLSignatureError if the signature is not valid.'''
+    doc = parseString(xml)
+    signature, credential = credential_signature(doc)
+    signed_info = _child(signature, 'SignedInfo')
+    if signed_info is None:
+        raise XMLSignatureError("Signature has no SignedInfo")
+    references = _children(signed_info, 'Reference')
+    if len(references) == 0:
+        raise XMLSignatureError("Signature has no Reference")
+    signed_credential = False
+    for reference in references:
+        expected = b64decode_text(_text(_child(reference, 'DigestValue')))
+        if reference_digest(doc, signature, reference) != expected:
+            raise XMLSignatureError("Digest of Reference %s does not match" % reference.getAttribute('URI'))
+        if credential is not None and \
+                find_by_id(doc, reference.getAttribute('URI')[1:]) is credential:
+            signed_credential = True
+    if credential is not None and not signed_credential:
+        raise XMLSignatureError("Signature does not sign the credential")
+
+    pems = []
+    key_info = _child(signature, 'KeyInfo')
+    if key_info is not None:
+        for x509_data in _children(key_info, 'X509Data'):
+            for cert in _children(x509_data, 'X509Certificate'):
+                pems.append("-----BEGIN CERTIFICATE-----\n%s\n-----END CERTIFICATE-----" % _text(cert).strip())
+    if len(pems) == 0:
+        raise XMLSignatureError("No certificate found in signature")
+    signer = GID(string="\n".join(pems))
+
+    if signer_gid is not None and \
+            signer.cert.digest('sha1') != signer_gid.cert.digest('sha1'):
+        raise XMLSignatureError("Signature is by %s, not %s" % \
+                                    (signer.get_printable_subject(),
+                                     signer_gid.get_printable_subject()))
+
+    data, digest = signed_info_data(signature)
+    value = b64decode_text(_text(_child(signature, 'SignatureValue')))
+    try:
+        crypto.verify(signer.cert, value, data, digest)
+    except crypto.Error, e:
+        raise XMLSignatureError("SignatureValue does not verify with signer %s: %s" % (signer.get_printable_subject(), e))
+
+    if trusted_certs is not None:
+        try:
+            signer.verify_chain(trusted_certs)
+        except Exception, e:
+            raise XMLSignatureError("Signer certificate not trusted: %s" % e)
+    return signer
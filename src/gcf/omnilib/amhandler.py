@@ -501,6 +501,13 @@ class AMCallHandler(object):
         #      urn
         #      url
         #      lasterror
+        # An Omni session shares the cache between calls (see oscript.OmniSession)
+        shared = self.config.get('sharedGetVersionCache')
+        if shared is not None and shared.has_key(self.opts.getversionCacheName):
+            self.GetVersionCache = shared[self.opts.getversionCacheName]
+            return
+        if shared is not None:
+            shared[self.opts.getversionCacheName] = self.GetVersionCache
         if not os.path.exists(self.opts.getversionCacheName) or os.path.getsize(self.opts.getversionCacheName) < 1:
             return
         try:
@@ -509,6 +516,8 @@ class AMCallHandler(object):
             self.logger.debug("Read GetVersionCache from %s", self.opts.getversionCacheName)
         except Exception, e:
             self.logger.error("Failed to read GetVersion cache: %s", e)
+        if shared is not None:
+            shared[self.opts.getversionCacheName] = self.GetVersionCache
 
     # FIXME: This saves every time we add to the cache. Is that right?
     def _cache_getversion(self, client, thisVersion, error=None):
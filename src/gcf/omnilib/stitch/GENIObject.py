@@ -28,17 +28,32 @@ from __future__ import absolute_import
 from .gmoc import GMOCObject, validateText
 
 class GENIObject(GMOCObject):
+    # Subclasses with many instances list their attributes in __slots__
+    __slots__ = ()
+
     def __init__(self):
         pass
         # Could do this but really don't want anything but id
         # return super(GENIObject, self).__init__(id)
 #        self.id = id
 
+    def _attributes(self):
+        '''Dictionary of the attributes of this object, whether in __slots__ or __dict__'''
+        attrs = dict()
+        for cls in type(self).__mro__:
+            for key in cls.__dict__.get('__slots__', ()):
+                if hasattr(self, key):
+                    attrs[key] = getattr(self, key)
+        if hasattr(self, '__dict__'):
+            attrs.update(self.__dict__)
+        return attrs
+
     def __str__(self):
         retVal = ""+str(self.__class__.__name__)
-        if self.__dict__.has_key('__id'):
-            retVal +="( "+str(self.__dict__['__id'])+" )"
-        for key, value in self.__dict__.items():
+        attrs = self._attributes()
+        if attrs.has_key('__id'):
+            retVal +="( "+str(attrs['__id'])+" )"
+        for key, value in attrs.items():
             if key == "__id":
                 continue
             retVal += "\n  "+str(key)+" : "+str(value)+""
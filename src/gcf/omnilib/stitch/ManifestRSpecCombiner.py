@@ -54,12 +54,76 @@ PATH_ID = 'id'
 
 # FIXME: As in RSpecParser, check use of getAttribute vs getAttributeNS and localName vs nodeName
 
+class ManifestIndex(object):
+    '''Lookup tables over the top level nodes and links and the stitching
+    paths and hops of one AM's manifest (or request) DOM. The combiner
+    does not edit the AM DOMs, so an index stays valid for the whole combine.'''
+
+    def __init__(self, dom):
+        self.nodesByCid = {} # node client_id -> node elements, in document order
+        self.linksByCid = {} # link client_id -> link elements, in document order
+        self.pathsById = {} # path id -> first path element with that id
+        self.hopsById = {} # (path id, hop id) -> first hop element on that path
+        self.hopLinksById = {} # (path id, hop link id) -> last hop link element on that path
+        self.stitching = None
+
+        doc_root = dom.documentElement
+        for child in doc_root.childNodes:
+            if child.nodeType != Node.ELEMENT_NODE:
+                continue
+            if child.localName == defs.NODE_TAG:
+                self.nodesByCid.setdefault(child.getAttribute(CLIENT_ID), []).append(child)
+            elif child.localName == defs.LINK_TAG:
+                self.linksByCid.setdefault(child.getAttribute(CLIENT_ID), []).append(child)
+
+        # Same search as getStitchingElement
+        for child in dom.childNodes:
+            if child.nodeType == Node.ELEMENT_NODE and \
+                    child.localName == defs.RSPEC_TAG:
+                for child2 in child.childNodes:
+                    if child2.nodeType == Node.ELEMENT_NODE and \
+                            child2.localName == defs.STITCHING_TAG:
+                        self.stitching = child2
+                        break
+                break
+        if self.stitching is None:
+            return
+        for path in self.stitching.childNodes:
+            if path.nodeType != Node.ELEMENT_NODE or \
+                    path.localName != defs.PATH_TAG:
+                continue
+            path_id = path.getAttribute(PATH_ID)
+            if self.pathsById.has_key(path_id):
+                continue
+            self.pathsById[path_id] = path
+            for hop in path.childNodes:
+                if hop.nodeType != Node.ELEMENT_NODE or hop.localName != HOP:
+                    continue
+                key = (path_id, hop.getAttribute(HOP_ID))
+                if not self.hopsById.has_key(key):
+                    self.hopsById[key] = hop
+                # First matching link on a hop, but later hops win (as replaceHopLinkElement used to search)
+                hopLinks = {}
+                for link in hop.childNodes:
+                    if link.nodeType == Node.ELEMENT_NODE and \
+                            link.localName == LINK:
+                        hopLinks.setdefault(link.getAttribute(LINK_ID), link)
+                for link_id, link in hopLinks.items():
+                    self.hopLinksById[(path_id, link_id)] = link
+
 class ManifestRSpecCombiner:
 
     # Constructor
     def __init__(self, useReqs=False):
         self.logger = logging.getLogger('stitch.ManifestRSpecCombiner')
         self.useReqs = useReqs
+        self._indexes = {} # ManifestIndex by AM DOM
+
+    def getIndex(self, am_dom):
+        '''Get the (cached) ManifestIndex for this AM manifest or request DOM'''
+        if not self._indexes.has_key(am_dom):
+            self._indexes[am_dom] = ManifestIndex(am_dom)
+        return self._indexes[am_dom]
 
     # Combine the manifest, replacing elements in the dom_template
     # with the appropriate pieces from the manifests
@@ -68,6 +132,7 @@ class ManifestRSpecCombiner:
     #    dom_template is a dom object into which to replace selected
     #      components from the aggregate doms
     def combine(self, ams_list, dom_template):
+        self._indexes = {}
         self.combineNodes(ams_list, dom_template)
         self.combineLinks(ams_list, dom_template)
         self.combineHops(ams_list, dom_template)
@@ -275,7 +340,7 @@ class ManifestRSpecCombiner:
 
         # Set up a dictionary mapping node by component_manager_id
         template_nodes_by_cmid={}
-        template_node_cids=[]
+        template_node_cids=set()
         doc_root = dom_template.documentElement
         children = doc_root.childNodes
         # Find all the client_ids for nodes in the template too
@@ -288,8 +353,7 @@ class ManifestRSpecCombiner:
                 template_nodes_by_cmid[cmid].append(child)
                 cid = child.getAttribute(CLIENT_ID)
                 key = cid + cmid
-                if not key in template_node_cids:
-                    template_node_cids.append(key)
+                template_node_cids.add(key)
 
 #        print "DICT = " + str(template_nodes_by_cmid)
         
@@ -324,7 +388,7 @@ class ManifestRSpecCombiner:
                     key = cid + cmid
                     # self.logger.debug("Found possible node to add. client_id: %s; comp_mgr: %s; from AM: %s", cid, cmid, am)
                     if key not in template_node_cids:
-                        if cmid in am.urn_syns:
+                        if am.hasURNSynonym(cmid):
                             # self.logger.debug(".... adding it")
                             self.logger.debug("Adding missing node client_id: %s; comp_mgr: %s; from AM: %s", cid, cmid, am)
                             doc_root.appendChild(child.cloneNode(True))
@@ -347,41 +411,41 @@ class ManifestRSpecCombiner:
                             cmidTrim += cmid[cmid.find('+authority'):]
 
                             key2 = cid + cmidTrim
-                            if key2 not in template_node_cids and (cmid in am.urn_syns or cmidTrim in am.urn_syns):
+                            if key2 not in template_node_cids and (am.hasURNSynonym(cmid) or am.hasURNSynonym(cmidTrim)):
                                 self.logger.debug("Adding missing node from a sub-AM client_id: %s; comp_mgr: %s; from AM: %s", cid, cmid, am)
                                 doc_root.appendChild(child.cloneNode(True))
             # Now do the node replacing as necessary
+            # Only nodes in this AM's manifest with the same client_id can match
+            am_nodes_by_cid = self.getIndex(am_manifest_dom).nodesByCid
             for urn in am.urn_syns:
                 if template_nodes_by_cmid.has_key(urn):
                     for template_node in template_nodes_by_cmid[urn]:
                         template_client_id = template_node.getAttribute(CLIENT_ID)
-                        for child in am_doc_root.childNodes:
-                            if child.nodeType == Node.ELEMENT_NODE and \
-                                    child.localName == defs.NODE_TAG:
-                                child_cmid = child.getAttribute(COMPONENT_MGR_ID)
-                                child_client_id = child.getAttribute(CLIENT_ID)
-                                if child_client_id == template_client_id:
-                                    if child_cmid == urn:
-                                        self.logger.debug(("Replacing template for node %s (" % template_client_id) + str(template_node) + (") with that from %s" % am) + " (" + str(child) + "). Node comp_mgr ID: " + child_cmid)
-                                        doc_root.replaceChild(child.cloneNode(True), template_node)
-                                    elif ':' in child_cmid[len('urn:publicid:IDN+'):child_cmid.find('+authority')] and child_cmid not in am.urn_syns:
-                                        self.logger.debug("Node %s cmid %s shows it is from a sub-AM. See if the parent would be a match (so must replace the node) at %s", child_client_id, child_cmid, am)
-                                        # If the CM on this node had a sub-site, then try comparing the non-root cmid with that in the template.
-                                        # if no other AM claims that CM and there is no node with the trimmed (less specific) cmid in the template
-
-                                        # if there is an am with cmid as a urn_syn but not this am: continue
-                                        thatAM = objects.Aggregate.findDontMake(child_cmid)
-                                        if thatAM is not None and thatAM != am:
-                                            self.logger.debug("Node cmid belongs to someone else: %s, %s", child_cmid, thatAM)
-                                            continue
+                        for child in am_nodes_by_cid.get(template_client_id, []):
+                            child_cmid = child.getAttribute(COMPONENT_MGR_ID)
+                            child_client_id = child.getAttribute(CLIENT_ID)
+                            if child_client_id == template_client_id:
+                                if child_cmid == urn:
+                                    self.logger.debug(("Replacing template for node %s (" % template_client_id) + str(template_node) + (") with that from %s" % am) + " (" + str(child) + "). Node comp_mgr ID: " + child_cmid)
+                                    doc_root.replaceChild(child.cloneNode(True), template_node)
+                                elif ':' in child_cmid[len('urn:publicid:IDN+'):child_cmid.find('+authority')] and not am.hasURNSynonym(child_cmid):
+                                    self.logger.debug("Node %s cmid %s shows it is from a sub-AM. See if the parent would be a match (so must replace the node) at %s", child_client_id, child_cmid, am)
+                                    # If the CM on this node had a sub-site, then try comparing the non-root cmid with that in the template.
+                                    # if no other AM claims that CM and there is no node with the trimmed (less specific) cmid in the template
+
+                                    # if there is an am with cmid as a urn_syn but not this am: continue
+                                    thatAM = objects.Aggregate.findDontMake(child_cmid)
+                                    if thatAM is not None and thatAM != am:
+                                        self.logger.debug("Node cmid belongs to someone else: %s, %s", child_cmid, thatAM)
+                                        continue
 
-                                        # Produce the cmid urn...exogeni.net+authority+am from urn...exogeni.net:site+authority+am
-                                        cmidTrim = child_cmid[:child_cmid.find('+authority')]
-                                        cmidTrim = cmidTrim[:cmidTrim.find(':', len('urn:publicid:IDN+'))]
-                                        cmidTrim += child_cmid[child_cmid.find('+authority'):]
-                                        if cmidTrim == urn:
-                                            self.logger.debug(("Replacing template for super AM (like EG-SM) node %s (" % template_client_id) + str(template_node) + (") with that from %s" % am) + " (" + str(child) + "). Node comp_mgr ID: " + child_cmid)
-                                            doc_root.replaceChild(child.cloneNode(True), template_node)
+                                    # Produce the cmid urn...exogeni.net+authority+am from urn...exogeni.net:site+authority+am
+                                    cmidTrim = child_cmid[:child_cmid.find('+authority')]
+                                    cmidTrim = cmidTrim[:cmidTrim.find(':', len('urn:publicid:IDN+'))]
+                                    cmidTrim += child_cmid[child_cmid.find('+authority'):]
+                                    if cmidTrim == urn:
+                                        self.logger.debug(("Replacing template for super AM (like EG-SM) node %s (" % template_client_id) + str(template_node) + (") with that from %s" % am) + " (" + str(child) + "). Node comp_mgr ID: " + child_cmid)
+                                        doc_root.replaceChild(child.cloneNode(True), template_node)
 
     def combineLinks(self, ams_list, dom_template):
         '''Replace each link in dom_template with matching link from (an) AM with same URN.
@@ -394,7 +458,7 @@ class ManifestRSpecCombiner:
         docAM = None
         children = doc_root.childNodes
         # Collect the link client_ids in the template
-        template_link_cids=[]
+        template_link_cids=set()
         for child in children:
             if child.nodeType == Node.ELEMENT_NODE and \
                     child.localName == defs.LINK_TAG:
@@ -402,7 +466,7 @@ class ManifestRSpecCombiner:
                 # Get first 'component_manager' child element
 #                print "LINK = " + str(link) + " " + cmid
                 client_id = str(link.getAttribute(CLIENT_ID))
-                template_link_cids.append(client_id)
+                template_link_cids.add(client_id)
 
         # loop over AMs. If an AM has a link client_id not in template_link_ids
         # and the link has that AM as a component_manager, then append this link to the template
@@ -440,13 +504,13 @@ class ManifestRSpecCombiner:
                     if cme.nodeType != Node.ELEMENT_NODE or cme.localName != COMP_MGR:
                         continue
                     cmid = str(cme.getAttribute(COMP_MGR_NAME))
-                    if cmid == agg.urn or cmid in agg.urn_syns:
+                    if cmid == agg.urn or agg.hasURNSynonym(cmid):
                         myLink = True
                         break
                 if myLink:
 #                    self.logger.debug("Adding link %s (%s)", cid, link2.toxml(encoding="utf-8"))
                     doc_root.appendChild(link2.cloneNode(True))
-                    template_link_cids.append(cid)
+                    template_link_cids.add(cid)
         # Done adding links from AMs not in template
 
         # Now go through the links in the template, swapping in info from the appropriate manifest RSpecs
@@ -538,10 +602,8 @@ class ManifestRSpecCombiner:
                         self.logger.debug("combineLinks Skipping manifest from %s - same as template", agg)
                         continue
                     self.logger.debug("combineLinks Considering manifest from %s", agg)
-                    for link2 in man.documentElement.childNodes:
-                        if link2.nodeType != Node.ELEMENT_NODE or \
-                                link2.localName != defs.LINK_TAG:
-                            continue
+                    # Only links in this AM's manifest with the same client_id can match
+                    for link2 in self.getIndex(man).linksByCid.get(client_id, []):
                         # If this is a manifest link and all irefs have
                         # manifest info, then this link is done. Move on.
                         # FIXME: This means we do not add the link sliver_id
@@ -890,6 +952,13 @@ class ManifestRSpecCombiner:
                 return
         # End of block to handle have no stitching template
 
+        # Template paths by ID. Paths are added below, but not replaced.
+        template_paths = {}
+        for child in template_stitching.childNodes:
+            if child.nodeType == Node.ELEMENT_NODE and \
+                    child.localName == defs.PATH_TAG:
+                template_paths.setdefault(child.getAttribute(PATH_ID), child)
+
         for am in ams_list:
             if am.dcn:
                 self.logger.debug("Pulling hops from a DCN AM: %s", am)
@@ -908,7 +977,8 @@ class ManifestRSpecCombiner:
                 self.logger.debug("%s had no manifest DOM", am)
                 continue
 
-            amStitch = self.getStitchingElement(am_manifest_dom)
+            am_index = self.getIndex(am_manifest_dom)
+            amStitch = am_index.stitching
             if amStitch == template_stitching:
                 self.logger.debug("%s's stitching element is same as the template. No need to combine.", am)
                 continue
@@ -929,18 +999,18 @@ class ManifestRSpecCombiner:
                     continue
                 if hop.aggregate != am:
                     self.logger.error("%s says AM is %s, but expected %s", hop, hop.aggregate, am)
-                template_path = self.findPathByID(template_stitching, path_id)
+                template_path = template_paths.get(path_id)
                 if template_path is None:
                     self.logger.debug("Cannot find path %s in template manifest", path_id)
                     # Find it on the AM and append it to the template
-                    am_path = self.findPathByID(amStitch, path_id)
-                    template_stitching.appendChild(am_path.cloneNode(True))
+                    am_path = am_index.pathsById.get(path_id)
+                    template_paths[path_id] = template_stitching.appendChild(am_path.cloneNode(True))
                     self.logger.debug(" ... added it from this AM")
                     continue
                 #self.logger.debug("Found path %s in template manifest: %s", path_id, template_path.toxml(encoding="utf-8"))
                 #                print "AGG " + str(am) + " HID " + str(hop_id)
                 if not am.isEG:
-                    res = self.replaceHopOrAddElement(template_path, self.getStitchingElement(am_manifest_dom), hop_id, path_id)
+                    res = self.replaceHopOrAddElement(template_path, am_index, hop_id, path_id)
 #                    for child in template_path.childNodes:
 #                        if child.nodeType == Node.ELEMENT_NODE and \
 #                                child.localName == HOP and \
@@ -949,7 +1019,7 @@ class ManifestRSpecCombiner:
                 else:
                     self.logger.debug("Had EG AM in combineHops: %s", am)
                     link_id = hop._hop_link.urn
-                    self.replaceHopLinkElement(template_path, amStitch, hop_id, path_id, link_id)
+                    self.replaceHopLinkElement(template_path, am_index, hop_id, path_id, link_id)
 #            self.logger.debug("After swapping hops for %s, stitching extension is %s", am, stripBlankLines(template_stitching.toprettyxml(encoding="utf-8")))
 
     # Add details about allocations to each aggregate in a 
@@ -1043,8 +1113,8 @@ class ManifestRSpecCombiner:
         return ret
 
     # Replace the hop element in the template DOM with the hop element 
-    # from the aggregate DOM that has the given HOP ID
-    def replaceHopOrAddElement(self, template_path, am_stitching, hop_id, path_id):
+    # from the aggregate DOM (given by its ManifestIndex) that has the given HOP ID
+    def replaceHopOrAddElement(self, template_path, am_index, hop_id, path_id):
         template_hop = None
 
         for child in template_path.childNodes:
@@ -1059,16 +1129,13 @@ class ManifestRSpecCombiner:
             self.logger.info("Cannot find hop %s in template manifest path %s - will add it", hop_id, path_id)
 
         # Find the path for the given path_id (there may be more than one)
-        am_path = self.findPathByID(am_stitching, path_id)
+        if am_index.stitching is None:
+            self.logger.debug("findPathByID: stitching element was None")
+        am_path = am_index.pathsById.get(path_id)
 
         am_hop = None
         if am_path is not None:
-            for child in am_path.childNodes:
-                if child.nodeType == Node.ELEMENT_NODE and \
-                        child.localName == HOP and \
-                        child.getAttribute(HOP_ID) == hop_id:
-                    am_hop = child
-                    break
+            am_hop = am_index.hopsById.get((path_id, hop_id))
         else:
             self.logger.error("Cannot find path %s in AM's stitching extension when looking to use AM's version of hop %s", path_id, hop_id)
             # self.logger.debug("%s" % am_stitching)
@@ -1087,9 +1154,9 @@ class ManifestRSpecCombiner:
         return True
 
     # Replace the hop link element in the template DOM with the hop link element 
-    # from the aggregate DOM that has the given HOP LINK ID
+    # from the aggregate DOM (given by its ManifestIndex) that has the given HOP LINK ID
     # For use with EG AMs
-    def replaceHopLinkElement(self, template_path, am_stitching, template_hop_id, path_id, link_id):
+    def replaceHopLinkElement(self, template_path, am_index, template_hop_id, path_id, link_id):
         template_link = None
         template_hop = None
 
@@ -1139,19 +1206,13 @@ class ManifestRSpecCombiner:
                 return
 
         # Find the path for the given path_id (there may be more than one)
-        am_path = self.findPathByID(am_stitching, path_id)
+        if am_index.stitching is None:
+            self.logger.debug("findPathByID: stitching element was None")
+        am_path = am_index.pathsById.get(path_id)
 
         am_link = None
         if am_path is not None:
-            for child in am_path.childNodes:
-                if child.nodeType == Node.ELEMENT_NODE and \
-                        child.localName == HOP:
-                    for child2 in child.childNodes:
-                        if child2.nodeType == Node.ELEMENT_NODE and \
-                                child2.localName == LINK and \
-                                child2.getAttribute(LINK_ID) == link_id:
-                            am_link = child2
-                            break
+            am_link = am_index.hopLinksById.get((path_id, link_id))
             if am_link is None:
                 self.logger.debug("Did not find HopLink %s in AM's Man RSpec, though found AM's path %s (usually harmless; happens 2+ times for ExoGENI aggregates)", link_id, path_id)
                 return
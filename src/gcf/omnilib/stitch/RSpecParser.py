@@ -27,18 +27,185 @@ from __future__ import absolute_import
 
 import logging
 import sys
+import time
 from xml.dom.minidom import parseString, getDOMImplementation
+from xml.parsers import expat
 
 from . import objects
 from .utils import StitchingError
 from . import defs
 
+class _Text(object):
+    '''A text node in a parsed RSpec fragment'''
+    localName = None
+    tagName = None
+    firstChild = None
+    childNodes = ()
+
+    def __init__(self, data):
+        self.nodeValue = data
+
+class _Comment(_Text):
+    pass
+
+class _Element(object):
+    '''An element of a parsed RSpec fragment. Supports the parts of the
+    minidom Element interface that the fromDOM methods of the stitching
+    objects use.'''
+
+    def __init__(self, tagName, localName, attributes):
+        self.tagName = tagName
+        self.localName = localName
+        self.attributes = attributes
+        self.childNodes = []
+
+    @property
+    def firstChild(self):
+        if self.childNodes:
+            return self.childNodes[0]
+        return None
+
+    def hasAttribute(self, name):
+        return name in self.attributes
+
+    def getAttribute(self, name):
+        return self.attributes.get(name, "")
+
+    def getElementsByTagName(self, name):
+        found = []
+        for child in self.childNodes:
+            if child.tagName is None:
+                continue
+            if child.tagName == name:
+                found.append(child)
+            found.extend(child.getElementsByTagName(name))
+        return found
+
+def _splitName(name):
+    '''Return the (qualified name, local name) of an element or attribute
+    name as reported by a namespace aware expat parser'''
+    parts = name.split(' ')
+    if len(parts) == 3:
+        return "%s:%s" % (parts[2], parts[1]), parts[1]
+    return parts[-1], parts[-1]
+
+class _StreamingRSpecBuilder(object):
+    '''Build the stitching objects of an RSpec in one pass over the XML.
+    Only the main body nodes and links and the stitching paths are kept
+    as (small) element trees, and each only until its object is built.'''
+
+    # Children of the rspec element that we build objects from
+    FRAGMENT_TAGS = (defs.LINK_TAG, defs.NODE_TAG, defs.STITCHING_TAG)
+
+    def __init__(self):
+        self.rspecCount = 0
+        self.rspecDepth = None
+        self.depth = 0
+        # Elements being built. None for elements we skip.
+        self.stack = []
+        self.stitching = None
+        # The stitching element being parsed, and its paths
+        self.stitchingElement = None
+        self.paths = []
+        self.links = []
+        self.nodes = []
+
+    def parse(self, data):
+        parser = expat.ParserCreate(namespace_separator=' ')
+        parser.namespace_prefixes = True
+        parser.buffer_text = True
+        parser.StartElementHandler = self.startElement
+        parser.EndElementHandler = self.endElement
+        parser.CharacterDataHandler = self.characters
+        parser.CommentHandler = self.comment
+        parser.Parse(data, True)
+
+    def startElement(self, name, attrs):
+        self.depth += 1
+        tagName, localName = _splitName(name)
+        if tagName == defs.RSPEC_TAG:
+            self.rspecCount += 1
+            if self.rspecDepth is None:
+                self.rspecDepth = self.depth
+        if self.stack:
+            parent = self.stack[-1]
+        elif self.rspecDepth is not None and self.depth == self.rspecDepth + 1 and \
+                localName in self.FRAGMENT_TAGS:
+            parent = None
+        else:
+            return
+        attributes = dict()
+        for (attrName, value) in attrs.iteritems():
+            attributes[_splitName(attrName)[0]] = value
+        element = _Element(tagName, localName, attributes)
+        if parent is None:
+            if localName == defs.STITCHING_TAG:
+                self.stitchingElement = element
+                self.paths = []
+        elif parent is not self.stitchingElement:
+            parent.childNodes.append(element)
+        self.stack.append(element)
+
+    def endElement(self, name):
+        self.depth -= 1
+        if not self.stack:
+            return
+        element = self.stack.pop()
+        if self.stack:
+            if self.stack[-1] is self.stitchingElement and element.localName == defs.PATH_TAG:
+                self.paths.append(objects.Path.fromDOM(element))
+            return
+        if element.localName == defs.LINK_TAG:
+            self.links.append(objects.Link.fromDOM(element))
+        elif element.localName == defs.NODE_TAG:
+            self.nodes.append(objects.Node.fromDOM(element))
+        else:
+            self.stitching = objects.Stitching(element.getAttribute(defs.LAST_UPDATE_TIME_TAG),
+                                               self.paths)
+            self.stitchingElement = None
+
+    def characters(self, data):
+        if not self.stack or self.stack[-1] is self.stitchingElement:
+            return
+        childNodes = self.stack[-1].childNodes
+        if childNodes and type(childNodes[-1]) is _Text:
+            childNodes[-1].nodeValue += data
+        else:
+            childNodes.append(_Text(data))
+
+    def comment(self, data):
+        if not self.stack or self.stack[-1] is self.stitchingElement:
+            return
+        self.stack[-1].childNodes.append(_Comment(data))
+
 class RSpecParser:
 
     def __init__(self, logger=None):
         self.logger = logger if logger else logging.getLogger('stitch')
 
     def parse(self, data):
+        '''Parse the given RSpec string into an RSpec object in one pass,
+        without building a DOM. The DOM of the RSpec (rspec.dom) is
+        built from the string the first time it is used.'''
+        start = time.time()
+        builder = _StreamingRSpecBuilder()
+        try:
+            builder.parse(data)
+        except StitchingError:
+            raise
+        except Exception, e:
+            self.logger.error("Failed to parse rspec: %s", e)
+            raise StitchingError("Failed to parse rspec: %s" % e)
+        if builder.rspecCount != 1:
+            raise StitchingError("Expected 1 rspec tag, got %d" % (builder.rspecCount))
+        rspec = self.makeRSpec(builder.nodes, builder.links, builder.stitching)
+        rspec.setDomSource(data)
+        self.logger.debug("Parsed %d byte rspec in %.3f seconds", len(data), time.time() - start)
+        return rspec
+
+    def parseDOM(self, data):
+        '''Parse the given RSpec string into an RSpec object by way of a DOM.
+        Slower than parse, which gives the same RSpec.'''
         try:
             dom = parseString(data)
         except Exception, e:
@@ -75,8 +242,10 @@ class RSpecParser:
             else:
 #                self.logger.debug("Skipping '%s' node", child.nodeName)
                 pass
+        return self.makeRSpec(nodes, links, stitching)
 
-        # Create the object version of the rspec
+    def makeRSpec(self, nodes, links, stitching):
+        '''Create the object version of the rspec from its parsed parts'''
         rspec = objects.RSpec(stitching)
         rspec.links = links
         rspec.nodes = nodes
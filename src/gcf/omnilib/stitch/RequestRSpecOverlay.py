@@ -0,0 +1,149 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''
+ Per aggregate edits to the shared request RSpec, written out without
+ copying the whole document.
+
+ Each aggregate needs its own request RSpec: the combined request with
+ its own expires, stitching schema version and hop VLAN edits. Rather than
+ deep copying the full request DOM per AM per allocation attempt, an
+ overlay records only the edits (attribute overrides and replacement
+ subtrees for the few nodes that change) and serializes the shared base
+ document with those edits applied. Output matches minidom toxml of an
+ edited copy.
+'''
+
+from __future__ import absolute_import
+
+import codecs
+from StringIO import StringIO
+from xml.dom.minidom import parseString
+
+def _write_data(writer, data):
+    "Writes datachars to writer, escaped as minidom does."
+    if data:
+        data = data.replace("&", "&amp;").replace("<", "&lt;"). \
+                    replace("\"", "&quot;").replace(">", "&gt;")
+        writer.write(data)
+
+class EditableAttr(object):
+    '''A detached name/value copy of an attribute, to edit and then save with setAttribute.'''
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+class RequestRSpecOverlay(object):
+    '''Edits for one aggregate's request, on top of a shared (unmodified) request DOM.'''
+
+    def __init__(self, baseDom):
+        self.baseDom = baseDom
+        # Attribute overrides: node -> dict of attribute name -> value
+        self._attrs = dict()
+        # Replacement subtrees: original node -> detached edited copy
+        self._replaced = dict()
+
+    def setAttribute(self, node, name, value):
+        '''Override an attribute on a node of the base document.'''
+        if not self._attrs.has_key(node):
+            self._attrs[node] = dict()
+        self._attrs[node][name] = value
+
+    def getAttribute(self, node, name):
+        '''Get an attribute value for a base node, with any override applied.'''
+        if self._replaced.has_key(node):
+            return self._replaced[node].getAttribute(name)
+        if self._attrs.has_key(node) and self._attrs[node].has_key(name):
+            return self._attrs[node][name]
+        return node.getAttribute(name)
+
+    def editableAttr(self, node, name):
+        '''Return an EditableAttr for this attribute of a base node, with any override applied.'''
+        return EditableAttr(name, self.getAttribute(node, name))
+
+    def editableCopy(self, node):
+        '''Return a detached deep copy of this (small) base node to edit in place.
+        The copy is written out in place of the original. Repeated calls return the same copy.'''
+        if not self._replaced.has_key(node):
+            self._replaced[node] = node.cloneNode(True)
+        return self._replaced[node]
+
+    def __len__(self):
+        return len(self._attrs) + len(self._replaced)
+
+    def writexml(self, writer, encoding=None):
+        '''Write the base document with edits applied, as minidom Document.writexml(writer, "", "", "", encoding).'''
+        if encoding is None:
+            writer.write('<?xml version="1.0" ?>')
+        else:
+            writer.write('<?xml version="1.0" encoding="%s"?>' % encoding)
+        # Edited nodes are few: find the nodes with edits within them by
+        # walking up from each edited node. Everything else is written by minidom directly.
+        editedWithin = set()
+        for edited in self._attrs.keys() + self._replaced.keys():
+            node = edited
+            while node is not None and node not in editedWithin:
+                editedWithin.add(node)
+                node = node.parentNode
+        for node in self.baseDom.childNodes:
+            self._writeNode(writer, node, editedWithin)
+
+    def _writeNode(self, writer, node, editedWithin):
+        if self._replaced.has_key(node):
+            self._replaced[node].writexml(writer, "", "", "")
+            return
+        if node not in editedWithin:
+            node.writexml(writer, "", "", "")
+            return
+
+        writer.write("<" + node.tagName)
+        attrs = dict()
+        for i in range(node.attributes.length):
+            attr = node.attributes.item(i)
+            attrs[attr.name] = attr.value
+        if self._attrs.has_key(node):
+            attrs.update(self._attrs[node])
+        a_names = attrs.keys()
+        a_names.sort()
+        for a_name in a_names:
+            writer.write(" %s=\"" % a_name)
+            _write_data(writer, attrs[a_name])
+            writer.write("\"")
+        if node.childNodes:
+            writer.write(">")
+            for child in node.childNodes:
+                self._writeNode(writer, child, editedWithin)
+            writer.write("</%s>" % node.tagName)
+        else:
+            writer.write("/>")
+
+    def toxml(self, encoding=None):
+        '''Like minidom toxml on an edited copy of the base document.'''
+        writer = StringIO()
+        if encoding is not None:
+            writer = codecs.lookup(encoding)[3](writer)
+        self.writexml(writer, encoding)
+        return writer.getvalue()
+
+    def toDom(self):
+        '''Build a standalone DOM with the edits applied, for callers that need a real DOM.'''
+        return parseString(self.toxml(encoding="utf-8"))
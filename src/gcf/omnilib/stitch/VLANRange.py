@@ -82,9 +82,29 @@ class VLANRange( set ):
 #        newRange = VLANRange( other )
 #        super( VLANRange, self).__add__(newRange)                    
 
+    # Shared read only VLANRanges, by the string they were parsed from
+    _shared = dict()
+    # Most ranges to remember
+    SHARED_MAX = 1000
+
     @classmethod
     def fromString( cls, stringIn ):
-        '''Construct a VLAN range from a string like: 'any', '1,5,7,10-15'''
+        '''Get the VLAN range for a string like: 'any', '1,5,7,10-15'.
+        The range is shared with everything else that parsed the same string,
+        so it is read only: combining it with another range (a - b, a.union(b),
+        a -= b) gives a new VLANRange. copy() it to edit it in place.'''
+        inputs = str(stringIn).strip()
+        shared = VLANRange._shared.get(inputs)
+        if shared is None:
+            shared = SharedVLANRange(cls.parseString(inputs))
+            if len(VLANRange._shared) >= VLANRange.SHARED_MAX:
+                VLANRange._shared.clear()
+            VLANRange._shared[inputs] = shared
+        return shared
+
+    @classmethod
+    def parseString( cls, stringIn ):
+        '''Construct a new VLAN range from a string like: 'any', '1,5,7,10-15'''
         # Valid inputs are like:
         #   any
         #   1-20
@@ -122,8 +142,7 @@ class VLANRange( set ):
             else:
                 raise ValueError("Range should contain at most 2 values instead received %s " % str(item))
 #            print minValue, maxValue
-            for newVLAN in xrange(minValue,maxValue+1):
-                newObj.add( newVLAN )
+            newObj.update(xrange(minValue,maxValue+1))
         return newObj
 
     def __str__( self ):
@@ -166,6 +185,56 @@ class VLANRange( set ):
                 out += ',' + str(max)
         return out
 
+class SharedVLANRange( VLANRange ):
+    '''A read only VLANRange, shared by everything that got it from
+    VLANRange.fromString. Combining it with other ranges returns a new
+    VLANRange, and so do the in place operators (a -= b rebinds a to a new
+    range). Methods that would edit the range in place raise TypeError.'''
+
+    def _readOnly( self, *args ):
+        raise TypeError("VLAN range '%s' is shared and read only. Copy it to edit it." % self)
+
+    add = discard = remove = pop = clear = _readOnly
+    update = difference_update = intersection_update = symmetric_difference_update = _readOnly
+
+    def _inPlace( self, other ):
+        # Fall back to the binary operator, which makes a new range
+        return NotImplemented
+
+    __ior__ = __iand__ = __isub__ = __ixor__ = _inPlace
+
+    def __str__( self ):
+        # Big ranges are slow to print, and printed often
+        if '_str' not in self.__dict__:
+            self._str = super(SharedVLANRange, self).__str__()
+        return self._str
+
+    def copy( self ):
+        return VLANRange(self)
+
+    def __copy__( self ):
+        return VLANRange(self)
+
+    def __deepcopy__( self, memo ):
+        return VLANRange(self)
+
+    def __reduce__( self ):
+        return (VLANRange, (set(self),))
+
+def _unshared( method ):
+    # Results of operations on a SharedVLANRange are plain (editable) VLANRanges
+    def unsharedResult( self, *args ):
+        result = method(self, *args)
+        if type(result) is SharedVLANRange:
+            result.__class__ = VLANRange
+        return result
+    unsharedResult.__name__ = method.__name__
+    return unsharedResult
+
+for _name in ('__and__', '__or__', '__sub__', '__xor__', '__rand__', '__ror__', '__rsub__', '__rxor__',
+              'difference', 'intersection', 'symmetric_difference', 'union'):
+    setattr(SharedVLANRange, _name, _unshared(getattr(set, _name)))
+del _name
 
 if __name__ == "__main__":
     print "\nSome operations on VLANRanges...\n"
@@ -117,6 +117,7 @@ def _setProp(propName, propType):
 
 class GMOCObject(object):
     """Base class for GMOC objects"""
+    __slots__ = ()
 
     def __init__(self, id):
         self.id = id
@@ -26,7 +26,6 @@ from __future__ import absolute_import
 
 import datetime
 import logging
-import time
 
 from .utils import StitchingRetryAggregateNewVlanError, StitchingRetryAggregateNewVlanImmediatelyError, StitchingError, StitchingStoppedError
 from .objects import Aggregate
@@ -88,15 +87,20 @@ class Launcher(object):
 
                     # Aggregate.BUSY_POLL_INTERVAL_SEC = 10 # dossl does 10
                     # Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS = 30
-                    # Use the v3 AM sleep by default.
-                    # But if any v2 AMs have (or have had) reservations, then use that sleep
-                    secs = Aggregate.PAUSE_FOR_V3_AM_TO_FREE_RESOURCES_SECS
+                    # Wait for this AM and any AMs that have (or have had) reservations
+                    # to free resources: at most the v3 AM sleep,
+                    # or the v2 AM sleep for v2 AMs, or the DCN sleep if this is a DCN AM.
+                    waits = []
                     for agg2 in self.aggs:
-                        if agg2.api_version == 2 and secs < Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS and agg2.triedRes:
-                            secs = Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS
-                    if not isinstance(se, StitchingRetryAggregateNewVlanImmediatelyError):
-                        if agg.dcn:
-                            secs = Aggregate.PAUSE_FOR_DCN_AM_TO_FREE_RESOURCES_SECS
+                        if not (agg2 is agg or agg2.triedRes):
+                            continue
+                        aggSecs = Aggregate.PAUSE_FOR_V3_AM_TO_FREE_RESOURCES_SECS
+                        if agg2.api_version == 2 and agg2.triedRes:
+                            aggSecs = Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS
+                        if agg2 is agg and agg.dcn and not isinstance(se, StitchingRetryAggregateNewVlanImmediatelyError):
+                            aggSecs = Aggregate.PAUSE_FOR_DCN_AM_TO_FREE_RESOURCES_SECS
+                        waits.append((agg2, aggSecs))
+                    secs = max([waitSecs for (agg2, waitSecs) in waits])
 
                     if datetime.datetime.utcnow() + datetime.timedelta(seconds=secs) >= self.timeoutTime:
                         # We'll time out. So quit now.
@@ -104,8 +108,8 @@ class Launcher(object):
                         msg = "Reservation attempt timing out after %d minutes." % self.opts.timeout
                         raise StitchingError(msg)
 
-                    self.logger.info("Pausing for %d seconds for Aggregates to free up resources...\n\n", secs)
-                    time.sleep(secs)
+                    self.logger.info("Pausing up to %d seconds for Aggregates to free up resources...\n\n", secs)
+                    Aggregate.releaseWaiter.wait(waits, self.opts, self.timeoutTime)
 
                     # After this exception/retry, the list of ready aggregates may have changed
                     # For example, when we locally work back a bit to handle vlan unavailable
@@ -35,11 +35,15 @@ import logging
 import os
 import random
 import string
+import threading
 import time
 from xml.dom.minidom import parseString, Node as XMLNode
 
 from . import defs
+from .releasewaiter import ReleaseWaiter
+from .teardown import Teardown
 from .GENIObject import *
+from .RequestRSpecOverlay import RequestRSpecOverlay
 from .VLANRange import *
 from .utils import *
 
@@ -62,6 +66,7 @@ DCN_AM_RETRY_INTERVAL_SECS = 10 * 60 # Xi and Chad say ION routers take a long t
 class Path(GENIObject):
     '''Path in stitching aka a Link'''
     __ID__ = validateText
+    __slots__ = ('id', '_hops', '_aggregates')
 
     # XML tag constants
     ID_TAG = 'id'
@@ -72,7 +77,7 @@ class Path(GENIObject):
     def fromDOM(cls, element):
         """Parse a stitching path from a DOM element."""
         # FIXME: Do we need getAttributeNS?
-        id = element.getAttribute(cls.ID_TAG)
+        id = internName(element.getAttribute(cls.ID_TAG))
         path = Path(id)
         globId = None
         for child in element.childNodes:
@@ -128,8 +133,10 @@ class Path(GENIObject):
         # Fail -- no hop matched the given index
         return None
 
-    def editChangesIntoDom(self, pathDomNode):
-        '''Edit any changes made in this element into the given DomNode'''
+    def editChangesIntoDom(self, pathDomNode, overlay=None):
+        '''Edit any changes made in this element into the given DomNode.
+        If an overlay (RequestRSpecOverlay) is given, edit copies of the hop nodes
+        recorded in the overlay, leaving the given DomNode untouched.'''
         # Note the parent RSpec element's dom is not touched, unless the given node is from that document
         # Here we just find all the Hops and let them do stuff
 
@@ -152,6 +159,8 @@ class Path(GENIObject):
                 # Couldn't find this Hop in the dom
                 # FIXME: Create it?
                 raise StitchingError("Couldn't find Hop %s in given Dom node to edit in changes" % hop)
+            if overlay is not None:
+                domHopNode = overlay.editableCopy(domHopNode)
             hop.editChangesIntoDom(domHopNode)
         # End of loop over hops
         return
@@ -179,12 +188,38 @@ class Aggregate(object):
     # Hold all instances. One instance per URN.
     aggs = dict()
 
+    # Index of the instances in aggs by each of their URN synonyms
+    bySynonym = dict()
+
+    # The instances in aggs that are ExoGENI AMs
+    _egAggs = set()
+
+    # URN synonyms by URN, as computed by urn_syns
+    _synonymsByURN = dict()
+
+    # Persistent Omni session for AM API calls (set by the StitchingHandler).
+    # If None, each call does a full omni.call
+    omniSession = None
+
+    # Omni session for the AM API calls of the current thread, if it is
+    # a helper thread (see useThreadSession)
+    _threadSession = threading.local()
+
+    # Deletes of reservations from failed attempts, run concurrently
+    teardown = Teardown()
+
+    # Waits for AMs to free the VLAN tags of deleted reservations
+    releaseWaiter = ReleaseWaiter()
+
     # FIXME: Move these constants up higher
     MAX_TRIES = 10 # Max times to try allocating here. Compare with allocateTries
     BUSY_MAX_TRIES = 5 # dossl does 3
     BUSY_POLL_INTERVAL_SEC = 10 # dossl does 10
     SLIVERSTATUS_MAX_TRIES = 10
     SLIVERSTATUS_POLL_INTERVAL_SEC = 30 # Xi says 10secs is short if ION is busy; per ticket 1045, even 20 may be too short
+    # DCN AMs: the first sliverstatus comes sooner, and later ones back off to SLIVERSTATUS_POLL_INTERVAL_SEC
+    DCN_FIRST_POLL_SEC = 20
+    DCN_POLL_BACKOFF = 1.25
     PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS = 30
     PAUSE_FOR_V3_AM_TO_FREE_RESOURCES_SECS = 15 # When its a V3 AM and we just allocated, should be quicker to free the resources
     # See DCN_AM_RETRY_INTERVAL_SECS for the DCN AM equiv of PAUSE_FOR_AM_TO_FREE...
@@ -198,22 +233,35 @@ class Aggregate(object):
     # Directory to store request rspecs - must be universally writable
     REQ_RSPEC_DIR = os.path.normpath(os.getenv("TMPDIR", os.getenv("TMP", "/tmp")))
 
+    @classmethod
+    def forkSession(cls):
+        '''Return a new Omni session for AM API calls from another thread,
+        or None if calls do not use a persistent session. Call from the
+        thread that will use it, before starting it.'''
+        if cls.omniSession is None:
+            return None
+        return cls.omniSession.fork()
+
+    @classmethod
+    def useThreadSession(cls, session):
+        '''Make the AM API calls of the current thread in this Omni session
+        (from forkSession), instead of the shared one.'''
+        cls._threadSession.session = session
+
     @classmethod
     def find(cls, urn, make=True):
-        if not urn in cls.aggs:
-            syns = Aggregate.urn_syns(urn)
-            found = False
-            for urn2 in syns:
-                if urn2 in cls.aggs:
-                    found = True
-                    urn = urn2
+        agg = cls.aggs.get(urn)
+        if agg is None:
+            # An AM whose URN is a synonym of this URN
+            for urn2 in cls.urn_syns(urn):
+                agg = cls.aggs.get(urn2)
+                if agg is not None:
                     break
-            if not found:
-                if not make:
-                    return None
-                m = cls(urn)
-                cls.aggs[urn] = m
-        return cls.aggs[urn]
+        if agg is None and make:
+            agg = cls(urn)
+            cls.aggs[urn] = agg
+            cls.indexAggregate(agg)
+        return agg
 
     @classmethod
     def findDontMake(cls, urn):
@@ -223,9 +271,39 @@ class Aggregate(object):
     def all_aggregates(cls):
         return cls.aggs.values()
 
+    @classmethod
+    def egAggregates(cls):
+        '''All the instances that are ExoGENI AMs'''
+        return list(cls._egAggs)
+
     @classmethod
     def clearCache(cls):
         cls.aggs = dict()
+        cls.bySynonym = dict()
+        cls._egAggs = set()
+
+    @classmethod
+    def setAggregates(cls, aggs):
+        '''Replace the dictionary of all instances (by URN), re-indexing them'''
+        cls.aggs = aggs
+        cls.bySynonym = dict()
+        cls._egAggs = set()
+        for agg in aggs.values():
+            agg._indexedURNs = []
+            cls.indexAggregate(agg)
+
+    @classmethod
+    def indexAggregate(cls, agg):
+        '''(Re-)index the given Aggregate by its URN synonyms.
+        Call this after changing agg.urn_syns other than with addURNSynonym.'''
+        for urn in agg._indexedURNs:
+            if cls.bySynonym.get(urn) is agg:
+                del cls.bySynonym[urn]
+        agg._indexedURNs = list(agg.urn_syns)
+        for urn in agg._indexedURNs:
+            cls.bySynonym[urn] = agg
+        if agg.isEG:
+            cls._egAggs.add(agg)
 
     @classmethod
     def urn_syns_helper(cls, urn, urn_syns):
@@ -257,6 +335,15 @@ class Aggregate(object):
     # Also, EG AMs have both a vmsite and a Net bit that could be in component_manager_ids
     @classmethod
     def urn_syns(cls, urn):
+        urn_syns = cls._synonymsByURN.get(urn)
+        if urn_syns is None:
+            urn_syns = cls._compute_urn_syns(urn)
+            cls._synonymsByURN[urn] = urn_syns
+        # Caller may edit the list
+        return list(urn_syns)
+
+    @classmethod
+    def _compute_urn_syns(cls, urn):
         urn_syns = list()
         urn = urn.strip()
         wasUni = False
@@ -379,6 +466,8 @@ class Aggregate(object):
         # IE don't get caught by cm/am differences
         # Also, EG AMs have both a vmsite and a Net bit that could be in component_manager_ids
         self.urn_syns = Aggregate.urn_syns(urn)
+        # URN synonyms this is indexed by in Aggregate.bySynonym
+        self._indexedURNs = []
 
         self.url = url
         self.alt_url = None # IE the rack URL vs the ExoSM URL
@@ -393,11 +482,12 @@ class Aggregate(object):
         self.isDependencyFor = set() # AMs that depend on this: for ripple down deletes
         self.logger = logging.getLogger('stitch.Aggregate')
         # Note these are sort of RSpecs but not RSpec objects, to avoid a loop
-        self.requestDom = None # the DOM as constructed to submit in request to this AM
+        self._requestDom = None # the DOM as constructed to submit in request to this AM (see requestDom)
+        self.requestOverlay = None # Edits for this AM on top of the shared request DOM (see getRequestOverlay)
         self.manifestDom = None # the DOM as we got back from the AM
         self.api_version = 2 # Set from stitchhandler.parseSCSResponse
         self.dcn = False # DCN AMs require waiting for sliverstatus to say ready before the manifest is legit
-        self.isEG = False # Handle EG AMs differently - manifests are different
+        self._isEG = False # Handle EG AMs differently - manifests are different
         self.isExoSM = False # Maybe we need to handle the ExoSM differently too?
         self.isPG = False
         self.isGRAM = False
@@ -476,10 +566,67 @@ class Aggregate(object):
     def paths(self):
         return list(self._paths)
 
+    @property
+    def requestDom(self):
+        '''The request DOM for this AM. When allocate built this request as an overlay
+        on the shared request DOM, build a standalone DOM only when first asked.'''
+        if self._requestDom is None and self.requestOverlay is not None:
+            self._requestDom = self.requestOverlay.toDom()
+        return self._requestDom
+
+    @requestDom.setter
+    def requestDom(self, dom):
+        self._requestDom = dom
+        self.requestOverlay = None
+
+    def getRequestString(self):
+        '''Get the request RSpec to submit to this AM as a UTF-8 XML string'''
+        if self._requestDom is None and self.requestOverlay is not None:
+            return self.requestOverlay.toxml(encoding="utf-8")
+        return self.requestDom.toxml(encoding="utf-8")
+
     @property
     def dependsOn(self):
         return list(self._dependsOn)
 
+    @property
+    def isEG(self):
+        return self._isEG
+
+    @isEG.setter
+    def isEG(self, isEG):
+        self._isEG = isEG
+        if not self._indexedURNs:
+            return
+        if isEG:
+            Aggregate._egAggs.add(self)
+        else:
+            Aggregate._egAggs.discard(self)
+
+    def hasURNSynonym(self, urn):
+        '''Is the given URN one of the URN synonyms of this AM?'''
+        owner = Aggregate.bySynonym.get(urn)
+        if owner is self:
+            return True
+        if owner is None and self._indexedURNs:
+            return False
+        # Not indexed, or another AM has this URN too
+        return urn in self.urn_syns
+
+    def addURNSynonym(self, urn):
+        '''Add a URN synonym for this AM, keeping the index up to date'''
+        if urn in self.urn_syns:
+            return
+        self.urn_syns.append(urn)
+        if self._indexedURNs:
+            self._indexedURNs.append(urn)
+            Aggregate.bySynonym[urn] = self
+
+    def reindexURNSynonyms(self):
+        '''Update the index after changing urn_syns directly'''
+        if self._indexedURNs:
+            Aggregate.indexAggregate(self)
+
     def add_hop(self, hop):
         self._hops.add(hop)
 #        self.logger.debug("%s now has %d hops", self, len(self._hops))
@@ -541,6 +688,9 @@ class Aggregate(object):
 
         # FIXME: If we are quitting, return (important when threaded)
 
+        # A delete of the reservation here from a failed attempt may still be running
+        Aggregate.teardown.waitForAM(self)
+
         # Import VLANs, noting if we need to delete an old reservation at this AM first
         mustDelete, alreadyDone = self.copyVLANsAndDetectRedo()
 
@@ -564,8 +714,8 @@ class Aggregate(object):
                 self.lastError = msg
                 raise StitchingError(msg)
 
-            self.logger.info("Pausing %d seconds to let aggregate free resources...", sleepSecs)
-            time.sleep(sleepSecs)
+            self.logger.info("Pausing up to %d seconds to let aggregate free resources...", sleepSecs)
+            Aggregate.releaseWaiter.wait([(self, sleepSecs)], opts, self.timeoutTime)
         # end of block to delete a previous reservation
 
         if alreadyDone:
@@ -781,8 +931,9 @@ class Aggregate(object):
         # See ticket #577
         newExpires = self.getExpiresForRequest(opts)
 
-        # Generate the new request Dom
-        self.requestDom = self.getEditedRSpecDom(rspecDom, newExpires)
+        # Generate the new request: edits for this AM on top of the shared request Dom
+        self.requestDom = None
+        self.requestOverlay = self.getRequestOverlay(rspecDom, newExpires)
 
         # Get the manifest for this AM
         # result is a manifest RSpec string. Errors wouuld be raised
@@ -1378,11 +1529,19 @@ class Aggregate(object):
             return attr, 0
 
     def getEditedRSpecDom(self, originalRSpec, newExpires=None):
+        '''Get a standalone request DOM for this AM: the given DOM with this AM's edits applied.'''
+        # newExpires is a datetime value for the expires attribute in the request
+        return self.getRequestOverlay(originalRSpec, newExpires).toDom()
+
+    def getRequestOverlay(self, originalRSpec, newExpires=None):
+        '''Record the edits this AM needs in its request, as a RequestRSpecOverlay
+        on the given (shared, unmodified) request RSpec DOM.'''
         # newExpires is a datetime value for the expires attribute in the request
 
-        # For each path on this AM, get that Path to write whatever it thinks necessary into a
-        # deep clone of the incoming RSpec Dom
-        requestRSpecDom = originalRSpec.cloneNode(True)
+        # For each path on this AM, get that Path to write whatever it thinks necessary into
+        # an overlay on the incoming RSpec Dom. Only the edited hops get copied.
+        overlay = RequestRSpecOverlay(originalRSpec)
+        requestRSpecDom = originalRSpec
 
         # This block no longer necessary. If stitchhandler sets the
         # expires attribute, then this is true. Otherwise, don't do
@@ -1419,7 +1578,7 @@ class Aggregate(object):
             newExpires = naiveUTC(newExpires).strftime('%Y-%m-%dT%H:%M:%SZ')
             rspecs = requestRSpecDom.getElementsByTagName(defs.RSPEC_TAG)
             if rspecs and len(rspecs) > 0:
-                rspecs[0].setAttribute(defs.EXPIRES_ATTRIBUTE, newExpires)
+                overlay.setAttribute(rspecs[0], defs.EXPIRES_ATTRIBUTE, newExpires)
 
         changing1To2 = False # FIXME: Use this later to determine how to write attributes?
         changing2To1 = False
@@ -1435,8 +1594,10 @@ class Aggregate(object):
         # Also check xsi:schemaLocation
         if rspecNode.hasAttributes():
             for i in range(rspecNode.attributes.length):
-                attr = rspecNode.attributes.item(i)
+                attr = overlay.editableAttr(rspecNode, rspecNode.attributes.item(i).name)
                 attr, newVer = self.changeStitchSchemaVersion(attr, 'rspec')
+                if newVer > 0:
+                    overlay.setAttribute(rspecNode, attr.name, attr.value)
                 if newVer == 2:
                     changing1To2 = True
                 elif newVer == 1:
@@ -1453,7 +1614,7 @@ class Aggregate(object):
         if stitchNodes and len(stitchNodes) > 0:
             stitchNode = stitchNodes[0]
         else:
-            return requestRSpecDom
+            return overlay
         # For GRE requests, there won't be one
 #            raise StitchingError("Couldn't find stitching element in rspec for %s request" % self)
 
@@ -1462,8 +1623,10 @@ class Aggregate(object):
         # If the value says v1 and we want v2 or vice versa, then change
         if stitchNode.hasAttributes():
             for i in range(stitchNode.attributes.length):
-                attr = stitchNode.attributes.item(i)
+                attr = overlay.editableAttr(stitchNode, stitchNode.attributes.item(i).name)
                 attr, newVer = self.changeStitchSchemaVersion(attr, 'stitching')
+                if newVer > 0:
+                    overlay.setAttribute(stitchNode, attr.name, attr.value)
                 if newVer == 2:
                     changing1To2 = True
                 elif newVer == 1:
@@ -1492,8 +1655,8 @@ class Aggregate(object):
             if domNode is None:
                 raise StitchingError("Couldn't find Path %s in stitching element of RSpec for %s request" % (path, self))
             #self.logger.debug("Doing path.editChanges for path %s", path.id)
-            path.editChangesIntoDom(domNode)
-        return requestRSpecDom
+            path.editChangesIntoDom(domNode, overlay)
+        return overlay
 
     # For a given hop, extract from the Manifest DOM a tuple (pathGlobalId, vlanRangeAvailability, suggestedVLANRange)
     def getVLANRangeSuggested(self, manifest, hop_id, path_id):
@@ -1763,7 +1926,7 @@ class Aggregate(object):
 
         # Write the request rspec to a string that we save to a file
         try:
-            requestString = self.requestDom.toxml(encoding="utf-8")
+            requestString = self.getRequestString()
         except Exception, xe:
             self.logger.debug("Failed to XMLify requestDOM for sending to AM: %s", xe)
             self.lastError = "%s: Constructed request RSpec malformed? Failed to XMLify" % self
@@ -1774,8 +1937,8 @@ class Aggregate(object):
         # Ticket #738
         if self.isEG:
             haveMultEGs = False
-            for agg in Aggregate.all_aggregates():
-                if agg != self and agg.isEG:
+            for agg in Aggregate.egAggregates():
+                if agg != self:
                     haveMultEGs = True
                     break
             if haveMultEGs:
@@ -2536,187 +2699,13 @@ class Aggregate(object):
 
         self.logger.info("DCN AM %s: must wait for status ready....", self)
 
-        # FIXME: Add a maxtime to wait as well
-        tries = 0
-        status = 'unknown'
-        while tries < self.SLIVERSTATUS_MAX_TRIES:
-            # Pause before calls to sliverstatus
-            if datetime.datetime.utcnow() + datetime.timedelta(seconds=self.SLIVERSTATUS_POLL_INTERVAL_SEC) >= self.timeoutTime:
-                # We'll time out. So quit now.
-                self.logger.debug("After planned sleep for %d seconds we will time out", self.SLIVERSTATUS_POLL_INTERVAL_SEC)
-                msg = "Reservation attempt timing out after %d minutes." % opts.timeout
-                self.lastError = msg
-                raise StitchingError(msg)
-
-            self.logger.info("Pausing %d seconds to let circuit become ready...", self.SLIVERSTATUS_POLL_INTERVAL_SEC)
-            time.sleep(self.SLIVERSTATUS_POLL_INTERVAL_SEC)
+        (status, circuitIDs, dcnErrors, statuses) = self.waitForDcnStatus(opts, slicename, ctr)
 
-            # generate args for sliverstatus
+        if status not in ('ready', 'geni_allocated', 'geni_provisioned', 'geni_ready'):
             if self.api_version == 2:
                 opName = 'sliverstatus'
             else:
                 opName = 'status'
-            if opts.warn:
-                omniargs = [ '-V%d' % self.api_version, '--raise-error-on-v2-amapi-error', '-a', self.url, opName, slicename]
-            else:
-                omniargs = ['-o', '-V%d' % self.api_version, '--raise-error-on-v2-amapi-error', '-a', self.url, opName, slicename]
-            result = None
-            try:
-                tries = tries + 1
-                # FIXME: shouldn't ctr be based on tries here?
-                # FIXME: Big hack!!!
-                if not opts.fakeModeDir:
-                    (text, result) = self.doAMAPICall(omniargs, opts, opName, slicename, ctr, suppressLogs=True)
-                    self.logger.debug("handleDcn %s %s at %s got: %s", opName, slicename, self, text)
-            except Exception, e:
-                # exit gracefully
-                # FIXME: to SCS excluding this hop? to user? This could be some transient thing, such that redoing
-                # circuit as is would work. Or it could be something permanent. How do we know?
-                self.lastError = "%s %s failed at %s: %s" % (opName, slicename, self, e)
-                raise StitchingError(self.lastError)
-
-            dcnErrors = dict() # geni_error by geni_urn of individual resource
-            # DCN circuit ID by geni_urn (one parsed from the other)
-            # These should match the globalIDs on the hops at this AM.
-            circuitIDs = dict()
-            statuses = dict() # per sliver status
-
-            # Parse out sliver status / status
-            if isinstance(result, dict) and result.has_key(self.url) and result[self.url] and \
-                    isinstance(result[self.url], dict):
-                if self.api_version == 2:
-
-                    # Save off the sliver expiration if found
-                    self.setSliverExpirations(expires_from_status(result[self.url], self.logger))
-
-                    if result[self.url].has_key("geni_status"):
-                        status = result[self.url]["geni_status"]
-                    else:
-                        # else malformed
-                        self.lastError = "%s had malformed %s result in handleDCN" % (self, opName)
-                        raise StitchingError(self.lastError)
-                    # Get any geni_error string
-                    if result[self.url].has_key("geni_resources") and \
-                            isinstance(result[self.url]["geni_resources"], list) and \
-                            len(result[self.url]["geni_resources"]) > 0:
-                        for resource in result[self.url]["geni_resources"]:
-                            if not isinstance(resource, dict) and not resource.has_key("geni_urn"):
-                                self.logger.debug("Malformed sliverstatus - resource not a dict or has no geni_urn: %s", str(resource))
-                                continue
-                            urn = resource["geni_urn"]
-                            if urn:
-                                circuitid = None
-                                import re
-                                match = re.match("^urn:publicid:IDN\+[^\+]+\+sliver\+[^\+]+\-(\d+)$", urn)
-                                if match:
-                                    circuitid = match.group(1).strip()
-                                    self.logger.debug("Found circuit '%s'", circuitid)
-                                else:
-                                    self.logger.debug("Found no geni_urn match? URN: %s", urn)
-                                circuitIDs[urn] = circuitid
-                                if resource.has_key("geni_error"):
-                                    dcnErrors[urn] = resource["geni_error"]
-                                    self.logger.debug("Found geni_error '%s' for circuit %s", dcnErrors[urn], circuitid)
-                                else:
-                                    self.logger.debug("Malformed sliverstatus missing geni_error tag: %s", str(resource))
-                                    dcnErrors[urn] = None
-
-                                if resource.has_key("geni_status"):
-                                    statuses[urn] = resource["geni_status"]
-                                    self.logger.debug("Found status '%s' for sliver %s (circuit %s)", statuses[urn], urn, circuitid)
-                                    # Ticket #731
-                                    if str(statuses[urn]).strip().lower() != 'ready' and str(status).strip().lower() == 'ready':
-                                        self.logger.debug("Resetting global status from '%s' to '%s' because of sliver %s", status, statuses[urn], urn)
-                                        status = str(statuses[urn])
-                                else:
-                                    self.logger.debug("Malformed sliverstatus missing geni_status: %s", str(resource))
-                                    statuses[urn] = status
-                            else:
-                                self.logger.debug("Malformed sliverstatus has empty geni_urn: %s", str(resource))
-                else:
-                    if result[self.url].has_key("value") and isinstance(result[self.url]["value"], dict) and \
-                            result[self.url]["value"].has_key("geni_slivers") and isinstance(result[self.url]["value"]["geni_slivers"], list):
-
-                        # Want to do something like this, but _getSliverExpirations is in amhandler
-                        # Put it in handler_utils? Requires _datetimeFromString and getSliverResultList
-                        # And maybe make it called by expires_from_status?
-#                        (orderedDates, sliverExps) = handler_utils._getSliverExpirations(result[self.url]["value"], None)
-#                        self.sliverExpirations = orderedDates
-                        # For now, reproduce the stuff I care about here
-                        expirations = []
-                        for sliver in result[self.url]["value"]["geni_slivers"]:
-                            if isinstance(sliver, dict) and sliver.has_key("geni_expires"):
-                                sliver_expires = sliver['geni_expires']
-                                if isinstance(sliver_expires, str):
-                                    # parse it
-                                    expObj = _naiveUTCFromString(sliver_expires)
-                                    if expObj and expObj not in expirations:
-                                        expirations.append(expObj)
-                        self.setSliverExpirations(expirations)
-
-                        for sliver in result[self.url]["value"]["geni_slivers"]:
-                            if isinstance(sliver, dict) and sliver.has_key("geni_allocation_status"):
-                                status = sliver["geni_allocation_status"]
-                                dcnerror = None
-                                if sliver.has_key("geni_error"):
-                                    dcnerror = sliver["geni_error"]
-                                if sliver.has_key("geni_sliver_urn"):
-                                    urn = sliver["geni_sliver_urn"]
-                                    if urn:
-                                        import re
-                                        statuses[urn] = status
-                                        circuitid = None
-                                        match = re.match("^urn:publicid:IDN\+[^\+]+\+sliver\+[^\+]+\-(\d+)$", urn)
-                                        if match:
-                                            circuitid = match.group(1).strip()
-                                            self.logger.debug("Found circuit '%s'", circuitid)
-                                        else:
-                                            self.logger.debug("Found no geni_urn match? URN: %s", urn)
-                                        circuitIDs[urn] = circuitid
-                                        dcnErrors[urn] = dcnerror
-                                    else:
-                                        self.logger.debug("Malformed sliverstatus has empty sliver_urn: %s", str(sliver))
-                                else:
-                                    self.logger.debug("Malformed sliverstatus has no geni_sliver_urn: %s", str(sliver))
-
-                                break # FIXME: This stops at the first sliver. Can we do better? Ticket 261
-                            else:
-                                self.logger.debug("Malformed sliverstatus has non dict sliver entry or entry with no geni_allocation_status: %s", str(sliver))
-                        # FIXME: Which sliver(s) do I look at?
-                        # 1st? look for any not ready and take that?
-                        # And pull out any geni_error
-                        # FIXME FIXME
-                        # FIXME: I don't really know how AMs will do v3 status' so wait
-                    else:
-                        # malformed
-                        self.lastError = "%s sent malformed %s result in handleDCN" % (self, opName)
-                        raise StitchingError(self.lastError)
-            else:
-                # FIXME FIXME Big hack
-                if not opts.fakeModeDir:
-                    # malformed
-                    self.lastError = "%s sent malformed %s result in handleDCN" % (self, opName)
-                    raise StitchingError(self.lastError)
-
-            # FIXME: Big hack!!!
-            if opts.fakeModeDir:
-                status = 'ready'
-
-            status = str(status).lower().strip()
-            if status in ('failed', 'ready', 'geni_allocated', 'geni_provisioned', 'geni_failed', 'geni_notready', 'geni_ready'):
-                break
-            for entry in circuitIDs.keys():
-                circuitid = circuitIDs[entry]
-                dcnerror = dcnErrors[entry]
-                status = statuses[entry]
-                if dcnerror and dcnerror.strip() != '':
-                    if circuitid:
-                        self.logger.info("%s: %s is (still) %s at %s. Had error message: %s", opName, circuitid, status, self, dcnerror)
-                    else:
-                        self.logger.info("%s is (still) %s at %s. Had error message: %s", opName, status, self, dcnerror)
-        # End of while loop getting sliverstatus
-
-        if status not in ('ready', 'geni_allocated', 'geni_provisioned', 'geni_ready'):
             for entry in circuitIDs.keys():
                 circuitid = circuitIDs[entry]
                 dcnerror = dcnErrors[entry]
@@ -2969,6 +2958,207 @@ class Aggregate(object):
                     raise StitchingError(self.lastError)
             return (text, oneResult)
 
+
+    def waitForDcnStatus(self, opts, slicename, ctr):
+        '''Poll sliverstatus at this DCN AM until the circuit is ready or failed.
+        The first poll is DCN_FIRST_POLL_SEC after allocating, and the pauses
+        grow by DCN_POLL_BACKOFF up to SLIVERSTATUS_POLL_INTERVAL_SEC. Polling stops
+        after as long as SLIVERSTATUS_MAX_TRIES polls at the full interval would take.
+        The last pause is cut short to poll once more just before the stitcher timeout.
+        Return the overall status, and the circuit IDs, DCN errors and statuses by sliver URN.'''
+        tries = 0
+        status = 'unknown'
+        dcnErrors = dict()
+        circuitIDs = dict()
+        statuses = dict()
+        maxWaitSecs = self.SLIVERSTATUS_MAX_TRIES * self.SLIVERSTATUS_POLL_INTERVAL_SEC
+        waitedSecs = 0
+        intervalSecs = self.DCN_FIRST_POLL_SEC
+        while waitedSecs < maxWaitSecs:
+            # Pause before calls to sliverstatus
+            left = self.timeoutTime - datetime.datetime.utcnow()
+            leftSecs = left.days * 86400 + left.seconds + left.microseconds / 1000000.0
+            if leftSecs <= 0:
+                # We timed out. So quit now.
+                self.logger.debug("Stitcher timeout reached while waiting for circuit at %s", self)
+                msg = "Reservation attempt timing out after %d minutes." % opts.timeout
+                self.lastError = msg
+                raise StitchingError(msg)
+            pauseSecs = min(intervalSecs, maxWaitSecs - waitedSecs)
+            if leftSecs < pauseSecs:
+                self.logger.debug("Cutting pause at %s short to poll before the stitcher timeout", self)
+                pauseSecs = leftSecs
+            self.logger.info("Pausing %d seconds to let circuit become ready...", pauseSecs)
+            time.sleep(pauseSecs)
+            waitedSecs += pauseSecs
+            intervalSecs = min(self.SLIVERSTATUS_POLL_INTERVAL_SEC, intervalSecs * self.DCN_POLL_BACKOFF)
+
+            # generate args for sliverstatus
+            if self.api_version == 2:
+                opName = 'sliverstatus'
+            else:
+                opName = 'status'
+            if opts.warn:
+                omniargs = [ '-V%d' % self.api_version, '--raise-error-on-v2-amapi-error', '-a', self.url, opName, slicename]
+            else:
+                omniargs = ['-o', '-V%d' % self.api_version, '--raise-error-on-v2-amapi-error', '-a', self.url, opName, slicename]
+            result = None
+            try:
+                tries = tries + 1
+                # FIXME: shouldn't ctr be based on tries here?
+                # FIXME: Big hack!!!
+                if not opts.fakeModeDir:
+                    (text, result) = self.doAMAPICall(omniargs, opts, opName, slicename, ctr, suppressLogs=True)
+                    self.logger.debug("handleDcn %s %s at %s got: %s", opName, slicename, self, text)
+            except Exception, e:
+                # exit gracefully
+                # FIXME: to SCS excluding this hop? to user? This could be some transient thing, such that redoing
+                # circuit as is would work. Or it could be something permanent. How do we know?
+                self.lastError = "%s %s failed at %s: %s" % (opName, slicename, self, e)
+                raise StitchingError(self.lastError)
+
+            dcnErrors = dict() # geni_error by geni_urn of individual resource
+            # DCN circuit ID by geni_urn (one parsed from the other)
+            # These should match the globalIDs on the hops at this AM.
+            circuitIDs = dict()
+            statuses = dict() # per sliver status
+
+            # Parse out sliver status / status
+            if isinstance(result, dict) and result.has_key(self.url) and result[self.url] and \
+                    isinstance(result[self.url], dict):
+                if self.api_version == 2:
+
+                    # Save off the sliver expiration if found
+                    self.setSliverExpirations(expires_from_status(result[self.url], self.logger))
+
+                    if result[self.url].has_key("geni_status"):
+                        status = result[self.url]["geni_status"]
+                    else:
+                        # else malformed
+                        self.lastError = "%s had malformed %s result in handleDCN" % (self, opName)
+                        raise StitchingError(self.lastError)
+                    # Get any geni_error string
+                    if result[self.url].has_key("geni_resources") and \
+                            isinstance(result[self.url]["geni_resources"], list) and \
+                            len(result[self.url]["geni_resources"]) > 0:
+                        for resource in result[self.url]["geni_resources"]:
+                            if not isinstance(resource, dict) and not resource.has_key("geni_urn"):
+                                self.logger.debug("Malformed sliverstatus - resource not a dict or has no geni_urn: %s", str(resource))
+                                continue
+                            urn = resource["geni_urn"]
+                            if urn:
+                                circuitid = None
+                                import re
+                                match = re.match("^urn:publicid:IDN\+[^\+]+\+sliver\+[^\+]+\-(\d+)$", urn)
+                                if match:
+                                    circuitid = match.group(1).strip()
+                                    self.logger.debug("Found circuit '%s'", circuitid)
+                                else:
+                                    self.logger.debug("Found no geni_urn match? URN: %s", urn)
+                                circuitIDs[urn] = circuitid
+                                if resource.has_key("geni_error"):
+                                    dcnErrors[urn] = resource["geni_error"]
+                                    self.logger.debug("Found geni_error '%s' for circuit %s", dcnErrors[urn], circuitid)
+                                else:
+                                    self.logger.debug("Malformed sliverstatus missing geni_error tag: %s", str(resource))
+                                    dcnErrors[urn] = None
+
+                                if resource.has_key("geni_status"):
+                                    statuses[urn] = resource["geni_status"]
+                                    self.logger.debug("Found status '%s' for sliver %s (circuit %s)", statuses[urn], urn, circuitid)
+                                    # Ticket #731
+                                    if str(statuses[urn]).strip().lower() != 'ready' and str(status).strip().lower() == 'ready':
+                                        self.logger.debug("Resetting global status from '%s' to '%s' because of sliver %s", status, statuses[urn], urn)
+                                        status = str(statuses[urn])
+                                else:
+                                    self.logger.debug("Malformed sliverstatus missing geni_status: %s", str(resource))
+                                    statuses[urn] = status
+                            else:
+                                self.logger.debug("Malformed sliverstatus has empty geni_urn: %s", str(resource))
+                else:
+                    if result[self.url].has_key("value") and isinstance(result[self.url]["value"], dict) and \
+                            result[self.url]["value"].has_key("geni_slivers") and isinstance(result[self.url]["value"]["geni_slivers"], list):
+
+                        # Want to do something like this, but _getSliverExpirations is in amhandler
+                        # Put it in handler_utils? Requires _datetimeFromString and getSliverResultList
+                        # And maybe make it called by expires_from_status?
+#                        (orderedDates, sliverExps) = handler_utils._getSliverExpirations(result[self.url]["value"], None)
+#                        self.sliverExpirations = orderedDates
+                        # For now, reproduce the stuff I care about here
+                        expirations = []
+                        for sliver in result[self.url]["value"]["geni_slivers"]:
+                            if isinstance(sliver, dict) and sliver.has_key("geni_expires"):
+                                sliver_expires = sliver['geni_expires']
+                                if isinstance(sliver_expires, str):
+                                    # parse it
+                                    expObj = _naiveUTCFromString(sliver_expires)
+                                    if expObj and expObj not in expirations:
+                                        expirations.append(expObj)
+                        self.setSliverExpirations(expirations)
+
+                        for sliver in result[self.url]["value"]["geni_slivers"]:
+                            if isinstance(sliver, dict) and sliver.has_key("geni_allocation_status"):
+                                status = sliver["geni_allocation_status"]
+                                dcnerror = None
+                                if sliver.has_key("geni_error"):
+                                    dcnerror = sliver["geni_error"]
+                                if sliver.has_key("geni_sliver_urn"):
+                                    urn = sliver["geni_sliver_urn"]
+                                    if urn:
+                                        import re
+                                        statuses[urn] = status
+                                        circuitid = None
+                                        match = re.match("^urn:publicid:IDN\+[^\+]+\+sliver\+[^\+]+\-(\d+)$", urn)
+                                        if match:
+                                            circuitid = match.group(1).strip()
+                                            self.logger.debug("Found circuit '%s'", circuitid)
+                                        else:
+                                            self.logger.debug("Found no geni_urn match? URN: %s", urn)
+                                        circuitIDs[urn] = circuitid
+                                        dcnErrors[urn] = dcnerror
+                                    else:
+                                        self.logger.debug("Malformed sliverstatus has empty sliver_urn: %s", str(sliver))
+                                else:
+                                    self.logger.debug("Malformed sliverstatus has no geni_sliver_urn: %s", str(sliver))
+
+                                break # FIXME: This stops at the first sliver. Can we do better? Ticket 261
+                            else:
+                                self.logger.debug("Malformed sliverstatus has non dict sliver entry or entry with no geni_allocation_status: %s", str(sliver))
+                        # FIXME: Which sliver(s) do I look at?
+                        # 1st? look for any not ready and take that?
+                        # And pull out any geni_error
+                        # FIXME FIXME
+                        # FIXME: I don't really know how AMs will do v3 status' so wait
+                    else:
+                        # malformed
+                        self.lastError = "%s sent malformed %s result in handleDCN" % (self, opName)
+                        raise StitchingError(self.lastError)
+            else:
+                # FIXME FIXME Big hack
+                if not opts.fakeModeDir:
+                    # malformed
+                    self.lastError = "%s sent malformed %s result in handleDCN" % (self, opName)
+                    raise StitchingError(self.lastError)
+
+            # FIXME: Big hack!!!
+            if opts.fakeModeDir:
+                status = 'ready'
+
+            status = str(status).lower().strip()
+            if status in ('failed', 'ready', 'geni_allocated', 'geni_provisioned', 'geni_failed', 'geni_notready', 'geni_ready'):
+                break
+            for entry in circuitIDs.keys():
+                circuitid = circuitIDs[entry]
+                dcnerror = dcnErrors[entry]
+                status = statuses[entry]
+                if dcnerror and dcnerror.strip() != '':
+                    if circuitid:
+                        self.logger.info("%s: %s is (still) %s at %s. Had error message: %s", opName, circuitid, status, self, dcnerror)
+                    else:
+                        self.logger.info("%s is (still) %s at %s. Had error message: %s", opName, status, self, dcnerror)
+        # End of while loop getting sliverstatus
+        return (status, circuitIDs, dcnErrors, statuses)
+
     def handleSuggestedVLANNotRequest(self, opts, slicename):
         # FIXME FIXME FIXME
         # Ticket 261
@@ -3954,6 +4144,18 @@ class Aggregate(object):
 
     def deleteReservation(self, opts, slicename):
         '''Delete any previous reservation/manifest at this AM'''
+        self.markForDelete()
+        try:
+            self.inProcess = True
+            (text, result) = self.callDelete(opts, slicename)
+        finally:
+            self.inProcess = False
+        self.noteDeleted(datetime.datetime.utcnow())
+        return text, result
+
+    def markForDelete(self):
+        '''Mark this AM and the AMs that depend on it as needing to be redone,
+        before deleting the reservation here.'''
         self.completed = False
 
         # Now mark all AMs that depend on this AM as incomplete, so we'll try them again
@@ -3964,8 +4166,11 @@ class Aggregate(object):
         for agg in self.isDependencyFor:
             agg.completed = False
 
-        # FIXME: Set a flag marking it is being deleted? Set inProcess?
-
+    def callDelete(self, opts, slicename):
+        '''Make the call to delete the reservation at this AM.
+        Returns the omni call (text, result); raises a StitchingError if the delete failed.
+        Does not change this Aggregate, so may run on a helper thread (see Teardown):
+        after a successful delete, call noteDeleted.'''
         # Delete the previous reservation
         # FIXME: Do we do something with log level or log format or file for omni calls?
         # FIXME: Supply --raiseErrorOnAMAPIV2Error?
@@ -3984,10 +4189,8 @@ class Aggregate(object):
         self.logger.info("Doing %s at %s...", opName, self)
         if not opts.fakeModeDir:
             try:
-                self.inProcess = True
 #                (text, (successList, fail)) = self.doOmniCall(omniargs, opts)
                 (text, result) = self.doAMAPICall(omniargs, opts, opName, slicename, 1, suppressLogs=True)
-                self.inProcess = False
                 if self.api_version == 2:
                     (successList, fail) = result
                     if self.url in fail or (len(successList) == 0 and len(fail) > 0):
@@ -4029,7 +4232,6 @@ class Aggregate(object):
                             raise StitchingError("Failed to delete prior reservation at %s (malformed return): %s" % (self, text))
 
             except OmniError, e:
-                self.inProcess = False
                 noError = False
                 if isinstance(e, AMAPIError):
                     ae = e
@@ -4061,11 +4263,13 @@ class Aggregate(object):
                     self.logger.error("Failed to %s at %s: %s", opName, self, e)
                     raise StitchingError(e) # FIXME: Right way to re-raise?
 
-        self.inProcess = False
         # FIXME: Fake mode delete results from a file?
+        return text, result
 
+    def noteDeleted(self, deletedAt):
+        '''Clear the state of the reservation deleted here at the given time'''
         # Set a flag marking this AM was deleted
-        self.deletedResAt = datetime.datetime.utcnow()
+        self.deletedResAt = deletedAt
         # self.logger.debug("Noted deleted reservation: %s", self.deletedResAt)
 
         # Clear old manifests
@@ -4076,7 +4280,6 @@ class Aggregate(object):
 
         # Clear old expirations so our end-run printout doesn't include this
         self.sliverExpirations = []
-        return text, result
 
     def doAvail(self, opts):
         # If the AM type support real avail (PG and GRAM only currently) and we are not requesting 'any' from some
@@ -4106,6 +4309,64 @@ class Aggregate(object):
         # This should be cases where all hops at this AM are requesting 'any' or import from another hop at the same AM
         return False
 
+    def requestedVLANs(self):
+        '''The VLAN tags the hops at this AM will request, by hop link URN, to
+        check with requestedVLANsAvailable. None if this AM cannot tell us if
+        they are available: it does not report accurate availability, or no hop
+        requests a specific tag.'''
+        # FIXME: Do not hard-code which AM types support this (see doAvail)
+        if not (self.isPG or self.isGRAM):
+            return None
+        tagsByHop = dict()
+        for hop in self._hops:
+            tags = hop._hop_link.vlan_suggested_request
+            if tags and tags != VLANRange.fromString("any"):
+                tagsByHop[hop._hop_link.urn] = tags
+        if len(tagsByHop) == 0:
+            return None
+        return tagsByHop
+
+    def requestedVLANsAvailable(self, opts, tagsByHop=None):
+        '''Are the VLAN tags the hops at this AM will request (or tagsByHop, as
+        from requestedVLANs) currently available here?
+        Return True or False, or None if this AM cannot tell us: it does not report
+        accurate availability, no hop requests a specific tag, or none of those hops
+        are in the advertisement.
+        Given tagsByHop, changes and reads nothing of the hops here, so may
+        run on a helper thread (see ReleaseWaiter).'''
+        if tagsByHop is None:
+            tagsByHop = self.requestedVLANs()
+            if tagsByHop is None:
+                return None
+        try:
+            rspec = self.callListResources(opts)
+        except StitchingError, se:
+            self.logger.debug("Failed to list avail resources: %s", se)
+            return None
+        if rspec is None:
+            return None
+        try:
+            from xml.dom.minidom import parseString
+            dom = parseString(rspec)
+        except Exception, e:
+            self.logger.debug("Failed to parse rspec: %s", e)
+            return None
+        found = False
+        for port in dom.getElementsByTagName(defs.PORT_TAG):
+            for child in port.childNodes:
+                if child.localName == defs.LINK_TAG:
+                    hLink = HopLink.fromDOM(child)
+                    tags = tagsByHop.get(hLink.urn)
+                    if tags is None:
+                        continue
+                    found = True
+                    if not tags.issubset(hLink.vlan_range_request):
+                        self.logger.debug("%s still has tag(s) %s in use at %s", self, tags.difference(hLink.vlan_range_request), hLink.urn)
+                        return False
+        if not found:
+            return None
+        return True
+
     def updateWithAvail(self, opts):
         # Update our hops availRange based on what is currently avail
         # Return True if updated some avail Ranges
@@ -4191,7 +4452,15 @@ class Aggregate(object):
         # Else list resources currently available at this AM (--available)
         # Return is the RSpec.
         # Raise StitchingError if fail
+        try:
+            self.inProcess = True
+            return self.callListResources(opts, slicename)
+        finally:
+            self.inProcess = False
 
+    def callListResources(self, opts, slicename=None):
+        # As listResources, but without marking this AM in process:
+        # changes nothing here, so may run on a helper thread
         opName = 'listresources'
         if self.api_version > 2 and slicename is not None:
             opName = 'describe'
@@ -4207,9 +4476,7 @@ class Aggregate(object):
         self.logger.debug("Doing %s at %s...", opName, self)
         if not opts.fakeModeDir:
             try:
-                self.inProcess = True
                 (text, result) = self.doAMAPICall(omniargs, opts, opName, slicename, 1, suppressLogs=True)
-                self.inProcess = False
                 if self.api_version == 2:
                     if not isinstance(result, dict) or len(result.values()) != 1:
                         raise StitchingError("Failed to list resources at %s (malformed APIv2 return): %s" % (self, text))
@@ -4241,11 +4508,9 @@ class Aggregate(object):
                             raise StitchingError("Failed to list resources at %s (malformed APIv3 return didn't have a value): %s" % (self, text))
 
             except OmniError, e:
-                self.inProcess = False
                 self.logger.error("Failed to %s at %s: %s", opName, self, e)
                 raise StitchingError(e) # FIXME: Right way to re-raise?
 
-        self.inProcess = False
         return rspec
 
     # This needs to handle createsliver, allocate, sliverstatus, listresources at least
@@ -4286,8 +4551,14 @@ class Aggregate(object):
 #        if suppressLogs and not opts.debug:
 #            logging.disable(logging.INFO)
         res = None
+        session = getattr(Aggregate._threadSession, 'session', None)
+        if session is None:
+            session = Aggregate.omniSession
         try:
-            res = omni.call(args, opts)
+            if session is not None:
+                res = session.call(args, opts)
+            else:
+                res = omni.call(args, opts)
         except:
             raise
 #        finally:
@@ -4365,10 +4636,50 @@ class Aggregate(object):
             result = resultsString
         return ("Fake %s at %s from file %s" % (opName, self.url, resultPath), result)
 
+class AggregateIndex(object):
+    '''Index of a list of Aggregates by URN and by URN synonym, to find the
+    Aggregate in the list for the same AM as some other Aggregate (like
+    the Aggregate from before a new SCS call).'''
+
+    def __init__(self, aggs):
+        self.aggs = list(aggs)
+        self._byURN = dict()
+        self._bySynonym = dict()
+        for (pos, agg) in enumerate(self.aggs):
+            self._byURN.setdefault(agg.urn, []).append(pos)
+            for urn in set([agg.urn] + agg.urn_syns):
+                self._bySynonym.setdefault(urn, []).append(pos)
+
+    def findSame(self, agg):
+        '''First Aggregate in the list whose URN is the URN of agg or one of
+        its URN synonyms, or which has the URN of agg as a synonym. Else None.'''
+        positions = list(self._bySynonym.get(agg.urn, []))
+        for urn in agg.urn_syns:
+            positions += self._byURN.get(urn, [])
+        if not positions:
+            return None
+        return self.aggs[min(positions)]
+
+    def findSharingURN(self, agg):
+        '''First Aggregate in the list with a URN or URN synonym in common with agg. Else None.'''
+        positions = []
+        for urn in set([agg.urn] + agg.urn_syns):
+            positions += self._bySynonym.get(urn, [])
+        if not positions:
+            return None
+        return self.aggs[min(positions)]
+
 class Hop(object):
     # A hop on a path in the stitching element
     # Note this is path specific (and has a path reference)
 
+    # There are many hops in a big topology
+    __slots__ = ('_id', '_hop_link', '_next_hop', '_path', '_aggregate', '_import_vlans',
+                 '_dependencies', 'idx', 'import_vlans_from', 'globalId', 'loose',
+                 'excludeFromSCS', 'vlans_unavailable')
+
+    logger = logging.getLogger('stitch.Hop')
+
     # XML tag constants
     ID_TAG = 'id'
     TYPE_TAG = 'type'
@@ -4379,7 +4690,7 @@ class Hop(object):
     def fromDOM(cls, element):
         """Parse a stitching hop from a DOM element."""
         # FIXME: getAttributeNS?
-        id = element.getAttribute(cls.ID_TAG)
+        id = internName(element.getAttribute(cls.ID_TAG))
         isLoose = False
         if element.hasAttribute(cls.TYPE_TAG):
             hopType = element.getAttribute(cls.TYPE_TAG)
@@ -4391,7 +4702,7 @@ class Hop(object):
             if child.localName == cls.LINK_TAG:
                 hop_link = HopLink.fromDOM(child)
             elif child.localName == cls.NEXT_HOP_TAG:
-                next_hop = child.firstChild.nodeValue
+                next_hop = internName(child.firstChild.nodeValue)
                 if next_hop == 'null':
                     next_hop = None
         hop = Hop(id, hop_link, next_hop)
@@ -4408,7 +4719,6 @@ class Hop(object):
         self._import_vlans = False
         self._dependencies = []
         self.idx = None
-        self.logger = logging.getLogger('stitch.Hop')
         self.import_vlans_from = None # a pointer to another hop
         self.globalId = None
 
@@ -4422,7 +4732,8 @@ class Hop(object):
         # VLANs we know are not possible here - cause of VLAN_UNAVAILABLE
         # or cause a suggested was not picked.
         # Use this to avoid picking these later
-        self.vlans_unavailable = VLANRange()
+        # (Starts as the shared empty range)
+        self.vlans_unavailable = VLANRange.fromString("")
 
     def __str__(self):
         return "<Hop %r on path %r>" % (self.urn, self._path.id)
@@ -4491,10 +4802,31 @@ class RSpec(GENIObject):
         self._nodes = []
         self._links = [] # Main body links
         # DOM used to construct this: edits to objects are not reflected here
-        self.dom = None
+        self._dom = None
+        # RSpec text to build the DOM from when first needed
+        self._domSource = None
         # Note these are not Aggregate objects to avoid any loops
         self.amURNs = set() # AMs mentioned in the RSpec
 
+    @property
+    def dom(self):
+        # The parser does not build a DOM; most parsed RSpecs
+        # (like AM manifests) never need one
+        if self._dom is None and self._domSource is not None:
+            self._dom = parseString(self._domSource)
+            self._domSource = None
+        return self._dom
+
+    @dom.setter
+    def dom(self, dom):
+        self._dom = dom
+        self._domSource = None
+
+    def setDomSource(self, rspecString):
+        '''Build the DOM of this RSpec from the given RSpec string when first needed.'''
+        self._dom = None
+        self._domSource = rspecString
+
     @property
     def nodes(self):
         return self._nodes
@@ -4558,6 +4890,8 @@ class RSpec(GENIObject):
         return dom
 
 class Node(GENIObject):
+    __slots__ = ('id', 'amURN', 'interface_ids')
+
     CLIENT_ID_TAG = 'client_id'
     COMPONENT_MANAGER_ID_TAG = 'component_manager_id'
     INTERFACE_TAG = "interface"
@@ -4566,16 +4900,16 @@ class Node(GENIObject):
     def fromDOM(cls, element):
         """Parse a Node from a DOM element."""
         # FIXME: getAttributeNS?
-        client_id = element.getAttribute(cls.CLIENT_ID_TAG)
+        client_id = internName(element.getAttribute(cls.CLIENT_ID_TAG))
         amID = None
         if element.hasAttribute(cls.COMPONENT_MANAGER_ID_TAG):
-            amID = element.getAttribute(cls.COMPONENT_MANAGER_ID_TAG)
+            amID = internName(element.getAttribute(cls.COMPONENT_MANAGER_ID_TAG))
         # Get the interfaces. Need those to get the client_id so from the link I can find the AM
         ifcs = []
         for child in element.childNodes:
             if child.localName == cls.INTERFACE_TAG:
                 if child.hasAttribute(cls.CLIENT_ID_TAG):
-                    ifcs.append(child.getAttribute(cls.CLIENT_ID_TAG))
+                    ifcs.append(internName(child.getAttribute(cls.CLIENT_ID_TAG)))
         return Node(client_id, amID, ifcs)
 
     def __init__(self, client_id, amID, ifc_ids = []):
@@ -4586,6 +4920,8 @@ class Node(GENIObject):
 
 class LinkProperty(GENIObject):
     # A property element inside a main body link
+    __slots__ = ('source_id', 'dest_id', 'latency', 'packet_loss', 'capacity', 'link')
+
     CAPACITY_TAG = "capacity"
     DEST_TAG = "dest_id" # node interface or 1 of the interface_ref elements
     LATENCY_TAG = "latency" # 0
@@ -4649,6 +4985,7 @@ class Link(GENIObject):
 
     __ID__ = validateTextLike
     __simpleProps__ = [ ['client_id', str]]
+    __slots__ = ('id', '_aggregates', '_interfaces', '_props', 'hasSharedVlan', 'typeName')
 
     # XML tag constants
     CLIENT_ID_TAG = 'client_id'
@@ -4666,7 +5003,7 @@ class Link(GENIObject):
     def fromDOM(cls, element):
         """Parse a Link from a DOM element."""
         # FIXME: getAttributeNS?
-        client_id = element.getAttribute(cls.CLIENT_ID_TAG)
+        client_id = internName(element.getAttribute(cls.CLIENT_ID_TAG))
         refs = []
         aggs = []
         props = []
@@ -4680,7 +5017,7 @@ class Link(GENIObject):
                     aggs.append(agg)
             elif child.localName == cls.INTERFACE_REF_TAG:
                 # FIXME: getAttributeNS?
-                c_id = child.getAttribute(cls.CLIENT_ID_TAG)
+                c_id = internName(child.getAttribute(cls.CLIENT_ID_TAG))
                 ir = InterfaceRef(c_id)
                 refs.append(ir)
             # If the link has the shared_vlan extension, note this - not a stitching reason
@@ -4697,9 +5034,9 @@ class Link(GENIObject):
                 pl = None
                 cap = None
                 if child.hasAttribute(LinkProperty.DEST_TAG):
-                    d_id = child.getAttribute(LinkProperty.DEST_TAG)
+                    d_id = internName(child.getAttribute(LinkProperty.DEST_TAG))
                 if child.hasAttribute(LinkProperty.SOURCE_TAG):
-                    s_id = child.getAttribute(LinkProperty.SOURCE_TAG)
+                    s_id = internName(child.getAttribute(LinkProperty.SOURCE_TAG))
                 if child.hasAttribute(LinkProperty.LATENCY_TAG):
                     lat = child.getAttribute(LinkProperty.LATENCY_TAG)
                 if child.hasAttribute(LinkProperty.PACKETLOSS_TAG):
@@ -4765,6 +5102,8 @@ class Link(GENIObject):
 
 
 class InterfaceRef(object):
+     __slots__ = ('client_id',)
+
      def __init__(self, client_id):
          self.client_id = client_id
 
@@ -4784,11 +5123,17 @@ class HopLink(object):
     SCSI_L2_TAG = 'switchingCapabilitySpecificInfo_L2sc'
     SCSI_OFL2_TAG = 'switchingCapabilitySpecificInfo_OpenflowL2sc'
 
+    __slots__ = ('urn', 'vlan_xlate', 'vlan_range_request', 'scs_vlan_range_request',
+                 'vlan_suggested_request', 'vlan_range_manifest', 'vlan_suggested_manifest',
+                 'vlan_producer', 'vlan_consumer', 'capabilities', 'isOF', 'controllerUrl', 'ofAMUrl')
+
+    logger = logging.getLogger('stitch.HopLink')
+
     @classmethod
     def fromDOM(cls, element):
         """Parse a stitching path from a DOM element."""
         # FIXME: getAttributeNS?
-        id = element.getAttribute(cls.ID_TAG)
+        id = internName(element.getAttribute(cls.ID_TAG))
         # FIXME: getElementsByTagNameNS?
         vlan_xlate = element.getElementsByTagName(cls.VLAN_TRANSLATION_TAG)
         vlan_translate = False
@@ -4879,8 +5224,6 @@ class HopLink(object):
         self.controllerUrl = None
         self.ofAMUrl = None
 
-        self.logger = logging.getLogger('stitch.HopLink')
-
     def editChangesIntoDom(self, domNode, request=True):
         '''Edit any changes made in this element into the given DomNode'''
         # Note that the parent RSpec object's dom is not touched, unless this domNode is from that
@@ -0,0 +1,200 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''Wait for aggregates to free the VLAN tags of failed or deleted reservations.
+
+After a VLAN unavailable failure the stitcher pauses before trying
+again, to let aggregates put the resources of deleted reservations back
+in the pool. Rather than always sleeping the full pause, aggregates that
+report accurate VLAN availability (see Aggregate.requestedVLANsAvailable)
+are probed concurrently, backing off between probes, and the wait ends
+as soon as the tags they will request are all available again. The
+full pause is still the most we wait, and is what we wait for an
+aggregate that cannot be probed (like a DCN AM, whose routers reset
+after the reservation is gone).
+
+The time each aggregate took to free its tags is remembered across
+runs, so later waits probe first around when that AM usually frees them.
+
+The tags to check are read from the aggregate before its probe starts,
+and each probe calls the AM in its own Omni session (see
+Aggregate.forkSession), so probes do not touch the Aggregates, which
+the stitching thread keeps using.'''
+
+from __future__ import absolute_import
+
+import datetime
+import json
+import logging
+import os
+import threading
+
+from .utils import prependFilePrefix
+
+class ReleaseWaiter(object):
+    '''Wait until aggregates have freed the VLAN tags we will request there.
+
+    Call wait from the thread driving the stitching.'''
+
+    FIRST_PROBE_SECS = 5 # First probe of an AM with no history
+    MAX_PROBE_INTERVAL_SEC = 30
+    PROBE_BACKOFF = 1.5 # Multiply the interval by this after each probe finding tags in use
+    HISTORY_SIZE = 10 # Release times remembered per AM
+    HISTORY_FILENAME = "~/.gcf/stitcher-release-times.json"
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger('stitch.releasewaiter')
+        self._cond = threading.Condition()
+        # AM URN -> list of recent seconds taken to free its tags
+        self._history = None
+        self._historyFile = None
+        self._historyChanged = False
+
+    def _loadHistory(self, opts):
+        if self._history is not None:
+            return
+        self._history = dict()
+        self._historyFile = prependFilePrefix(opts.fileDir, self.HISTORY_FILENAME)
+        if not os.path.exists(self._historyFile):
+            return
+        try:
+            with open(self._historyFile, 'r') as file:
+                history = json.load(file)
+            if isinstance(history, dict):
+                self._history = history
+        except Exception, e:
+            self.logger.debug("Failed to read AM release times from %s: %s", self._historyFile, e)
+
+    def _saveHistory(self):
+        histDir = os.path.dirname(self._historyFile)
+        try:
+            if not os.path.exists(histDir):
+                os.makedirs(histDir)
+            with open(self._historyFile, 'w') as file:
+                json.dump(self._history, file)
+        except Exception, e:
+            self.logger.debug("Failed to save AM release times to %s: %s", self._historyFile, e)
+
+    def typicalReleaseSecs(self, agg):
+        '''Median seconds this AM took to free its tags in recent waits, or None if unknown.'''
+        with self._cond:
+            times = (self._history or {}).get(agg.urn)
+            if not times:
+                return None
+            times = sorted(times)
+            return times[len(times) / 2]
+
+    def _record(self, agg, secs):
+        with self._cond:
+            times = self._history.setdefault(agg.urn, [])
+            times.append(round(secs, 1))
+            del times[:-self.HISTORY_SIZE]
+            self._historyChanged = True
+
+    def wait(self, waits, opts, timeoutTime=datetime.datetime.max):
+        '''Wait for each (aggregate, maxSecs) pair until that aggregate has freed the
+        tags its hops will request, or for maxSecs if it cannot be probed.
+        Never wait past timeoutTime. Returns the number of seconds waited.'''
+        start = datetime.datetime.utcnow()
+        with self._cond:
+            self._loadHistory(opts)
+        states = []
+        for (agg, maxSecs) in waits:
+            deadline = min(start + datetime.timedelta(seconds=maxSecs), timeoutTime)
+            state = {'agg': agg, 'deadline': deadline, 'done': False}
+            states.append(state)
+            if agg.dcn:
+                # Nothing the AM reports says when its routers are ready again
+                continue
+            tagsByHop = agg.requestedVLANs()
+            if tagsByHop is None:
+                # Cannot tell: wait the full pause for this AM
+                self.logger.debug("Cannot check whether %s freed its VLAN tags", agg)
+                continue
+            session = None
+            if not opts.fakeModeDir:
+                session = agg.forkSession()
+            thread = threading.Thread(target=self._probe, args=(state, tagsByHop, session, start, opts),
+                                      name="release-%s" % (agg.nick or agg.urn))
+            thread.daemon = True
+            thread.start()
+        with self._cond:
+            while True:
+                now = datetime.datetime.utcnow()
+                waiting = [s for s in states if not s['done'] and now < s['deadline']]
+                if not waiting:
+                    break
+                left = max([s['deadline'] for s in waiting]) - now
+                # Wake at least once a second, so Ctrl-C is not held up
+                self._cond.wait(min(1, left.days * 86400 + left.seconds + left.microseconds / 1000000.0))
+            for state in states:
+                # Tell probes still running to stop
+                state['done'] = True
+        with self._cond:
+            if self._historyChanged:
+                self._saveHistory()
+                self._historyChanged = False
+        waited = datetime.datetime.utcnow() - start
+        return waited.days * 86400 + waited.seconds + waited.microseconds / 1000000.0
+
+    def _probe(self, state, tagsByHop, session, start, opts):
+        '''Probe one aggregate with backoff until its tags are free, it cannot tell us, or we stop.'''
+        agg = state['agg']
+        if session is not None:
+            agg.useThreadSession(session)
+        typical = self.typicalReleaseSecs(agg)
+        if typical is not None:
+            # Start just before this AM usually has its tags free
+            interval = max(self.FIRST_PROBE_SECS, 0.8 * typical)
+        else:
+            interval = self.FIRST_PROBE_SECS
+        nextProbe = start + datetime.timedelta(seconds=interval)
+        while True:
+            with self._cond:
+                while not state['done']:
+                    now = datetime.datetime.utcnow()
+                    if now >= nextProbe or now >= state['deadline']:
+                        break
+                    left = min(nextProbe, state['deadline']) - now
+                    self._cond.wait(left.days * 86400 + left.seconds + left.microseconds / 1000000.0)
+                if state['done'] or datetime.datetime.utcnow() >= state['deadline']:
+                    return
+            try:
+                free = agg.requestedVLANsAvailable(opts, tagsByHop)
+            except Exception, e:
+                self.logger.debug("Failed to check whether %s freed its VLAN tags: %s", agg, e)
+                free = None
+            if free is None:
+                # Cannot tell: wait the full pause for this AM
+                self.logger.debug("Cannot check whether %s freed its VLAN tags", agg)
+                return
+            if free:
+                elapsed = datetime.datetime.utcnow() - start
+                secs = elapsed.days * 86400 + elapsed.seconds + elapsed.microseconds / 1000000.0
+                self.logger.info("%s freed its VLAN tags after %d seconds", agg, secs)
+                self._record(agg, secs)
+                with self._cond:
+                    state['done'] = True
+                    self._cond.notifyAll()
+                return
+            interval = min(self.MAX_PROBE_INTERVAL_SEC, interval * self.PROBE_BACKOFF)
+            nextProbe = datetime.datetime.utcnow() + datetime.timedelta(seconds=interval)
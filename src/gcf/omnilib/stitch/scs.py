@@ -79,10 +79,14 @@ class Result(object):
 
 # FIXME: Support authentication by the service at some point
 class Service(object):
-    def __init__(self, url, key=None, cert=None, timeout=None, verbose=False):
+    def __init__(self, url, key=None, cert=None, timeout=None, verbose=False, cache=None):
         self.url = url
         self.timeout=timeout
         self.verbose=verbose
+        # Optional SCSResultCache of ComputePath results
+        self.cache = cache
+        # Did the last ComputePath use a cached result
+        self.fromCache = False
         if isinstance(url, unicode):
             url2 = url.encode('ISO-8859-1')
         else:
@@ -126,8 +130,10 @@ class Service(object):
     def ComputePath(self, slice_urn, request_rspec, options, savedFile=None):
         """Invoke the XML-RPC service with the request rspec.
         Create an SCS PathInfo from the result.
+        Use a cached result if there is a cache with a current result for this request.
         """
         result = None
+        self.fromCache = False
         if savedFile and os.path.exists(savedFile) and os.path.getsize(savedFile) > 0:
             # read it in
             try:
@@ -139,6 +145,11 @@ class Service(object):
                 import traceback
                 print "ERROR", e, traceback.format_exc()
                 raise
+        cacheKey = None
+        if result is None and self.cache is not None:
+            cacheKey = self.cache.key(self.url, request_rspec, options)
+            result = self.cache.get(cacheKey)
+            self.fromCache = result is not None
         if result is None:
             server = make_client(self.url, keyfile=self.key, certfile=self.cert, verbose=self.verbose, timeout=self.timeout)
             arg = dict(slice_urn=slice_urn, request_rspec=request_rspec,
@@ -156,7 +167,10 @@ class Service(object):
         self.result = result # save the raw result for stitchhandler to print
         geni_result = Result(result) # parse result
         if geni_result.isSuccess():
-            return PathInfo(geni_result.value())
+            pathInfo = PathInfo(geni_result.value())
+            if cacheKey is not None and not self.fromCache:
+                self.cache.put(cacheKey, result)
+            return pathInfo
         else:
                 # when there is no route I seem to get:
 #{'geni_code': 3} MxTCE ComputeWorker return error message ' Action_ProcessRequestTopology_MP2P::Finish() Cannot find the set of paths for the RequestTopology. '.
@@ -0,0 +1,162 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''On disk cache of SCS ComputePath results.
+
+A ComputePath call takes seconds, and a stitcher retry or a repeated run
+of the same topology often sends the same request with the same options.
+Successful results are saved in files named by a hash of the SCS URL,
+the normalized request RSpec and the options (hop exclusions and
+inclusions, VLAN tags to avoid), and reused until they are older than
+the cache's time to live.'''
+
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import time
+from xml.dom.minidom import parseString, Node as XMLNode
+
+try:
+    from ..util.json_encoding import DateTimeAwareJSONEncoder, DateTimeAwareJSONDecoder
+except:
+    from gcf.omnilib.util.json_encoding import DateTimeAwareJSONEncoder, DateTimeAwareJSONDecoder
+
+# Attributes of the request rspec element that do not change the path computed
+VOLATILE_RSPEC_ATTRIBUTES = ('generated', 'generated_by', 'expires')
+
+def _stripNodes(element):
+    '''Remove comments and whitespace only text from the given DOM element, recursively.'''
+    for child in list(element.childNodes):
+        if child.nodeType == XMLNode.COMMENT_NODE:
+            element.removeChild(child)
+        elif child.nodeType == XMLNode.TEXT_NODE and child.data.strip() == '':
+            element.removeChild(child)
+        elif child.nodeType == XMLNode.ELEMENT_NODE:
+            _stripNodes(child)
+
+def normalizeRequest(request_rspec):
+    '''Return the request RSpec string without comments, formatting whitespace
+    or generated timestamps, so equivalent requests compare equal.'''
+    try:
+        dom = parseString(request_rspec)
+    except Exception:
+        # Not XML we can parse: use as is
+        return request_rspec
+    _stripNodes(dom.documentElement)
+    for attr in VOLATILE_RSPEC_ATTRIBUTES:
+        if dom.documentElement.hasAttribute(attr):
+            dom.documentElement.removeAttribute(attr)
+    return dom.documentElement.toxml(encoding="utf-8")
+
+def _normalizeOptions(options):
+    '''Sort the lists in the SCS options, where order does not matter.'''
+    if isinstance(options, dict):
+        return dict([(k, _normalizeOptions(v)) for (k, v) in options.items()])
+    if isinstance(options, (list, tuple)):
+        return sorted([_normalizeOptions(v) for v in options])
+    return options
+
+class SCSResultCache(object):
+    '''Save and look up successful ComputePath results by request and options.'''
+
+    def __init__(self, cacheDir, ttlSecs, logger=None):
+        self.cacheDir = os.path.normpath(os.path.expanduser(cacheDir))
+        self.ttlSecs = ttlSecs
+        self.logger = logger
+
+    def key(self, scsURL, request_rspec, options):
+        '''The cache key for a ComputePath call'''
+        digest = hashlib.sha256()
+        digest.update(str(scsURL))
+        digest.update('\0')
+        digest.update(normalizeRequest(request_rspec))
+        digest.update('\0')
+        digest.update(json.dumps(_normalizeOptions(options), sort_keys=True, cls=DateTimeAwareJSONEncoder))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cacheDir, "scs-%s.json" % key)
+
+    def get(self, key):
+        '''Return the raw ComputePath result cached under this key, or None
+        if there is none younger than the time to live.'''
+        path = self._path(key)
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except OSError:
+            return None
+        if age > self.ttlSecs:
+            self._debug("Cached SCS result %s expired %d seconds ago", path, age - self.ttlSecs)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+        try:
+            with open(path, 'r') as file:
+                result = json.loads(file.read(), encoding='ascii', cls=DateTimeAwareJSONDecoder)
+        except Exception, e:
+            self._debug("Failed to read cached SCS result %s: %s", path, e)
+            return None
+        self._debug("Using cached SCS result %s from %d seconds ago", path, age)
+        return result
+
+    def put(self, key, result):
+        '''Cache this raw ComputePath result under this key.'''
+        path = self._path(key)
+        tmpPath = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            if not os.path.exists(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            with open(tmpPath, 'w') as file:
+                file.write(json.dumps(result, encoding='ascii', cls=DateTimeAwareJSONEncoder))
+            # Readers never see a partly written result
+            os.rename(tmpPath, path)
+        except Exception, e:
+            self._debug("Failed to cache SCS result in %s: %s", path, e)
+        self.prune()
+
+    def prune(self):
+        '''Remove the cached results older than the time to live,
+        so the cache directory does not grow without bound.'''
+        try:
+            filenames = os.listdir(self.cacheDir)
+        except OSError:
+            return
+        now = time.time()
+        for filename in filenames:
+            if not (filename.startswith("scs-") and (filename.endswith(".json") or filename.endswith(".tmp"))):
+                continue
+            path = os.path.join(self.cacheDir, filename)
+            try:
+                if now - os.path.getmtime(path) > self.ttlSecs:
+                    os.unlink(path)
+                    self._debug("Removed expired cached SCS result %s", path)
+            except OSError:
+                # Gone already, or not ours to remove
+                pass
+
+    def _debug(self, msg, *args):
+        if self.logger:
+            self.logger.debug(msg, *args)
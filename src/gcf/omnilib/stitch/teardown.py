@@ -0,0 +1,210 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''Concurrent teardown of the reservations from a failed stitching attempt.
+
+Deleting a reservation can take minutes at a busy AM (we retry while it
+is busy), and deleting at each aggregate in turn adds all those up.
+Instead every delete starts at once on its own thread, with its own
+deadline. Callers wait only for the aggregates they need done now; the
+others finish in the background, and an aggregate waits for any delete
+still running at its AM before making a new reservation there.
+
+A delete thread only makes the delete call, in its own Omni session
+(see Aggregate.forkSession). The Aggregate of a delete is only changed
+by the thread driving the stitching: when it starts the delete, and
+when it waits for it (clearing the deleted reservation's state).'''
+
+from __future__ import absolute_import
+
+import datetime
+import logging
+import sys
+import threading
+
+from .utils import StitchingError
+
+def deleteResultByURL(am, result):
+    '''Return the result struct entries for the return of a delete
+    (deletesliver in APIv2) at this aggregate, by AM URL.
+    For APIv2 the entry is True if the AM URL is in the success list,
+    False if it is in the failed list, and otherwise what the AM returned.
+    For APIv3 the entries are those of the Omni return struct.'''
+    if am.api_version < 3 or not isinstance(result, dict):
+        if not (isinstance(result, tuple) and isinstance(result[0], list)):
+            # Some kind of error
+            am.logger.debug("Struct result from delete or deletesliver unknown from %s: %s", am, result)
+            return {am.url: result}
+        (succ, fail) = result
+        # FIXME: Do the handler_utils tricks for comparing URLs?
+        if am.url in succ or am.alt_url in succ:
+            return {am.url: True}
+        if am.url in fail or am.alt_url in fail:
+            return {am.url: False}
+        am.logger.debug("Failed to find AM URL in v2 deletesliver return struct. AM %s, return %s", am, result)
+        return {am.url: result}
+    return dict(result)
+
+def deleteResultFailed(value):
+    '''Return True if this result struct entry of a delete (see deleteResultByURL)
+    shows the delete failed: a false value, a geni_code other than
+    0 (success), 12 (search failed) or 15 (not found), or a sliver
+    that is still allocated.'''
+    if not value:
+        return True
+    if isinstance(value, dict) and value.has_key('code') and isinstance(value['code'], dict) and value['code'].has_key('geni_code'):
+        if value['code']['geni_code'] not in (0, 12, 15):
+            return True
+        if value['code']['geni_code'] == 0 and value.has_key('value') and isinstance(value['value'], list) and len(value['value']) > 0:
+            try:
+                for sliver in value["value"]:
+                    if sliver["geni_allocation_status"] != 'geni_unallocated':
+                        return True
+            except:
+                # Malformed return I think
+                return True
+    # FIXME: Handle other cases...
+    return False
+
+class Teardown(object):
+    '''Run Aggregate.deleteReservation at many aggregates concurrently.
+
+    Call start and the waits from the thread driving the stitching.
+    Deletes are tracked per Aggregate instance, and found for a new
+    instance of the same AM (after a new SCS call) by URN synonym.'''
+
+    # Allowance for the delete call itself, on top of the time spent
+    # retrying while the AM is busy
+    DELETE_CALL_SECS = 180
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger('stitch.teardown')
+        self._cond = threading.Condition()
+        # Deletes not yet collected by a wait, in the order started:
+        # dict with 'am', 'deadline', 'done', 'deletedAt', 'text', 'result', 'excInfo'
+        self._deletes = []
+
+    def deadlineSecs(self, am):
+        '''Seconds to allow for a delete at this aggregate before giving up on it'''
+        return am.BUSY_MAX_TRIES * am.BUSY_POLL_INTERVAL_SEC + self.DELETE_CALL_SECS
+
+    def start(self, am, opts, slicename):
+        '''Start deleting the reservation at this aggregate, unless
+        a delete there is already running.'''
+        with self._cond:
+            if self._find(am) is not None:
+                self.logger.debug("Delete at %s already running", am)
+                return
+            deadline = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.deadlineSecs(am))
+            delete = {'am': am, 'deadline': deadline, 'done': False, 'deletedAt': None,
+                      'text': None, 'result': None, 'excInfo': None}
+            self._deletes.append(delete)
+        am.markForDelete()
+        session = None
+        if not opts.fakeModeDir:
+            session = am.forkSession()
+        thread = threading.Thread(target=self._run, args=(delete, session, opts, slicename),
+                                  name="delete-%s" % (am.nick or am.urn))
+        # Do not hold up exit for an AM that never answers
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, delete, session, opts, slicename):
+        text = None
+        result = None
+        excInfo = None
+        deletedAt = None
+        try:
+            if session is not None:
+                delete['am'].useThreadSession(session)
+            (text, result) = delete['am'].callDelete(opts, slicename)
+            deletedAt = datetime.datetime.utcnow()
+        except Exception:
+            excInfo = sys.exc_info()
+        with self._cond:
+            delete['deletedAt'] = deletedAt
+            delete['text'] = text
+            delete['result'] = result
+            delete['excInfo'] = excInfo
+            delete['done'] = True
+            self._cond.notifyAll()
+
+    def _find(self, am):
+        for delete in self._deletes:
+            if delete['am'] is am:
+                return delete
+        return None
+
+    def pending(self):
+        '''Return the aggregates with deletes not yet waited for.'''
+        with self._cond:
+            return [delete['am'] for delete in self._deletes]
+
+    def wait(self, am):
+        '''Block until the delete at this aggregate is done, or its deadline passes.
+
+        Returns (done, text, result, excInfo): the return of the delete call,
+        or the sys.exc_info() of what it raised. If the delete succeeded, the
+        Aggregate notes it (see Aggregate.noteDeleted). If the deadline passed,
+        done is False and the delete keeps running, to be waited for again later.'''
+        with self._cond:
+            delete = self._find(am)
+            if delete is None:
+                return (True, None, None, None)
+            while not delete['done']:
+                now = datetime.datetime.utcnow()
+                if now >= delete['deadline']:
+                    break
+                left = delete['deadline'] - now
+                # Wake at least once a second, so Ctrl-C is not held up
+                self._cond.wait(min(1, left.days * 86400 + left.seconds + left.microseconds / 1000000.0))
+            if not delete['done']:
+                return (False, None, None, None)
+            self._deletes.remove(delete)
+        if delete['excInfo'] is None:
+            am.noteDeleted(delete['deletedAt'])
+        return (True, delete['text'], delete['result'], delete['excInfo'])
+
+    def waitForAM(self, agg):
+        '''Wait for any delete still running at the AM of this Aggregate
+        (maybe an instance from an earlier attempt), before reserving there.
+        If that delete failed, timed out or the AM reported errors, warn and
+        raise a StitchingError, as for a delete with errors before a retry.'''
+        for am in self.pending():
+            if not (am is agg or am.urn == agg.urn or agg.hasURNSynonym(am.urn)):
+                continue
+            self.logger.info("Waiting for delete of previous reservation at %s to finish...", agg)
+            (done, text, result, excInfo) = self.wait(am)
+            if not done:
+                msg = "Timed out deleting reservation at %s" % am
+            elif excInfo is not None:
+                msg = "Failed to delete reservation at %s: %s" % (am, excInfo[1])
+            else:
+                failed = False
+                for value in deleteResultByURL(am, result).values():
+                    if deleteResultFailed(value):
+                        failed = True
+                if not failed:
+                    continue
+                msg = "Delete of reservation at %s had errors: %s" % (am, text)
+            self.logger.warn(msg)
+            raise StitchingError("Stitching failed. Would retry but delete had errors. %s" % msg)
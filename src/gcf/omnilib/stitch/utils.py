@@ -91,6 +91,24 @@ def stripBlankLines(strWithBlanks):
             str2 = str2 + line + '\n'
     return str2
 
+# One copy of each URN or client_id string seen, shared by all the
+# objects that name the same hop, link or node
+_internedNames = dict()
+INTERNED_NAMES_MAX = 100000
+
+def internName(name):
+    '''Return the shared copy of the given URN or client_id string.
+    Works for unicode strings too (unlike intern()).'''
+    if name is None:
+        return None
+    interned = _internedNames.get(name)
+    if interned is None:
+        if len(_internedNames) >= INTERNED_NAMES_MAX:
+            _internedNames.clear()
+        _internedNames[name] = name
+        interned = name
+    return interned
+
 def isRSpecStitchingSchemaV2(rspec):
     '''Does the given RSpec mention stitch schema v2?'''
     if rspec is None:
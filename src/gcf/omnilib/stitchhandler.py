@@ -45,9 +45,11 @@ from .util.json_encoding import DateTimeAwareJSONEncoder
 from . import stitch
 from .stitch import defs
 from .stitch.ManifestRSpecCombiner import combineManifestRSpecs
-from .stitch.objects import Aggregate, Link, Node, LinkProperty
+from .stitch.objects import Aggregate, AggregateIndex, Link, Node, LinkProperty
 from .stitch.RSpecParser import RSpecParser
 from .stitch import scs
+from .stitch.scscache import SCSResultCache
+from .stitch.teardown import deleteResultByURL, deleteResultFailed
 from .stitch.workflow import WorkflowParser
 from .stitch.utils import StitchingError, StitchingCircuitFailedError, stripBlankLines, isRSpecStitchingSchemaV2, prependFilePrefix, StitchingStoppedError
 from .stitch.VLANRange import *
@@ -115,6 +117,11 @@ class StitchingHandler(object):
                     handler.setLevel(lvl)
                     break
 
+        # Persistent Omni session for the calls to AMs, so each call
+        # does not re-load the config and framework
+        self.omniSession = omni.OmniSession(self.config, self.opts)
+        Aggregate.omniSession = self.omniSession
+
         # FIXME: How many times is right to go back to the SCS
         self.maxSCSCalls = MAX_SCS_CALLS
 
@@ -334,7 +341,11 @@ class StitchingHandler(object):
         if self.isStitching:
             if not "geni-scs.net.internet2.edu:8443" in self.opts.scsURL:
                 self.logger.info("Using SCS at %s", self.opts.scsURL)
-            self.scsService = scs.Service(self.opts.scsURL, key=self.framework.key, cert=self.framework.cert, timeout=self.opts.ssltimeout, verbose=self.opts.verbosessl)
+            scsCache = None
+            if self.opts.scsCacheTTL > 0 and not self.opts.savedSCSResults:
+                scsCache = SCSResultCache(prependFilePrefix(self.opts.fileDir, "~/.gcf/scs-cache"),
+                                          self.opts.scsCacheTTL * 60, self.logger)
+            self.scsService = scs.Service(self.opts.scsURL, key=self.framework.key, cert=self.framework.cert, timeout=self.opts.ssltimeout, verbose=self.opts.verbosessl, cache=scsCache)
         self.scsCalls = 0
 
         # Create singleton that knows about default sliver expirations by AM type
@@ -422,6 +433,9 @@ class StitchingHandler(object):
             else:
                 raise se
         finally:
+            # Let deletes from failed attempts finish, noting any that did not work
+            self.finishTeardown()
+
             # Save a file with the aggregates used in this slice
             self.saveAggregateList(sliceurn)
 
@@ -594,14 +608,8 @@ class StitchingHandler(object):
                     if urn in Aggregate.aggs:
                         # self.logger.debug("Already is an AM")
                         continue
-                    syns = Aggregate.urn_syns(urn)
-                    found = False
-                    for urn2 in syns:
-                        if urn2 in Aggregate.aggs:
-                            found = True
-                            urn = urn2
-                            # self.logger.debug(".. which is an AM under syn %s", urn)
-                            break
+                    # Is this an existing AM under a URN synonym?
+                    found = Aggregate.findDontMake(urn) is not None
                     if not found:
                         if not (urn.strip().lower().endswith("+cm") or urn.strip().lower().endswith("+am")):
                             # Doesn't look like an AM URN. Skip it.
@@ -612,7 +620,7 @@ class StitchingHandler(object):
                         urnAuth = urnO.getAuthority()
                         if urnAuth.startswith("exogeni.net"):
                             # self.logger.debug("Is an ExoGENI URN. Since this is the exoSM, add it as a urn syn")
-                            am.urn_syns.append(urn)
+                            am.addURNSynonym(urn)
                 # end of loop over AM URNs
             # End of block to handle ExoSM
 
@@ -1305,7 +1313,10 @@ class StitchingHandler(object):
             # We are doing another call.
             # Let AMs recover. Is this long enough?
             # If one of the AMs is a DCN AM, use that sleep time instead - longer
+            # Wait on each AM we tried a reservation on (whether it worked or failed),
+            # for up to the pause for that kind of AM
             sTime = Aggregate.PAUSE_FOR_V3_AM_TO_FREE_RESOURCES_SECS
+            waits = []
             for agg in existingAggs:
                 if agg.dcn and agg.triedRes:
                     # Only need to sleep this much longer time
@@ -1313,9 +1324,14 @@ class StitchingHandler(object):
                     if sTime < Aggregate.PAUSE_FOR_DCN_AM_TO_FREE_RESOURCES_SECS:
                         self.logger.debug("Must sleep longer cause had a previous reservation attempt at a DCN AM: %s", agg)
                     sTime = Aggregate.PAUSE_FOR_DCN_AM_TO_FREE_RESOURCES_SECS
-                elif agg.api_version == 2 and agg.triedRes and sTime < Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS:
-                    self.logger.debug("Must sleep longer cause had a previous v2 reservation attempt at %s", agg)
-                    sTime = Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS
+                    waits.append((agg, Aggregate.PAUSE_FOR_DCN_AM_TO_FREE_RESOURCES_SECS))
+                elif agg.api_version == 2 and agg.triedRes:
+                    if sTime < Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS:
+                        self.logger.debug("Must sleep longer cause had a previous v2 reservation attempt at %s", agg)
+                        sTime = Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS
+                    waits.append((agg, Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS))
+                elif agg.triedRes:
+                    waits.append((agg, Aggregate.PAUSE_FOR_V3_AM_TO_FREE_RESOURCES_SECS))
                 # Reset whether we've tried this AM this time through
                 agg.triedRes = False
 
@@ -1348,8 +1364,12 @@ class StitchingHandler(object):
                                 self.logger.warn("You have a reservation at %s", am)
                 raise StitchingError(msg)
 
-            self.logger.info("Pausing for %d seconds for Aggregates to free up resources...\n\n", sTime)
-            time.sleep(sTime)
+            if waits:
+                self.logger.info("Pausing up to %d seconds for Aggregates to free up resources...\n\n", sTime)
+                Aggregate.releaseWaiter.wait(waits, self.opts, self.config['timeoutTime'])
+            else:
+                self.logger.info("Pausing for %d seconds for Aggregates to free up resources...\n\n", sTime)
+                time.sleep(sTime)
         # Done pausing to let AMs free resources
 
         # Parse SCS Response, constructing objects and dependencies, validating return
@@ -1385,23 +1405,12 @@ class StitchingHandler(object):
             # An AM added only from parsed AM URNs will have state lost. Ticket #781
             if self.parsedSCSRSpec:
                 # Look for existing aggs that came from parsed URN and aren't in workflow
+                workflowAggs = AggregateIndex(workflow_parser.aggs)
                 for agg in existingAggs:
                     self.logger.debug("Looking at existing AM %s", agg)
-                    isWorkflow = False
-                    for agg2 in workflow_parser.aggs:
-                        if agg.urn == agg2.urn or agg.urn in agg2.urn_syns:
-                            self.logger.debug("Is a workflow AM; found AM's URN %s in workflow's AMs", agg.urn)
-                            isWorkflow = True
-                            break
-                        else:
-                            for urn2 in agg.urn_syns:
-                                if urn2 == agg2.urn or urn2 in agg2.urn_syns:
-                                    self.logger.debug("Is a workflow AM based on urn_syn; found AM's urn_syn %s in workflow AM", urn2)
-                                    isWorkflow = True
-                                    break
-                        if isWorkflow:
-                            break
-                    if isWorkflow:
+                    agg2 = workflowAggs.findSharingURN(agg)
+                    if agg2 is not None:
+                        self.logger.debug("Is a workflow AM; found AM's URN %s or a urn_syn in workflow AM %s", agg.urn, agg2)
                         continue
 
                     isParsed = False
@@ -1550,28 +1559,19 @@ class StitchingHandler(object):
                 self.logger.warn("Stitching failed but will retry: %s", se)
                 success = False
                 try:
-                    (delRetText, delRetStruct) = self.deleteAllReservations(launcher)
+                    # Only wait now for the deletes at AMs that the next attempt reserves
+                    # first: those with no dependencies. The others finish during the
+                    # next SCS call and pause, and each AM waits for its own delete
+                    # before reserving again.
+                    firstAMs = [am for am in launcher.aggs if not am.dependsOn]
+                    (delRetText, delRetStruct) = self.deleteAllReservations(launcher, waitFor=firstAMs)
+                    # The deletes not waited for here are checked the same way
+                    # when their AM waits for them (see Teardown.waitForAM)
                     hadFail = False
                     for url in delRetStruct.keys():
-                        if not delRetStruct[url]:
-                            hadFail = True
-                            break
-                        if isinstance(delRetStruct[url], dict) and delRetStruct[url].has_key('code') and isinstance(delRetStruct[url]['code'], dict) and delRetStruct[url]['code'].has_key('geni_code') and delRetStruct[url]['code']['geni_code'] not in (0, 12, 15):
+                        if deleteResultFailed(delRetStruct[url]):
                             hadFail = True
                             break
-                        if isinstance(delRetStruct[url], dict) and delRetStruct[url].has_key('code') and isinstance(delRetStruct[url]['code'], dict) and delRetStruct[url]['code'].has_key('geni_code') and delRetStruct[url]['code']['geni_code'] == 0 and delRetStruct[url].has_key('value') and isinstance(delRetStruct[url]['value'], list) and len(delRetStruct[url]['value']) > 0:
-                            try:
-                                for sliver in delRetStruct[url]["value"]:
-                                    status = sliver["geni_allocation_status"]
-                                    if status != 'geni_unallocated':
-                                        hadFail = True
-                                        break
-                                if hadFail:
-                                    break
-                            except:
-                                # Malformed return I think
-                                hadFail = True
-                        # FIXME: Handle other cases...
                     if not hadFail:
                         success = True
                 except KeyboardInterrupt:
@@ -1769,11 +1769,10 @@ class StitchingHandler(object):
                 break
             # For EG there are multiple URNs that are really the same
             # If find one, found them all
-            for urn2 in agg.urn_syns:
-                if urn2 == amURN:
-#                    self.logger.debug(" .. was in ams_to_process under synonym. Ams_to_process had %s", agg.urn)
-                    found = True
-                    break
+            if agg.hasURNSynonym(amURN):
+#                self.logger.debug(" .. was in ams_to_process under synonym. Ams_to_process had %s", agg.urn)
+                found = True
+                break
         if found:
             return
 
@@ -1816,7 +1815,7 @@ class StitchingHandler(object):
             try:
                 fw_ams = self.framework.list_aggregates()
                 for fw_am_urn in fw_ams.keys():
-                    if fw_am_urn and fw_am_urn.strip() in am.urn_syns and fw_ams[fw_am_urn].strip() != '':
+                    if fw_am_urn and am.hasURNSynonym(fw_am_urn.strip()) and fw_ams[fw_am_urn].strip() != '':
                         am.url = fw_ams[fw_am_urn]
                         self.logger.debug("Found AM %s URL from CH ListAggs: %s", amURN, am.url)
                         break
@@ -2017,8 +2016,12 @@ class StitchingHandler(object):
             # End of loop over hops in AM
         # End of loop over AMs to process
 
-    def deleteAllReservations(self, launcher):
-        '''On error exit, ensure all outstanding reservations are deleted.'''
+    def deleteAllReservations(self, launcher, waitFor=None):
+        '''On error exit, ensure all outstanding reservations are deleted.
+        Deletes at all the aggregates run concurrently (see Aggregate.teardown).
+        If waitFor is a list of aggregates, only wait for the deletes there: the rest
+        keep running, and each aggregate waits for its own before reserving again.
+        By default wait for all deletes, including any left running by an earlier call.'''
         # Try to combine v2 and v3 results together
         # Text is just appended
         # all results in struct are keyed by am.url
@@ -2028,55 +2031,64 @@ class StitchingHandler(object):
         # So instead, the v2 return is True if the AM was found in the success list, False if found in Failed list,
         # and otherwise the return under the am.url is whatever the AM originally returned.
         # Note that failing to find the AM url may mean it's a variant of the URL
+        teardown = Aggregate.teardown
         loggedDeleting = False
         retText = ""
         retStruct = {}
         if len(launcher.aggs) == 0:
             self.logger.debug("0 aggregates from which to delete")
+        deleting = []
         for am in launcher.aggs:
             if am.manifestDom:
                 if not loggedDeleting:
                     loggedDeleting = True
                     self.logger.info("Deleting existing reservations...")
                 self.logger.debug("Had reservation at %s", am)
-                try:
-                    (text, result) = am.deleteReservation(self.opts, self.slicename)
-                    self.logger.info("Deleted reservation at %s.", am)
-                    if retText != "":
-                        retText += "\n %s" % text
-                    else:
-                        retText = text
-                    if am.api_version < 3 or not isinstance(result, dict):
-                        if not (isinstance(result, tuple) and isinstance(result[0], list)):
-                            # Some kind of error
-                            self.logger.debug("Struct result from delete or deletesliver unknown from %s: %s", am, result)
-                            retStruct[am.url] = result
-                        else:
-                            (succ, fail) = result
-                            # FIXME: Do the handler_utils tricks for comparing URLs?
-                            if am.url in succ or am.alt_url in succ:
-                                retStruct[am.url] = True
-                            elif am.url in fail or am.alt_url in fail:
-                                retStruct[am.url] = False
-                            else:
-                                self.logger.debug("Failed to find AM URL in v2 deletesliver return struct. AM %s, return %s", am, result)
-                                retStruct[am.url] = result
-                    else:
-                        retCopy = retStruct.copy()
-                        retCopy.update(result)
-                        retStruct = retCopy
-                except StitchingError, se2:
-                    msg = "Failed to delete reservation at %s: %s" % (am, se2)
-                    self.logger.warn(msg)
-                    retStruct[am.url] = False
-                    if retText != "":
-                        retText += "\n %s" % msg
-                    else:
-                        retText = msg
+                teardown.start(am, self.opts, self.slicename)
+                deleting.append(am)
+        if waitFor is None:
+            for am in teardown.pending():
+                if am not in deleting:
+                    self.logger.debug("Still deleting reservation at %s from an earlier attempt", am)
+                    deleting.append(am)
+        for am in deleting:
+            if waitFor is not None and am not in waitFor:
+                self.logger.debug("Not waiting now for delete at %s", am)
+                continue
+            (done, text, result, excInfo) = teardown.wait(am)
+            if excInfo is not None and not isinstance(excInfo[1], StitchingError):
+                raise excInfo[0], excInfo[1], excInfo[2]
+            if not done or excInfo is not None:
+                if not done:
+                    msg = "Timed out deleting reservation at %s" % am
+                else:
+                    msg = "Failed to delete reservation at %s: %s" % (am, excInfo[1])
+                self.logger.warn(msg)
+                retStruct[am.url] = False
+                if retText != "":
+                    retText += "\n %s" % msg
+                else:
+                    retText = msg
+                continue
+            self.logger.info("Deleted reservation at %s.", am)
+            if retText != "":
+                retText += "\n %s" % text
+            else:
+                retText = text
+            retStruct.update(deleteResultByURL(am, result))
         if retText == "":
             retText = "No aggregates with reservations from which to delete"
         return (retText, retStruct)
 
+    def finishTeardown(self):
+        '''Wait for any deletes of reservations from failed attempts that are still running.'''
+        for am in Aggregate.teardown.pending():
+            (done, text, result, excInfo) = Aggregate.teardown.wait(am)
+            if not done:
+                self.logger.warn("Timed out deleting reservation at %s. You may still have a reservation there.", am)
+            elif excInfo is not None:
+                self.logger.warn("Failed to delete reservation at %s: %s. You may still have a reservation there.", am, excInfo[1])
+
     def confirmGoodRSpec(self, requestString, rspecType=rspec_schema.REQUEST, doRSpecLint=True):
         '''Ensure an rspec is valid'''
         typeStr = 'Request'
@@ -2500,7 +2512,10 @@ class StitchingHandler(object):
             raise StitchingError("SCS gave error: %s" % strE)
         # Done SCS call error handling
 
-        self.logger.debug("SCS successfully returned.");
+        if self.scsService.fromCache:
+            self.logger.info("Using saved SCS result for this same request (saved less than %d minutes ago)", self.opts.scsCacheTTL)
+        else:
+            self.logger.debug("SCS successfully returned.");
 
         if self.opts.debug:
             scsresfile = prependFilePrefix(self.opts.fileDir, "scs-result.json")
@@ -2935,12 +2950,12 @@ class StitchingHandler(object):
             exoSM = exoSMs[0]
             exoSMURN = handler_utils._lookupAggURNFromURLInNicknames(self.logger, self.config, defs.EXOSM_URL)
             # Ensure standard ExoSM URN is the URN and old URN is in urn_syns
-            if exoSM.urn not in exoSM.urn_syns:
-                exoSM.urn_syns.append(exoSM.urn)
+            exoSM.addURNSynonym(exoSM.urn)
             if exoSMURN != exoSM.urn:
                 exoSM.urn = exoSMURN
             if exoSMURN not in exoSM.urn_syns:
                 exoSM.urn_syns += Aggregate.urn_syns(exoSMURN)
+                exoSM.reindexURNSynonyms()
 
         if exoSMCount < 2:
             self.logger.debug("Only %d ExoSMs", exoSMCount)
@@ -2953,11 +2968,10 @@ class StitchingHandler(object):
             self.logger.debug("Merge AM %s (%s, %s) into %s (%s, %s)", am.urn, am.url, am.alt_url, exoSM, exoSM.url, exoSM.alt_url)
 
             # Merge urn_syns
-            if exoSM.urn != am.urn and am.urn not in exoSM.urn_syns:
-                exoSM.urn_syns.append(am.urn)
+            if exoSM.urn != am.urn:
+                exoSM.addURNSynonym(am.urn)
             for urn in am.urn_syns:
-                if urn not in exoSM.urn_syns:
-                    exoSM.urn_syns.append(urn)
+                exoSM.addURNSynonym(urn)
 
             # Merge _dependsOn
             if am in exoSM.dependsOn:
@@ -3033,7 +3047,7 @@ class StitchingHandler(object):
         for (key, agg) in Aggregate.aggs.items():
             if not (agg.isExoSM and agg != exoSM):
                 newaggs[key] = agg
-        Aggregate.aggs = newaggs
+        Aggregate.setAggregates(newaggs)
 
         nonExoSMs.append(exoSM)
         self.ams_to_process = nonExoSMs
@@ -3069,7 +3083,7 @@ class StitchingHandler(object):
             # EG AMs in particular have 2 URLs in some sense - ExoSM and local
             # So note the other one, since VMs are split between the 2
             for (amURN, amURL) in self.config['aggregate_nicknames'].values():
-                if amURN.strip() in agg.urn_syns:
+                if agg.hasURNSynonym(amURN.strip()):
                     hadURL = handler_utils._extractURL(self.logger, agg.url)
                     newURL = handler_utils._extractURL(self.logger, amURL)
                     if hadURL != newURL and not hadURL in newURL and not newURL in hadURL and not newURL.strip == '':
@@ -3127,7 +3141,7 @@ class StitchingHandler(object):
 
             try:
                 self.logger.debug("Getting extra AM info from Omni for AM %s", agg)
-                (text, version) = omni.call(omniargs, options_copy)
+                (text, version) = self.omniSession.call(omniargs, options_copy)
                 aggurl = agg.url
                 if isinstance (version, dict) and version.has_key(aggurl) and isinstance(version[aggurl], dict) \
                         and version[aggurl].has_key('value') and isinstance(version[aggurl]['value'], dict):
@@ -3694,46 +3708,46 @@ class StitchingHandler(object):
 
     def saveAggregateState(self, oldAggs, newAggs):
         '''Save state from old aggregates for use with new aggregates from later SCS call'''
+        oldAggIndex = AggregateIndex(oldAggs)
         for agg in newAggs:
-            for oldAgg in oldAggs:
-                # Is this oldAgg the same as the new 'agg' by URN? If so, copy from old to new
-                # FIXME: Correct to compare urn_syns too?
-                if not (agg.urn == oldAgg.urn or agg.urn in oldAgg.urn_syns or oldAgg.urn in agg.urn_syns):
-                    # Not a match
-                    continue
+            # Is there an oldAgg the same as the new 'agg' by URN? If so, copy from old to new
+            # FIXME: Correct to compare urn_syns too?
+            oldAgg = oldAggIndex.findSame(agg)
+            if oldAgg is None:
+                # Not a match
+                continue
 
-                for hop in agg.hops:
-                    for oldHop in oldAgg.hops:
-                        if hop.urn == oldHop.urn:
-                            if oldHop.excludeFromSCS:
-                                self.logger.warn("%s had been marked to exclude from SCS, but we got it again", oldHop)
-                            hop.vlans_unavailable = hop.vlans_unavailable.union(oldHop.vlans_unavailable)
-                            break
-                # End of loop over hops
+            for hop in agg.hops:
+                for oldHop in oldAgg.hops:
+                    if hop.urn == oldHop.urn:
+                        if oldHop.excludeFromSCS:
+                            self.logger.warn("%s had been marked to exclude from SCS, but we got it again", oldHop)
+                        hop.vlans_unavailable = hop.vlans_unavailable.union(oldHop.vlans_unavailable)
+                        break
+            # End of loop over hops
 
-                # FIXME: agg.allocateTries?
-                agg.dcn = oldAgg.dcn
-                agg.isOESS = oldAgg.isOESS
-                agg.isGRAM = oldAgg.isGRAM
-                agg.isPG = oldAgg.isPG
-                agg.isEG = oldAgg.isEG
-                agg.isExoSM = oldAgg.isExoSM
-                agg.userRequested = oldAgg.userRequested
-                agg.alt_url = oldAgg.alt_url
-                agg.api_version = oldAgg.api_version
-                agg.nick = oldAgg.nick
-                agg.doesSchemaV1 = oldAgg.doesSchemaV1
-                agg.doesSchemaV2 = oldAgg.doesSchemaV2
-                agg.slicecred = oldAgg.slicecred
-
-                # Since we're restarting, clear out any old error, so don't do this copy
-                # agg.lastError = oldAgg.lastError
-
-                # FIXME: correct?
-                agg.url = oldAgg.url
-                agg.urn_syns = copy.deepcopy(oldAgg.urn_syns)
-                break # out of loop over oldAggs, cause we found the new 'agg'
-            # Loop over oldAggs
+            # FIXME: agg.allocateTries?
+            agg.dcn = oldAgg.dcn
+            agg.isOESS = oldAgg.isOESS
+            agg.isGRAM = oldAgg.isGRAM
+            agg.isPG = oldAgg.isPG
+            agg.isEG = oldAgg.isEG
+            agg.isExoSM = oldAgg.isExoSM
+            agg.userRequested = oldAgg.userRequested
+            agg.alt_url = oldAgg.alt_url
+            agg.api_version = oldAgg.api_version
+            agg.nick = oldAgg.nick
+            agg.doesSchemaV1 = oldAgg.doesSchemaV1
+            agg.doesSchemaV2 = oldAgg.doesSchemaV2
+            agg.slicecred = oldAgg.slicecred
+
+            # Since we're restarting, clear out any old error, so don't do this copy
+            # agg.lastError = oldAgg.lastError
+
+            # FIXME: correct?
+            agg.url = oldAgg.url
+            agg.urn_syns = copy.deepcopy(oldAgg.urn_syns)
+            agg.reindexURNSynonyms()
         # Loop over newAggs
     # End of saveAggregateState
 
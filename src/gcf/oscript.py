@@ -115,6 +115,7 @@ import optparse
 import os
 import shutil
 import sys
+import threading
 import urllib
 
 from .omnilib.util import OmniError, AMAPIError
@@ -319,7 +320,46 @@ def load_config(opts, logger, config={}, filename=None):
             else:
                 config['rspec_nicknames'][key] = temp
 
-    # Load up the framework section
+    apply_config_options(config, opts, logger)
+
+    logger.info("Using control framework %s" % opts.framework)
+
+    # Find the control framework
+    cf = opts.framework.strip()
+    if not confparser.has_section(cf):
+        logger.error("Missing framework '%s' in configuration file" % cf )
+        raise OmniError, "Missing framework '%s' in configuration file" % cf
+    
+    # Copy the control framework into a dictionary
+    config['selected_framework'] = {}
+    for (key,val) in confparser.items(cf):
+        config['selected_framework'][key] = val
+
+    # This portion of the config is only of interest for `omni-configure`
+    # but is included here for completeness
+    if confparser.has_section('omni_configure'):
+        for (key,val) in confparser.items('omni_configure'):
+            key = key.strip()
+            temp = val.strip()
+            if key == "version":
+                config['omni_configure_version'] = temp
+            elif key == "date":
+                config['omni_configure_date'] = temp
+            elif key == "files":
+                files1 = temp.split("\n")
+                files2 = []
+                for item in files1:
+                    fdesc,fname,oktodelete = item.split(",")
+                    files2.append((fdesc.strip(),fname.strip(),oktodelete.strip()))
+                config['omni_configure_files'] = files2
+
+    return config
+
+def apply_config_options(config, opts, logger):
+    """Set the options that the omni_config supplies values for
+    (framework, project, useSliceMembers, ignoreConfigUsers)
+    from the given loaded config."""
+    # The framework section
     if not opts.framework:
         if config['omni'].has_key('default_cf'):
             opts.framework = config['omni']['default_cf']
@@ -355,39 +395,6 @@ def load_config(opts, logger, config={}, filename=None):
                 logger.info("Setting option 'ignoreConfigUsers' based on omni_config setting")
                 opts.ignoreConfigUsers = True
 
-    logger.info("Using control framework %s" % opts.framework)
-
-    # Find the control framework
-    cf = opts.framework.strip()
-    if not confparser.has_section(cf):
-        logger.error("Missing framework '%s' in configuration file" % cf )
-        raise OmniError, "Missing framework '%s' in configuration file" % cf
-    
-    # Copy the control framework into a dictionary
-    config['selected_framework'] = {}
-    for (key,val) in confparser.items(cf):
-        config['selected_framework'][key] = val
-
-    # This portion of the config is only of interest for `omni-configure`
-    # but is included here for completeness
-    if confparser.has_section('omni_configure'):
-        for (key,val) in confparser.items('omni_configure'):
-            key = key.strip()
-            temp = val.strip()
-            if key == "version":
-                config['omni_configure_version'] = temp
-            elif key == "date":
-                config['omni_configure_date'] = temp
-            elif key == "files":
-                files1 = temp.split("\n")
-                files2 = []
-                for item in files1:
-                    fdesc,fname,oktodelete = item.split(",")
-                    files2.append((fdesc.strip(),fname.strip(),oktodelete.strip()))
-                config['omni_configure_files'] = files2
-
-    return config
-
 def load_aggregate_nicknames( config, confparser, filename, logger, opts ):
     # Find aggregate nicknames
     if not config.has_key('aggregate_nicknames'):
@@ -764,6 +771,88 @@ if __name__ == "__main__":
     # process the user's call
     return API_call( framework, config, args, opts, verbose=verbose )
 
+class OmniSession(object):
+    """A persistent Omni session, for scripts that make many Omni calls.
+
+    call() is like the module level call(), but the setup that does on every
+    call (configure logging, load the agg_nick_cache and omni_config,
+    check for updates, instantiate the control framework) is done
+    once, when the session is created. Each call then only parses its
+    own arguments and makes its API call, reusing the framework (with
+    its credentials and SSL context), the config and an in memory
+    GetVersion cache.
+
+    Create a session with from_args(), or from an already loaded
+    config and options.
+
+    Calls in one session are serialized: they share the framework
+    (which holds the options of the call in progress), the config and
+    the GetVersion cache. To make calls from several threads at once,
+    give each thread its own session with fork().
+    """
+
+    def __init__(self, config, opts, framework=None):
+        """Create a session from a config as returned by load_config
+        and the options it was loaded with.
+        If no framework is given, one that logs to the 'omni' logger
+        (as omni.call does) is loaded on the first call."""
+        # Do not modify the caller's config
+        self.config = dict(config)
+        self.config['selected_framework'] = dict(config['selected_framework'])
+        if framework is None:
+            self.config['logger'] = logging.getLogger("omni")
+        self.framework = framework
+        self.opts = opts
+        # GetVersion cache filename -> cache, shared by calls in this session
+        self.config['sharedGetVersionCache'] = {}
+        # Held for the length of a call
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_args(cls, argv, options=None, dictLoggingConfig=None):
+        """Create a session as initialize() would for the given argv
+        and optional optparse.Values options."""
+        framework, config, args, opts = initialize(argv, options, dictLoggingConfig)
+        return cls(config, opts, framework)
+
+    def call(self, argv, options=None, verbose=False):
+        """Call Omni with the given argv list and optional optparse.Values
+        options, in this session. Return is as from omni.call."""
+        if options is not None and not options.__class__==optparse.Values:
+            raise OmniError("Invalid options argument to call: must be an optparse.Values object")
+
+        if argv is None or not type(argv) == list:
+            raise OmniError("Invalid argv argument to call: must be a list")
+
+        opts, args = parse_args(argv, options)
+        with self._lock:
+            apply_config_options(self.config, opts, self.config['logger'])
+            if opts.framework != self.opts.framework:
+                raise OmniError("Cannot use framework %s in an Omni session using framework %s" % \
+                                    (opts.framework, self.opts.framework))
+            if self.framework is None:
+                self.framework = load_framework(self.config, opts)
+            # Frameworks that hold the options should see those of this call
+            elif hasattr(self.framework, 'opts'):
+                self.framework.opts = opts
+            return API_call( self.framework, self.config, args, opts, verbose=verbose )
+
+    def fork(self):
+        """Return a new session for making calls from another thread,
+        concurrently with calls in this one.
+        The new session starts from a copy of this session's config and
+        GetVersion cache, and has its own framework, loaded now in the
+        calling thread."""
+        with self._lock:
+            config = dict(self.config)
+            config['selected_framework'] = dict(self.config['selected_framework'])
+            shared = deepcopy(self.config['sharedGetVersionCache'])
+            session = OmniSession(config, self.opts)
+            session.config['logger'] = self.config['logger']
+            session.config['sharedGetVersionCache'] = shared
+            session.framework = load_framework(session.config, self.opts)
+        return session
+
 def getOptsUsed(parser, opts, logger=None):
     '''Get string to print out the options supplied'''
     #sys.argv when called as a library is
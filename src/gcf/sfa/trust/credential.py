@@ -271,6 +271,7 @@ class Credential(object):
         self.issuer_privkey = None
         self.issuer_gid = None
         self.issuer_pubkey = None
+        self.signer = None
         self.parent = None
         self.signature = None
         self.xml = None
@@ -356,6 +357,16 @@ class Credential(object):
         self.issuer_privkey = privkey
         self.issuer_gid = gid
 
+    ##
+    # Sign with the given signer instead of calling out to xmlsec1
+    # with the issuer key and GID files.
+    # @param signer Object whose sign_xml(xml, node_id) method fills in the
+    #     signature template with the given ID and returns the signed XML,
+    #     eg gcf.geni.util.xmldsig_util.XMLSigner
+
+    def set_signer(self, signer):
+        self.signer = signer
+
 
     ##
     # Set this credential's parent
@@ -662,10 +673,10 @@ class Credential(object):
     # you have loaded an existing signed credential, do not call encode() or sign() on it.
 
     def sign(self):
-        if not self.issuer_privkey:
+        if not self.issuer_privkey and not self.signer:
             logger.warn("Cannot sign credential (no private key)")
             return
-        if not self.issuer_gid:
+        if not self.issuer_gid and not self.signer:
             logger.warn("Cannot sign credential (no issuer gid)")
             return
         doc = parseString(self.get_xml())
@@ -680,7 +691,25 @@ class Credential(object):
 
         self.xml = doc.toxml("utf-8")
 
+        ref = 'Sig_%s' % self.get_refid()
+        if self.signer:
+            # Sign in process with the already loaded issuer key and certs
+            self.xml = self.signer.sign_xml(self.xml, ref)
+        else:
+            self.xml = self._sign_with_xmlsec1(ref)
+
+        # This is no longer a legacy credential
+        if self.legacy:
+            self.legacy = None
+
+        # Update signatures
+        self.decode()       
 
+    ##
+    # Sign the current XML by calling out to xmlsec1 with the issuer
+    # key and GID files, returning the signed XML
+
+    def _sign_with_xmlsec1(self, ref):
         # Split the issuer GID into multiple certificates if it's a chain
         chain = GID(filename=self.issuer_gid)
         gid_files = []
@@ -693,7 +722,6 @@ class Credential(object):
 
 
         # Call out to xmlsec1 to sign it
-        ref = 'Sig_%s' % self.get_refid()
         filename = self.save_to_random_tmp_file()
         command='%s --sign --node-id "%s" --privkey-pem %s,%s %s' \
             % (self.xmlsec_path, ref, self.issuer_privkey, ",".join(gid_files), filename)
@@ -704,15 +732,7 @@ class Credential(object):
         for gid_file in gid_files:
             os.remove(gid_file)
 
-        self.xml = signed
-
-        # This is no longer a legacy credential
-        if self.legacy:
-            self.legacy = None
-
-        # Update signatures
-        self.decode()       
-
+        return signed
 
     ##
     # Retrieve the attributes of the credential from the XML.
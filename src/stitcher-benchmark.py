@@ -0,0 +1,508 @@
+#!/usr/bin/env python
+
+#----------------------------------------------------------------------
+# Copyright (c) 2015 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Benchmark the stitcher's RSpec handling on large topologies.
+
+Builds a large stitched slice by replicating a stitcherTestFiles
+request RSpec (--copies times, spread over --aggregates groups of
+aggregates), adds a stitching extension with a path per stitched link,
+and makes a manifest for each aggregate the way an AM would (sliver_ids,
+component_ids, VLAN tags). Then times the stitcher operations on that
+slice, such as parsing the expanded request and the manifests,
+building each aggregate's request and combining the aggregate manifests
+into the combined manifest, and reports per operation latency and
+throughput. With --memory, also reports how much parsing grows the
+peak memory (resident set size) of a process. For example, to compare
+the memory used by the stitching objects (parse_request) and by those
+objects plus a DOM (parse_request_dom) for a 500 hop stitched request:
+
+  stitcher-benchmark.py --hops 500 --memory -o parse_request -o parse_request_dom
+
+Runs offline: no aggregate or SCS is contacted.
+
+Run with "-h" flag to see usage and command line options.
+"""
+
+import sys
+
+# Check python version. Requires 2.6 or greater, but less than 3.
+if sys.version_info < (2, 6):
+    raise Exception('Must use python 2.6 or greater.')
+elif sys.version_info >= (3,):
+    raise Exception('Not python 3 ready')
+
+import datetime
+import gc
+import json
+import logging
+import optparse
+import os
+import shutil
+import subprocess
+import tempfile
+import timeit
+try:
+    import resource
+except ImportError:
+    resource = None
+from xml.dom.minidom import parseString, Node
+
+from gcf.omnilib.stitch import defs
+from gcf.omnilib.stitch.ManifestRSpecCombiner import combineManifestRSpecs
+from gcf.omnilib.stitch.objects import Aggregate
+from gcf.omnilib.stitch.RSpecParser import RSpecParser
+
+DEFAULT_RSPEC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'stitcherTestFiles', 'request-pg-ig-utah-2links.xml')
+STITCH_NS = "http://hpn.east.isi.edu/rspec/ext/stitch/0.1/"
+URN_PREFIX = 'urn:publicid:IDN+'
+
+def parse_args(argv):
+    parser = optparse.OptionParser(usage="%prog [options]\n" + __doc__)
+    parser.add_option("-r", "--rspec", default=DEFAULT_RSPEC,
+                      help="Request RSpec to scale up (default %default)")
+    parser.add_option("-c", "--copies", type="int", default=50,
+                      help="Number of copies of the request topology (default %default)")
+    parser.add_option("--hops", type="int", default=None,
+                      help="Use enough copies of the request topology to make at least this many stitching hops (overrides --copies)")
+    parser.add_option("-a", "--aggregates", type="int", default=10,
+                      help="Number of groups of aggregates to spread the copies over (default %default)")
+    parser.add_option("-n", "--iterations", type="int", default=5,
+                      help="Number of times to run each operation (default %default)")
+    parser.add_option("-o", "--operation", action="append", default=None,
+                      help="Only run the named operation. May be repeated.")
+    parser.add_option("--list", action="store_true", default=False,
+                      help="List the operations and exit")
+    parser.add_option("--save", default=None, metavar="DIR",
+                      help="Save the generated expanded request and manifests to this directory")
+    parser.add_option("--memory", action="store_true", default=False,
+                      help="Also measure the peak memory of the parse operations, each in a fresh process")
+    parser.add_option("--parse-memory", default=None, help=optparse.SUPPRESS_HELP)
+    parser.add_option("--json", default=None, metavar="FILE",
+                      help="Also write the results as JSON to this file")
+    parser.add_option("--debug", action="store_true", default=False,
+                      help="Enable debug logging")
+    opts, args = parser.parse_args(argv)
+    if opts.iterations < 1:
+        parser.error("--iterations must be at least 1")
+    if opts.copies < 1:
+        parser.error("--copies must be at least 1")
+    if opts.hops is not None and opts.hops < 1:
+        parser.error("--hops must be at least 1")
+    if opts.aggregates < 1:
+        parser.error("--aggregates must be at least 1")
+    if (opts.memory or opts.parse_memory) and resource is None:
+        parser.error("--memory is not supported on this platform")
+    return opts, args
+
+def get_auth(urn):
+    '''Get the authority of an authority, interface or sliver URN'''
+    return urn[len(URN_PREFIX):].split('+')[0]
+
+def element_children(element, localName):
+    return [child for child in element.childNodes
+            if child.nodeType == Node.ELEMENT_NODE and child.localName == localName]
+
+def rename_am(urn, group):
+    '''The URN for this aggregate in the given group of aggregates'''
+    if group == 0:
+        return urn
+    auth = get_auth(urn)
+    return urn.replace(URN_PREFIX + auth + '+', '%sg%d.%s+' % (URN_PREFIX, group, auth), 1)
+
+def scale_request(rspecString, copies, aggregates):
+    '''Replicate the nodes and links of the request, renaming client_ids
+    per copy and aggregates per group of copies. Return the DOM.'''
+    dom = parseString(rspecString)
+    rspec = dom.documentElement
+    originals = element_children(rspec, defs.NODE_TAG) + element_children(rspec, defs.LINK_TAG)
+    for element in originals:
+        rspec.removeChild(element)
+    for copy in range(copies):
+        group = copy % aggregates
+        suffix = "-%d" % copy
+        for element in originals:
+            clone = element.cloneNode(True)
+            rspec.appendChild(clone)
+            for e in [clone] + clone.getElementsByTagName('*'):
+                if e.hasAttribute('client_id'):
+                    e.setAttribute('client_id', e.getAttribute('client_id') + suffix)
+                for attr in ('component_manager_id', 'name'):
+                    if e.hasAttribute(attr) and e.getAttribute(attr).startswith(URN_PREFIX):
+                        e.setAttribute(attr, rename_am(e.getAttribute(attr), group))
+    return dom
+
+def add_stitching(dom):
+    '''Add a stitching extension with a path for every link between aggregates,
+    with a hop at each aggregate, as the SCS would.'''
+    rspec = dom.documentElement
+    stitching = dom.createElement(defs.STITCHING_TAG)
+    stitching.setAttribute('xmlns', STITCH_NS)
+    stitching.setAttribute(defs.LAST_UPDATE_TIME_TAG, '20150101:00:00:00')
+    rspec.appendChild(stitching)
+    for link in element_children(rspec, defs.LINK_TAG):
+        cms = [cm.getAttribute('name') for cm in element_children(link, 'component_manager')]
+        if len(cms) < 2:
+            continue
+        path = dom.createElement(defs.PATH_TAG)
+        path.setAttribute('id', link.getAttribute('client_id'))
+        stitching.appendChild(path)
+        hopIds = []
+        for cm in cms:
+            auth = get_auth(cm)
+            hopIds.append("%s%s+interface+%s:sw:%s" % (URN_PREFIX, auth, auth, link.getAttribute('client_id')))
+        for i in range(len(hopIds)):
+            hop = dom.createElement('hop')
+            hop.setAttribute('id', hopIds[i])
+            path.appendChild(hop)
+            hopLink = dom.createElement('link')
+            hopLink.setAttribute('id', hopIds[i])
+            hop.appendChild(hopLink)
+            scd = dom.createElement('switchingCapabilityDescriptor')
+            hopLink.appendChild(scd)
+            scsi = dom.createElement('switchingCapabilitySpecificInfo')
+            scd.appendChild(scsi)
+            l2sc = dom.createElement('switchingCapabilitySpecificInfo_L2sc')
+            scsi.appendChild(l2sc)
+            for (name, value) in (('interfaceMTU', '9000'), ('vlanRangeAvailability', '100-3000'),
+                                  ('suggestedVLANRange', '100'), ('vlanTranslation', 'false')):
+                e = dom.createElement(name)
+                e.appendChild(dom.createTextNode(value))
+                l2sc.appendChild(e)
+            nextHop = dom.createElement('nextHop')
+            if i + 1 < len(hopIds):
+                nextHop.appendChild(dom.createTextNode(hopIds[i + 1]))
+            else:
+                nextHop.appendChild(dom.createTextNode('null'))
+            hop.appendChild(nextHop)
+    return dom
+
+def count_hops(rspecString):
+    '''The number of stitching hops in one copy of the request topology'''
+    dom = add_stitching(scale_request(rspecString, 1, 1))
+    return len(dom.getElementsByTagName('hop'))
+
+def make_manifest(expandedString, am_urn, tag):
+    '''Make the manifest this aggregate would return for the expanded request:
+    sliver_ids and component_ids on its nodes and interfaces, and a VLAN tag
+    on its links and hops.'''
+    dom = parseString(expandedString)
+    rspec = dom.documentElement
+    rspec.setAttribute('type', 'manifest')
+    auth = get_auth(am_urn)
+    myInterfaces = set()
+    for node in element_children(rspec, defs.NODE_TAG):
+        if node.getAttribute('component_manager_id') != am_urn:
+            continue
+        cid = node.getAttribute('client_id')
+        node.setAttribute('sliver_id', '%s%s+sliver+%s' % (URN_PREFIX, auth, cid))
+        node.setAttribute('component_id', '%s%s+node+pc-%s' % (URN_PREFIX, auth, cid))
+        for intf in element_children(node, 'interface'):
+            icid = intf.getAttribute('client_id')
+            myInterfaces.add(icid)
+            intf.setAttribute('sliver_id', '%s%s+sliver+%s' % (URN_PREFIX, auth, icid))
+            intf.setAttribute('component_id', '%s%s+interface+pc-%s' % (URN_PREFIX, auth, icid))
+    for link in element_children(rspec, defs.LINK_TAG):
+        cms = [cm.getAttribute('name') for cm in element_children(link, 'component_manager')]
+        if am_urn not in cms:
+            continue
+        link.setAttribute('vlantag', str(tag))
+        link.setAttribute('sliver_id', '%s%s+sliver+%s' % (URN_PREFIX, auth, link.getAttribute('client_id')))
+        for iref in element_children(link, 'interface_ref'):
+            if iref.getAttribute('client_id') in myInterfaces:
+                iref.setAttribute('sliver_id', '%s%s+sliver+%s' % (URN_PREFIX, auth, iref.getAttribute('client_id')))
+                iref.setAttribute('component_id', '%s%s+interface+pc-%s' % (URN_PREFIX, auth, iref.getAttribute('client_id')))
+    for hop in dom.getElementsByTagName('hop'):
+        if get_auth(hop.getAttribute('id')) != auth:
+            continue
+        for suggested in hop.getElementsByTagName('suggestedVLANRange'):
+            suggested.firstChild.nodeValue = str(tag)
+        for avail in hop.getElementsByTagName('vlanRangeAvailability'):
+            avail.firstChild.nodeValue = str(tag)
+    return dom
+
+class Fixture(object):
+    '''The scaled up slice the operations work on.'''
+
+    def __init__(self, rspecFile, copies, aggregates, logger):
+        with open(rspecFile) as f:
+            baseString = f.read()
+        expanded = add_stitching(scale_request(baseString, copies, aggregates))
+        self.expandedString = expanded.toxml(encoding="utf-8")
+        self.expandedDom = parseString(self.expandedString)
+        self.rspec = RSpecParser(logger).parse(self.expandedString)
+
+        # Aggregates and their hops, as stitchhandler sets them up from the SCS response
+        Aggregate.clearCache()
+        for path in self.rspec.stitching.paths:
+            for hop in path.hops:
+                agg = Aggregate.find("%s%s+authority+cm" % (URN_PREFIX, get_auth(hop.urn)))
+                hop.aggregate = agg
+                agg.add_hop(hop)
+                agg.add_path(path)
+        for node in self.rspec.nodes:
+            Aggregate.find(node.amURN)
+        self.aggs = Aggregate.all_aggregates()
+        self.aggs.sort(key=lambda agg: agg.urn)
+
+        self.manifests = dict()
+        for i, agg in enumerate(self.aggs):
+            self.manifests[agg] = make_manifest(self.expandedString, agg.urn, 100 + i)
+            agg.manifestDom = self.manifests[agg]
+        self.manifestStrings = [self.manifests[agg].toxml(encoding="utf-8") for agg in self.aggs]
+        self.lastAM = self.aggs[-1]
+        self.lastManifest = self.manifests[self.lastAM]
+        self.expires = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        self.overlays = dict()
+        for agg in self.aggs:
+            self.overlays[agg] = agg.getRequestOverlay(self.expandedDom, self.expires)
+        logger.info("Built a slice of %d nodes, %d links, %d stitching paths with %d hops at %d aggregates (%d bytes of request)",
+                    len(self.rspec.nodes), len(self.rspec.links), len(self.rspec.stitching.paths),
+                    sum([len(path.hops) for path in self.rspec.stitching.paths]),
+                    len(self.aggs), len(self.expandedString))
+
+    def save(self, dirname):
+        '''Save the expanded request and manifests in the given directory.
+        Return the names of the request file and of the manifest files.'''
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        requestFile = os.path.join(dirname, 'expanded-request.xml')
+        with open(requestFile, 'w') as f:
+            f.write(self.expandedString)
+        manifestFiles = []
+        for i, manifest in enumerate(self.manifestStrings):
+            manifestFiles.append(os.path.join(dirname, 'manifest-%d.xml' % i))
+            with open(manifestFiles[-1], 'w') as f:
+                f.write(manifest)
+        return requestFile, manifestFiles
+
+# Operations whose peak memory --memory measures:
+# name -> (RSpecParser method, whether it parses the manifests or the request)
+PARSE_MEMORY_OPERATIONS = {
+    'parse_request': ('parse', False),
+    'parse_request_dom': ('parseDOM', False),
+    'parse_manifests': ('parse', True),
+    'parse_manifests_dom': ('parseDOM', True),
+    }
+
+def operations(fixture):
+    '''Return the list of (name, description, function, setup) benchmark
+    operations on the given fixture. setup (if not None) is run untimed
+    before each run of function, and its return value passed to it.'''
+    f = fixture
+    parser = RSpecParser(logging.getLogger('stitch'))
+
+    def parse_manifests(parse):
+        for manifest in f.manifestStrings:
+            parse(manifest)
+
+    def manifests_setup():
+        # The combiner edits the template: the last AM's manifest, as in stitchhandler
+        for agg in f.aggs:
+            agg.manifestDom = f.manifests[agg]
+        f.lastAM.manifestDom = f.lastManifest.cloneNode(True)
+        return f.lastAM.manifestDom
+
+    def requests_setup():
+        # As when writing the expanded request for AMs with no reservation
+        for agg in f.aggs:
+            agg.manifestDom = None
+            agg.requestDom = None
+            agg.requestOverlay = f.overlays[agg]
+        return f.expandedDom.cloneNode(True)
+
+    def build_requests():
+        for agg in f.aggs:
+            agg.getRequestOverlay(f.expandedDom, f.expires).toxml(encoding="utf-8")
+
+    return [
+        ('parse_request', 'Parse the expanded request',
+         lambda: parser.parse(f.expandedString), None),
+        ('parse_request_dom', 'Parse the expanded request by way of a DOM',
+         lambda: parser.parseDOM(f.expandedString), None),
+        ('parse_manifests', 'Parse every aggregate manifest',
+         lambda: parse_manifests(parser.parse), None),
+        ('parse_manifests_dom', 'Parse every aggregate manifest by way of a DOM',
+         lambda: parse_manifests(parser.parseDOM), None),
+        ('build_requests', 'Build and serialize the request RSpec for every aggregate',
+         build_requests, None),
+        ('combine_manifests', 'Combine the aggregate manifests into the combined manifest',
+         lambda template: combineManifestRSpecs(f.aggs, template), manifests_setup),
+        ('combine_requests', 'Combine the aggregate requests into an expanded request',
+         lambda template: combineManifestRSpecs(f.aggs, template, useReqs=True), requests_setup),
+        ]
+
+def run(name, func, setup, iterations):
+    '''Run func iterations times (after one untimed warm up run).
+    Return a dict of results.'''
+    def once():
+        if setup is None:
+            start = timeit.default_timer()
+            func()
+        else:
+            arg = setup()
+            start = timeit.default_timer()
+            func(arg)
+        return timeit.default_timer() - start
+    once()
+    times = []
+    for i in range(iterations):
+        times.append(once())
+    times.sort()
+    total = sum(times)
+    return dict(operation=name, iterations=iterations,
+                mean_ms=1000.0 * total / iterations,
+                median_ms=1000.0 * times[iterations // 2],
+                p95_ms=1000.0 * times[min(iterations - 1, int(iterations * 0.95))],
+                min_ms=1000.0 * times[0],
+                ops_per_sec=iterations / total if total > 0 else 0)
+
+def parse_peak_kb(method, filenames):
+    '''Parse the given RSpec files with the given RSpecParser method
+    (keeping the results) in a fresh python process. Return how much
+    (in KB) that grew the peak resident set size of the process.'''
+    args = [sys.executable, os.path.abspath(__file__), '--parse-memory', method] + filenames
+    child = subprocess.Popen(args, stdout=subprocess.PIPE)
+    out = child.communicate()[0]
+    if child.returncode != 0:
+        raise Exception("Memory measurement failed (exit code %d)" % child.returncode)
+    return int(out.strip().splitlines()[-1])
+
+def peak_rss_kb():
+    '''The peak resident set size of this process in KB'''
+    # On Linux getrusage reports the largest of this process and the
+    # process that started it (here the much larger benchmark process)
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Reported in bytes, not KB
+        peak = peak // 1024
+    return peak
+
+def parse_memory_child(method, filenames):
+    '''The child process of parse_peak_kb: print the peak RSS growth in KB'''
+    rspecStrings = []
+    for filename in filenames:
+        with open(filename) as f:
+            rspecStrings.append(f.read())
+    parse = getattr(RSpecParser(logging.getLogger('stitch')), method)
+    gc.collect()
+    before = peak_rss_kb()
+    # Keep every parsed RSpec live so the peak counts all of them
+    rspecs = []
+    for rspecString in rspecStrings:
+        rspecs.append(parse(rspecString))
+    print peak_rss_kb() - before
+    return 0
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    opts, args = parse_args(argv)
+    if opts.parse_memory:
+        return parse_memory_child(opts.parse_memory, args)
+
+    level = logging.INFO
+    if opts.debug:
+        level = logging.DEBUG
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)-8s %(message)s')
+    logger = logging.getLogger("stitcher-benchmark")
+    if not opts.debug:
+        # The stitcher logs details of every hop it combines
+        logging.getLogger("stitch").setLevel(logging.WARN)
+
+    if opts.hops:
+        with open(opts.rspec) as f:
+            hopsPerCopy = count_hops(f.read())
+        if hopsPerCopy == 0:
+            sys.exit("%s has no links between aggregates to stitch" % opts.rspec)
+        opts.copies = (opts.hops + hopsPerCopy - 1) // hopsPerCopy
+    fixture = Fixture(opts.rspec, opts.copies, opts.aggregates, logger)
+    if opts.save:
+        fixture.save(opts.save)
+        logger.info("Saved the expanded request and manifests in %s", opts.save)
+    ops = operations(fixture)
+    if opts.list:
+        for (name, description, func, setup) in ops:
+            print "%-20s %s" % (name, description)
+        return 0
+
+    if opts.operation:
+        unknown = set(opts.operation) - set([op[0] for op in ops])
+        if unknown:
+            sys.exit("Unknown operation(s): %s" % ", ".join(sorted(unknown)))
+        ops = [op for op in ops if op[0] in opts.operation]
+
+    memoryDir = None
+    if opts.memory:
+        memoryDir = tempfile.mkdtemp(prefix='stitcher-benchmark-')
+        requestFile, manifestFiles = fixture.save(memoryDir)
+
+    results = []
+    header = "%-20s %10s %10s %10s %10s" % ("operation", "mean ms", "median ms", "p95 ms", "ops/sec")
+    if opts.memory:
+        header += " %10s" % "peak KB"
+    print header
+    for (name, description, func, setup) in ops:
+        try:
+            result = run(name, func, setup, opts.iterations)
+            if opts.memory and name in PARSE_MEMORY_OPERATIONS:
+                (method, manifests) = PARSE_MEMORY_OPERATIONS[name]
+                if manifests:
+                    result['peak_kb'] = parse_peak_kb(method, manifestFiles)
+                else:
+                    result['peak_kb'] = parse_peak_kb(method, [requestFile])
+        except Exception, e:
+            logger.debug("%s failed", name, exc_info=True)
+            print "%-20s failed: %s" % (name, e)
+            results.append(dict(operation=name, error=str(e)))
+            continue
+        results.append(result)
+        line = "%-20s %10.3f %10.3f %10.3f %10.1f" % \
+            (name, result['mean_ms'], result['median_ms'],
+             result['p95_ms'], result['ops_per_sec'])
+        if 'peak_kb' in result:
+            line += " %10d" % result['peak_kb']
+        print line
+    if memoryDir:
+        shutil.rmtree(memoryDir)
+
+    if opts.json:
+        with open(opts.json, 'w') as f:
+            json.dump(dict(rspec=opts.rspec,
+                           copies=opts.copies,
+                           aggregates=opts.aggregates,
+                           iterations=opts.iterations,
+                           timestamp=datetime.datetime.utcnow().isoformat(),
+                           results=results), f, indent=2)
+        logger.info("Wrote results to %s", opts.json)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -134,6 +134,8 @@ def call(argv, options=None):
     parser.add_option("--scsURL",
                       help="URL to the SCS service. Default: Value of 'scs_url' in omni_config or " + SCS_URL,
                       default=None)
+    parser.add_option("--scsCacheTTL", default=15, type="int",
+                      help="Minutes to reuse a saved SCS result for the same request and options, instead of calling the SCS again (default %default, 0 means never)")
     parser.add_option("--timeout", default=0, type="int",
                       help="Max minutes to allow stitcher to run before killing a reservation attempt (default %default minutes, 0 means no timeout).")
     parser.add_option("--noAvailCheck", default=False, action="store_true",